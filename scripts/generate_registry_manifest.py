@@ -0,0 +1,88 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Writes the registry manifest of packages (see
+vistrails.core.modules.registry_snapshot).
+
+Usage: generate_registry_manifest.py codepath [codepath ...]
+
+The manifest is written as registry_manifest.json in the directory of
+each package. It has to be generated again whenever the modules or ports
+of the package change; it is ignored once the package version changes.
+
+"""
+
+import sys
+
+import vistrails.core.application
+from vistrails.core.modules.module_registry import get_module_registry, \
+    MissingPackage
+from vistrails.core.modules import registry_snapshot
+from vistrails.core.packagemanager import get_package_manager
+
+def generate_manifest(codepath):
+    pm = get_package_manager()
+    reg = get_module_registry()
+    try:
+        package = pm.get_package_by_codepath(codepath)
+    except MissingPackage:
+        pm.late_enable_package(codepath)
+        package = pm.get_package_by_codepath(codepath)
+    # an existing manifest was used; load the actual code
+    package.materialize()
+    if not all(d.is_module_loaded() and d.module is not None
+               for d in package.descriptor_list):
+        print >>sys.stderr, ("The current manifest of %s is out of date, "
+                             "remove it and try again" % codepath)
+        return False
+    snapshot = reg.get_package_snapshot(package)
+    registry_snapshot.write_manifest(package, snapshot)
+    print "Wrote %s" % registry_snapshot.get_manifest_filename(package)
+    return True
+
+def run(codepaths):
+    vistrails.core.application.init({'batch': True,
+                                     'executionLog': False,
+                                     'singleInstance': False})
+    success = True
+    for codepath in codepaths:
+        success = generate_manifest(codepath) and success
+    return success
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print >>sys.stderr, __doc__
+        sys.exit(2)
+    sys.exit(0 if run(sys.argv[1:]) else 1)
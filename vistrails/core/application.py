@@ -41,6 +41,7 @@ import warnings
 from vistrails.core import debug
 from vistrails.core import keychain
 from vistrails.core import system
+from vistrails.core.cache.file_signature import FileSignatureCache
 from vistrails.core.collection import Collection
 import vistrails.core.configuration
 from vistrails.core.configuration import ConfigurationObject
@@ -194,6 +195,7 @@ class VistrailsApplicationInterface(object):
             self.package_manager.finalize_packages()
         Collection.clearInstance()
         ThumbnailCache.clearInstance()
+        FileSignatureCache.clearInstance()
 
     def __del__(self):
         """ __del__() -> None
@@ -0,0 +1,410 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+""" Runs a manifest of workflows on a pool of worker processes.
+
+A manifest is a JSON file listing the workflows to execute::
+
+    {"jobs": [{"file": "a.vt", "version": "tag", "parameters": {"x": 1}},
+              {"id": "b", "file": "b.vt", "version": 12}]}
+
+Each worker process has its own CachedInterpreter. Jobs that share upstream
+subpipelines are grouped and sent to the same worker so that the shared part
+is only computed once. A JSON summary of the results is written at the end.
+
+"""
+from __future__ import absolute_import, division
+
+import copy
+import json
+import math
+import multiprocessing
+import os
+import time
+import traceback
+
+from vistrails.core import debug
+from vistrails.core.application import get_vistrails_application
+from vistrails.core.db.io import load_vistrail
+from vistrails.core.db.locator import FileLocator
+from vistrails.core.interpreter.cached import CachedInterpreter
+from vistrails.core.vistrail.controller import VistrailController
+import vistrails.core.console_mode
+import vistrails.core.packagemanager
+
+import unittest
+
+################################################################################
+
+def load_manifest(filename):
+    """load_manifest(filename: str) -> list of dict
+    Reads a batch manifest, either a list of jobs or a dict with a 'jobs'
+    key. Relative file names are resolved from the manifest's directory.
+
+    """
+    with open(filename, 'rb') as fp:
+        manifest = json.load(fp)
+    if isinstance(manifest, dict):
+        manifest = manifest.get('jobs', [])
+    return normalize_jobs(manifest, os.path.dirname(os.path.abspath(filename)))
+
+def normalize_jobs(jobs, base_dir=None):
+    """normalize_jobs(jobs: list, base_dir: str) -> list of dict
+    Checks the manifest entries and fills in the defaults.
+
+    """
+    result = []
+    for i, job in enumerate(jobs):
+        if isinstance(job, basestring):
+            job = {'file': job}
+        if 'file' not in job:
+            raise ValueError("Batch job %d has no 'file'" % i)
+        filename = job['file']
+        if base_dir is not None and not os.path.isabs(filename):
+            filename = os.path.join(base_dir, filename)
+        version = job.get('version', job.get('tag'))
+        parameters = job.get('parameters') or {}
+        if isinstance(parameters, basestring):
+            parameters = parse_parameters(parameters)
+        result.append({'id': job.get('id', i),
+                       'file': filename,
+                       'version': version,
+                       'parameters': dict((k, unicode(v))
+                                          for k, v in parameters.iteritems())})
+    return result
+
+def parse_parameters(parameters):
+    """parse_parameters(parameters: str) -> dict
+    Parses the '$&$'-separated alias=value list used on the command-line.
+
+    """
+    result = {}
+    for e in parameters.split("$&$"):
+        pos = e.find("=")
+        if pos != -1:
+            result[e[:pos].strip()] = e[pos+1:].strip()
+    return result
+
+def format_parameters(parameters):
+    return "$&$".join("%s=%s" % (k, v)
+                      for k, v in sorted(parameters.iteritems()))
+
+################################################################################
+# Planning
+
+def job_signatures(job, controllers=None):
+    """job_signatures(job: dict, controllers: dict) -> set
+    Returns the subpipeline signatures of the modules that have upstream
+    connections in the job's pipeline, after the parameter overrides are
+    applied. These are the intermediate results a worker can reuse.
+
+    An empty set is returned if the pipeline cannot be loaded; the job is
+    then scheduled on its own.
+
+    """
+    try:
+        if controllers is None:
+            controllers = {}
+        filename = job['file']
+        if filename not in controllers:
+            locator = FileLocator(filename)
+            (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+            controllers[filename] = VistrailController(v, locator,
+                                                       abstractions,
+                                                       thumbnails, mashups,
+                                                       auto_save=False)
+        controller = controllers[filename]
+        version = job['version']
+        if isinstance(version, basestring):
+            version = controller.vistrail.get_version_number(version)
+        elif version is None:
+            version = controller.get_latest_version_in_graph()
+        # This also upgrades the pipeline, as execution would
+        controller.change_selected_version(version)
+        pipeline = copy.copy(controller.current_pipeline)
+        for alias, value in job['parameters'].iteritems():
+            if pipeline.has_alias(alias):
+                info = pipeline.aliases[alias]
+                pipeline.db_get_object(info[0], info[1]).strValue = value
+        signatures = set()
+        for module_id in pipeline.modules:
+            if pipeline.graph.edges_to(module_id):
+                signatures.add(pipeline.subpipeline_signature(module_id))
+        return signatures
+    except Exception, e:
+        debug.debug("Could not compute signatures for %s" % job['file'],
+                    debug.format_exception(e))
+        return set()
+
+def group_jobs(signatures, processes):
+    """group_jobs(signatures: list of set, processes: int) -> list of list
+    Groups the job indexes that share signatures. A group is never made
+    larger than an even share of the jobs, so that all the processes get
+    work. Groups are returned largest first, jobs in manifest order.
+
+    """
+    nb_jobs = len(signatures)
+    max_size = max(1, int(math.ceil(nb_jobs / max(1, processes))))
+    parent = range(nb_jobs)
+    size = [1] * nb_jobs
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owners = {}
+    for i, sigs in enumerate(signatures):
+        for sig in sigs:
+            j = owners.setdefault(sig, i)
+            ri, rj = find(i), find(j)
+            if ri != rj and size[ri] + size[rj] <= max_size:
+                parent[ri] = rj
+                size[rj] += size[ri]
+
+    groups = {}
+    for i in xrange(nb_jobs):
+        groups.setdefault(find(i), []).append(i)
+    return sorted(groups.itervalues(), key=lambda g: (-len(g), g[0]))
+
+################################################################################
+# Execution
+
+def _init_worker(options):
+    # With fork() the worker inherits the application; otherwise (Windows)
+    # it has to start its own
+    if get_vistrails_application() is None:
+        import vistrails.core.application
+        vistrails.core.application.init(options, [])
+    CachedInterpreter.flush()
+
+def run_job(job, output_dir=None):
+    """run_job(job: dict, output_dir: str) -> dict
+    Executes a single job and returns its entry for the summary.
+
+    """
+    start = time.time()
+    result = {'id': job['id'],
+              'file': job['file'],
+              'version': job['version'],
+              'parameters': job['parameters'],
+              'pid': os.getpid()}
+    output_dir = output_dir or None
+    extra_info = {}
+    if output_dir:
+        extra_info['pathDumpCells'] = output_dir
+    try:
+        locator = FileLocator(os.path.abspath(job['file']))
+        run, = vistrails.core.console_mode.run_and_get_results(
+                [(locator, job['version'])],
+                format_parameters(job['parameters']),
+                output_dir, update_vistrail=False, extra_info=extra_info,
+                reason='Batch Mode Execution')
+        errors = []
+        for module_id, error in sorted(run.errors.iteritems()):
+            errors.append({'module_id': module_id, 'message': unicode(error)})
+        result.update(status='error' if errors else 'success',
+                      executed_version=run.workflow_info[1],
+                      executed=len(run.executed),
+                      suspended=len(run.suspended),
+                      errors=errors)
+    except Exception, e:
+        result.update(status='failed',
+                      errors=[{'module_id': None,
+                               'message': debug.format_exception(e),
+                               'traceback': traceback.format_exc()}])
+    result['time'] = time.time() - start
+    return result
+
+def _run_group(args):
+    group, output_dir = args
+    return [(i, run_job(job, output_dir)) for i, job in group]
+
+def run_batch(jobs, processes=None, summary_file=None, output_dir=None,
+              options=None):
+    """run_batch(jobs: list of dict, processes: int, summary_file: str,
+                 output_dir: str, options: dict) -> dict
+    Runs the jobs (see normalize_jobs()) on a pool of processes and returns
+    the summary, which is also written to summary_file if given. options
+    are used to start the application in workers that can't inherit it.
+
+    With processes=1 the jobs run in the current process.
+
+    """
+    start = time.time()
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+
+    controllers = {}
+    signatures = [job_signatures(job, controllers) for job in jobs]
+    del controllers
+    groups = group_jobs(signatures, processes)
+    tasks = [([(i, jobs[i]) for i in group], output_dir) for group in groups]
+
+    results = [None] * len(jobs)
+    if processes == 1:
+        for task in tasks:
+            for i, result in _run_group(task):
+                results[i] = result
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker,
+                                    (options or {},))
+        try:
+            for group_results in pool.imap_unordered(_run_group, tasks):
+                for i, result in group_results:
+                    results[i] = result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    for group_id, group in enumerate(groups):
+        for i in group:
+            results[i]['group'] = group_id
+
+    summary = {'jobs': results,
+               'processes': processes,
+               'groups': len(groups),
+               'succeeded': sum(1 for r in results
+                                if r['status'] == 'success'),
+               'failed': sum(1 for r in results
+                             if r['status'] != 'success'),
+               'time': time.time() - start}
+    if summary_file:
+        with open(summary_file, 'wb') as fp:
+            json.dump(summary, fp, indent=2, sort_keys=True)
+    return summary
+
+def summary_errors(summary):
+    """summary_errors(summary: dict) -> list of tuple
+    Returns the errors in the format of console_mode.run().
+
+    """
+    all_errors = []
+    for result in summary['jobs']:
+        for error in result['errors']:
+            all_errors.append((result['file'],
+                               result.get('executed_version',
+                                          result['version']),
+                               error['module_id'], error['message']))
+    return all_errors
+
+################################################################################
+# Testing
+
+
+class TestBatchMode(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import vistrails.core.system
+        cls.resources = os.path.join(
+                vistrails.core.system.vistrails_root_directory(),
+                'tests', 'resources')
+        manager = vistrails.core.packagemanager.get_package_manager()
+        if manager.has_package('org.vistrails.vistrails.console_mode_test'):
+            return
+        d = {'console_mode_test': 'vistrails.tests.resources.'}
+        manager.late_enable_package('console_mode_test', d)
+
+    @classmethod
+    def tearDownClass(cls):
+        manager = vistrails.core.packagemanager.get_package_manager()
+        if manager.has_package('org.vistrails.vistrails.console_mode_test'):
+            manager.late_disable_package('console_mode_test')
+
+    def test_group_jobs(self):
+        signatures = [set(['a', 'b']), set(['c']), set(['b']), set(),
+                      set(['c', 'd']), set(['a'])]
+        self.assertEqual(group_jobs(signatures, 2),
+                         [[0, 2, 5], [1, 4], [3]])
+        self.assertEqual(group_jobs(signatures, 3),
+                         [[0, 2], [1, 4], [3], [5]])
+        self.assertEqual(group_jobs(signatures, 6),
+                         [[i] for i in xrange(6)])
+
+    def test_manifest(self):
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp(prefix='vt_batch_')
+        try:
+            filename = os.path.join(directory, 'manifest.json')
+            with open(filename, 'wb') as fp:
+                json.dump({'jobs': [
+                        'a.vt',
+                        {'id': 'b', 'file': '/b.vt', 'tag': 'x',
+                         'parameters': 'p=1$&$q = 2'}]}, fp)
+            jobs = load_manifest(filename)
+            self.assertEqual(jobs, [
+                    {'id': 0, 'file': os.path.join(directory, 'a.vt'),
+                     'version': None, 'parameters': {}},
+                    {'id': 'b', 'file': '/b.vt', 'version': 'x',
+                     'parameters': {'p': '1', 'q': '2'}}])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_run(self):
+        import tempfile
+        jobs = normalize_jobs([
+                {'file': 'pythonsource.xml', 'version': 'test_simple_success'},
+                {'file': 'dynamic_module_error.xml', 'version': 'test'},
+                {'file': 'missing.xml'}],
+                self.resources)
+        fd, summary_file = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            summary = run_batch(jobs, processes=1, summary_file=summary_file)
+            with open(summary_file, 'rb') as fp:
+                self.assertEqual(json.load(fp)['succeeded'], 1)
+        finally:
+            os.remove(summary_file)
+        self.assertEqual([r['status'] for r in summary['jobs']],
+                         ['success', 'error', 'failed'])
+        self.assertEqual(summary['failed'], 2)
+        self.assertEqual(len(summary_errors(summary)),
+                         len(summary['jobs'][1]['errors']) + 1)
+
+    def test_signatures(self):
+        job, = normalize_jobs([{'file': 'dummy.xml', 'version': 'int chain'}],
+                              self.resources)
+        sigs = job_signatures(job)
+        self.assertTrue(sigs)
+        self.assertEqual(sigs, job_signatures(job))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,372 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Content signatures of files and directories.
+
+Hashing the content of files is expensive, so FileSignatureCache keeps
+the digests it computes along with the inode, size and modification
+time of each file, and only hashes a file again when these change. The
+cache is saved to the file given by the fileSignatureCache option when
+the application exits, so that it is reused across sessions.
+
+"""
+
+import cPickle
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+
+from vistrails.core import debug
+from vistrails.core.cache.utils import sha_hash
+
+##############################################################################
+
+CHUNK_SIZE = 1 << 20
+# A file modified this recently (in seconds) when it is hashed could be
+# modified again without its mtime changing, on filesystems with coarse
+# timestamps; its digest is not cached
+RACY_DELAY = 2.0
+# The cache only keeps the entries used during the session when it grows
+# larger than this
+MAX_ENTRIES = 1000000
+CACHE_FORMAT_VERSION = 1
+
+try:
+    HASHER_THREADS = max(1, min(8, cpu_count()))
+except NotImplementedError:
+    HASHER_THREADS = 1
+
+def sha1_file(filename, chunk_size=CHUNK_SIZE):
+    """sha1_file(filename: str, chunk_size: int) -> str
+
+    Returns the hex SHA1 digest of the content of a file.
+
+    """
+    hasher = sha_hash()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def list_files(dirname):
+    """list_files(dirname: str) -> [str]
+
+    Returns the paths of all the regular files under dirname, relative
+    to it, in a stable order.
+
+    """
+    filenames = []
+    for root, dirs, files in os.walk(dirname, followlinks=True):
+        dirs.sort()
+        rel_root = os.path.relpath(root, dirname)
+        for name in sorted(files):
+            if not os.path.isfile(os.path.join(root, name)):
+                continue
+            if rel_root == os.curdir:
+                filenames.append(name)
+            else:
+                filenames.append(os.path.join(rel_root, name))
+    return filenames
+
+class FileSignatureCache(object):
+    _instance = None
+
+    @staticmethod
+    def getInstance(*args, **kwargs):
+        if FileSignatureCache._instance is None:
+            if not args and not kwargs:
+                args = (FileSignatureCache.get_default_filename(),)
+            FileSignatureCache._instance = FileSignatureCache(*args,
+                                                              **kwargs)
+        return FileSignatureCache._instance
+
+    @staticmethod
+    def clearInstance():
+        if FileSignatureCache._instance is not None:
+            FileSignatureCache._instance.destroy()
+            FileSignatureCache._instance = None
+
+    @staticmethod
+    def get_default_filename():
+        """get_default_filename() -> str
+
+        Returns the file the cache is saved to according to the
+        configuration, or None if it should only be kept in memory.
+
+        """
+        from vistrails.core.configuration import get_vistrails_configuration
+        from vistrails.core.system import get_vistrails_directory
+        conf = get_vistrails_configuration()
+        if conf is None:
+            return None
+        return get_vistrails_directory('fileSignatureCache', conf)
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        # absolute path -> ((inode, size, mtime), {kind: digest})
+        self._entries = {}
+        self._used = set()
+        self._modified = False
+        self._lock = threading.Lock()
+        if filename is not None:
+            self.load()
+
+    def destroy(self):
+        self.save()
+
+    def load(self):
+        if not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, 'rb') as f:
+                version, entries = cPickle.load(f)
+        except Exception, e:
+            debug.warning("Could not read file signature cache %s" %
+                          self.filename, e)
+            return
+        if version == CACHE_FORMAT_VERSION:
+            self._entries = entries
+
+    def save(self):
+        if self.filename is None or not self._modified:
+            return
+        with self._lock:
+            if len(self._entries) > MAX_ENTRIES:
+                self._entries = dict((path, entry)
+                                     for path, entry in self._entries.iteritems()
+                                     if path in self._used)
+            entries = dict(self._entries)
+            self._modified = False
+        directory = os.path.dirname(self.filename)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp_filename = tempfile.mkstemp(prefix='signatures_',
+                                                dir=directory)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    cPickle.dump((CACHE_FORMAT_VERSION, entries), f,
+                                 cPickle.HIGHEST_PROTOCOL)
+                if os.path.exists(self.filename):
+                    os.remove(self.filename)
+                os.rename(tmp_filename, self.filename)
+            except Exception:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+        except Exception, e:
+            debug.warning("Could not save file signature cache %s" %
+                          self.filename, e)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._used = set()
+            self._modified = True
+
+    def _lookup(self, path, key, kind):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == key:
+                digest = entry[1].get(kind)
+                if digest is not None:
+                    self._used.add(path)
+                return digest
+        return None
+
+    def _store(self, path, key, kind, digest, now):
+        if now - key[2] < RACY_DELAY:
+            return
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != key:
+                entry = (key, {})
+                self._entries[path] = entry
+            entry[1][kind] = digest
+            self._used.add(path)
+            self._modified = True
+
+    def get_file_digest(self, filename, digest_func=sha1_file, kind='sha1'):
+        """get_file_digest(filename: str, digest_func: callable,
+                           kind: str) -> str
+
+        Returns the digest of a file, as computed by
+        digest_func(filename). kind identifies digest_func in the cache.
+
+        """
+        return self.get_file_digests([filename], digest_func, kind)[0]
+
+    def get_file_digests(self, filenames, digest_func=sha1_file,
+                         kind='sha1'):
+        """get_file_digests(filenames: [str], digest_func: callable,
+                            kind: str) -> [str]
+
+        Returns the digests of several files, hashing those that are not
+        in the cache concurrently.
+
+        """
+        digests = [None] * len(filenames)
+        missing = []
+        for i, filename in enumerate(filenames):
+            st = os.stat(filename)
+            path = os.path.abspath(filename)
+            key = (st.st_ino, st.st_size, st.st_mtime)
+            digests[i] = self._lookup(path, key, kind)
+            if digests[i] is None:
+                missing.append((i, path, key))
+        if not missing:
+            return digests
+
+        now = time.time()
+        to_hash = [filenames[i] for i, path, key in missing]
+        if len(missing) > 1 and HASHER_THREADS > 1:
+            # reading files and hashing release the GIL
+            pool = ThreadPool(min(HASHER_THREADS, len(missing)))
+            try:
+                new_digests = pool.map(digest_func, to_hash)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            new_digests = map(digest_func, to_hash)
+        for (i, path, key), digest in zip(missing, new_digests):
+            digests[i] = digest
+            self._store(path, key, kind, digest, now)
+        return digests
+
+    def get_path_digest(self, path, digest_func=sha1_file, kind='sha1'):
+        """get_path_digest(path: str, digest_func: callable,
+                           kind: str) -> str
+
+        Returns the digest of a file or directory. The digest of a
+        directory accounts for the names and content of all the files
+        under it.
+
+        """
+        if not os.path.isdir(path):
+            return self.get_file_digest(path, digest_func, kind)
+        filenames = list_files(path)
+        digests = self.get_file_digests([os.path.join(path, name)
+                                         for name in filenames],
+                                        digest_func, kind)
+        hasher = sha_hash()
+        for name, digest in zip(filenames, digests):
+            hasher.update(name.replace(os.sep, '/'))
+            hasher.update('\0')
+            hasher.update(digest)
+            hasher.update('\0')
+        return hasher.hexdigest()
+
+##############################################################################
+
+import shutil
+import unittest
+
+class TestFileSignatureCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_signature_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content, mtime):
+        filename = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'wb') as f:
+            f.write(content)
+        os.utime(filename, (mtime, mtime))
+        return filename
+
+    def test_file_digest(self):
+        calls = []
+        def digest_func(filename):
+            calls.append(filename)
+            return sha1_file(filename)
+
+        cache = FileSignatureCache()
+        old = time.time() - 60
+        filename = self.write('a', 'abc', old)
+        d1 = cache.get_file_digest(filename, digest_func)
+        self.assertEqual(d1, sha_hash('abc').hexdigest())
+        self.assertEqual(cache.get_file_digest(filename, digest_func), d1)
+        self.assertEqual(len(calls), 1)
+
+        # same size, new mtime
+        self.write('a', 'abd', old + 1)
+        d2 = cache.get_file_digest(filename, digest_func)
+        self.assertNotEqual(d1, d2)
+        self.assertEqual(len(calls), 2)
+
+    def test_recent_not_cached(self):
+        cache = FileSignatureCache()
+        filename = self.write('a', 'abc', time.time())
+        cache.get_file_digest(filename)
+        self.write('a', 'abd', os.stat(filename).st_mtime)
+        self.assertEqual(cache.get_file_digest(filename),
+                         sha_hash('abd').hexdigest())
+
+    def test_directory_digest(self):
+        cache = FileSignatureCache()
+        old = time.time() - 60
+        for i in xrange(10):
+            self.write(os.path.join('sub%d' % (i % 3), str(i)), str(i), old)
+        d1 = cache.get_path_digest(self.directory)
+        self.assertEqual(FileSignatureCache().get_path_digest(self.directory),
+                         d1)
+        self.write(os.path.join('sub1', '4'), 'X', old + 1)
+        self.assertNotEqual(cache.get_path_digest(self.directory), d1)
+        self.write(os.path.join('sub1', '4'), '4', old)
+        os.rename(os.path.join(self.directory, 'sub1', '4'),
+                  os.path.join(self.directory, 'sub1', '44'))
+        self.assertNotEqual(cache.get_path_digest(self.directory), d1)
+
+    def test_persistent(self):
+        filename = os.path.join(self.directory, 'cache', 'signatures')
+        data = self.write('a', 'abc', time.time() - 60)
+        cache = FileSignatureCache(filename)
+        digest = cache.get_file_digest(data)
+        cache.destroy()
+        self.assertTrue(os.path.isfile(filename))
+
+        def digest_func(filename):
+            self.fail("File was hashed again")
+        cache = FileSignatureCache(filename)
+        self.assertEqual(cache.get_file_digest(data, digest_func), digest)
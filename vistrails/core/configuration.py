@@ -62,8 +62,14 @@ dbDefault: Save vistrails in a database by default
 cache: Cache previous results so they may be used in future computations
 stopOnError: Stop all workflow execution immediately after first error
 executionLog: Track execution provenance when running workflows
+executionLogStream: Write the execution log to this file as it is recorded
+executionLogStore: Index the execution log in this SQLite database
 errorLog: Write errors to a log file
 parameters: List of parameters to use when running workflow
+batchManifest: JSON manifest of workflows to run on a pool of processes
+batchProcesses: Number of processes used to run the batch manifest
+batchSummary: File where the results of the batch manifest are written
+executionProfile: Profile the workflows run from the command-line to this file
 host: The hostname for the database to load the vistrail from
 port: The port for the database to load the vistrail from
 db: The name for the database to load the vistrail from
@@ -72,6 +78,7 @@ defaultFileType: Default file type/extension for vistrails (.vt or .xml)
 enablePackagesSilently: Automatically enable packages when needed
 installBundles: Install missing Python dependencies
 installBundlesWithPip: Use pip to install missing Python dependencies
+registrySnapshot: Restore packages from registry snapshots at startup
 upgrades: Attempt to automatically upgrade old workflows
 showConnectionErrors: Show error when input value doesn't match type during execution
 showVariantErrors: Show error when variant input value doesn't match type during execution
@@ -98,6 +105,8 @@ dataDir: Default data directory
 packageDir: System packages directory
 userPackageDir: Local packages directory
 logDir: Log files directory
+registrySnapshotDir: Registry snapshots directory
+fileSignatureCache: File signature cache
 fileDir: Default vistrail directory
 temporaryDir: Temporary files directory
 webRepositoryURL: Web repository URL
@@ -209,6 +218,24 @@ batch: Boolean
 
     Run vistrails in batch mode instead of interactive mode
 
+batchManifest: Path
+
+    A JSON file listing the workflows to run in batch mode, as
+    {"jobs": [{"file": ..., "version": ..., "parameters": {...}}]}.
+    The jobs are run on a pool of processes, and jobs that share
+    upstream subpipelines are run by the same process so that they
+    share its cache.
+
+batchProcesses: Integer
+
+    The number of processes used to run the batchManifest (defaults to
+    the number of CPUs).
+
+batchSummary: Path
+
+    The JSON file where the results and errors of the batchManifest
+    jobs are written.
+
 logDir: Path
 
     The path that indicates where log files should be stored.
@@ -247,6 +274,30 @@ executionLog: Boolean
 
     Track execution provenance when running workflows
 
+executionLogStream: Path
+
+    Write each record of the execution log to this file when it
+    finishes, instead of keeping it in memory until the vistrail is
+    saved: to a SQLite database if it ends with .db or .sqlite, else
+    appended to an XML file. The log is read back with
+    vistrails.core.log.sink.open_log_sink(filename).read_log().
+
+executionLogStore: Path
+
+    Record the execution log in this SQLite database as the workflows
+    run, indexed by module, signature, status and time, and query it
+    with vistrails.core.log.store.ProvenanceStore(filename). Unlike the
+    log itself, it has the signatures of the modules.
+
+executionProfile: Path
+
+    Profile the execution of the workflows run from the command-line:
+    the time spent upstream and in compute(), the CPU time, the peak
+    memory, the size of the outputs and the cache state of each module
+    are added to the execution log and written to this file, as a Chrome
+    trace if it ends with .json, else as collapsed stacks for
+    flamegraph.pl.
+
 packageDir: Path
 
     The directory to look for VisTrails core packages (use
@@ -260,6 +311,24 @@ pythonPrompt: Boolean
 
     *Deprecated*
 
+registrySnapshot: Boolean
+
+    Save the modules registered by each package to a snapshot and, in
+    later sessions, restore them from it instead of importing and
+    initializing the package code at startup. The code is then only
+    loaded when one of the package's modules is used.
+
+registrySnapshotDir: Path
+
+    The directory where the registry snapshots are stored.
+
+fileSignatureCache: Path
+
+    The file where the content digests of the files used as File or
+    Directory parameters are cached, along with their size and
+    modification time, so that unchanged files are not hashed again in
+    later sessions.
+
 recentVistrailList: String
 
     Storage for recent vistrails.  Users should not edit.
@@ -569,6 +638,15 @@ base_config = {
                  flag='-p'),
      # ConfigField("package", [], str, flag='-p', nargs='*'),
      ConfigField("parameters", None, str, ConfigType.COMMAND_LINE),
+     ConfigField("batchManifest", None, ConfigPath, ConfigType.COMMAND_LINE),
+     ConfigField("batchProcesses", 0, int, ConfigType.COMMAND_LINE),
+     ConfigField("batchSummary", None, ConfigPath, ConfigType.COMMAND_LINE),
+     ConfigField("executionProfile", None, ConfigPath,
+                 ConfigType.COMMAND_LINE),
+     ConfigField("executionLogStream", None, ConfigPath,
+                 ConfigType.COMMAND_LINE),
+     ConfigField("executionLogStore", None, ConfigPath,
+                 ConfigType.COMMAND_LINE),
      ConfigField('showWindow', True, bool, ConfigType.COMMAND_LINE_FLAG),
      ConfigField("withVersionTree", False, bool, ConfigType.COMMAND_LINE_FLAG),
      ConfigField("withWorkflow", False, bool, ConfigType.COMMAND_LINE_FLAG),
@@ -652,6 +730,7 @@ base_config = {
      ConfigField('installBundles', True, bool, ConfigType.ON_OFF),
      ConfigField('installBundlesWithPip', False, bool, ConfigType.ON_OFF,
                  depends_on="installBundles"),
+     ConfigField('registrySnapshot', False, bool, ConfigType.ON_OFF),
      ConfigField('repositoryLocalPath', None, ConfigPath),
      ConfigField('repositoryHTTPURL', "http://www.vistrails.org/packages",
                  ConfigURL)],
@@ -664,6 +743,8 @@ base_config = {
      ConfigField('userPackageDir', "userpackages", ConfigPath),
      ConfigField('fileDir', None, ConfigPath),
      ConfigField('logDir', "logs", ConfigPath),
+     ConfigField('registrySnapshotDir', "registry", ConfigPath),
+     ConfigField('fileSignatureCache', "file_signatures", ConfigPath),
      ConfigField('temporaryDir', None,  ConfigPath)],
     "Advanced":
     [ConfigField('singleInstance', True, bool, ConfigType.ON_OFF),
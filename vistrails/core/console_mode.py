@@ -58,12 +58,13 @@ import vistrails.db
     
 def run_and_get_results(w_list, parameters='', output_dir=None, 
                         update_vistrail=True, extra_info=None, 
-                        reason='Console Mode Execution'):
+                        reason='Console Mode Execution', profiler=None):
     """run_and_get_results(w_list: list of (locator, version), parameters: str,
                            output_dir:str, update_vistrail: boolean,
-                           extra_info:dict)
+                           extra_info:dict, profiler: ExecutionProfiler)
     Run all workflows in w_list, and returns an interpreter result object.
     version can be a tag name or a version id.
+    If profiler is given, it records statistics about each module execution.
     
     """
     elements = parameters.split("$&$")
@@ -139,7 +140,8 @@ def run_and_get_results(w_list, parameters='', output_dir=None,
             controller.execute_current_workflow(custom_aliases=aliases,
                                                 custom_params=params,
                                                 extra_info=extra_info,
-                                                reason=reason)
+                                                reason=reason,
+                                                profiler=profiler)
         finally:
             jobMonitor.finishWorkflow()
         new_version = controller.current_version
@@ -259,14 +261,15 @@ def get_vt_graph(vt_list, tree_info, pdf=False):
 ################################################################################
 
 def run(w_list, parameters='', output_dir=None, update_vistrail=True,
-        extra_info=None, reason="Console Mode Execution"):
+        extra_info=None, reason="Console Mode Execution", profiler=None):
     """run(w_list: list of (locator, version), parameters: str) -> boolean
     Run all workflows in w_list, version can be a tag name or a version id.
     Returns list of errors (empty list if there are no errors)
     """
     all_errors = []
     results = run_and_get_results(w_list, parameters, output_dir, 
-                                  update_vistrail,extra_info, reason)
+                                  update_vistrail,extra_info, reason,
+                                  profiler)
     for result in results:
         (objs, errors, executed) = (result.objects,
                                     result.errors, result.executed)
@@ -0,0 +1,607 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Array-backed, read-only snapshot of a Graph.
+
+CompactGraph maps vertex ids to consecutive integers and stores both
+the forward and inverse adjacency in CSR form (an offsets array and a
+targets array per direction). All traversals are iterative and run in
+O(V + E), so they are safe to use on very large pipelines and version
+trees where recursion depth or per-call graph copies become a problem.
+
+"""
+
+from array import array
+from collections import deque
+from itertools import izip
+
+from vistrails.core.data_structures.graph import Graph, GraphException
+
+import unittest
+
+################################################################################
+# CompactGraph
+
+class CompactGraph(object):
+    """CompactGraph is an immutable snapshot of a Graph that exposes the
+    same read-only API. Build it with Graph.compact() (or
+    CompactGraph(graph)) and discard it once the source graph changes.
+
+    >>> g = Graph()
+    >>> g.add_vertex('a')
+    >>> g.add_vertex('b')
+    >>> g.add_edge('a', 'b')
+    >>> g.compact().vertices_topological_sort()
+    ['a', 'b']
+
+    """
+
+    GraphContainsCycles = Graph.GraphContainsCycles
+    VertexHasNoParentError = Graph.VertexHasNoParentError
+
+    ##########################################################################
+    # Constructor
+
+    def __init__(self, graph):
+        """ CompactGraph(graph: Graph) -> CompactGraph
+        Snapshot the vertices and edges of graph into flat arrays
+
+        """
+        self.vertices = dict(graph.vertices)
+        self._ids = ids = list(self.vertices)
+        self._index = index = dict(izip(ids, xrange(len(ids))))
+        (self._out_offsets, self._out_targets, self._out_edges) = \
+            self._build(ids, index, graph.adjacency_list)
+        (self._in_offsets, self._in_targets, self._in_edges) = \
+            self._build(ids, index, graph.inverse_adjacency_list)
+
+    @staticmethod
+    def _build(ids, index, adjacency):
+        offsets = array('l', [0])
+        targets = array('l')
+        edges = []
+        total = 0
+        for v in ids:
+            lst = adjacency[v]
+            total += len(lst)
+            offsets.append(total)
+            for (to, eid) in lst:
+                targets.append(index[to])
+                edges.append(eid)
+        return (offsets, targets, edges)
+
+    def _indices(self, vertex_set):
+        """_indices(vertex_set) -> list(int)
+        Map a Graph, dict or iterable of vertex ids to internal indices.
+
+        """
+        if isinstance(vertex_set, (Graph, CompactGraph)):
+            vertex_set = vertex_set.vertices
+        index = self._index
+        return [index[v] for v in vertex_set]
+
+    ##########################################################################
+    # Accessors
+
+    def inverse(self):
+        """inverse() -> CompactGraph
+        Return a view of the graph with all edge directions inverted.
+        The arrays are shared with self, no edge data is copied.
+
+        """
+        result = CompactGraph.__new__(CompactGraph)
+        result.__dict__.update(self.__dict__)
+        (result._out_offsets, result._in_offsets) = \
+            (self._in_offsets, self._out_offsets)
+        (result._out_targets, result._in_targets) = \
+            (self._in_targets, self._out_targets)
+        (result._out_edges, result._in_edges) = \
+            (self._in_edges, self._out_edges)
+        return result
+
+    inverse_immutable = inverse
+
+    def out_degree(self, froom):
+        """ out_degree(froom: id type) -> int
+        Return the number of edges leaving froom
+
+        """
+        i = self._index[froom]
+        return self._out_offsets[i + 1] - self._out_offsets[i]
+
+    def in_degree(self, to):
+        """ in_degree(to: id type) -> int
+        Return the number of edges entering to
+
+        """
+        i = self._index[to]
+        return self._in_offsets[i + 1] - self._in_offsets[i]
+
+    def sinks(self):
+        """ sinks() -> list(id type)
+        Return the vertices that have no outgoing edges
+
+        """
+        offsets = self._out_offsets
+        return [v for (i, v) in enumerate(self._ids)
+                if offsets[i] == offsets[i + 1]]
+
+    def sources(self):
+        """ sources() -> list(id type)
+        Return the vertices that have no incoming edges
+
+        """
+        offsets = self._in_offsets
+        return [v for (i, v) in enumerate(self._ids)
+                if offsets[i] == offsets[i + 1]]
+
+    def _edges(self, i, offsets, targets, edges):
+        ids = self._ids
+        return [(ids[targets[j]], edges[j])
+                for j in xrange(offsets[i], offsets[i + 1])]
+
+    def edges_from(self, id):
+        """ edges_from(id: id type) -> list(tuple(id type, id type))
+        Return the (vertex_to, edge_id) pairs of edges leaving id
+
+        """
+        return self._edges(self._index[id], self._out_offsets,
+                           self._out_targets, self._out_edges)
+
+    def edges_to(self, id):
+        """ edges_to(id: id type) -> list(tuple(id type, id type))
+        Return the (vertex_from, edge_id) pairs of edges entering id
+
+        """
+        return self._edges(self._index[id], self._in_offsets,
+                           self._in_targets, self._in_edges)
+
+    def get_edge(self, frm, to):
+        """ get_edge(frm: id type, to: id type) -> id type
+        Return the id of the first edge frm -> to, or None
+
+        """
+        i = self._index[frm]
+        j = self._index[to]
+        targets = self._out_targets
+        for k in xrange(self._out_offsets[i], self._out_offsets[i + 1]):
+            if targets[k] == j:
+                return self._out_edges[k]
+        return None
+
+    def has_edge(self, frm, to):
+        """ has_edge(frm: id type, to: id type) -> bool
+        Check whether there is an edge frm -> to
+
+        """
+        if frm not in self._index or to not in self._index:
+            return False
+        i = self._index[frm]
+        j = self._index[to]
+        targets = self._out_targets
+        for k in xrange(self._out_offsets[i], self._out_offsets[i + 1]):
+            if targets[k] == j:
+                return True
+        return False
+
+    def parent(self, v):
+        """ parent(v: id type) -> id type
+        Find the parent of vertex v and return an id. Like Graph.parent,
+        this is the source of the last edge entering v.
+
+        raises VertexHasNoParentError is vertex has no parent
+
+        raises KeyError is vertex is not on graph
+
+        """
+        i = self._index[v]
+        start = self._in_offsets[i]
+        end = self._in_offsets[i + 1]
+        if start == end:
+            raise self.VertexHasNoParentError(v)
+        return self._ids[self._in_targets[end - 1]]
+
+    ##########################################################################
+    # Mutators
+
+    def _immutable(self, *args, **kwargs):
+        raise GraphException("CompactGraph is read-only; modify the source "
+                             "Graph and call compact() again")
+
+    add_vertex = add_edge = delete_vertex = delete_edge = _immutable
+    rename_vertex = change_edge = _immutable
+
+    ##########################################################################
+    # Traversals
+
+    def bfs(self, frm):
+        """ bfs(frm:id type) -> dict(id type)
+        Perform Breadth-First-Search and return a dict of parent id
+
+        """
+        ids = self._ids
+        offsets = self._out_offsets
+        targets = self._out_targets
+        start = self._index[frm]
+        visited = bytearray(len(ids))
+        visited[start] = 1
+        parent = {}
+        q = deque([start])
+        while q:
+            i = q.popleft()
+            for k in xrange(offsets[i], offsets[i + 1]):
+                j = targets[k]
+                if not visited[j]:
+                    visited[j] = 1
+                    parent[ids[j]] = ids[i]
+                    q.append(j)
+        return parent
+
+    def _reach(self, starts, reverse=False):
+        """_reach(starts: list(int), reverse: bool) -> bytearray
+        Mark every index reachable from starts (starts included).
+
+        """
+        if reverse:
+            offsets = self._in_offsets
+            targets = self._in_targets
+        else:
+            offsets = self._out_offsets
+            targets = self._out_targets
+        mark = bytearray(len(self._ids))
+        stack = []
+        for i in starts:
+            if not mark[i]:
+                mark[i] = 1
+                stack.append(i)
+        while stack:
+            i = stack.pop()
+            for k in xrange(offsets[i], offsets[i + 1]):
+                j = targets[k]
+                if not mark[j]:
+                    mark[j] = 1
+                    stack.append(j)
+        return mark
+
+    def reachable(self, vertex_set, reverse=False):
+        """ reachable(vertex_set, reverse=False) -> set(id type)
+        Return the vertices reachable from any vertex in vertex_set,
+        including vertex_set itself. With reverse=True, edges are
+        followed backwards (i.e. this returns the upstream vertices).
+
+        """
+        mark = self._reach(self._indices(vertex_set), reverse)
+        return set(v for (i, v) in enumerate(self._ids) if mark[i])
+
+    def _kahn(self, rep, mark=None):
+        """_kahn(rep: list(int), mark: bytearray) -> (list, int, list)
+        Iterative Kahn topological sort over the graph whose vertex i is
+        mapped to rep[i]. Edges between vertices with the same
+        representative are ignored, which lets callers contract vertex
+        sets without building a new graph. If mark is given, only
+        marked indices are considered. Returns the sorted
+        representatives, the number of representatives that took part
+        in the sort and the leftover in-degrees (non-zero on cycles).
+
+        """
+        n = len(self._ids)
+        offsets = self._out_offsets
+        targets = self._out_targets
+        in_degree = [0] * n
+        members = {}
+        seeds = []
+        count = 0
+        for i in xrange(n):
+            if mark is not None and not mark[i]:
+                continue
+            r = rep[i]
+            if r != i:
+                members.setdefault(r, []).append(i)
+            else:
+                seeds.append(i)
+                count += 1
+            for k in xrange(offsets[i], offsets[i + 1]):
+                t = targets[k]
+                if rep[t] != r and (mark is None or mark[t]):
+                    in_degree[rep[t]] += 1
+        queue = deque(r for r in seeds if in_degree[r] == 0)
+        order = []
+        while queue:
+            r = queue.popleft()
+            order.append(r)
+            group = members.get(r)
+            for i in (group and [r] + group or (r,)):
+                for k in xrange(offsets[i], offsets[i + 1]):
+                    t = targets[k]
+                    if mark is not None and not mark[t]:
+                        continue
+                    r2 = rep[t]
+                    if r2 != r:
+                        in_degree[r2] -= 1
+                        if in_degree[r2] == 0:
+                            queue.append(r2)
+        return (order, count, in_degree)
+
+    def vertices_topological_sort(self, vertex_set=None):
+        """ vertices_topological_sort(vertex_set=None) -> list(id type)
+        Return the vertices in topological order (every vertex comes
+        after all of its parents). If vertex_set is given, only the
+        vertices reachable from it are sorted.
+
+        Uses Kahn's algorithm and runs in O(V + E).
+
+        raises GraphContainsCycles if the (reachable) graph has a cycle
+
+        """
+        n = len(self._ids)
+        if vertex_set:
+            mark = self._reach(self._indices(vertex_set))
+        else:
+            mark = None
+        (order, count, in_degree) = self._kahn(range(n), mark)
+        if len(order) < count:
+            raise self.GraphContainsCycles(*self._back_edge(in_degree,
+                                                            mark))
+        ids = self._ids
+        return [ids[i] for i in order]
+
+    def _back_edge(self, in_degree, mark=None):
+        """_back_edge(in_degree, mark) -> (id type, id type)
+        Find an edge inside the cyclic leftovers of a Kahn sort.
+
+        """
+        ids = self._ids
+        offsets = self._in_offsets
+        targets = self._in_targets
+        for i in xrange(len(ids)):
+            if in_degree[i] > 0 and (mark is None or mark[i]):
+                for k in xrange(offsets[i], offsets[i + 1]):
+                    j = targets[k]
+                    if in_degree[j] > 0 and (mark is None or mark[j]):
+                        return (ids[j], ids[i])
+        return (None, None)
+
+    def topologically_contractible(self, subgraph):
+        """topologically_contractible(subgraph) -> Boolean.
+
+        Returns true if contracting the subgraph to a single vertex
+        doesn't create cycles. subgraph may be a Graph or an iterable of
+        vertex ids. The contraction is virtual: no graph is copied.
+
+        """
+        sub = self._indices(subgraph)
+        if not sub:
+            return True
+        rep = range(len(self._ids))
+        r = min(sub)
+        for i in sub:
+            rep[i] = r
+        (order, count, _) = self._kahn(rep)
+        return len(order) == count
+
+    ##########################################################################
+    # Subgraphs
+
+    def subgraph(self, vertex_set):
+        """ subgraph(vertex_set) -> Graph.
+
+        Returns a subgraph of self containing all vertices and
+        connections between them."""
+        result = Graph()
+        sub = set(self._indices(vertex_set))
+        ids = self._ids
+        for i in sub:
+            result.add_vertex(ids[i])
+        for i in sub:
+            for k in xrange(self._out_offsets[i], self._out_offsets[i + 1]):
+                j = self._out_targets[k]
+                if j in sub:
+                    result.add_edge(ids[i], ids[j], self._out_edges[k])
+        return result
+
+    def _crossing(self, subgraph, offsets, targets, edges, incoming):
+        ids = self._ids
+        sub = self._indices(subgraph)
+        inside = bytearray(len(ids))
+        for i in sub:
+            inside[i] = 1
+        result = []
+        for i in sub:
+            for k in xrange(offsets[i], offsets[i + 1]):
+                j = targets[k]
+                if not inside[j]:
+                    if incoming:
+                        result.append((ids[j], ids[i], edges[k]))
+                    else:
+                        result.append((ids[i], ids[j], edges[k]))
+        return result
+
+    def connections_to_subgraph(self, subgraph):
+        """connections_to_subgraph(subgraph) -> [(vert_from, vert_to, edge_id)]
+
+        Returns the list of all edges that connect a vertex \not \in
+        subgraph to a vertex \in subgraph. Only the edges incident to
+        subgraph are visited."""
+        return self._crossing(subgraph, self._in_offsets, self._in_targets,
+                              self._in_edges, True)
+
+    def connections_from_subgraph(self, subgraph):
+        """connections_from_subgraph(subgraph) -> [(vert_from, vert_to, edge_id)]
+
+        Returns the list of all edges that connect from a vertex \in
+        subgraph to a vertex \not \in subgraph. Only the edges incident
+        to subgraph are visited."""
+        return self._crossing(subgraph, self._out_offsets, self._out_targets,
+                              self._out_edges, False)
+
+    ##########################################################################
+    # Iterators
+
+    def iter_edges_from(self, vertex):
+        """iter_edges_from(self, vertex) -> iterable
+
+        Returns an iterator over all edges in the form
+        (vertex, vert_to, edge_id)."""
+        return ((vertex, to, eid) for (to, eid) in self.edges_from(vertex))
+
+    def iter_edges_to(self, vertex):
+        """iter_edges_to(self, vertex) -> iterable
+
+        Returns an iterator over all edges in the form
+        (vert_from, vertex, edge_id)."""
+        return ((froom, vertex, eid) for (froom, eid) in self.edges_to(vertex))
+
+    def iter_all_edges(self):
+        """iter_all_edges() -> iterable
+
+        Returns an iterator over all edges in the graph in the form
+        (vert_from, vert_to, edge_id)."""
+        ids = self._ids
+        offsets = self._out_offsets
+        for i in xrange(len(ids)):
+            for k in xrange(offsets[i], offsets[i + 1]):
+                yield (ids[i], ids[self._out_targets[k]], self._out_edges[k])
+
+    def iter_vertices(self):
+        """iter_vertices() -> iterable
+
+        Returns an iterator over all vertex ids of the graph."""
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+################################################################################
+# Unit testing
+
+class TestCompactGraph(unittest.TestCase):
+
+    def make_linear(self, n):
+        g = Graph()
+        for i in xrange(n):
+            g.add_vertex(i)
+        for i in xrange(n - 1):
+            g.add_edge(i, i + 1, i)
+        return g
+
+    def make_diamond(self):
+        g = Graph()
+        for v in 'abcde':
+            g.add_vertex(v)
+        g.add_edge('a', 'b', 0)
+        g.add_edge('a', 'c', 1)
+        g.add_edge('b', 'd', 2)
+        g.add_edge('c', 'd', 3)
+        return g
+
+    def test_accessors(self):
+        g = self.make_diamond()
+        c = g.compact()
+        self.assertEqual(sorted(c.sinks()), sorted(g.sinks()))
+        self.assertEqual(sorted(c.sources()), sorted(g.sources()))
+        for v in g.vertices:
+            self.assertEqual(c.edges_from(v), g.edges_from(v))
+            self.assertEqual(c.edges_to(v), g.edges_to(v))
+            self.assertEqual(c.out_degree(v), g.out_degree(v))
+            self.assertEqual(c.in_degree(v), g.in_degree(v))
+        self.assertEqual(c.get_edge('c', 'd'), 3)
+        self.assertEqual(c.get_edge('d', 'c'), None)
+        self.assertTrue(c.has_edge('a', 'b'))
+        self.assertFalse(c.has_edge('b', 'a'))
+        self.assertEqual(c.parent('d'), 'c')
+        self.assertRaises(c.VertexHasNoParentError, c.parent, 'a')
+        self.assertEqual(c.bfs('a'), g.bfs('a'))
+        self.assertEqual(sorted(c.iter_all_edges()),
+                         sorted(g.iter_all_edges()))
+        self.assertEqual(c.inverse().edges_from('d'), g.edges_to('d'))
+        self.assertRaises(GraphException, c.add_vertex, 'f')
+
+    def test_snapshot(self):
+        g = self.make_linear(3)
+        c = g.compact()
+        g.add_vertex(3)
+        g.add_edge(2, 3)
+        self.assertNotIn(3, c.vertices)
+        self.assertEqual(c.sinks(), [2])
+
+    def test_topological_sort(self):
+        order = self.make_diamond().compact().vertices_topological_sort()
+        pos = dict((v, i) for (i, v) in enumerate(order))
+        self.assertEqual(len(order), 5)
+        self.assertTrue(pos['a'] < pos['b'] < pos['d'])
+        self.assertTrue(pos['a'] < pos['c'] < pos['d'])
+        c = self.make_diamond().compact()
+        self.assertEqual(set(c.vertices_topological_sort(['c'])),
+                         set(['c', 'd']))
+
+    def test_deep_graph(self):
+        """Deep graphs must not hit the recursion limit."""
+        n = 50000
+        c = self.make_linear(n).compact()
+        self.assertEqual(c.vertices_topological_sort(), range(n))
+        self.assertEqual(len(c.reachable([n - 1], reverse=True)), n)
+        self.assertEqual(c.reachable([n - 2]), set([n - 2, n - 1]))
+
+    def test_cycles(self):
+        g = self.make_linear(4)
+        g.add_edge(3, 1)
+        c = g.compact()
+        with self.assertRaises(Graph.GraphContainsCycles):
+            c.vertices_topological_sort()
+        with self.assertRaises(Graph.GraphContainsCycles):
+            c.vertices_topological_sort([2])
+        g.add_vertex(4)
+        g.add_edge(4, 0)
+        self.assertEqual(g.compact().reachable([4], reverse=True),
+                         set([4]))
+        self.assertTrue(c.topologically_contractible([1, 2, 3]))
+        self.assertFalse(c.topologically_contractible([0]))
+
+    def test_subgraph_queries(self):
+        g = self.make_diamond()
+        c = g.compact()
+        self.assertEqual(c.subgraph(['a', 'b']), g.subgraph(['a', 'b']))
+        sub = g.subgraph(['b', 'c'])
+        self.assertEqual(sorted(c.connections_to_subgraph(sub)),
+                         [('a', 'b', 0), ('a', 'c', 1)])
+        self.assertEqual(sorted(c.connections_from_subgraph(['b', 'c'])),
+                         [('b', 'd', 2), ('c', 'd', 3)])
+        self.assertEqual(sorted(g.connections_to_subgraph(sub)),
+                         sorted(c.connections_to_subgraph(sub)))
+        self.assertTrue(c.topologically_contractible(['b', 'c']))
+        self.assertFalse(c.topologically_contractible(['a', 'd']))
+        self.assertTrue(c.topologically_contractible(['a', 'b', 'c', 'd']))
+
+if __name__ == '__main__':
+    unittest.main()
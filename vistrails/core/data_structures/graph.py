@@ -406,7 +406,7 @@ class Graph(object):
             self.back_edge = (v1, v2)
         def __str__(self):
             return ("Graph contains cycles: back edge %s encountered" %
-                    self.back_edge)
+                    (self.back_edge,))
 
     def dfs(self,
             vertex_set=None,
@@ -541,16 +541,9 @@ class Graph(object):
         traversed). vertex_set is optionally a list of vertices on
         which to perform the topological sort.
 
-        This is O(n log n) instead of the optimal O(n), 
+        This runs Kahn's algorithm on a compact snapshot and is O(n).
         """
-        (d, p, f) = self.dfs(vertex_set,raise_if_cyclic=True)
-        # Optimized these three lines into the last one
-        # lst = [(v, k) for (k,v) in f.iteritems()]
-        # lst.sort(reverse=True)
-        # return [v for (k, v) in lst]
-        return [k for (k, _) in sorted(f.iteritems(), 
-                                       key=lambda x: (x[1], x[0]),
-                                       reverse=True)]
+        return self.compact().vertices_topological_sort(vertex_set)
 
     def topologically_contractible(self, subgraph):
         """topologically_contractible(subgraph) -> Boolean.
@@ -558,22 +551,17 @@ class Graph(object):
         Returns true if contracting the subgraph to a single vertex
         doesn't create cycles. This is equivalent to checking whether
         a pipeline subgraph forms a legal abstraction."""
-        x = copy.copy(self)
-        conns_to_subgraph = self.connections_to_subgraph(subgraph)
-        conns_from_subgraph = self.connections_from_subgraph(subgraph)
-        for v in subgraph.vertices.iterkeys():
-            x.delete_vertex(v)
-        free_vertex = max(subgraph.vertices.iterkeys()) + 1
-        x.add_vertex(free_vertex)
-        for (edge_from, edge_to, edge_id) in conns_to_subgraph:
-            x.add_edge(free_vertex, edge_to)
-        for (edge_from, edge_to, edge_id) in conns_from_subgraph:
-            x.add_edge(edge_from, free_vertex)
-        try:
-            x.vertices_topological_sort()
-            return True
-        except self.GraphContainsCycles:
-            return False
+        return self.compact().topologically_contractible(subgraph)
+
+    def compact(self):
+        """compact() -> CompactGraph
+
+        Returns an array-backed, read-only snapshot of the graph with
+        linear-time traversals. The snapshot does not follow later
+        changes to self."""
+        from vistrails.core.data_structures.compact_graph import \
+            CompactGraph
+        return CompactGraph(self)
 
     ##########################################################################
     # Subgraphs
@@ -600,16 +588,13 @@ class Graph(object):
 
         Returns the list of all edges that connect to a vertex \in
         subgraph. subgraph is assumed to be a subgraph of self"""
-        vertices_to_traverse = set(self.vertices.iterkeys())
-        subgraph_verts = set(subgraph.vertices.iterkeys())
-        vertices_to_traverse -= subgraph_verts
+        subgraph_verts = subgraph.vertices
 
         result = []
-        for v in vertices_to_traverse:
-            for e in self.adjacency_list[v]:
-                (v_to, e_id) = e
-                if v_to in subgraph_verts:
-                    result.append((v, v_to, e_id))
+        for v in subgraph_verts:
+            for (v_from, e_id) in self.inverse_adjacency_list[v]:
+                if v_from not in subgraph_verts:
+                    result.append((v_from, v, e_id))
         return result
 
     def connections_from_subgraph(self, subgraph):
@@ -197,18 +197,23 @@ class BaseInterpreter(object):
     def update_params(self, pipeline,
                         customParams=None):
         """update_params(pipeline: Pipeline, 
-                         customParams=[(vttype, oId, strval)] -> None
+                         customParams=[(vttype, oId, strval)] -> bool
         This will set the new parameter values in the pipeline before
-        execution 
+        execution. Returns True if a value was changed.
         
         """
+        changed = False
         if customParams:
             for (vttype, oId, strval) in customParams:
                 try:
                     param = pipeline.db_get_object(vttype,oId)
-                    param.strValue = str(strval)
+                    strval = str(strval)
+                    if param.strValue != strval:
+                        param.strValue = strval
+                        changed = True
                 except Exception, e:
                     debug.debug("Problem when updating params", e)
+        return changed
 
     def resolve_variables(self, vistrail_variables, pipeline):
         for m in pipeline.module_list:
@@ -75,13 +75,14 @@ class ViewUpdatingLogController(object):
             self.log.finish_iteration(looped_obj)
 
     def __init__(self, logger, view, remap_id, ids,
-                 module_executed_hook=[]):
+                 module_executed_hook=[], profiler=None):
         self.log = logger
         self.view = view
         self.remap_id = remap_id
         self.ids = set(ids) # modules left to be executed
         self.nb_modules = len(self.ids)
         self.module_executed_hook = module_executed_hook
+        self.profiler = profiler
 
         self.errors = {}
         self.executed = {}
@@ -99,6 +100,10 @@ class ViewUpdatingLogController(object):
     def begin_update(self, obj):
         i = self.remap_id(obj.id)
         self.view.set_module_active(i)
+        if self.profiler is not None:
+            reg = get_module_registry()
+            module_name = reg.get_descriptor(obj.__class__).name
+            self.profiler.begin_update(obj, i, module_name)
 
     def begin_compute(self, obj):
         i = self.remap_id(obj.id)
@@ -108,6 +113,8 @@ class ViewUpdatingLogController(object):
         module_name = reg.get_descriptor(obj.__class__).name
 
         self.log.start_execution(obj, i, module_name)
+        if self.profiler is not None:
+            self.profiler.begin_compute(obj, i, module_name)
 
     def update_progress(self, obj, progress=0.0):
         i = self.remap_id(obj.id)
@@ -167,6 +174,11 @@ class ViewUpdatingLogController(object):
                     1.0 - ((len(self.ids) + len(Generator.generators)) * 1.0 /
                            (self.nb_modules + len(Generator.generators))))
 
+        if self.profiler is not None:
+            profile = self.profiler.end_update(obj, error)
+            if profile:
+                self.log.insert_module_annotations(obj, profile)
+
         msg = '' if error is None else error.msg
         self.log.finish_execution(obj, msg, errorTrace,
                                   was_suspended)
@@ -181,6 +193,10 @@ class ViewUpdatingLogController(object):
         self.log.start_execution(obj, i, module_name,
                                  cached=1)
         self.view.set_module_not_executed(i)
+        if self.profiler is not None:
+            profile = self.profiler.update_cached(obj)
+            if profile:
+                self.log.insert_module_annotations(obj, profile)
         self.log.finish_execution(obj, '')
 
     def set_computing(self, obj):
@@ -237,7 +253,7 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         g = self._persistent_pipeline.graph
         modules_to_clean = (set(modules_to_clean) &
                             set(self._persistent_pipeline.modules.iterkeys()))
-        dependencies = g.vertices_topological_sort(modules_to_clean)
+        dependencies = g.compact().reachable(modules_to_clean)
         for v in dependencies:
             self._persistent_pipeline.delete_module(v)
             del self._objects[v]
@@ -305,6 +321,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         module_executed_hook = fetch('module_executed_hook', [])
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        profiler = fetch('profiler', None)
+        prepared = fetch('prepared', False)
 
         reg = get_module_registry()
 
@@ -340,7 +358,11 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         to_delete = []
         errors = {}
 
-        if controller is not None:
+        if prepared:
+            # Caller validated the pipeline and keeps its signatures up to
+            # date (see Pipeline.invalidate_signatures())
+            pass
+        elif controller is not None:
             # Controller is none for sub_modules
             controller.validate(pipeline)
         else:
@@ -350,12 +372,16 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         if vistrail_variables:
             self.resolve_variables(vistrail_variables,  pipeline)
 
-        self.update_params(pipeline, params)
+        # A prepared pipeline can be given the params it already has, so
+        # that they are recorded in the log
+        params_changed = self.update_params(pipeline, params)
         
+        refresh = (not prepared or aliases or params_changed or
+                   vistrail_variables)
         (tmp_to_persistent_module_map,
          conn_map,
          module_added_set,
-         conn_added_set) = self.add_to_persistent_pipeline(pipeline)
+         conn_added_set) = self.add_to_persistent_pipeline(pipeline, refresh)
 
         # Create the new objects
         for i in module_added_set:
@@ -459,6 +485,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         clean_pipeline = fetch('clean_pipeline', False)
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        profiler = fetch('profiler', None)
+        fetch('prepared', False)
 
         if len(kwargs) > 0:
             raise VistrailsInternalError('Wrong parameters passed '
@@ -473,7 +501,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
                 view=view,
                 remap_id=get_remapped_id,
                 ids=pipeline.modules.keys(),
-                module_executed_hook=module_executed_hook)
+                module_executed_hook=module_executed_hook,
+                profiler=profiler)
 
         # PARAMETER CHANGES SETUP
         parameter_changes = []
@@ -661,6 +690,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
           actions = fetch('actions', None)
           done_summon_hooks = fetch('done_summon_hooks', [])
           module_executed_hook = fetch('module_executed_hook', [])
+          profiler = fetch('profiler', None)
+          prepared = fetch('prepared', False)
 
         Executes a pipeline using caching. Caching works by reusing
         pipelines directly.  This means that there exists one global
@@ -680,7 +711,11 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         whether they were executed or not.
 
         If modules have no error associated with but were not executed, it
-        means they were cached."""
+        means they were cached.
+
+        If prepared is True, the pipeline is not validated again and only
+        its missing signatures are computed; the caller has to invalidate
+        the signatures of the modules it changed."""
 
         # Setup named arguments. We don't use named parameters so
         # that positional parameter calls fail earlier
@@ -704,6 +739,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         module_executed_hook = fetch('module_executed_hook', [])
         stop_on_error = fetch('stop_on_error', True)
         parent_exec = fetch('parent_exec', None)
+        profiler = fetch('profiler', None)
+        prepared = fetch('prepared', False)
 
         if len(kwargs) > 0:
             raise VistrailsInternalError('Wrong parameters passed '
@@ -770,8 +807,8 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
             d["__params__"] = pickle.dumps(params)
         logger.insert_workflow_exec_annotations(d)
         
-    def add_to_persistent_pipeline(self, pipeline):
-        """add_to_persistent_pipeline(pipeline):
+    def add_to_persistent_pipeline(self, pipeline, refresh=True):
+        """add_to_persistent_pipeline(pipeline, refresh=True):
         (module_id_map, connection_id_map, modules_added)
         Adds a pipeline to the persistent pipeline of the cached interpreter
         and adds current logging object to each existing module.
@@ -781,12 +818,18 @@ class CachedInterpreter(vistrails.core.interpreter.base.BaseInterpreter):
         first one has the module id mapping, the second one has the
         connection id mapping), a set of all module ids added to the
         persistent pipeline, and a set of all connection ids added to
-        the persistent pipeline."""
+        the persistent pipeline.
+
+        If refresh is False, the signatures already computed for pipeline
+        are trusted."""
         module_id_map = Bidict()
         connection_id_map = Bidict()
         modules_added = set()
         connections_added = set()
-        pipeline.refresh_signatures()
+        if refresh:
+            pipeline.refresh_signatures()
+        else:
+            pipeline.compute_signatures()
         # we must traverse vertices in topological sort order
         verts = pipeline.graph.vertices_topological_sort()
         for new_module_id in verts:
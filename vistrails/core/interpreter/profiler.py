@@ -0,0 +1,378 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Collects per-module execution statistics.
+
+An ExecutionProfiler is passed to the interpreter with the 'profiler' keyword
+argument. For each module execution it records the wall-clock time spent
+updating upstream modules and in compute(), the CPU time, how much the
+update raised the peak memory of the process, the size of the values on the
+output ports and whether the result came from the cache. These are stored as annotations on the module
+execution in the log, and can be exported as a Chrome trace (load it in
+chrome://tracing) or as collapsed stacks for flamegraph.pl.
+
+"""
+
+from __future__ import division
+
+import json
+import os
+import sys
+import thread
+import time
+
+try:
+    import resource
+except ImportError: # pragma: no cover
+    resource = None
+
+import unittest
+
+################################################################################
+
+def peak_memory():
+    """peak_memory() -> int
+    Returns the peak resident set size of this process, in bytes, or None if
+    it can't be measured on this platform. This is the high-water mark since
+    the process started: it never goes down.
+
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return rss
+    return rss * 1024
+
+def cpu_time():
+    """cpu_time() -> float
+    Returns the user+system CPU time used by this process, in seconds.
+
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+def value_size(value, depth=3):
+    """value_size(value: object) -> int
+    Estimates the number of bytes held by a value passed through a port.
+
+    """
+    if hasattr(value, 'nbytes'):
+        try:
+            return int(value.nbytes)
+        except (TypeError, ValueError):
+            pass
+    if isinstance(value, basestring):
+        return len(value)
+    size = sys.getsizeof(value, 0)
+    if depth > 0:
+        if isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(value_size(v, depth - 1) for v in value)
+        elif isinstance(value, dict):
+            size += sum(value_size(k, depth - 1) + value_size(v, depth - 1)
+                        for k, v in value.iteritems())
+    return size
+
+
+class ModuleProfile(object):
+    """Timings of a single update of a module.
+
+    """
+    def __init__(self, module_id, name, parent, start):
+        self.module_id = module_id
+        self.name = name
+        self.parent = parent
+        self.thread = thread.get_ident()
+        self.start = start
+        self.compute_start = None
+        self.end = None
+        self.cpu_start = cpu_time()
+        self.cpu_time = None
+        self.peak_memory_start = peak_memory()
+        self.peak_memory_increase = None
+        self.output_bytes = 0
+        self.cached = False
+        self.error = False
+
+    @property
+    def wall_time(self):
+        return self.end - self.start
+
+    @property
+    def upstream_time(self):
+        if self.compute_start is None:
+            return self.wall_time
+        return self.compute_start - self.start
+
+    @property
+    def compute_time(self):
+        if self.compute_start is None:
+            return 0.0
+        return self.end - self.compute_start
+
+    def annotations(self):
+        """annotations() -> dict
+        Returns the statistics as log annotations.
+
+        """
+        d = {'profile_wall_time': '%.6f' % self.wall_time,
+             'profile_upstream_time': '%.6f' % self.upstream_time,
+             'profile_compute_time': '%.6f' % self.compute_time,
+             'profile_cpu_time': '%.6f' % self.cpu_time,
+             'profile_output_bytes': str(self.output_bytes),
+             'profile_cache': 'hit' if self.cached else 'miss'}
+        if self.peak_memory_increase is not None:
+            d['profile_peak_memory_increase'] = str(self.peak_memory_increase)
+        return d
+
+
+class ExecutionProfiler(object):
+    """Records ModuleProfile objects from the interpreter's logging calls.
+
+    Module updates are nested (a module updates its upstream modules before
+    calling compute()), so the profiler keeps a stack of the modules being
+    updated to know the parent of each one.
+
+    """
+    def __init__(self):
+        self.origin = time.time()
+        self.profiles = []
+        self._active = {}
+        self._stack = []
+
+    def _open(self, module, module_id, name):
+        parent = self._stack[-1] if self._stack else None
+        profile = ModuleProfile(module_id, name, parent, time.time())
+        self._active[module] = profile
+        self._stack.append(profile)
+        return profile
+
+    def _close(self, module):
+        profile = self._active.pop(module, None)
+        if profile is None:
+            return None
+        profile.end = time.time()
+        profile.cpu_time = cpu_time() - profile.cpu_start
+        if profile.peak_memory_start is not None:
+            # The peak only grows, so this is how far above the previous
+            # peak the update went, 0 if it stayed under it
+            profile.peak_memory_increase = (peak_memory() -
+                                            profile.peak_memory_start)
+        # Modules above this one on the stack failed without being closed
+        while self._stack:
+            top = self._stack.pop()
+            if top is profile:
+                break
+            self._active = dict((m, p) for m, p in self._active.iteritems()
+                                if p is not top)
+        self.profiles.append(profile)
+        return profile
+
+    def begin_update(self, module, module_id, name):
+        self._open(module, module_id, name)
+
+    def begin_compute(self, module, module_id, name):
+        profile = self._active.get(module)
+        if profile is None:
+            # Modules run by loops are computed without an update
+            profile = self._open(module, module_id, name)
+        profile.compute_start = time.time()
+
+    def end_update(self, module, error=None):
+        """end_update(module: Module, error: Exception) -> dict
+        Finishes the profile of a module, returning its annotations (empty
+        if compute() was never reached, as there is no log entry for them).
+
+        """
+        profile = self._close(module)
+        if profile is None:
+            return {}
+        profile.error = error is not None
+        profile.output_bytes = sum(value_size(v)
+                                   for v in module.outputPorts.itervalues())
+        if profile.compute_start is None:
+            return {}
+        return profile.annotations()
+
+    def update_cached(self, module):
+        """update_cached(module: Module) -> dict
+        Finishes the profile of a module that was found in the cache.
+
+        """
+        profile = self._close(module)
+        if profile is None:
+            return {}
+        profile.cached = True
+        return profile.annotations()
+
+    def to_chrome_trace(self):
+        """to_chrome_trace() -> dict
+        Returns the profiles in the Chrome trace-event format.
+
+        """
+        pid = os.getpid()
+        events = []
+        for profile in self.profiles:
+            ts = (profile.start - self.origin) * 1e6
+            args = profile.annotations()
+            args['module_id'] = profile.module_id
+            events.append({'name': profile.name,
+                           'cat': 'cached' if profile.cached else 'module',
+                           'ph': 'X',
+                           'ts': ts,
+                           'dur': profile.wall_time * 1e6,
+                           'pid': pid,
+                           'tid': profile.thread,
+                           'args': args})
+            if profile.compute_start is not None:
+                events.append({'name': 'compute',
+                               'cat': 'compute',
+                               'ph': 'X',
+                               'ts': (profile.compute_start -
+                                      self.origin) * 1e6,
+                               'dur': profile.compute_time * 1e6,
+                               'pid': pid,
+                               'tid': profile.thread})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def to_collapsed_stacks(self):
+        """to_collapsed_stacks() -> list of str
+        Returns the profiles as 'frame;frame;frame microseconds' lines, the
+        input format of flamegraph.pl.
+
+        """
+        children_time = {}
+        for profile in self.profiles:
+            if profile.parent is not None:
+                key = id(profile.parent)
+                children_time[key] = (children_time.get(key, 0.0) +
+                                      profile.wall_time)
+        stacks = {}
+        for profile in self.profiles:
+            frames = []
+            p = profile
+            while p is not None:
+                frames.append('%s#%s' % (p.name, p.module_id))
+                p = p.parent
+            stack = ';'.join(reversed(frames))
+            self_time = profile.wall_time - children_time.get(id(profile), 0.0)
+            stacks[stack] = stacks.get(stack, 0) + max(0, self_time)
+        return ['%s %d' % (stack, int(t * 1e6))
+                for stack, t in sorted(stacks.iteritems())]
+
+    def write(self, filename):
+        """write(filename: str) -> None
+        Writes a Chrome trace if filename ends with .json, else collapsed
+        stacks for flamegraph.pl.
+
+        """
+        with open(filename, 'wb') as fp:
+            if filename.lower().endswith('.json'):
+                json.dump(self.to_chrome_trace(), fp)
+            else:
+                for line in self.to_collapsed_stacks():
+                    fp.write(line + '\n')
+
+################################################################################
+# Testing
+
+
+class TestExecutionProfiler(unittest.TestCase):
+
+    def test_profile(self):
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.interpreter.cached import CachedInterpreter
+        from vistrails.core.modules.basic_modules import StandardOutput
+        import vistrails.core.system
+        from vistrails.core.utils import DummyView
+        from vistrails.core.vistrail.controller import VistrailController
+
+        locator = XMLFileLocator(vistrails.core.system.vistrails_root_directory() +
+                                 '/tests/resources/dummy.xml')
+        (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+        controller = VistrailController(v, locator, abstractions,
+                                        thumbnails, mashups)
+        version = v.get_version_number('int chain')
+        controller.change_selected_version(version)
+        controller.flush_delayed_actions()
+        pipeline = controller.current_pipeline
+        n = len(pipeline.modules)
+
+        old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+        try:
+            CachedInterpreter.flush()
+            interpreter = CachedInterpreter.get()
+            profiler = ExecutionProfiler()
+            for i in xrange(2):
+                interpreter.execute(pipeline, locator=locator,
+                                    current_version=version,
+                                    view=DummyView(), profiler=profiler)
+        finally:
+            StandardOutput.compute = old_compute
+
+        self.assertEqual(len(profiler.profiles), 2 * n)
+        first, second = profiler.profiles[:n], profiler.profiles[n:]
+        self.assertFalse(any(p.cached for p in first))
+        # StandardOutput is not cacheable
+        self.assertEqual([p.cached for p in second],
+                         [True] * (n - 1) + [False])
+        for p in first:
+            self.assertGreaterEqual(p.wall_time, p.compute_time)
+            self.assertIsNotNone(p.compute_start)
+            if p.peak_memory_increase is not None:
+                self.assertGreaterEqual(p.peak_memory_increase, 0)
+        # Every module but the sink was updated from a downstream one
+        self.assertEqual(sum(1 for p in first if p.parent is None), 1)
+
+        trace = profiler.to_chrome_trace()
+        self.assertEqual(
+                sum(1 for e in trace['traceEvents'] if e['cat'] == 'module'),
+                n + 1)
+        stacks = profiler.to_collapsed_stacks()
+        self.assertEqual(max(len(s.split(';')) for s in stacks), n)
+
+    def test_value_size(self):
+        self.assertEqual(value_size('abcd'), 4)
+        self.assertGreater(value_size([1, 2, 3]), value_size([]))
+        try:
+            import numpy
+        except ImportError:
+            self.skipTest("numpy is not available")
+        self.assertEqual(value_size(numpy.zeros(10, dtype='float64')), 80)
+
+
+if __name__ == '__main__':
+    unittest.main()
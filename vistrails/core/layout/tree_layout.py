@@ -93,8 +93,12 @@ class TreeLW(object):
         else:
             node.level = node.parent.level + 1
         maxLevel = node.level
-        for child in node.childs:
-            maxLevel = max(maxLevel, self.__dfsUpdateLevel(child))
+        stack = list(node.childs)
+        while stack:
+            v = stack.pop()
+            v.level = v.parent.level + 1
+            maxLevel = max(maxLevel, v.level)
+            stack.extend(v.childs)
         return maxLevel
 
     def boundingBox(self):
@@ -300,7 +304,27 @@ class TreeLayoutLW(object):
 
 
     def firstWalk(self, v):
-        
+
+        # post-order walk with an explicit stack; each entry holds the
+        # node, the index of its next child and its default ancestor
+        stack = [[v, 0, None]]
+        while stack:
+            top = stack[-1]
+            v = top[0]
+            if top[1] < len(v.childs):
+                if top[1] == 0:
+                    top[2] = v.leftChild()
+                stack.append([v.childs[top[1]], 0, None])
+                top[1] += 1
+                continue
+            stack.pop()
+            self.finishFirstWalk(v)
+            if stack:
+                parent = stack[-1]
+                parent[2] = self.apportion(v, parent[2])
+
+    def finishFirstWalk(self, v):
+
         if v.isLeaf():
             v.prelim = 0
             w = v.leftSibling()
@@ -309,10 +333,6 @@ class TreeLayoutLW(object):
 
         else:
             
-            defaultAncestor = v.leftChild()
-            for w in v.childs:
-                self.firstWalk(w)
-                defaultAncestor = self.apportion(w, defaultAncestor)
             self.executeShifts(v)
             
             midpoint = (v.leftChild().prelim + v.rightChild().prelim) / 2.0
@@ -427,9 +447,12 @@ class TreeLayoutLW(object):
             return defaultAncestor
 
     def secondWalk(self,  v, m):
-        v.x = v.prelim + m
-        for w in v.childs:
-            self.secondWalk(w, m + v.mod)
+        stack = [(v, m)]
+        while stack:
+            (v, m) = stack.pop()
+            v.x = v.prelim + m
+            for w in v.childs:
+                stack.append((w, m + v.mod))
 
 # graph
 if __name__ == "__main__":
@@ -107,9 +107,12 @@ class VistrailsTreeLayoutLW(object):
 
         # mount list of edges (parent, child).
         # preserving the order given by
-        # "graph.edges_from()".
+        # "graph.edges_from()". Parents are visited in topological
+        # order so children are attached before they get children
+        # of their own, keeping the level updates linear.
         edges = []
-        for id in graph.vertices:
+        graph = graph.compact()
+        for id in graph.vertices_topological_sort():
             froom = graph.edges_from(id)
             for (first,second) in froom:
                 # print "arc %d -> %d" % (id, first)                
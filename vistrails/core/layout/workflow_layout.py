@@ -510,27 +510,37 @@ class WorkflowLayout(object):
         if len(self.wf.modules) == 0:
             return
         
-        visited = set()
-        min_layer = [0]
-        def set_module_layer_number(module, layer_number):
-            module.layout_layer_number = layer_number
-            visited.add(module)
-            min_layer[0] = min(min_layer[0], layer_number)
+        def neighbors(module):
+            layer_number = module.layout_layer_number
             for port in module.input_ports:
                 for conn in port.connections:
-                    if conn.source_port.module not in visited:
-                        set_module_layer_number(conn.source_port.module, layer_number-1)
+                    yield (conn.source_port.module, layer_number-1)
             for port in module.output_ports:
                 for conn in port.connections:
-                    if conn.target_port.module not in visited:
-                        set_module_layer_number(conn.target_port.module, layer_number+1)
-               
-        set_module_layer_number(self.wf.modules[0], 0)
+                    yield (conn.target_port.module, layer_number+1)
+
+        # depth-first walk with an explicit stack so long workflows
+        # do not hit the recursion limit
+        first = self.wf.modules[0]
+        first.layout_layer_number = 0
+        visited = set([first])
+        min_layer = 0
+        stack = [neighbors(first)]
+        while stack:
+            for (module, layer_number) in stack[-1]:
+                if module not in visited:
+                    module.layout_layer_number = layer_number
+                    visited.add(module)
+                    min_layer = min(min_layer, layer_number)
+                    stack.append(neighbors(module))
+                    break
+            else:
+                stack.pop()
                         
         #adjust all layers numbers so that the min is 0
-        if min_layer[0] < 0:
+        if min_layer < 0:
             for module in self.wf.modules:
-                module.layout_layer_number -= min_layer[0]
+                module.layout_layer_number -= min_layer
 
     def assign_module_permutation_to_each_layer(self, preserve_order=False):
         wf = self.wf
@@ -72,7 +72,10 @@ class DummyLogController(object):
 class LogController(object):
     """The top-level log controller.
 
-    This holds a log.
+    This holds a log. If a LogSink is given, the exec records are written to
+    it as they finish, and removed from the log. If a ProvenanceStore is
+    given, the execs are also recorded in it as they happen, with the
+    signatures of the modules, that are not stored in the log itself.
     """
     local_machine = Machine(
             id=-1,
@@ -82,8 +85,10 @@ class LogController(object):
             processor=vistrails.core.system.current_processor(),
             ram=vistrails.core.system.guess_total_memory())
 
-    def __init__(self, log, machine=None):
+    def __init__(self, log, machine=None, sink=None, store=None):
         self.log = log
+        self.sink = sink
+        self.store = store
         self.module_execs = {}      # vistrails_module -> *Exec
         self.parent_execs = {}      # vistrails_module -> *Exec
         self.children_execs = {}    # vistrails_module -> [*Exec]
@@ -133,7 +138,8 @@ class LogController(object):
         """Signals the start of the execution of a pipeline.
         """
         return LogWorkflowExecController(self.log, self.machine, parent_exec,
-                                         vistrail, pipeline, currentVersion)
+                                         vistrail, pipeline, currentVersion,
+                                         self.sink, self.store)
 
 
 class LogLoopController(object):
@@ -159,6 +165,10 @@ class LogLoopController(object):
             execs.discard(self.loop_exec)
         except KeyError:
             pass
+        if self.controller.store is not None:
+            self.controller.store.finish(self.loop_exec)
+        if self.controller.sink is not None:
+            self.controller.sink.finish(self.loop_exec)
 
     def start_iteration(self, looped_module, iteration):
         """Signals that we are executing a module as an iteration of the loop.
@@ -166,6 +176,12 @@ class LogLoopController(object):
         loop_iteration = self._create_loop_iteration(iteration)
         self.loop_exec.add_loop_iteration(loop_iteration)
         self.controller.parent_execs[looped_module] = loop_iteration
+        if self.controller.store is not None:
+            self.controller.store.start(loop_iteration, self.loop_exec,
+                                        self.controller.workflow_exec)
+        if self.controller.sink is not None:
+            self.controller.sink.start(loop_iteration, self.loop_exec,
+                                       self.controller.workflow_exec)
 
     def finish_iteration(self, looped_module):
         """Signals that the iteration is done.
@@ -175,6 +191,10 @@ class LogLoopController(object):
 
         loop_iteration.ts_end = vistrails.core.system.current_time()
         loop_iteration.completed = 1
+        if self.controller.store is not None:
+            self.controller.store.finish(loop_iteration)
+        if self.controller.sink is not None:
+            self.controller.sink.finish(loop_iteration)
 
 
 class LogWorkflowController(LogController):
@@ -200,8 +220,9 @@ class LogWorkflowController(LogController):
            finished with the same error as the module if it fails before they
            end
     """
-    def __init__(self, log, machine, parent_exec, workflow_exec):
-        super(LogWorkflowController, self).__init__(log, machine)
+    def __init__(self, log, machine, parent_exec, workflow_exec, sink=None,
+                 store=None):
+        super(LogWorkflowController, self).__init__(log, machine, sink, store)
         self.parent_exec = parent_exec
         self.workflow_exec = workflow_exec
 
@@ -213,7 +234,8 @@ class LogWorkflowController(LogController):
         if parent_exec in self.module_execs:
             parent_exec = self.module_execs[parent_exec]
         return LogWorkflowController(self.log, self.machine, parent_exec,
-                                     self.workflow_exec)
+                                     self.workflow_exec, self.sink,
+                                     self.store)
 
     def get_iteration_from_module(self, module):
         """If executing this module as part of a loop, gets the iteration;
@@ -247,6 +269,13 @@ class LogWorkflowController(LogController):
                             self.workflow_exec):
             if parent_exec is not None:
                 parent_exec.add_item_exec(module_exec)
+                if self.store is not None:
+                    self.store.start(module_exec, parent_exec,
+                                     self.workflow_exec,
+                                     getattr(module, 'signature', None))
+                if self.sink is not None:
+                    self.sink.start(module_exec, parent_exec,
+                                    self.workflow_exec)
                 return
         assert False
 
@@ -263,7 +292,12 @@ class LogWorkflowController(LogController):
                     parent_exec.add_loop_exec(loop_exec)
                 break
         else:
-            self.workflow_exec.add_item_exec(loop_exec)
+            parent_exec = self.workflow_exec
+            parent_exec.add_item_exec(loop_exec)
+        if self.store is not None:
+            self.store.start(loop_exec, parent_exec, self.workflow_exec)
+        if self.sink is not None:
+            self.sink.start(loop_exec, parent_exec, self.workflow_exec)
         self.children_execs.setdefault(loop_module, set()).add(loop_exec)
         return LogLoopController(self, loop_exec, loop_module)
 
@@ -304,6 +338,15 @@ class LogWorkflowController(LogController):
             else:
                 child.completed = -1
                 child.error = error
+            if self.store is not None:
+                self.store.finish(child)
+            if self.sink is not None:
+                self.sink.finish(child)
+
+        if self.store is not None:
+            self.store.finish(module_exec)
+        if self.sink is not None:
+            self.sink.finish(module_exec)
 
     def insert_module_annotations(self, module, a_dict):
         """Adds an annotation on the execution object for this module.
@@ -345,7 +388,7 @@ class LogWorkflowExecController(LogWorkflowController):
     obtained through recursing(), don't.
     """
     def __init__(self, log, machine, parent_exec, vistrail=None, pipeline=None,
-                 currentVersion=None):
+                 currentVersion=None, sink=None, store=None):
         if vistrail is not None:
             parent_type = Vistrail.vtType
             parent_id = vistrail.id
@@ -371,8 +414,14 @@ class LogWorkflowExecController(LogWorkflowController):
                 session=session,
                 machines=[machine])
         log.add_workflow_exec(workflow_exec)
+        if store is not None:
+            locator = getattr(vistrail, 'locator', None)
+            store.start_workflow(workflow_exec,
+                                 locator.name if locator is not None else None)
+        if sink is not None:
+            sink.start_workflow(workflow_exec)
 
-        super(LogWorkflowExecController, self).__init__(log, machine, parent_exec, workflow_exec)
+        super(LogWorkflowExecController, self).__init__(log, machine, parent_exec, workflow_exec, sink, store)
 
     def finish_workflow_execution(self, errors, suspended=False):
         """Signals the end of the execution of a pipeline.
@@ -384,3 +433,7 @@ class LogWorkflowExecController(LogWorkflowController):
             self.workflow_exec.completed = -1
         else:
             self.workflow_exec.completed = 1
+        if self.store is not None:
+            self.store.finish_workflow(self.workflow_exec)
+        if self.sink is not None:
+            self.sink.finish_workflow(self.workflow_exec)
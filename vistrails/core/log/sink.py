@@ -0,0 +1,442 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Log sinks write the execution log as it is recorded.
+
+A LogController given a sink hands it each exec record (ModuleExec,
+GroupExec, LoopExec, LoopIteration) when it finishes; the sink writes it
+then removes it from its parent, so that the memory used by the log stays
+bounded however long the execution. The WorkflowExec itself stays in the
+Log, without its children.
+
+read_log() reconstructs a complete Log from the records, which can then be
+saved as usual, e.g. with save_log_to_xml().
+"""
+
+import os
+import sqlite3
+import uuid
+from xml.sax.saxutils import quoteattr
+
+from vistrails.core import debug
+from vistrails.core.log.log import Log
+from vistrails.core.log.loop_exec import LoopExec, LoopIteration
+from vistrails.core.log.module_exec import ModuleExec
+from vistrails.core.log.workflow_exec import WorkflowExec
+from vistrails.core.system import get_elementtree_library
+from vistrails.db import VistrailsDBException
+from vistrails.db.domain import DBLog
+import vistrails.db.services.log
+from vistrails.db.versions import getVersionDAO, currentVersion, translate_log
+
+ElementTree = get_elementtree_library()
+
+
+class LogSink(object):
+    """Base class for the log sinks.
+
+    A sink records the execs of a single Log, whose ids are unique.
+    Subclasses implement write_record(), records(), flush() and close().
+    A record is a dict with keys 'run', 'version', 'vt_type', 'id',
+    'parent_type', 'parent_id', 'workflow_exec' and 'xml'.
+    """
+    def __init__(self):
+        # identifies the records of this sink among others in the same
+        # storage, as ids are only unique within a Log
+        self.run = uuid.uuid1().hex
+        self._parents = {}      # (vt_type, id) -> (parent, workflow_exec)
+
+    def start_workflow(self, workflow_exec):
+        """start_workflow(workflow_exec: WorkflowExec) -> None
+        Writes the workflow exec, so that its records can be found even if
+        it never finishes.
+
+        """
+        self._write(workflow_exec, None, workflow_exec)
+        self.flush()
+
+    def start(self, exec_, parent, workflow_exec):
+        """start(exec_, parent, workflow_exec: WorkflowExec) -> None
+        Remembers where the exec record was added.
+
+        """
+        self._parents[(exec_.vtType, exec_.id)] = (parent, workflow_exec)
+
+    def finish(self, exec_):
+        """finish(exec_) -> None
+        Writes the finished exec record and removes it from its parent.
+
+        """
+        try:
+            parent, workflow_exec = self._parents.pop((exec_.vtType,
+                                                       exec_.id))
+        except KeyError:
+            # Not started through this sink, it will be written with its
+            # parent
+            return
+        self._write(exec_, parent, workflow_exec)
+        if exec_.vtType == LoopExec.vtType and \
+                parent.vtType == ModuleExec.vtType:
+            parent.db_delete_loop_exec(exec_)
+        elif exec_.vtType == LoopIteration.vtType:
+            parent.db_delete_loop_iteration(exec_)
+        else:
+            parent.db_delete_item_exec(exec_)
+
+    def finish_workflow(self, workflow_exec):
+        """finish_workflow(workflow_exec: WorkflowExec) -> None
+        Writes the finished workflow exec, with the records that were not
+        written on their own.
+
+        """
+        self._write(workflow_exec, None, workflow_exec)
+        self.flush()
+
+    def _write(self, exec_, parent, workflow_exec):
+        node = getVersionDAO(currentVersion).write_xml_object(exec_)
+        self.write_record({
+                'run': self.run,
+                'version': currentVersion,
+                'vt_type': exec_.vtType,
+                'id': exec_.id,
+                'parent_type': parent.vtType if parent is not None else None,
+                'parent_id': parent.id if parent is not None else None,
+                'workflow_exec': workflow_exec.id,
+                'xml': ElementTree.tostring(node)})
+
+    def write_record(self, record):
+        raise NotImplementedError
+
+    def records(self):
+        """records() -> iter(dict)
+        Reads back the records, in the order they were written.
+
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def read_log(self):
+        """read_log() -> Log
+        Reconstructs the log from all the records, including those written
+        by other runs.
+
+        """
+        self.flush()
+        version = None
+        objects = {}
+        records = []
+        for record in self.records():
+            if version is None:
+                version = record['version']
+            elif record['version'] != version:
+                raise VistrailsDBException("Log records have different "
+                                           "versions: %s and %s" % (
+                                           version, record['version']))
+            node = ElementTree.fromstring(record['xml'])
+            obj = getVersionDAO(version).read_xml_object(record['vt_type'],
+                                                         node)
+            # the last record wins, i.e. the finished workflow exec
+            objects[(record['run'], obj.vtType, obj.db_id)] = obj
+            records.append(record)
+
+        workflow_execs = []
+        added = set()
+        for record in records:
+            key = (record['run'], record['vt_type'], record['id'])
+            if key in added:
+                continue
+            added.add(key)
+            obj = objects[key]
+            if record['parent_type'] is None:
+                workflow_execs.append(obj)
+                continue
+            parent = objects.get((record['run'], record['parent_type'],
+                                  record['parent_id']))
+            if parent is None:
+                # the parent never finished; keep the record in the workflow
+                parent = objects.get((record['run'], WorkflowExec.vtType,
+                                      record['workflow_exec']))
+                if parent is None:
+                    debug.warning("Dropping log record %s %s of unknown "
+                                  "workflow" % (key[1], key[2]))
+                    continue
+            if obj.vtType == LoopExec.vtType and \
+                    parent.vtType == ModuleExec.vtType:
+                parent.db_add_loop_exec(obj)
+            elif obj.vtType == LoopIteration.vtType:
+                parent.db_add_loop_iteration(obj)
+            else:
+                parent.db_add_item_exec(obj)
+
+        log = DBLog(workflow_execs=workflow_execs)
+        vistrails.db.services.log.update_ids(log)
+        if version is not None:
+            log = translate_log(log, version)
+        Log.convert(log)
+        return log
+
+
+class XMLFileLogSink(LogSink):
+    """Appends the records to a file, one XML element per line.
+
+    A record partially written when the process died is ignored.
+    """
+    def __init__(self, filename):
+        LogSink.__init__(self)
+        self.filename = filename
+        self.file = open(filename, 'ab')
+
+    def write_record(self, record):
+        attrs = ' '.join('%s=%s' % (k, quoteattr(str(record[k])))
+                         for k in ('run', 'version', 'vt_type', 'id',
+                                   'parent_type', 'parent_id',
+                                   'workflow_exec')
+                         if record[k] is not None)
+        # newlines are escaped so that each record stays on one line
+        self.file.write('<record %s>%s</record>\n' % (
+                attrs,
+                record['xml'].replace('\r', '&#13;').replace('\n', '&#10;')))
+        self.file.flush()
+
+    def records(self):
+        with open(self.filename, 'rb') as f:
+            for line in f:
+                try:
+                    node = ElementTree.fromstring(line)
+                except Exception:
+                    debug.warning("Ignoring incomplete log record in %s" %
+                                  self.filename)
+                    continue
+                record = dict((k, node.get(k)) for k in (
+                        'run', 'version', 'vt_type', 'parent_type'))
+                for k in ('id', 'parent_id', 'workflow_exec'):
+                    value = node.get(k)
+                    record[k] = long(value) if value is not None else None
+                record['xml'] = ElementTree.tostring(node[0])
+                yield record
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SQLiteLogSink(LogSink):
+    """Inserts the records in a table of a SQLite database.
+
+    Records are committed in batches of commit_every, and when a workflow
+    exec starts or finishes.
+    """
+    def __init__(self, filename, commit_every=100):
+        LogSink.__init__(self)
+        self.filename = filename
+        self.commit_every = commit_every
+        self.pending = 0
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS log_record(
+                                 seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                                 run TEXT, version TEXT, vt_type TEXT,
+                                 id INTEGER, parent_type TEXT,
+                                 parent_id INTEGER, workflow_exec INTEGER,
+                                 xml TEXT)''')
+        self.conn.commit()
+
+    def write_record(self, record):
+        self.conn.execute('''INSERT INTO log_record(run, version, vt_type,
+                                 id, parent_type, parent_id, workflow_exec,
+                                 xml)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                          (record['run'], record['version'],
+                           record['vt_type'], record['id'],
+                           record['parent_type'], record['parent_id'],
+                           record['workflow_exec'],
+                           record['xml'].decode('utf-8')))
+        self.pending += 1
+        if self.pending >= self.commit_every:
+            self.flush()
+
+    def records(self):
+        cur = self.conn.execute('''SELECT run, version, vt_type, id,
+                                          parent_type, parent_id,
+                                          workflow_exec, xml
+                                   FROM log_record ORDER BY seq''')
+        for row in cur:
+            (run, version, vt_type, id, parent_type, parent_id,
+             workflow_exec, xml) = row
+            yield {'run': str(run), 'version': str(version),
+                   'vt_type': str(vt_type), 'id': long(id),
+                   'parent_type': (str(parent_type)
+                                   if parent_type is not None else None),
+                   'parent_id': (long(parent_id)
+                                 if parent_id is not None else None),
+                   'workflow_exec': long(workflow_exec),
+                   'xml': xml.encode('utf-8')}
+
+    def flush(self):
+        self.conn.commit()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+def open_log_sink(filename):
+    """open_log_sink(filename: str) -> LogSink
+    Opens a SQLiteLogSink if filename ends with .db or .sqlite, else an
+    XMLFileLogSink.
+
+    """
+    if os.path.splitext(filename)[1].lower() in ('.db', '.sqlite'):
+        return SQLiteLogSink(filename)
+    else:
+        return XMLFileLogSink(filename)
+
+###############################################################################
+
+import unittest
+
+
+class TestLogSink(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, sink, log=None):
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.interpreter.cached import CachedInterpreter
+        from vistrails.core.log.controller import LogController
+        from vistrails.core.utils import DummyView
+        from vistrails.tests.utils import build_pipeline
+
+        pipeline = build_pipeline([
+                ('List', 'org.vistrails.vistrails.basic', [
+                    ('value', [('List', '[1.2, 2.7, 3.5]')])]),
+                ('Round', 'org.vistrails.vistrails.basic', [])],
+                [(0, 'value', 1, 'in_value')])
+        if log is None:
+            log = Log()
+        CachedInterpreter.flush()
+        result = CachedInterpreter.get().execute(
+                pipeline,
+                locator=XMLFileLocator('test.xml'),
+                current_version=1,
+                view=DummyView(),
+                logger=LogController(log, sink=sink))
+        self.assertFalse(result.errors)
+        return log
+
+    def summary(self, exec_):
+        children = []
+        for attr in ('item_execs', 'loop_execs', 'loop_iterations'):
+            children.extend(getattr(exec_, 'db_%s' % attr, []))
+        return (exec_.vtType,
+                getattr(exec_, 'db_module_id', None),
+                getattr(exec_, 'db_iteration', None),
+                getattr(exec_, 'db_completed', None),
+                sorted(self.summary(c) for c in children))
+
+    def check_sink(self, sink):
+        log = self.execute(sink)
+        # only the workflow exec stays in memory
+        self.assertEqual(len(log.workflow_execs), 1)
+        self.assertEqual(log.workflow_execs[0].item_execs, [])
+        self.execute(sink, log)
+
+        expected = self.execute(None).workflow_execs[0]
+        read = sink.read_log()
+        self.assertIsInstance(read, Log)
+        self.assertEqual(len(read.workflow_execs), 2)
+        for workflow_exec in read.workflow_execs:
+            self.assertIsInstance(workflow_exec, WorkflowExec)
+            self.assertEqual(self.summary(workflow_exec),
+                             self.summary(expected))
+        # there is a loop with 3 iterations
+        self.assertIn('loop_iteration', repr(self.summary(expected)))
+        return read
+
+    def test_xml_file(self):
+        from vistrails.db.services.io import save_log_to_xml, \
+            open_log_from_xml
+
+        filename = os.path.join(self.tmpdir, 'log.xml')
+        sink = XMLFileLogSink(filename)
+        try:
+            read = self.check_sink(sink)
+        finally:
+            sink.close()
+
+        # the same as the log kept in memory
+        save_log_to_xml(read, os.path.join(self.tmpdir, 'full.xml'))
+        full = open_log_from_xml(os.path.join(self.tmpdir, 'full.xml'))
+        self.assertEqual(len(full.db_workflow_execs), 2)
+
+    def test_sqlite(self):
+        sink = SQLiteLogSink(os.path.join(self.tmpdir, 'log.db'),
+                             commit_every=2)
+        try:
+            self.check_sink(sink)
+        finally:
+            sink.close()
+
+    def test_interrupted(self):
+        """Records written before a crash can be read."""
+        filename = os.path.join(self.tmpdir, 'log.xml')
+        sink = XMLFileLogSink(filename)
+        try:
+            self.execute(sink)
+        finally:
+            sink.close()
+        with open(filename, 'rb') as f:
+            lines = f.readlines()
+        # drop the finished workflow exec, and truncate the last record
+        with open(filename, 'wb') as f:
+            f.writelines(lines[:-2])
+            f.write(lines[-2][:len(lines[-2]) // 2])
+
+        read = XMLFileLogSink(filename).read_log()
+        self.assertEqual(len(read.workflow_execs), 1)
+        workflow_exec = read.workflow_execs[0]
+        self.assertEqual(workflow_exec.completed, 0)
+        self.assertTrue(workflow_exec.item_execs)
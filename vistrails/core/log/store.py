@@ -0,0 +1,736 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""An indexed store of the execution provenance, built on SQLite.
+
+The records of the execution logs (workflow execs, module and group execs,
+their annotations and machines) are flattened into tables indexed on the
+module id, version, signature, status and time, so that questions such as
+the failed executions of a module over the last week can be answered
+without reading whole logs in memory. XML logs are imported one workflow
+exec at a time.
+
+A LogController given a store also records the execs in it as they happen,
+like it does with a LogSink; the signatures of the modules, that are not
+part of the logs, are only known to the store this way. Logs imported
+afterwards have no signatures.
+
+The file paths found in the annotations are normalized and indexed, so that
+runs_producing() matches them exactly.
+"""
+
+import ast
+import datetime
+import os
+import re
+import sqlite3
+
+from vistrails.core.system import get_elementtree_library
+from vistrails.db import VistrailsDBException
+from vistrails.db.domain import DBLog, DBWorkflowExec
+from vistrails.db.versions import getVersionDAO, currentVersion, translate_log
+
+ElementTree = get_elementtree_library()
+
+schema = ["""CREATE TABLE IF NOT EXISTS workflow_exec(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 vistrail TEXT, log_id INTEGER, user TEXT, ip TEXT,
+                 session INTEGER, vt_version TEXT, parent_type TEXT,
+                 parent_id INTEGER, version INTEGER, name TEXT,
+                 completed INTEGER, ts_start TEXT, ts_end TEXT,
+                 duration REAL)""",
+          """CREATE TABLE IF NOT EXISTS machine(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 workflow_exec INTEGER, log_id INTEGER, name TEXT, os TEXT,
+                 architecture TEXT, processor TEXT, ram INTEGER)""",
+          """CREATE TABLE IF NOT EXISTS module_exec(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 workflow_exec INTEGER, parent INTEGER, log_id INTEGER,
+                 type TEXT, module_id INTEGER, module_name TEXT,
+                 signature TEXT, machine INTEGER, iteration INTEGER,
+                 cached INTEGER, completed INTEGER, error TEXT,
+                 ts_start TEXT, ts_end TEXT, duration REAL)""",
+          """CREATE TABLE IF NOT EXISTS annotation(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 workflow_exec INTEGER, module_exec INTEGER,
+                 key TEXT, value TEXT)""",
+          """CREATE TABLE IF NOT EXISTS file(
+                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                 workflow_exec INTEGER, module_exec INTEGER, path TEXT)""",
+          "CREATE INDEX IF NOT EXISTS wf_exec_version "
+          "ON workflow_exec(vistrail, version)",
+          "CREATE INDEX IF NOT EXISTS wf_exec_completed "
+          "ON workflow_exec(completed)",
+          "CREATE INDEX IF NOT EXISTS wf_exec_ts_start "
+          "ON workflow_exec(ts_start)",
+          "CREATE INDEX IF NOT EXISTS machine_wf_exec "
+          "ON machine(workflow_exec)",
+          "CREATE INDEX IF NOT EXISTS module_exec_wf_exec "
+          "ON module_exec(workflow_exec)",
+          "CREATE INDEX IF NOT EXISTS module_exec_module_id "
+          "ON module_exec(module_id)",
+          "CREATE INDEX IF NOT EXISTS module_exec_module_name "
+          "ON module_exec(module_name)",
+          "CREATE INDEX IF NOT EXISTS module_exec_signature "
+          "ON module_exec(signature)",
+          "CREATE INDEX IF NOT EXISTS module_exec_completed "
+          "ON module_exec(completed)",
+          "CREATE INDEX IF NOT EXISTS module_exec_ts_start "
+          "ON module_exec(ts_start)",
+          "CREATE INDEX IF NOT EXISTS annotation_module_exec "
+          "ON annotation(module_exec)",
+          "CREATE INDEX IF NOT EXISTS annotation_key_value "
+          "ON annotation(key, value)",
+          "CREATE INDEX IF NOT EXISTS file_path "
+          "ON file(path)"]
+
+
+def format_time(ts):
+    """format_time(ts: datetime) -> str
+    Formats a timestamp the way it is stored, so that the text order is the
+    time order.
+
+    """
+    if ts is None:
+        return None
+    return ts.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def normalize_path(path):
+    """normalize_path(path: str) -> str
+    Normalizes a file path the way it is indexed.
+
+    """
+    return os.path.normpath(path)
+
+
+_quoted_re = re.compile(r"""u?(?:'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""")
+
+
+def _annotation_paths(value):
+    """_annotation_paths(value: str) -> set(str)
+    Returns the normalized file paths mentioned by an annotation value,
+    either the value itself or the strings quoted in it (e.g. the repr of
+    the output values of a module).
+
+    """
+    if not value:
+        return set()
+    if '\'' not in value and '"' not in value:
+        strings = [value]
+    else:
+        strings = []
+        for match in _quoted_re.finditer(value):
+            try:
+                strings.append(ast.literal_eval(match.group()))
+            except (SyntaxError, ValueError):
+                pass
+    return set(normalize_path(string) for string in strings
+               if isinstance(string, basestring) and
+                   ('/' in string or os.sep in string))
+
+
+def _duration(ts_start, ts_end):
+    if ts_start is None or ts_end is None:
+        return None
+    delta = ts_end - ts_start
+    return delta.days * 86400.0 + delta.seconds + delta.microseconds * 1e-6
+
+
+class _WrappedFile(object):
+    """Reads a file between a prefix and a suffix, to parse appended XML
+    logs, which have no root element.
+    """
+    def __init__(self, f, prefix, suffix):
+        self.parts = [prefix, f, suffix]
+
+    def read(self, size=-1):
+        while self.parts:
+            part = self.parts[0]
+            if isinstance(part, str):
+                self.parts.pop(0)
+                if part:
+                    return part
+            else:
+                data = part.read(size)
+                if data:
+                    return data
+                self.parts.pop(0)
+        return ''
+
+
+class ProvenanceStore(object):
+    """The store of the execution provenance, in a SQLite database.
+
+    Query results are sqlite3.Row objects, that can be indexed by column
+    name; see the schema for the columns. completed is 1 for success, -1
+    for failure, -2 for suspended and 0 if it did not finish. Times are
+    datetime objects or strings as returned by format_time().
+    """
+    def __init__(self, database=':memory:'):
+        self.database = database
+        self.conn = sqlite3.connect(database)
+        self.conn.row_factory = sqlite3.Row
+        cur = self.conn.cursor()
+        for statement in schema:
+            cur.execute(statement)
+        self.conn.commit()
+        # (vt_type, id) -> (workflow exec row, parent row, iteration) for the
+        # children of the execs being recorded
+        self._running = {}
+
+    def close(self):
+        self.conn.close()
+
+    ##########################################################################
+    # Import
+
+    def start_workflow(self, workflow_exec, vistrail=None):
+        """start_workflow(workflow_exec: WorkflowExec, vistrail: str) -> None
+        Starts recording a workflow exec as it runs, labeled with vistrail.
+
+        """
+        cur = self.conn.cursor()
+        wf_id = self._insert_workflow_exec(cur, workflow_exec, vistrail)
+        self._running[(workflow_exec.vtType, workflow_exec.db_id)] = \
+                (wf_id, None, None)
+        self.conn.commit()
+
+    def start(self, exec_, parent, workflow_exec, signature=None):
+        """start(exec_, parent, workflow_exec: WorkflowExec,
+                 signature: str) -> None
+        Records a module, group or loop exec, or a loop iteration, as it
+        starts; signature is that of the module.
+
+        """
+        try:
+            wf_id, parent_id, iteration = self._running[(parent.vtType,
+                                                         parent.db_id)]
+        except KeyError:
+            # parent not recorded by this store
+            return
+        key = (exec_.vtType, exec_.db_id)
+        if exec_.vtType == 'loop_exec':
+            self._running[key] = (wf_id, parent_id, None)
+        elif exec_.vtType == 'loop_iteration':
+            self._running[key] = (wf_id, parent_id, exec_.db_iteration)
+        else:
+            exec_id = self._insert_item_exec(self.conn.cursor(), wf_id,
+                                             parent_id, iteration, exec_,
+                                             signature)
+            self._running[key] = (wf_id, exec_id, None)
+
+    def finish(self, exec_):
+        """finish(exec_) -> None
+        Records the end of an exec started with start(), with its
+        annotations.
+
+        """
+        try:
+            wf_id, exec_id, iteration = self._running.pop((exec_.vtType,
+                                                           exec_.db_id))
+        except KeyError:
+            return
+        if exec_.vtType not in ('module_exec', 'group_exec'):
+            return
+        cur = self.conn.cursor()
+        cur.execute("""UPDATE module_exec SET cached = ?, completed = ?,
+                           error = ?, ts_end = ?, duration = ?
+                       WHERE id = ?""",
+                    (exec_.db_cached, exec_.db_completed, exec_.db_error,
+                     format_time(exec_.db_ts_end),
+                     _duration(exec_.db_ts_start, exec_.db_ts_end),
+                     exec_id))
+        self._add_annotations(cur, wf_id, exec_id, exec_.db_annotations)
+
+    def finish_workflow(self, workflow_exec):
+        """finish_workflow(workflow_exec: WorkflowExec) -> None
+        Records the end of a workflow exec started with start_workflow(),
+        with its machines and annotations.
+
+        """
+        try:
+            wf_id, _, _ = self._running.pop((workflow_exec.vtType,
+                                             workflow_exec.db_id))
+        except KeyError:
+            return
+        cur = self.conn.cursor()
+        cur.execute("""UPDATE workflow_exec SET completed = ?, ts_end = ?,
+                           duration = ?
+                       WHERE id = ?""",
+                    (workflow_exec.db_completed,
+                     format_time(workflow_exec.db_ts_end),
+                     _duration(workflow_exec.db_ts_start,
+                               workflow_exec.db_ts_end),
+                     wf_id))
+        self._add_machines(cur, wf_id, workflow_exec.db_machines)
+        self._add_annotations(cur, wf_id, None, workflow_exec.db_annotations)
+        self.conn.commit()
+
+    def import_log(self, log, vistrail=None):
+        """import_log(log: Log, vistrail: str) -> int
+        Adds the workflow execs of a log, labeled with vistrail (e.g. the
+        filename). Returns the number of workflow execs added.
+
+        """
+        cur = self.conn.cursor()
+        count = 0
+        for workflow_exec in log.db_workflow_execs:
+            self._add_workflow_exec(cur, workflow_exec, vistrail)
+            count += 1
+        self.conn.commit()
+        return count
+
+    def import_xml_log(self, filename, vistrail=None):
+        """import_xml_log(filename: str, vistrail: str) -> int
+        Adds the workflow execs of an XML log file, either a complete log or
+        one that was appended to (as in .vt files). The file is parsed one
+        workflow exec at a time. Returns the number of workflow execs added.
+
+        """
+        cur = self.conn.cursor()
+        count = 0
+        with open(filename, 'rb') as f:
+            head = f.read(512).lstrip()
+            f.seek(0)
+            if head.startswith('<?'):
+                head = head[head.find('?>') + 2:].lstrip()
+            if not head.startswith('<log'):
+                source = _WrappedFile(f, '<log>', '</log>')
+            else:
+                source = f
+            root = None
+            version = None
+            for event, node in ElementTree.iterparse(source,
+                                                     ('start', 'end')):
+                if event == 'start':
+                    if root is None:
+                        root = node
+                        version = node.get('version')
+                    continue
+                if node.tag != 'workflowExec':
+                    continue
+                wf_version = node.get('version', version)
+                if wf_version is None:
+                    raise VistrailsDBException("Cannot find version "
+                                               "information in %s" %
+                                               filename)
+                workflow_exec = getVersionDAO(wf_version).read_xml_object(
+                        DBWorkflowExec.vtType, node)
+                if wf_version != currentVersion:
+                    log = DBLog()
+                    translate_log(log, currentVersion, wf_version)
+                    log.db_add_workflow_exec(workflow_exec)
+                    log = translate_log(log, wf_version)
+                    workflow_exec = log.db_workflow_execs[0]
+                self._add_workflow_exec(cur, workflow_exec, vistrail)
+                count += 1
+                # forget what was parsed so far
+                root.clear()
+        self.conn.commit()
+        return count
+
+    def _insert_workflow_exec(self, cur, workflow_exec, vistrail):
+        cur.execute("""INSERT INTO workflow_exec(vistrail, log_id, user, ip,
+                           session, vt_version, parent_type, parent_id,
+                           version, name, completed, ts_start, ts_end,
+                           duration)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (vistrail, workflow_exec.db_id, workflow_exec.db_user,
+                     workflow_exec.db_ip, workflow_exec.db_session,
+                     workflow_exec.db_vt_version, workflow_exec.db_parent_type,
+                     workflow_exec.db_parent_id,
+                     workflow_exec.db_parent_version, workflow_exec.db_name,
+                     workflow_exec.db_completed,
+                     format_time(workflow_exec.db_ts_start),
+                     format_time(workflow_exec.db_ts_end),
+                     _duration(workflow_exec.db_ts_start,
+                               workflow_exec.db_ts_end)))
+        return cur.lastrowid
+
+    def _add_workflow_exec(self, cur, workflow_exec, vistrail):
+        wf_id = self._insert_workflow_exec(cur, workflow_exec, vistrail)
+        self._add_machines(cur, wf_id, workflow_exec.db_machines)
+        self._add_annotations(cur, wf_id, None, workflow_exec.db_annotations)
+        self._add_item_execs(cur, wf_id, None, None,
+                             workflow_exec.db_item_execs)
+
+    def _add_machines(self, cur, wf_id, machines):
+        cur.executemany("""INSERT INTO machine(workflow_exec, log_id, name,
+                               os, architecture, processor, ram)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                        [(wf_id, machine.db_id, machine.db_name,
+                          machine.db_os, machine.db_architecture,
+                          machine.db_processor, machine.db_ram)
+                         for machine in machines])
+
+    def _add_annotations(self, cur, wf_id, module_exec_id, annotations):
+        cur.executemany("""INSERT INTO annotation(workflow_exec, module_exec,
+                               key, value)
+                           VALUES (?, ?, ?, ?)""",
+                        [(wf_id, module_exec_id, a.db_key, a.db_value)
+                         for a in annotations])
+        cur.executemany("""INSERT INTO file(workflow_exec, module_exec, path)
+                           VALUES (?, ?, ?)""",
+                        [(wf_id, module_exec_id, path)
+                         for a in annotations
+                         for path in _annotation_paths(a.db_value)])
+
+    def _insert_item_exec(self, cur, wf_id, parent, iteration, item_exec,
+                          signature=None):
+        if item_exec.vtType == 'group_exec':
+            name = item_exec.db_group_name
+        else:
+            name = item_exec.db_module_name
+        cur.execute("""INSERT INTO module_exec(workflow_exec, parent,
+                           log_id, type, module_id, module_name,
+                           signature, machine, iteration, cached,
+                           completed, error, ts_start, ts_end, duration)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (wf_id, parent, item_exec.db_id, item_exec.vtType,
+                     item_exec.db_module_id, name, signature,
+                     item_exec.db_machine_id, iteration,
+                     item_exec.db_cached, item_exec.db_completed,
+                     item_exec.db_error,
+                     format_time(item_exec.db_ts_start),
+                     format_time(item_exec.db_ts_end),
+                     _duration(item_exec.db_ts_start,
+                               item_exec.db_ts_end)))
+        return cur.lastrowid
+
+    def _add_item_execs(self, cur, wf_id, parent, iteration, item_execs):
+        for item_exec in item_execs:
+            if item_exec.vtType == 'loop_exec':
+                self._add_loop_exec(cur, wf_id, parent, item_exec)
+                continue
+            exec_id = self._insert_item_exec(cur, wf_id, parent, iteration,
+                                             item_exec)
+            self._add_annotations(cur, wf_id, exec_id,
+                                  item_exec.db_annotations)
+            if item_exec.vtType == 'group_exec':
+                self._add_item_execs(cur, wf_id, exec_id, None,
+                                     item_exec.db_item_execs)
+            else:
+                for loop_exec in item_exec.db_loop_execs:
+                    self._add_loop_exec(cur, wf_id, exec_id, loop_exec)
+
+    def _add_loop_exec(self, cur, wf_id, parent, loop_exec):
+        for loop_iteration in loop_exec.db_loop_iterations:
+            self._add_item_execs(cur, wf_id, parent,
+                                 loop_iteration.db_iteration,
+                                 loop_iteration.db_item_execs)
+
+    ##########################################################################
+    # Queries
+
+    def _where(self, conditions, clauses=None):
+        clauses = list(clauses or [])
+        args = []
+        for clause, value in conditions:
+            if value is not None:
+                if isinstance(value, datetime.datetime):
+                    value = format_time(value)
+                clauses.append(clause)
+                args.append(value)
+        if clauses:
+            return ' WHERE ' + ' AND '.join(clauses), args
+        return '', args
+
+    def workflow_executions(self, vistrail=None, version=None,
+                            completed=None, since=None, until=None):
+        """workflow_executions(vistrail: str, version: int, completed: int,
+                               since: datetime, until: datetime) -> [Row]
+        Returns the workflow execs matching all the given criteria, that
+        started in [since, until), in time order.
+
+        """
+        where, args = self._where([('vistrail = ?', vistrail),
+                                   ('version = ?', version),
+                                   ('completed = ?', completed),
+                                   ('ts_start >= ?', since),
+                                   ('ts_start < ?', until)])
+        return self.conn.execute("SELECT * FROM workflow_exec" + where +
+                                 " ORDER BY ts_start", args).fetchall()
+
+    def module_executions(self, module_id=None, module_name=None,
+                          signature=None, completed=None, since=None,
+                          until=None, vistrail=None, version=None):
+        """module_executions(module_id: int, module_name: str,
+                             signature: str, completed: int,
+                             since: datetime, until: datetime,
+                             vistrail: str, version: int) -> [Row]
+        Returns the module and group execs matching all the given criteria,
+        that started in [since, until), in time order. vistrail and version
+        are those of their workflow exec.
+
+        e.g. the failed executions of module 3 in the last week:
+          module_executions(module_id=3, completed=-1,
+                            since=datetime.now() - timedelta(weeks=1))
+
+        """
+        where, args = self._where([('m.module_id = ?', module_id),
+                                   ('m.module_name = ?', module_name),
+                                   ('m.signature = ?', signature),
+                                   ('m.completed = ?', completed),
+                                   ('m.ts_start >= ?', since),
+                                   ('m.ts_start < ?', until),
+                                   ('w.vistrail = ?', vistrail),
+                                   ('w.version = ?', version)])
+        return self.conn.execute("SELECT m.* FROM module_exec m "
+                                 "JOIN workflow_exec w "
+                                 "ON m.workflow_exec = w.id" + where +
+                                 " ORDER BY m.ts_start", args).fetchall()
+
+    def average_durations(self, since=None, until=None, cached=False):
+        """average_durations(since: datetime, until: datetime,
+                             cached: bool) -> {str: (int, float)}
+        Returns the number of finished executions and their average
+        duration in seconds, per module name. Results taken from the cache
+        are not counted unless cached is True.
+
+        """
+        where, args = self._where([('cached = ?', None if cached else 0),
+                                   ('ts_start >= ?', since),
+                                   ('ts_start < ?', until)],
+                                  ['duration IS NOT NULL'])
+        rows = self.conn.execute("SELECT module_name, COUNT(*), "
+                                 "AVG(duration) FROM module_exec" + where +
+                                 " GROUP BY module_name", args)
+        return dict((row[0], (row[1], row[2])) for row in rows)
+
+    def runs_producing(self, filename):
+        """runs_producing(filename: str) -> [Row]
+        Returns the workflow execs with an annotation mentioning the file
+        path, e.g. in the output values of their modules. Paths are
+        compared normalized, but otherwise exactly.
+
+        """
+        return self.conn.execute("SELECT * FROM workflow_exec WHERE id IN "
+                                 "(SELECT workflow_exec FROM file "
+                                 "WHERE path = ?) "
+                                 "ORDER BY ts_start",
+                                 (normalize_path(filename),)).fetchall()
+
+    def annotations(self, module_exec=None, workflow_exec=None):
+        """annotations(module_exec: int, workflow_exec: int) -> {str: str}
+        Returns the annotations of a module exec, or of a workflow exec
+        itself, by their store ids.
+
+        """
+        if module_exec is not None:
+            rows = self.conn.execute("SELECT key, value FROM annotation "
+                                     "WHERE module_exec = ?", (module_exec,))
+        else:
+            rows = self.conn.execute("SELECT key, value FROM annotation "
+                                     "WHERE workflow_exec = ? AND "
+                                     "module_exec IS NULL", (workflow_exec,))
+        return dict((row[0], row[1]) for row in rows)
+
+###############################################################################
+
+import unittest
+
+
+class TestProvenanceStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.tmpdir)
+
+    def create_log(self):
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.interpreter.cached import CachedInterpreter
+        from vistrails.core.log.controller import LogController
+        from vistrails.core.log.log import Log
+        from vistrails.core.utils import DummyView
+        from vistrails.core.vistrail.annotation import Annotation
+        from vistrails.tests.utils import build_pipeline
+
+        pipeline = build_pipeline([
+                ('List', 'org.vistrails.vistrails.basic', [
+                    ('value', [('List', '[1.2, 2.7, 3.5]')])]),
+                ('Round', 'org.vistrails.vistrails.basic', [])],
+                [(0, 'value', 1, 'in_value')])
+        log = Log()
+        for version in (1, 2):
+            CachedInterpreter.flush()
+            result = CachedInterpreter.get().execute(
+                    pipeline,
+                    locator=XMLFileLocator('test.xml'),
+                    current_version=version,
+                    view=DummyView(),
+                    logger=LogController(log))
+            self.assertFalse(result.errors)
+
+        # pretend the first execution of List failed a month ago, writing
+        # a file
+        workflow_exec = log.workflow_execs[0]
+        list_exec = [e for e in workflow_exec.item_execs
+                     if e.module_name == 'List'][0]
+        list_exec.completed = -1
+        list_exec.ts_start -= datetime.timedelta(days=30)
+        list_exec.add_annotation(Annotation(id=1000, key='output',
+                                            value="[('value', "
+                                                  "'/data/out_1.png')]"))
+        return log
+
+    def check_store(self, store):
+        now = datetime.datetime.now()
+        self.assertEqual(len(store.workflow_executions()), 2)
+        self.assertEqual(len(store.workflow_executions(version=2)), 1)
+        self.assertEqual(len(store.workflow_executions(
+                since=now - datetime.timedelta(days=1))), 2)
+
+        # the looping module, then one per iteration
+        rounds = store.module_executions(module_name='Round', version=1)
+        self.assertEqual(len(rounds), 4)
+        self.assertEqual(sorted(r['iteration'] for r in rounds),
+                         [None, 0, 1, 2])
+        looping = [r for r in rounds if r['iteration'] is None][0]
+        self.assertTrue(all(r['parent'] == looping['id']
+                            for r in rounds if r is not looping))
+        # the logs don't have the signatures
+        self.assertFalse(any(r['signature'] for r in rounds))
+
+        list_id = store.module_executions(module_name='List')[0]['module_id']
+        failed = store.module_executions(module_id=list_id, completed=-1)
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(len(store.module_executions(
+                module_id=list_id, completed=-1,
+                since=now - datetime.timedelta(weeks=1))), 0)
+
+        durations = store.average_durations()
+        self.assertEqual(durations['Round'][0], 8)
+        self.assertEqual(durations['List'][0], 2)
+
+        runs = store.runs_producing('/data/out_1.png')
+        self.assertEqual([r['id'] for r in runs], [failed[0]['workflow_exec']])
+        self.assertEqual(store.runs_producing('/data/./out_1.png'), runs)
+        self.assertEqual(store.runs_producing('out_1.png'), [])
+        self.assertEqual(store.runs_producing('/data/out_1.pn'), [])
+
+    def test_import_log(self):
+        store = ProvenanceStore()
+        self.assertEqual(store.import_log(self.create_log()), 2)
+        self.check_store(store)
+
+    def test_import_xml_log(self):
+        import os
+        from vistrails.db.services.io import save_log_to_xml
+
+        store = ProvenanceStore(os.path.join(self.tmpdir, 'store.db'))
+        log = self.create_log()
+        filename = os.path.join(self.tmpdir, 'log.xml')
+        save_log_to_xml(log, filename)
+        self.assertEqual(store.import_xml_log(filename), 2)
+        self.check_store(store)
+        store.close()
+
+        # appended log, as in .vt files
+        filename = os.path.join(self.tmpdir, 'appended.xml')
+        save_log_to_xml(log, filename, do_append=True)
+        store = ProvenanceStore()
+        self.assertEqual(store.import_xml_log(filename), 2)
+        self.check_store(store)
+
+    def test_record_execution(self):
+        """The controller records its executions in the executionLogStore.
+        """
+        import os
+        from vistrails.core.configuration import get_vistrails_configuration
+        from vistrails.core.interpreter.cached import CachedInterpreter
+        from vistrails.core.vistrail.controller import VistrailController
+        from vistrails.core.vistrail.vistrail import Vistrail
+
+        basic_pkg = 'org.vistrails.vistrails.basic'
+        controller = VistrailController(Vistrail(), auto_save=False)
+        controller.change_selected_version(0)
+        list_module = controller.add_module(basic_pkg, 'List')
+        controller.update_function(list_module, 'value', ['[1.2, 2.7, 3.5]'])
+        round_module = controller.add_module(basic_pkg, 'Round')
+        controller.add_connection(list_module.id, 'value',
+                                  round_module.id, 'in_value')
+
+        filename = os.path.join(self.tmpdir, 'store.db')
+        conf = get_vistrails_configuration()
+        old_log = conf.check('executionLog')
+        old_store = conf.check('executionLogStore') or None
+        conf.executionLog = True
+        conf.executionLogStore = filename
+        try:
+            CachedInterpreter.flush()
+            for i in xrange(2):
+                results, changed = controller.execute_current_workflow()
+                self.assertFalse(results[0].errors)
+        finally:
+            conf.executionLog = old_log
+            conf.executionLogStore = old_store
+            controller.close_log_store()
+
+        store = ProvenanceStore(filename)
+        runs = store.workflow_executions()
+        self.assertEqual([r['completed'] for r in runs], [1, 1])
+        self.assertEqual([r['log_id'] for r in runs],
+                         [e.id for e in controller.log.workflow_execs])
+        self.assertIsNotNone(runs[0]['duration'])
+
+        # the looping module, then one per iteration; then from the cache
+        rounds = store.module_executions(module_name='Round')
+        self.assertEqual([(r['iteration'], r['cached'], r['completed'])
+                          for r in rounds],
+                         [(None, 0, 1), (0, 0, 1), (1, 0, 1), (2, 0, 1),
+                          (None, 1, 1)])
+        looping = rounds[0]
+        self.assertTrue(all(r['parent'] == looping['id']
+                            for r in rounds[1:4]))
+        self.assertTrue(all(r['signature'] for r in rounds))
+        self.assertEqual(
+                len(store.module_executions(signature=rounds[0]['signature'])),
+                2)
+        lists = store.module_executions(module_name='List')
+        self.assertEqual(len(lists), 2)
+        self.assertEqual(lists[0]['signature'], lists[1]['signature'])
+        self.assertEqual(len(store.module_executions(
+                signature=lists[0]['signature'], version=runs[1]['version'])),
+                2)
+        store.close()
+
+        # the log itself doesn't have the signatures
+        for workflow_exec in controller.log.workflow_execs:
+            for item_exec in workflow_exec.item_execs:
+                self.assertNotIn('signature',
+                                 [a.key for a in item_exec.annotations])
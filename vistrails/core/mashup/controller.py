@@ -34,10 +34,29 @@
 ###############################################################################
 import copy
 import os.path
+from vistrails.core.interpreter.base import AbortExecution
 from vistrails.core.system import current_user, current_time
 from vistrails.core.mashup.alias import Alias
 from vistrails.core.mashup.component import Component
 from vistrails.core.mashup.mashup import Mashup
+from vistrails.core.utils import DummyView
+
+class MashupExecutionView(object):
+    """Passes the execution updates on to another view, and aborts the
+    execution at the next module once the mashup controller canceled it.
+
+    """
+    def __init__(self, controller, view):
+        self.controller = controller
+        self.view = view
+
+    def __getattr__(self, name):
+        return getattr(self.view, name)
+
+    def set_module_active(self, *args, **kwargs):
+        if self.controller.execution_canceled:
+            raise AbortExecution("Execution superseded by newer values")
+        self.view.set_module_active(*args, **kwargs)
 
 class MashupController(object):
     def __init__(self, originalController, vt_controller, vt_version, mshptrail=None):
@@ -51,6 +70,13 @@ class MashupController(object):
         self.currentVersion = -1
         self.currentMashup = None
         self._changed = False
+        # pipeline kept validated with up-to-date signatures between
+        # executions, and (vttype, vtid) -> module id of its parameters
+        self._prepared_pipeline = None
+        self._param_modules = {}
+        self._executing = False
+        self._pending_params = None
+        self.execution_canceled = False
 
     def setChanged(self, on):
         self._changed = on
@@ -58,6 +84,7 @@ class MashupController(object):
         
     def setCurrentVersion(self, version):
         self.currentVersion = version
+        self._prepared_pipeline = None
         self.vtPipeline = self.vtController.vistrail.getPipeline(self.vtVersion)
         if version > -1:
             self.currentMashup = self.mshptrail.getMashup(version)
@@ -70,15 +97,92 @@ class MashupController(object):
         return None
     
     def execute(self, params):
-        if self.vtPipeline and self.vtController:
-            mashup_id = self.mshptrail.id
-            mashup_version = self.currentVersion
-            reason = "mashup::%s::%s"%(str(mashup_id), mashup_version)
-            result = self.vtController.execute_current_workflow(custom_params=params,
-                                                              reason=reason)
-            self.originalController.set_changed(True)
-            return result
-        return ([], False)
+        """execute(params: [(vttype, vtid, strval)]) -> (list, bool)
+        Executes the workflow with the given alias values.
+
+        A call made while an execution is running, for instance from events
+        processed while a slider is dragged, cancels that execution and
+        returns None; the running call then executes again with the latest
+        values only.
+
+        """
+        if not (self.vtPipeline and self.vtController):
+            return ([], False)
+        self._pending_params = params
+        if self._executing:
+            self.execution_canceled = True
+            return None
+        self._executing = True
+        try:
+            while self._pending_params is not None:
+                params = self._pending_params
+                self._pending_params = None
+                self.execution_canceled = False
+                result = self._execute(params)
+        finally:
+            self._executing = False
+            self.execution_canceled = False
+        self.originalController.set_changed(True)
+        return result
+
+    def cancel_execution(self):
+        """cancel_execution() -> None
+        Aborts the running execution before its next module.
+
+        """
+        if self._executing:
+            self.execution_canceled = True
+
+    def _prepare_pipeline(self, pipeline):
+        """_prepare_pipeline(pipeline: Pipeline) -> None
+        Validates the pipeline and computes its signatures, once for all
+        the executions with different alias values.
+
+        """
+        self.vtController.validate(pipeline)
+        pipeline.refresh_signatures()
+        self._param_modules = {}
+        for module in pipeline.module_list:
+            for function in module.functions:
+                for param in function.params:
+                    self._param_modules[(param.vtType, param.real_id)] = \
+                        module.id
+        self._prepared_pipeline = pipeline
+
+    def _execute(self, params):
+        """_execute(params: [(vttype, vtid, strval)]) -> (list, bool)
+        Sets the changed values in the prepared pipeline, and executes it
+        recomputing only the signatures downstream of them.
+
+        """
+        pipeline = self.vtController.current_pipeline
+        if pipeline is not self._prepared_pipeline:
+            self._prepare_pipeline(pipeline)
+        changed = set()
+        for (vttype, vtid, strval) in params:
+            strval = str(strval)
+            try:
+                param = pipeline.db_get_object(vttype, vtid)
+            except KeyError:
+                continue
+            if param.strValue != strval:
+                param.strValue = strval
+                changed.add(self._param_modules.get((vttype, vtid)))
+        if None in changed:
+            pipeline.refresh_signatures()
+        else:
+            pipeline.invalidate_signatures(changed)
+
+        mashup_id = self.mshptrail.id
+        mashup_version = self.currentVersion
+        reason = "mashup::%s::%s"%(str(mashup_id), mashup_version)
+        view = getattr(self.vtController, 'current_pipeline_scene', None)
+        if view is None:
+            view = DummyView()
+        # the params are already set, they are passed for the log
+        return self.vtController.execute_current_workflow(
+                custom_params=params, reason=reason,
+                view=MashupExecutionView(self, view), prepared=True)
             
     def updateCurrentTag(self, name):
         if self.mshptrail.changeTag(self.currentVersion, name, current_user(),
@@ -360,3 +464,119 @@ class MashupController(object):
         self.setCurrentVersion(currVersion, quiet)
         self.setChanged(True)
         return currVersion
+
+################################################################################
+
+import unittest
+
+class TestMashupController(unittest.TestCase):
+    def create_controller(self):
+        from vistrails.core.db.io import load_vistrail
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.mashup.mashup_trail import Mashuptrail
+        from vistrails.core.system import vistrails_root_directory
+        from vistrails.core.vistrail.controller import VistrailController
+
+        locator = XMLFileLocator(vistrails_root_directory() +
+                                 '/tests/resources/dummy.xml')
+        (v, abstractions, thumbnails, mashups) = load_vistrail(locator)
+        vt_controller = VistrailController(v, locator, abstractions,
+                                           thumbnails, mashups)
+        vt_controller.change_selected_version(
+                v.get_version_number('int chain'))
+        # the controller upgraded the workflow
+        vt_controller.flush_delayed_actions()
+        version = vt_controller.current_version
+        return MashupController(vt_controller, vt_controller, version,
+                                Mashuptrail('mashup', version))
+
+    def setUp(self):
+        from vistrails.core.modules.basic_modules import StandardOutput
+        self.old_compute = StandardOutput.compute
+        StandardOutput.compute = lambda s: None
+
+    def tearDown(self):
+        from vistrails.core.modules.basic_modules import StandardOutput
+        StandardOutput.compute = self.old_compute
+
+    def find_value(self, pipeline):
+        """find_value(pipeline) -> (Module, ModuleParam)
+        Returns the Integer module whose value is set, and its parameter.
+
+        """
+        for module in pipeline.modules.itervalues():
+            if module.name == 'Integer' and module.functions:
+                return module, module.functions[0].params[0]
+
+    def test_incremental(self):
+        """Changed values only recompute the signatures downstream."""
+        controller = self.create_controller()
+        # 'int chain' is Integer(2) -> Integer -> StandardOutput
+        pipeline = controller.vtController.current_pipeline
+        module, param = self.find_value(pipeline)
+        output = [m.id for m in pipeline.modules.itervalues()
+                  if m.name == 'StandardOutput'][0]
+        result = controller.execute(
+                [('parameter', param.real_id, '1031')])[0][0]
+        self.assertEqual(result.errors, {})
+        pipeline = controller.vtController.current_pipeline
+        self.assertIs(controller._prepared_pipeline, pipeline)
+        signature = pipeline.subpipeline_signature(output)
+
+        result = controller.execute(
+                [('parameter', param.real_id, '1032')])[0][0]
+        self.assertEqual(result.errors, {})
+        self.assertIs(controller._prepared_pipeline, pipeline)
+        self.assertEqual(self.find_value(pipeline)[1].strValue, '1032')
+        self.assertNotEqual(pipeline.subpipeline_signature(output), signature)
+        signature = pipeline.subpipeline_signature(output)
+        pipeline.refresh_signatures()
+        self.assertEqual(pipeline.subpipeline_signature(output), signature)
+
+    def test_coalesce(self):
+        """Values set during an execution supersede the pending ones."""
+        controller = self.create_controller()
+        pipeline = controller.vtController.current_pipeline
+        param_id = self.find_value(pipeline)[1].real_id
+        executed = []
+        execute = controller._execute
+        def _execute(params):
+            executed.append(params[0][2])
+            if len(executed) == 1:
+                self.assertIsNone(controller.execute([('parameter', param_id,
+                                                       '7')]))
+                self.assertIsNone(controller.execute([('parameter', param_id,
+                                                       '8')]))
+                self.assertTrue(controller.execution_canceled)
+            return execute(params)
+        controller._execute = _execute
+
+        results = controller.execute([('parameter', param_id, '6')])
+        self.assertEqual(executed, ['6', '8'])
+        self.assertEqual(results[0][0].errors, {})
+        self.assertFalse(controller.execution_canceled)
+        pipeline = controller.vtController.current_pipeline
+        self.assertEqual(self.find_value(pipeline)[1].strValue, '8')
+
+    def test_log_params(self):
+        """The alias values are recorded in the execution log."""
+        import cPickle
+        from vistrails.core.configuration import get_vistrails_configuration
+        controller = self.create_controller()
+        param_id = self.find_value(
+                controller.vtController.current_pipeline)[1].real_id
+        conf = get_vistrails_configuration()
+        old_log = conf.check('executionLog')
+        conf.executionLog = True
+        try:
+            for value in ('4', '5'):
+                result = controller.execute([('parameter', param_id,
+                                              value)])[0][0]
+                self.assertEqual(result.errors, {})
+                workflow_exec = controller.vtController.log.workflow_execs[-1]
+                params = [a.value for a in workflow_exec.annotations
+                          if a.key == '__params__']
+                self.assertEqual([cPickle.loads(p) for p in params],
+                                 [[('parameter', param_id, value)]])
+        finally:
+            conf.executionLog = old_log
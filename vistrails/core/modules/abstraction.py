@@ -48,6 +48,8 @@ from vistrails.core.utils import InvalidPipeline
 name = 'My SubWorkflows'
 version = '1.6'
 identifier = 'local.abstractions'
+# subworkflows are loaded from the user's directory
+registry_snapshot = False
 
 my_vistrails = {}
 
@@ -35,6 +35,7 @@
 """basic_modules defines basic VisTrails Modules that are used in most
 pipelines."""
 import vistrails.core.cache.hasher
+from vistrails.core.cache.file_signature import FileSignatureCache
 from vistrails.core.debug import format_exception
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.modules.vistrails_module import Module, new_module, \
@@ -48,11 +49,13 @@ from vistrails.core import debug
 
 from abc import ABCMeta
 from ast import literal_eval
+from collections import OrderedDict
 from itertools import izip
 import os
 import pickle
 import re
 import shutil
+import threading
 import zipfile
 import urllib
 
@@ -69,6 +72,8 @@ version = '2.1.1'
 name = 'Basic Modules'
 identifier = 'org.vistrails.vistrails.basic'
 old_identifiers = ['edu.utah.sci.vistrails.basic']
+# the core modules are always registered from code
+registry_snapshot = False
 
 constant_config_path = "vistrails.gui.modules.constant_configuration"
 query_config_path = "vistrails.gui.modules.query_configuration"
@@ -333,24 +338,15 @@ class Path(Constant):
 Path.default_value = PathObject('')
 
 def path_parameter_hasher(p):
-    def get_mtime(path):
-        t = int(os.path.getmtime(path))
-        if os.path.isdir(path):
-            for subpath in os.listdir(path):
-                subpath = os.path.join(path, subpath)
-                if os.path.isdir(subpath):
-                    t = max(t, get_mtime(subpath))
-        return t
-
     h = vistrails.core.cache.hasher.Hasher.parameter_signature(p)
     try:
         # FIXME: This will break with aliases - I don't really care that much
-        t = get_mtime(p.strValue)
-    except OSError:
+        digest = FileSignatureCache.getInstance().get_path_digest(p.strValue)
+    except (OSError, IOError):
         return h
     hasher = sha_hash()
     hasher.update(h)
-    hasher.update(str(t))
+    hasher.update(digest)
     return hasher.digest()
 
 class File(Path):
@@ -920,6 +916,34 @@ class Unpickle(Module):
 
 ##############################################################################
 
+_compiled_code_cache = OrderedDict()
+_compiled_code_cache_lock = threading.Lock()
+COMPILED_CODE_CACHE_SIZE = 128
+
+def compile_code(code_str):
+    """compile_code(code_str: str) -> code
+
+    Compiles a piece of python code for exec. The code objects of the
+    most recently used sources are kept, so that modules executed many
+    times (e.g. in a loop or over a list) only compile their code once.
+
+    """
+    with _compiled_code_cache_lock:
+        try:
+            code = _compiled_code_cache.pop(code_str)
+        except KeyError:
+            code = None
+        else:
+            _compiled_code_cache[code_str] = code
+    if code is None:
+        # Python 2.6 needs code to end with newline
+        code = compile(code_str + '\n', '<string>', 'exec')
+        with _compiled_code_cache_lock:
+            _compiled_code_cache[code_str] = code
+            while len(_compiled_code_cache) > COMPILED_CODE_CACHE_SIZE:
+                _compiled_code_cache.popitem(last=False)
+    return code
+
 class CodeRunnerMixin(object):
     def __init__(self):
         self.output_ports_order = []
@@ -959,8 +983,7 @@ class CodeRunnerMixin(object):
                         'self': self})
         if 'source' in locals_:
             del locals_['source']
-        # Python 2.6 needs code to end with newline
-        exec code_str + '\n' in locals_, locals_
+        exec compile_code(code_str) in locals_, locals_
         if use_output:
             for k in self.output_ports_order:
                 if locals_.get(k) != None:
@@ -1565,6 +1588,19 @@ class TestPythonSource(unittest.TestCase):
                 ]))
         self.assertEqual(results[-1], "nb is 42")
 
+    def test_compile_cache(self):
+        source = 'x = %d' % id(self)
+        code = compile_code(source)
+        self.assertIs(compile_code(source), code)
+        for i in xrange(COMPILED_CODE_CACHE_SIZE):
+            compile_code('x = %d' % i)
+        self.assertIsNot(compile_code(source), code)
+        self.assertLessEqual(len(_compiled_code_cache),
+                             COMPILED_CODE_CACHE_SIZE)
+        d = {}
+        exec compile_code(source) in d, d
+        self.assertEqual(d['x'], id(self))
+
 
 class TestNumericConversions(unittest.TestCase):
     def test_full(self):
@@ -96,6 +96,8 @@ class ModuleDescriptor(DBModuleDescriptor):
 
     def __init__(self, *args, **kwargs):
         self.children = []
+        self._module_loader = None
+        self._port_loader = None
         if 'module' in kwargs:
             self.module = kwargs['module']
             if 'name' not in kwargs:
@@ -153,7 +155,9 @@ class ModuleDescriptor(DBModuleDescriptor):
             self.children = copy.copy(other.children)
             
             self._base_descriptor = other._base_descriptor
-            self.module = other.module
+            self._module = other._module
+            self._module_loader = other._module_loader
+            self._port_loader = other._port_loader
             self._port_count = other._port_count
             self._abstraction_refs = self._abstraction_refs
             self._is_abstract = other._is_abstract
@@ -170,7 +174,6 @@ class ModuleDescriptor(DBModuleDescriptor):
             self.ghost_identifier = other.ghost_identifier
             self.ghost_package_version = other.ghost_package_version
             self.ghost_namespace = other.ghost_namespace
-        self.port_specs = self.db_portSpecs_name_index
         if self.version is None:
             self.version = ''
         if self.namespace is None:
@@ -196,6 +199,8 @@ class ModuleDescriptor(DBModuleDescriptor):
 
         # do more init stuff
         _desc.children = []
+        _desc._module_loader = None
+        _desc._port_loader = None
         _desc.module = None
         _desc._base_descriptor = None
         _desc._port_count = 0
@@ -212,8 +217,105 @@ class ModuleDescriptor(DBModuleDescriptor):
     package_version = DBModuleDescriptor.db_package_version
     version = DBModuleDescriptor.db_version
     base_descriptor_id = DBModuleDescriptor.db_base_descriptor_id
-    port_specs_list = DBModuleDescriptor.db_portSpecs
-    
+
+    def _get_port_specs(self):
+        self.load_ports()
+        return self.db_portSpecs_name_index
+    port_specs = property(_get_port_specs)
+
+    def _get_port_specs_list(self):
+        self.load_ports()
+        return self.db_portSpecs
+    port_specs_list = property(_get_port_specs_list)
+
+    def _get_module(self):
+        if self._module is None and self._module_loader is not None:
+            self.load_module()
+        return self._module
+    def _set_module(self, module):
+        self._module = module
+        self._module_loader = None
+    module = property(_get_module, _set_module)
+
+    def set_module_loader(self, loader):
+        """set_module_loader(loader: callable) -> None
+
+        Registers a callable that will provide the python class for
+        this descriptor the first time it is needed. This is used by
+        descriptors that were restored without importing the package
+        code, e.g. from a registry snapshot. The loader is called with
+        the descriptor and is expected to set descriptor.module.
+
+        """
+        self._module = None
+        self._module_loader = loader
+
+    def is_module_loaded(self):
+        """is_module_loaded() -> bool
+
+        Returns False if the python class has not been loaded yet
+        (see set_module_loader), True otherwise.
+
+        """
+        return self._module_loader is None
+
+    def load_module(self):
+        """load_module() -> class
+
+        Runs the module loader if the python class has not been loaded
+        yet, and returns the class.
+
+        """
+        loader = self._module_loader
+        if loader is not None:
+            # clear first so that loaders don't recurse
+            self._module_loader = None
+            try:
+                loader(self)
+            finally:
+                if self._module is None and self._module_loader is None:
+                    # still not bound, e.g. the package is in the middle
+                    # of registering its modules
+                    self._module_loader = loader
+        return self._module
+
+    def set_port_loader(self, loader):
+        """set_port_loader(loader: callable) -> None
+
+        Registers a callable that will add the ports of this descriptor
+        the first time they are needed, so that packages wrapping large
+        libraries don't have to introspect every class at startup. The
+        loader is called with the descriptor and is expected to add its
+        port specs through the registry. None removes the loader.
+
+        """
+        self._port_loader = loader
+
+    def are_ports_loaded(self):
+        """are_ports_loaded() -> bool
+
+        Returns False if the port loader has not been run yet (see
+        set_port_loader), True otherwise.
+
+        """
+        return self._port_loader is None
+
+    def load_ports(self):
+        """load_ports() -> None
+
+        Runs the port loader if the ports have not been added yet. A
+        loader may register another one, e.g. by loading the package
+        code, which is then run as well.
+
+        """
+        while self._port_loader is not None:
+            loader = self._port_loader
+            # clear first so that adding ports doesn't recurse; a
+            # loader that fails is not run again, as it might have added
+            # some of the ports already
+            self._port_loader = None
+            loader(self)
+
     def _get_base_descriptor(self):
         if self._base_descriptor is None and self.base_descriptor_id >= 0:
             from vistrails.core.modules.module_registry import get_module_registry
@@ -260,6 +362,7 @@ class ModuleDescriptor(DBModuleDescriptor):
         self._widget_classes[widget_use][widget_type] = widget_class
 
     def has_constant_config_widget(self, widget_use, widget_type):
+        self.load_module()
         return widget_use in self._widget_classes and \
             widget_type in self._widget_classes[widget_use]
 
@@ -269,6 +372,7 @@ class ModuleDescriptor(DBModuleDescriptor):
         return None
 
     def get_all_constant_config_widgets(self, widget_use):
+        self.load_module()
         if widget_use in self._widget_classes:
             return self._widget_classes[widget_use]
         return {}
@@ -391,9 +495,11 @@ class ModuleDescriptor(DBModuleDescriptor):
 
     # port_type is 'input' or 'output'
     def has_port_spec(self, name, port_type):
+        self.load_ports()
         return self.db_has_portSpec_with_name((name, port_type))
 
     def get_port_spec(self, name, port_type):
+        self.load_ports()
         if not self.db_has_portSpec_with_name((name, port_type)):
             raise ValueError("ModuleDescriptor.get_port_spec called when spec "
                              " (%s, %s) doesn't exist" % (name, port_type))
@@ -37,6 +37,7 @@ from ast import literal_eval
 import collections
 import copy
 import os
+import sys
 import tempfile
 import traceback
 import uuid
@@ -51,6 +52,7 @@ from vistrails.core.modules.config import ConstantWidgetConfig, \
 import vistrails.core.modules.vistrails_module
 from vistrails.core.modules.module_descriptor import ModuleDescriptor
 from vistrails.core.modules.package import Package
+from vistrails.core.modules import registry_snapshot
 from vistrails.core.requirements import MissingRequirement
 import vistrails.core.modules.utils
 from vistrails.core.utils import VistrailsInternalError, memo_method, \
@@ -484,6 +486,25 @@ class MissingBaseClass(Exception):
     def __str__(self):
         return "Base class has not been registered : %s" % (self._base.__name__)
 
+class _LazyCallable(object):
+    """Stands for a callable (e.g. a custom hasher) that a package
+    registers from its init module, for packages restored from a
+    registry snapshot. Calling it loads the package code first.
+
+    """
+    def __init__(self, package, getter):
+        self._package = package
+        self._getter = getter
+
+    def __call__(self, *args, **kwargs):
+        self._package.materialize()
+        callable_ = self._getter()
+        if callable_ is None or callable_ is self:
+            raise VistrailsInternalError("Package %s did not register the "
+                                         "expected callable" %
+                                         self._package.codepath)
+        return callable_(*args, **kwargs)
+
 class ModuleRegistry(DBRegistry):
     """ModuleRegistry serves as a registry of VisTrails modules.
     """
@@ -513,8 +534,12 @@ class ModuleRegistry(DBRegistry):
 
     def set_defaults(self, other=None):
         self._root_descriptor = None
+        # package whose module classes are being bound to descriptors
+        # restored from a snapshot (see materialize_package)
+        self._binding_package = None
         self.signals = ModuleRegistrySignals()
         self.setup_indices()
+        self.clear_descriptor_caches()
         if other is None:
             # _constant_hasher_map stores callables for custom parameter
             # hashers
@@ -550,8 +575,8 @@ class ModuleRegistry(DBRegistry):
                 self.descriptors_by_id[descriptor.id] = descriptor
                 k = (descriptor.identifier, descriptor.name, 
                      descriptor.namespace, pkg.version, descriptor.version)
-                if descriptor.module is not None:
-                    self._module_key_map[descriptor.module] = k
+                if descriptor._module is not None:
+                    self._module_key_map[descriptor._module] = k
         for descriptor in self.descriptors_by_id.itervalues():
             if descriptor.base_descriptor_id in self.descriptors_by_id:
                 base_descriptor = \
@@ -609,12 +634,33 @@ class ModuleRegistry(DBRegistry):
         self.root_descriptor_id = descriptor.id
     root_descriptor = property(_get_root_descriptor, _set_root_descriptor)
 
+    def clear_descriptor_caches(self):
+        """clear_descriptor_caches() -> None
+        Invalidates the caches used to answer subclass and port
+        compatibility queries. Called whenever descriptors or converters
+        are added or removed.
+
+        """
+        # descriptor id -> frozenset of the ids of its base descriptors
+        # (including itself)
+        self._ancestor_ids = {}
+        # (sub ids, super ids, allow_conversion) -> (matched, converters)
+        self._spec_match_cache = {}
+        self._basic_descriptors = {}
+
+    def _converters_changed(self):
+        # What a converter converts depends on its ports, so this is also
+        # called when the ports of a converter change
+        self._conversions = dict()
+        self.clear_descriptor_caches()
+
     def add_descriptor(self, desc, package=None):
         if package is None:
             package = self._default_package
         # self.descriptors[(desc.package, desc.name, desc.namespace)] = desc
         self.descriptors_by_id[desc.id] = desc
         package.add_descriptor(desc)
+        self.clear_descriptor_caches()
     def delete_descriptor(self, desc, package=None):
         if package is None:
             try:
@@ -626,6 +672,7 @@ class ModuleRegistry(DBRegistry):
         # del self.descriptors[(desc.package, desc.name, desc.namespace)]
         del self.descriptors_by_id[desc.id]
         package.delete_descriptor(desc)
+        self.clear_descriptor_caches()
     def add_package(self, package):
         DBRegistry.db_add_package(self, package)
         for key in chain(package.old_identifiers, [package.identifier]):
@@ -794,9 +841,30 @@ class ModuleRegistry(DBRegistry):
         # assert isinstance(module, type)
         # assert issubclass(module, core.modules.vistrails_module.Module)
         # assert self._module_key_map.has_key(module)
-        k = self._module_key_map[module]
+        try:
+            k = self._module_key_map[module]
+        except KeyError:
+            # the class might come from a package restored from a snapshot
+            # whose code has not been loaded through the registry yet
+            if not self.materialize_module_package(module):
+                raise
+            k = self._module_key_map[module]
         return self.get_descriptor_by_name(*k)
 
+    def materialize_module_package(self, module):
+        """materialize_module_package(module: class) -> bool
+        Loads the code of the lazily initialized package that defines
+        module. Returns False if there is no such package.
+
+        """
+        for package in self.package_versions.itervalues():
+            if (package.is_lazy() and package.prefix is not None and
+                    module.__module__.startswith(package.prefix +
+                                                 package.codepath)):
+                package.materialize()
+                return True
+        return False
+
     # get_descriptor_from_module is a synonym for get_descriptor
     get_descriptor_from_module = get_descriptor
 
@@ -933,8 +1001,8 @@ class ModuleRegistry(DBRegistry):
         # invalidate the map of converters
         if issubclass(module,
                 vistrails.core.modules.vistrails_module.Converter):
-            self._conversions = dict()
             self._converters.add(descriptor)
+            self._converters_changed()
 
         if module is not None:
             self._module_key_map[module] = (identifier, name, namespace,
@@ -1147,37 +1215,43 @@ class ModuleRegistry(DBRegistry):
                                          "not specified.")
 
         package = self.package_versions[(identifier, package_version)]
-        desc_key = (name, namespace, version)
-        if desc_key in package.descriptor_versions:
-            raise ModuleAlreadyExists(identifier, name)
-
-        # We allow multiple inheritance as long as only one of the superclasses
-        # is a subclass of Module.
-        if settings.is_root:
-            base_descriptor = None
-        else:
-            candidates = self.get_subclass_candidates(module)
-            if len(candidates) != 1:
-                raise InvalidModuleClass(module)
-            base_class = candidates[0]
-            if base_class not in self._module_key_map:
-                raise MissingBaseClass(base_class)
-            base_descriptor = self.get_descriptor(base_class)
-
-        if module in self._module_key_map:
-            # This is really obsolete as having two descriptors
-            # pointing to the same module isn't a big deal except to
-            # get_descriptor which shouldn't be used often
-            if identifier != 'local.abstractions':
-                raise DuplicateModule(self.get_descriptor(module), identifier,
-                                      name, namespace)
-        elif self.has_descriptor_with_name(identifier, name, namespace,
-                                           package_version, version):
-            raise DuplicateIdentifier(identifier, name, namespace,
-                                      package_version, version)
-        descriptor = self.update_registry(base_descriptor, module, identifier, 
-                                          name, namespace, package_version,
+        descriptor = None
+        if package is self._binding_package:
+            descriptor = self.bind_module(package, module, name, namespace,
                                           version)
+        is_new = descriptor is None
+        if is_new:
+            desc_key = (name, namespace, version)
+            if desc_key in package.descriptor_versions:
+                raise ModuleAlreadyExists(identifier, name)
+
+            # We allow multiple inheritance as long as only one of the
+            # superclasses is a subclass of Module.
+            if settings.is_root:
+                base_descriptor = None
+            else:
+                candidates = self.get_subclass_candidates(module)
+                if len(candidates) != 1:
+                    raise InvalidModuleClass(module)
+                base_class = candidates[0]
+                if base_class not in self._module_key_map:
+                    raise MissingBaseClass(base_class)
+                base_descriptor = self.get_descriptor(base_class)
+
+            if module in self._module_key_map:
+                # This is really obsolete as having two descriptors
+                # pointing to the same module isn't a big deal except to
+                # get_descriptor which shouldn't be used often
+                if identifier != 'local.abstractions':
+                    raise DuplicateModule(self.get_descriptor(module),
+                                          identifier, name, namespace)
+            elif self.has_descriptor_with_name(identifier, name, namespace,
+                                               package_version, version):
+                raise DuplicateIdentifier(identifier, name, namespace,
+                                          package_version, version)
+            descriptor = self.update_registry(base_descriptor, module,
+                                              identifier, name, namespace,
+                                              package_version, version)
         if settings.is_root:
             self.root_descriptor = descriptor
 
@@ -1239,11 +1313,68 @@ class ModuleRegistry(DBRegistry):
         if settings.ghost_namespace:
             descriptor.ghost_namespace = settings.ghost_namespace
                  
-        self.signals.emit_new_module(descriptor)
-        if self.is_abstraction(descriptor):
-            self.signals.emit_new_abstraction(descriptor)
+        if is_new:
+            self.signals.emit_new_module(descriptor)
+            if self.is_abstraction(descriptor):
+                self.signals.emit_new_abstraction(descriptor)
+        return descriptor
+
+    def bind_module(self, package, module, name, namespace, version):
+        """bind_module(package: Package, module: class, name: str,
+                       namespace: str, version: str) -> ModuleDescriptor
+        Sets the class of a descriptor that was restored from a snapshot
+        and whose class hasn't been loaded yet. Returns None if there is
+        no such descriptor.
+
+        """
+        key = (name, namespace or '', version or '')
+        try:
+            descriptor = package.descriptor_versions[key]
+        except KeyError:
+            return None
+        # the loader of the descriptor that triggered the import has
+        # already been cleared, so check the class itself; it might
+        # also have been loaded on its own (see load_module_class)
+        if descriptor._module is not None and descriptor._module is not module:
+            return None
+        descriptor.module = module
+        self._module_key_map[module] = (package.identifier, name,
+                                        namespace, package.version, version)
         return descriptor
 
+    def load_module_class(self, package, descriptor, module_path,
+                          class_name):
+        """load_module_class(package: Package, descriptor: ModuleDescriptor,
+                             module_path: str, class_name: str) -> bool
+        Binds a descriptor restored from a manifest to its class by
+        importing the python module that defines it, module_path being
+        relative to the package. Returns False if the class couldn't be
+        loaded that way.
+
+        """
+        name = package.prefix + package.codepath
+        if module_path:
+            name += '.' + module_path
+        try:
+            __import__(name, globals(), locals(), [])
+            module = getattr(sys.modules[name], class_name)
+        except Exception, e:
+            debug.warning("Could not load class %s from %s" % (class_name,
+                                                               name), e)
+            return False
+        module_cls = vistrails.core.modules.vistrails_module.Module
+        if not isinstance(module, type) or not issubclass(module, module_cls):
+            debug.warning("%s.%s is not a module class" % (name, class_name))
+            return False
+        debug.log("Loaded class %s of package %s" % (class_name,
+                                                    package.codepath))
+        descriptor.module = module
+        self._module_key_map[module] = (package.identifier, descriptor.name,
+                                        descriptor.namespace,
+                                        descriptor.package_version,
+                                        descriptor.version)
+        return True
+
     def auto_add_subworkflow(self, subworkflow):
         if isinstance(subworkflow, str):
             return self.add_subworkflow(subworkflow)
@@ -1471,6 +1602,8 @@ class ModuleRegistry(DBRegistry):
             raise InvalidPortSpec(descriptor, spec.name, spec.type, e)
 
         descriptor.add_port_spec(spec)
+        if descriptor in self._converters:
+            self._converters_changed()
         if spec.type == 'input':
             self.signals.emit_new_input_port(descriptor.identifier,
                                              descriptor.name, spec.name, spec)
@@ -1509,6 +1642,11 @@ class ModuleRegistry(DBRegistry):
                  labels=None, defaults=None, values=None, entry_types=None, 
                  docstring=None, shape=None, min_conns=0, max_conns=-1,
                  depth=0):
+        if (self._binding_package is not None and
+                descriptor.identifier == self._binding_package.identifier and
+                descriptor.has_port_spec(port_name, port_type)):
+            # the port was restored from the package's snapshot
+            return
         spec = self.create_port_spec(port_name, port_type, port_sig,
                                      port_sigstring, optional, sort_key,
                                      labels, defaults, values, entry_types,
@@ -1597,53 +1735,20 @@ class ModuleRegistry(DBRegistry):
         debug.log("Initializing " + package.codepath)
         if (package.identifier, package.version) not in self.package_versions:
             self.add_package(package)
+        use_snapshot = registry_snapshot.snapshots_enabled()
+        if (self.load_package_manifest(package) or
+                (use_snapshot and self.load_package_snapshot(package))):
+            debug.splashMessage("Initializing " + package.codepath +
+                                '... done.')
+            package._initialized = True
+            return
+        # packages we subclass from need to have their code loaded
+        for dep_package in self.get_package_dependencies(package):
+            dep_package.materialize()
         self.set_current_package(package)
         try:
             package.initialize()
-            # Perform auto-initialization
-            if hasattr(package.module, '_modules'):
-                modules = package.module._modules
-                if isinstance(modules, dict):
-                    module_list = []
-                    for namespace, m_list in modules.iteritems():
-                        for module in m_list:
-                            m_dict = {'namespace': namespace}
-                            if isinstance(module, tuple):
-                                m_dict.update(module[1])
-                                module_list.append((module[0], m_dict))
-                            elif '_settings' in module.__dict__:
-                                kwargs = module._settings._asdict()
-                                kwargs.update(m_dict)
-                                module._settings = ModuleSettings(**kwargs)
-                                module_list.append(module)
-                            else:
-                                module_list.append((module, m_dict))
-                else:
-                    module_list = modules
-                modules = _toposort_modules(module_list)
-                # We add all modules before adding ports because
-                # modules inside package might use each other as ports
-                for module in modules:
-                    self.auto_add_module(module)
-
-            # allow all modules to auto_add_ports!
-            added_descriptors = set()
-            for descriptor in package.descriptor_list:
-                if hasattr(descriptor, 'module'):
-                    self.auto_add_ports(descriptor.module)
-                    added_descriptors.add(descriptor)
-            # Perform auto-initialization of abstractions
-            if hasattr(package.module, '_subworkflows'):
-                subworkflows = \
-                    _toposort_abstractions(package,
-                                           package.module._subworkflows)
-                for subworkflow in subworkflows:
-                    self.auto_add_subworkflow(subworkflow)
-            for descriptor in package.descriptor_list:
-                if descriptor not in added_descriptors:
-                    if hasattr(descriptor, 'module'):
-                        self.auto_add_ports(descriptor.module)
-                        added_descriptors.add(descriptor)
+            self.auto_add_package(package)
         except MissingRequirement:
             raise
         except Exception, e:
@@ -1654,6 +1759,373 @@ class ModuleRegistry(DBRegistry):
         self.set_current_package(None)
         debug.splashMessage("Initializing " + package.codepath + '... done.')
         package._initialized = True 
+        if use_snapshot:
+            self.save_package_snapshot(package)
+
+    def auto_add_package(self, package):
+        """auto_add_package(package: Package) -> None
+        Registers the modules, ports and subworkflows that the
+        package's init module lists in _modules and _subworkflows.
+
+        """
+        # Perform auto-initialization
+        if hasattr(package.module, '_modules'):
+            modules = package.module._modules
+            if isinstance(modules, dict):
+                module_list = []
+                for namespace, m_list in modules.iteritems():
+                    for module in m_list:
+                        m_dict = {'namespace': namespace}
+                        if isinstance(module, tuple):
+                            m_dict.update(module[1])
+                            module_list.append((module[0], m_dict))
+                        elif '_settings' in module.__dict__:
+                            kwargs = module._settings._asdict()
+                            kwargs.update(m_dict)
+                            module._settings = ModuleSettings(**kwargs)
+                            module_list.append(module)
+                        else:
+                            module_list.append((module, m_dict))
+            else:
+                module_list = modules
+            modules = _toposort_modules(module_list)
+            # We add all modules before adding ports because
+            # modules inside package might use each other as ports
+            for module in modules:
+                self.auto_add_module(module)
+
+        # allow all modules to auto_add_ports!
+        added_descriptors = set()
+        for descriptor in package.descriptor_list:
+            if descriptor.module is not None:
+                self.auto_add_ports(descriptor.module)
+                added_descriptors.add(descriptor)
+        # Perform auto-initialization of abstractions
+        if hasattr(package.module, '_subworkflows'):
+            subworkflows = \
+                _toposort_abstractions(package,
+                                       package.module._subworkflows)
+            for subworkflow in subworkflows:
+                self.auto_add_subworkflow(subworkflow)
+        for descriptor in package.descriptor_list:
+            if descriptor not in added_descriptors:
+                if descriptor.module is not None:
+                    self.auto_add_ports(descriptor.module)
+                    added_descriptors.add(descriptor)
+
+    def get_package_dependencies(self, package):
+        """get_package_dependencies(package: Package) -> [Package]
+        Returns the registered packages that package depends on.
+
+        """
+        dep_packages = []
+        for dep in package.dependencies():
+            if isinstance(dep, tuple):
+                dep = dep[0]
+            if dep in self.packages:
+                dep_packages.append(self.packages[dep])
+        return dep_packages
+
+    ##########################################################################
+    # Registry snapshots
+
+    def save_package_snapshot(self, package):
+        """save_package_snapshot(package: Package) -> None
+        Writes the descriptors and port specs of an initialized package
+        to its snapshot file, if the package allows it.
+
+        """
+        if not registry_snapshot.can_snapshot(package):
+            return
+        try:
+            snapshot = self.get_package_snapshot(package)
+            registry_snapshot.write_snapshot(package, snapshot)
+        except Exception, e:
+            debug.warning("Could not save registry snapshot for package %s" %
+                          package.codepath, e)
+
+    def load_package_snapshot(self, package):
+        """load_package_snapshot(package: Package) -> bool
+        Restores the package's descriptors from an up-to-date snapshot
+        without importing its init module. Returns False if there is no
+        usable snapshot, in which case the registry is left unchanged.
+
+        """
+        snapshot = registry_snapshot.read_snapshot(package)
+        if snapshot is None:
+            return False
+        package.check_requirements()
+        if not self.restore_package_snapshot(package, snapshot):
+            registry_snapshot.remove_snapshot(package)
+            return False
+        package.set_lazy_initialization(self.materialize_package,
+                                        snapshot['init_hooks'])
+        debug.log("Restored %d modules of package %s from snapshot" %
+                  (len(snapshot['descriptors']), package.codepath))
+        return True
+
+    def load_package_manifest(self, package):
+        """load_package_manifest(package: Package) -> bool
+        Restores the package's descriptors from the manifest it ships
+        with, if any. Module classes will be imported one by one when
+        first needed. Returns False if the package has no usable
+        manifest, in which case the registry is left unchanged.
+
+        """
+        manifest = registry_snapshot.read_manifest(package)
+        if manifest is None:
+            return False
+        package.check_requirements()
+        if not self.restore_package_snapshot(package, manifest, True):
+            debug.warning("Registry manifest of package %s does not match "
+                          "the registry, ignoring it" % package.codepath)
+            return False
+        package.set_lazy_initialization(self.materialize_package,
+                                        manifest['init_hooks'])
+        debug.log("Restored %d modules of package %s from manifest" %
+                  (len(manifest['descriptors']), package.codepath))
+        return True
+
+    def load_all_ports(self):
+        """load_all_ports() -> None
+        Runs the port loaders of all the descriptors. The DB layer reads the
+        port specs directly, so this has to be called before saving or
+        exporting the registry.
+
+        """
+        for descriptor in self.descriptors_by_id.values():
+            descriptor.load_ports()
+
+    def get_package_snapshot(self, package):
+        """get_package_snapshot(package: Package) -> dict
+        Returns a picklable description of the descriptors and port
+        specs registered by package.
+
+        """
+        package_path = package.prefix + package.codepath
+        descriptors = []
+        for descriptor in package.descriptor_list:
+            # where the class can be imported from, relative to the
+            # package, if it is defined there
+            module_path = None
+            module = descriptor.module
+            python_module = sys.modules.get(module.__module__)
+            if getattr(python_module, module.__name__, None) is module:
+                if module.__module__ == package_path:
+                    module_path = ''
+                elif module.__module__.startswith(package_path + '.'):
+                    module_path = module.__module__[len(package_path) + 1:]
+            configure_widget = descriptor.configuration_widget()
+            if isinstance(configure_widget, type):
+                configure_widget = (configure_widget.__module__,
+                                    configure_widget.__name__)
+            base = descriptor.base_descriptor
+            if base is not None:
+                base = (base.identifier, base.name, base.namespace,
+                        base.package_version, base.version)
+            port_specs = []
+            # this runs the port loader, so ports added on demand are
+            # saved as well
+            for spec in descriptor.port_specs_list:
+                items = [(item.pos, item.package, item.module,
+                          item.namespace, item.label, item.default,
+                          item.db_values, item.entry_type)
+                         for item in spec.port_spec_items]
+                port_specs.append({'name': spec.name,
+                                   'type': spec.type,
+                                   'optional': spec.optional,
+                                   'sort_key': spec.sort_key,
+                                   'min_conns': spec.min_conns,
+                                   'max_conns': spec.max_conns,
+                                   'depth': spec.depth,
+                                   'docstring': spec.docstring(),
+                                   'shape': spec.shape(),
+                                   'items': items})
+            descriptors.append(
+                {'name': descriptor.name,
+                 'namespace': descriptor.namespace,
+                 'package_version': descriptor.package_version,
+                 'version': descriptor.version,
+                 'base': base,
+                 'abstract': descriptor.module_abstract(),
+                 'color': descriptor.module_color(),
+                 'fringe': descriptor.module_fringe(),
+                 'is_hidden': descriptor.is_hidden,
+                 'namespace_hidden': descriptor.namespace_hidden,
+                 'ghost_identifier': descriptor.ghost_identifier,
+                 'ghost_package_version': descriptor.ghost_package_version,
+                 'ghost_namespace': descriptor.ghost_namespace,
+                 'has_hasher': descriptor.hasher_callable() is not None,
+                 'is_converter': descriptor in self._converters,
+                 'configure_widget': configure_widget,
+                 'constant_widgets': bool(descriptor._widget_classes),
+                 'module_path': module_path,
+                 'class_name': module.__name__,
+                 'port_specs': port_specs})
+        constant_hashers = [k for k in self._constant_hasher_map
+                            if k[0] == package.identifier]
+        return {'descriptors': descriptors,
+                'constant_hashers': constant_hashers,
+                'init_hooks': package.get_init_module_hooks()}
+
+    def restore_package_snapshot(self, package, snapshot,
+                                 load_classes=False):
+        """restore_package_snapshot(package: Package, snapshot: dict,
+                                    load_classes: bool) -> bool
+        Adds the descriptors from a snapshot (see get_package_snapshot)
+        to the registry. Their module classes will be loaded through
+        package.materialize() when first needed, or, if load_classes is
+        True, by importing only the python module that defines them
+        when they don't need the init module. Returns False if the
+        snapshot doesn't match the current registry.
+
+        """
+        def load_module(descriptor):
+            package.materialize()
+
+        def make_class_loader(module_path, class_name):
+            def load_class(descriptor):
+                if not self.load_module_class(package, descriptor,
+                                              module_path, class_name):
+                    package.materialize()
+            return load_class
+
+        added = []
+        try:
+            for d in snapshot['descriptors']:
+                base_descriptor = None
+                if d['base'] is not None:
+                    base_descriptor = self.get_descriptor_by_name(*d['base'])
+                descriptor_id = self.idScope.getNewId(ModuleDescriptor.vtType)
+                descriptor = ModuleDescriptor(
+                    id=descriptor_id,
+                    package=package.identifier,
+                    base_descriptor=base_descriptor,
+                    name=d['name'],
+                    namespace=d['namespace'],
+                    package_version=d['package_version'],
+                    version=d['version'])
+                hash_key = (package.identifier, d['name'], d['namespace'])
+                if (load_classes and d['module_path'] is not None and
+                        not d['has_hasher'] and not d['is_converter'] and
+                        not d['constant_widgets'] and
+                        hash_key not in snapshot['constant_hashers']):
+                    descriptor.set_module_loader(
+                            make_class_loader(d['module_path'],
+                                              d['class_name']))
+                else:
+                    descriptor.set_module_loader(load_module)
+                descriptor.set_module_abstract(d['abstract'])
+                descriptor.set_configuration_widget(d['configure_widget'])
+                descriptor.set_module_color(d['color'])
+                if d['fringe'] is not None:
+                    descriptor.set_module_fringe(*d['fringe'])
+                descriptor.is_hidden = d['is_hidden']
+                descriptor.namespace_hidden = d['namespace_hidden']
+                descriptor.ghost_identifier = d['ghost_identifier']
+                descriptor.ghost_package_version = d['ghost_package_version']
+                descriptor.ghost_namespace = d['ghost_namespace']
+                if d['has_hasher']:
+                    descriptor.set_hasher_callable(
+                        _LazyCallable(package, descriptor.hasher_callable))
+                self.add_descriptor(descriptor, package)
+                added.append(descriptor)
+                if d['is_converter']:
+                    self._converters.add(descriptor)
+                    self._converters_changed()
+                for spec_d in d['port_specs']:
+                    items = []
+                    for (pos, identifier, name, namespace, label, default,
+                         values, entry_type) in spec_d['items']:
+                        psi_id = self.idScope.getNewId(PortSpecItem.vtType)
+                        items.append(PortSpecItem(id=psi_id, pos=pos,
+                                                  package=identifier,
+                                                  module=name,
+                                                  namespace=namespace,
+                                                  label=label,
+                                                  default=default,
+                                                  values=values,
+                                                  entry_type=entry_type))
+                    spec_id = self.idScope.getNewId(PortSpec.vtType)
+                    spec = PortSpec(id=spec_id,
+                                    name=spec_d['name'],
+                                    type=spec_d['type'],
+                                    optional=spec_d['optional'],
+                                    sort_key=spec_d['sort_key'],
+                                    min_conns=spec_d['min_conns'],
+                                    max_conns=spec_d['max_conns'],
+                                    depth=spec_d['depth'],
+                                    docstring=spec_d['docstring'],
+                                    shape=spec_d['shape'],
+                                    items=items)
+                    self.add_port_spec(descriptor, spec)
+        except ModuleRegistryException, e:
+            debug.log("Registry snapshot of package %s is out of date: %s" %
+                      (package.codepath, e))
+            for descriptor in reversed(added):
+                self._converters.discard(descriptor)
+                self.delete_descriptor(descriptor, package)
+            return False
+
+        for key in snapshot['constant_hashers']:
+            def get_constant_hasher(key=key):
+                return self._constant_hasher_map.get(key)
+            self._constant_hasher_map[key] = \
+                _LazyCallable(package, get_constant_hasher)
+        for descriptor in added:
+            self.signals.emit_new_module(descriptor)
+        return True
+
+    def materialize_package(self, package):
+        """materialize_package(package: Package) -> None
+        Imports and initializes the code of a package whose descriptors
+        were restored from a snapshot, binding the module classes it
+        registers to the existing descriptors.
+
+        """
+        for dep_package in self.get_package_dependencies(package):
+            dep_package.materialize()
+        debug.log("Loading code of package " + package.codepath)
+        old_package = self._current_package
+        old_binding = self._binding_package
+        self._binding_package = package
+        self.set_current_package(package)
+        try:
+            package.initialize()
+            self.auto_add_package(package)
+        except MissingRequirement:
+            registry_snapshot.remove_snapshot(package)
+            raise
+        except Exception, e:
+            registry_snapshot.remove_snapshot(package)
+            raise package.InitializationFailed(package,
+                                               [traceback.format_exc()])
+        finally:
+            self._binding_package = old_binding
+            self._current_package = old_package
+
+        # the snapshot was stale if some descriptors were not registered
+        # again; make sure the next session initializes the package fully
+        stale = False
+        for descriptor in package.descriptor_list:
+            # all the ports were restored, even those the package adds
+            # on demand
+            descriptor.set_port_loader(None)
+            if not descriptor.is_module_loaded():
+                descriptor.module = None
+                stale = True
+            if isinstance(descriptor._hasher_callable, _LazyCallable):
+                descriptor.set_hasher_callable(None)
+                stale = True
+        for key, hasher in self._constant_hasher_map.items():
+            if (key[0] == package.identifier and
+                    isinstance(hasher, _LazyCallable)):
+                del self._constant_hasher_map[key]
+                stale = True
+        if stale:
+            debug.warning("Registry snapshot of package %s did not match "
+                          "its code" % package.codepath)
+            registry_snapshot.remove_snapshot(package)
 
     def delete_module(self, identifier, module_name, namespace=None):
         """deleteModule(module_name): Removes a module from the registry."""
@@ -1665,16 +2137,16 @@ class ModuleRegistry(DBRegistry):
         converter_desc = self.get_descriptor(
                 vistrails.core.modules.vistrails_module.Converter)
         if self.is_descriptor_subclass(descriptor, converter_desc):
-            self._conversions = dict()
             self._converters.remove(descriptor)
+            self._converters_changed()
 
         self.signals.emit_deleted_module(descriptor)
         if self.is_abstraction(descriptor):
             self.signals.emit_deleted_abstraction(descriptor)
         package = self.packages[descriptor.identifier]
         self.delete_descriptor(descriptor, package)
-        if descriptor.module is not None:
-            del self._module_key_map[descriptor.module]
+        if descriptor._module is not None:
+            del self._module_key_map[descriptor._module]
 
     def remove_package(self, package):
         """remove_package(package) -> None:
@@ -1715,10 +2187,14 @@ class ModuleRegistry(DBRegistry):
     def delete_input_port(self, descriptor, port_name):
         """ Just remove a name input port with all of its specs """
         descriptor.delete_input_port(port_name)
+        if descriptor in self._converters:
+            self._converters_changed()
 
     def delete_output_port(self, descriptor, port_name):
         """ Just remove a name output port with all of its specs """
         descriptor.delete_output_port(port_name)
+        if descriptor in self._converters:
+            self._converters_changed()
 
     def source_ports_from_descriptor(self, descriptor, sorted=True):
         ports = [p[1] for p in self.module_ports('output', descriptor)]
@@ -1851,10 +2327,38 @@ class ModuleRegistry(DBRegistry):
         self._conversions[key] = converters
         return converters
 
+    def get_basic_descriptor(self, name):
+        """get_basic_descriptor(name: str) -> ModuleDescriptor
+        Returns the descriptor of a module of the basic package, caching
+        it as these are looked up for every port compatibility check.
+
+        """
+        try:
+            return self._basic_descriptors[name]
+        except KeyError:
+            descriptor = self.get_descriptor_by_name(
+                    get_vistrails_basic_pkg_id(), name)
+            self._basic_descriptors[name] = descriptor
+            return descriptor
+
+    def get_registered_ids(self, descriptors):
+        """get_registered_ids(descriptors: [ModuleDescriptor]) -> tuple
+        Returns the ids of the descriptors, or None if one of them is
+        not a descriptor of this registry (e.g. it comes from a copy or
+        from a disabled package), in which case cached answers keyed on
+        ids don't apply.
+
+        """
+        ids = []
+        for descriptor in descriptors:
+            if self.descriptors_by_id.get(descriptor.id) is not descriptor:
+                return None
+            ids.append(descriptor.id)
+        return tuple(ids)
+
     def is_descriptor_list_subclass(self, sub_descs, super_descs):
-        basic_pkg = get_vistrails_basic_pkg_id()
-        variant_desc = self.get_descriptor_by_name(basic_pkg, 'Variant')
-        module_desc = self.get_descriptor_by_name(basic_pkg, 'Module')
+        variant_desc = self.get_basic_descriptor('Variant')
+        module_desc = self.get_basic_descriptor('Module')
 
         for (sub_desc, super_desc) in izip(sub_descs, super_descs):
             if sub_desc == variant_desc or super_desc == variant_desc:
@@ -1877,28 +2381,56 @@ class ModuleRegistry(DBRegistry):
         
         """
         # For a connection, this gets called for sub -> super
-        basic_pkg = get_vistrails_basic_pkg_id()
-        variant_desc = self.get_descriptor_by_name(basic_pkg, 'Variant')
-        list_desc = self.get_descriptor_by_name(basic_pkg, 'List')
         # sometimes sub is coming None
         # I don't know if this is expected, so I will put a test here
         sub_descs = []
         if sub:
             sub_descs = sub.descriptors()
-        if sub_descs is None:
-            return False
-        elif sub_descs == [variant_desc]:
-            return True
         super_descs = []
         if super:
             super_descs = super.descriptors()
-        if super_descs is None:
+        if sub_descs is None or super_descs is None:
             return False
+
+        # The answer only depends on the descriptors, so it is cached
+        # for registered ones; this is hit for every connection when
+        # validating a pipeline
+        sub_ids = self.get_registered_ids(sub_descs)
+        super_ids = self.get_registered_ids(super_descs)
+        if sub_ids is None or super_ids is None:
+            matched, converters = self.match_descriptor_lists(
+                    sub_descs, super_descs, allow_conversion)
+        else:
+            key = (sub_ids, super_ids, allow_conversion)
+            try:
+                matched, converters = self._spec_match_cache[key]
+            except KeyError:
+                matched, converters = self.match_descriptor_lists(
+                        sub_descs, super_descs, allow_conversion)
+                self._spec_match_cache[key] = (matched, converters)
+        if converters and out_converters is not None:
+            out_converters.extend(converters)
+        return matched
+
+    def match_descriptor_lists(self, sub_descs, super_descs,
+                               allow_conversion=False):
+        """match_descriptor_lists(sub_descs: [ModuleDescriptor],
+                                  super_descs: [ModuleDescriptor],
+                                  allow_conversion: bool) -> (bool, list)
+        Checks if a port with signature sub_descs can be connected to
+        one with signature super_descs. Returns whether they match and
+        the converters that make them match, if conversion was needed.
+
+        """
+        variant_desc = self.get_basic_descriptor('Variant')
+        list_desc = self.get_basic_descriptor('List')
+        if sub_descs == [variant_desc]:
+            return True, []
         elif super_descs == [variant_desc]:
-            return True
+            return True, []
         elif [list_desc] in [super_descs, sub_descs]:
             # Allow Lists to connect to anything
-            return True
+            return True, []
         #elif super_descs == [list_desc] and sub_descs != [list_desc] \
         #     and sub.depth > 0:
         #    # List is handled as Variant with depth 1
@@ -1910,22 +2442,20 @@ class ModuleRegistry(DBRegistry):
 
         if (len(sub_descs) == len(super_descs) and
                 self.is_descriptor_list_subclass(sub_descs, super_descs)):
-            return True
+            return True, []
 
         if allow_conversion:
             converters = self.get_converters(sub_descs, super_descs)
             if converters:
-                if out_converters is not None:
-                    out_converters.extend(converters)
-                return True
+                return True, converters
 
-        return False
+        return False, []
 
     def get_module_hierarchy(self, descriptor):
         """get_module_hierarchy(descriptor) -> [klass].
         Returns the module hierarchy all the way to Module, excluding
         any mixins."""
-        if descriptor.module is None:
+        if not descriptor.is_module_loaded() or descriptor.module is None:
             descriptors = [descriptor]
             base_id = descriptor.base_descriptor_id
             while base_id >= 0:
@@ -2054,8 +2584,14 @@ class ModuleRegistry(DBRegistry):
                                   super: ModuleDescriptor) -> bool
         
         """
+        # use the precomputed ancestors of registered descriptors
+        if (self.descriptors_by_id.get(sub.id) is sub and
+                self.descriptors_by_id.get(super.id) is super):
+            return super.id in self.get_ancestor_ids(sub)
+
         # use issubclass for speed if we've loaded the modules
-        if sub.module is not None and super.module is not None:
+        if (sub.is_module_loaded() and super.is_module_loaded() and
+                sub.module is not None and super.module is not None):
             return issubclass(sub.module, super.module)
         
         # otherwise, use descriptors themselves
@@ -2068,6 +2604,25 @@ class ModuleRegistry(DBRegistry):
 
         return False
 
+    def get_ancestor_ids(self, descriptor):
+        """get_ancestor_ids(descriptor: ModuleDescriptor) -> frozenset
+        Returns the ids of descriptor and all of its base descriptors.
+        descriptor must belong to this registry.
+
+        """
+        try:
+            return self._ancestor_ids[descriptor.id]
+        except KeyError:
+            pass
+        base_id = descriptor.base_descriptor_id
+        if base_id >= 0 and base_id in self.descriptors_by_id:
+            ancestors = self.get_ancestor_ids(self.descriptors_by_id[base_id])
+            ancestors = ancestors.union((descriptor.id,))
+        else:
+            ancestors = frozenset((descriptor.id,))
+        self._ancestor_ids[descriptor.id] = ancestors
+        return ancestors
+
     def find_descriptor_subclass(self, d1, d2):
         if self.is_descriptor_subclass(d1, d2):
             return d1
@@ -2157,3 +2712,119 @@ class TestModuleRegistry(unittest.TestCase):
         t1 = PortSpec(signature=[Float, Integer])
         t2 = PortSpec(signature=[Integer, Float])
         self.assertNotEquals(t1, t2)
+
+    def test_descriptor_subclass(self):
+        reg = get_module_registry()
+        basic_pkg = get_vistrails_basic_pkg_id()
+        module = reg.get_descriptor_by_name(basic_pkg, 'Module')
+        constant = reg.get_descriptor_by_name(basic_pkg, 'Constant')
+        string = reg.get_descriptor_by_name(basic_pkg, 'String')
+        self.assertTrue(reg.is_descriptor_subclass(string, constant))
+        self.assertTrue(reg.is_descriptor_subclass(string, module))
+        self.assertTrue(reg.is_descriptor_subclass(string, string))
+        self.assertFalse(reg.is_descriptor_subclass(constant, string))
+        self.assertEqual(reg.get_ancestor_ids(string),
+                         frozenset(d.id for d in
+                                   reg.get_module_hierarchy(string)))
+
+    def test_port_loader(self):
+        from vistrails.core.modules.basic_modules import Integer
+        d = ModuleDescriptor(id=-1, package='org.vistrails.tests.lazy',
+                             name='LazyPorts')
+        calls = []
+        def loader(descriptor):
+            calls.append(descriptor)
+            # adding ports doesn't run the loader again
+            self.assertFalse(descriptor.has_port_spec('value', 'input'))
+            descriptor.add_port_spec(PortSpec(name='value', type='input',
+                                              signature=Integer))
+        d.set_port_loader(loader)
+        self.assertFalse(d.are_ports_loaded())
+        self.assertEqual(calls, [])
+
+        reg = get_module_registry()
+        spec = reg.get_port_spec_from_descriptor(d, 'value', 'input')
+        self.assertEqual(spec.name, 'value')
+        self.assertTrue(d.are_ports_loaded())
+        self.assertEqual(d.port_specs.keys(), [('value', 'input')])
+        self.assertEqual([s.name for s in d.port_specs_list], ['value'])
+        self.assertEqual(calls, [d])
+
+    def test_specs_matched_cache(self):
+        from vistrails.core.modules.basic_modules import Float, Integer, \
+            String
+        reg = get_module_registry()
+        float_spec = PortSpec(name='a', type='output', signature=Float)
+        int_spec = PortSpec(name='b', type='input', signature=Integer)
+        str_spec = PortSpec(name='c', type='input', signature=String)
+
+        for i in xrange(2):
+            self.assertFalse(reg.are_specs_matched(float_spec, str_spec))
+            self.assertFalse(reg.are_specs_matched(float_spec, int_spec))
+            converters = []
+            self.assertTrue(reg.are_specs_matched(float_spec, int_spec,
+                                                  allow_conversion=True,
+                                                  out_converters=converters))
+            self.assertEqual([c.name for c in converters], ['Round'])
+
+    def test_specs_matched_cache_converters(self):
+        from vistrails.core.modules.basic_modules import Float, Integer, \
+            String
+        from vistrails.core.modules.vistrails_module import Converter
+        class IntegerToStringTest(Converter):
+            pass
+        reg = get_module_registry()
+        basic_pkg = get_vistrails_basic_pkg_id()
+        float_spec = PortSpec(name='a', type='output', signature=Float)
+        str_spec = PortSpec(name='c', type='input', signature=String)
+        self.assertFalse(reg.are_specs_matched(float_spec, str_spec,
+                                               allow_conversion=True))
+
+        reg.add_module(IntegerToStringTest, package=basic_pkg,
+                       package_version=reg.get_package_by_name(
+                               basic_pkg).version)
+        try:
+            # has the Variant ports inherited from Converter for now
+            converters = []
+            self.assertTrue(reg.are_specs_matched(float_spec, str_spec,
+                                                  allow_conversion=True,
+                                                  out_converters=converters))
+            self.assertEqual([c.name for c in converters],
+                             ['IntegerToStringTest'])
+            reg.add_input_port(IntegerToStringTest, 'in_value', Integer)
+            reg.add_output_port(IntegerToStringTest, 'out_value', String)
+            self.assertFalse(reg.are_specs_matched(float_spec, str_spec,
+                                                   allow_conversion=True))
+        finally:
+            reg.delete_module(basic_pkg, 'IntegerToStringTest')
+        self.assertFalse(reg.are_specs_matched(float_spec, str_spec,
+                                               allow_conversion=True))
+
+    def test_write_registry_loads_ports(self):
+        import os
+        import shutil
+        import tempfile
+        from vistrails.core.db.locator import XMLFileLocator
+        from vistrails.core.modules.basic_modules import Integer
+        from vistrails.core.modules.vistrails_module import Module
+        from vistrails.core.vistrail.controller import VistrailController
+        class LazyPortsTest(Module):
+            pass
+        reg = get_module_registry()
+        basic_pkg = get_vistrails_basic_pkg_id()
+        descriptor = reg.add_module(LazyPortsTest, package=basic_pkg,
+                                    package_version=reg.get_package_by_name(
+                                            basic_pkg).version)
+        directory = tempfile.mkdtemp(prefix='vt_registry_')
+        try:
+            descriptor.set_port_loader(
+                    lambda d: reg.add_input_port(LazyPortsTest,
+                                                 'lazy_value', Integer))
+            filename = os.path.join(directory, 'registry.xml')
+            VistrailController().write_registry(XMLFileLocator(filename))
+            self.assertTrue(descriptor.are_ports_loaded())
+            with open(filename, 'rb') as f:
+                self.assertIn('lazy_value', f.read())
+        finally:
+            shutil.rmtree(directory)
+            reg.delete_module(basic_pkg, 'LazyPortsTest')
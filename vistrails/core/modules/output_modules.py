@@ -268,7 +268,12 @@ class OutputModule(NotCacheable, Module):
         mode_config = mode_config_cls(mode_config_dict)
         return mode_config
 
-    def compute(self):
+    def get_output_mode_class(self):
+        """get_output_mode_class() -> class
+        Returns the output mode to use: the one set on the mode_type port,
+        or the registered one with the highest priority that can compute.
+
+        """
         mode_cls = None
         self.ensure_mode_dict()
         if self.has_input("mode_type"):
@@ -291,7 +296,10 @@ class OutputModule(NotCacheable, Module):
         if mode_cls is None:
             raise ModuleError(self, "No output mode is valid, output cannot "
                               "be generated")
+        return mode_cls
 
+    def compute(self):
+        mode_cls = self.get_output_mode_class()
         mode_config = self.get_mode_config(mode_cls)
         mode = mode_cls()
         self.annotate({"output_mode": mode.mode_type})
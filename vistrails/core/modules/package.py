@@ -142,6 +142,8 @@ class Package(DBPackage):
             self.old_identifiers = []
             self._default_configuration = None
             self._persistent_configuration = None
+            self._materializer = None
+            self._lazy_init_attrs = None
         else:
             self._module = other._module
             self._init_module = other._init_module
@@ -156,6 +158,8 @@ class Package(DBPackage):
                                         copy.copy(other._default_configuration)
             self._persistent_configuration = \
                                     copy.copy(other._persistent_configuration)
+            self._materializer = other._materializer
+            self._lazy_init_attrs = copy.copy(other._lazy_init_attrs)
 
         # FIXME decide whether we want None or ''
         if self.version is None:
@@ -222,6 +226,7 @@ class Package(DBPackage):
     module = property(_get_module)
 
     def _get_init_module(self):
+        self.materialize()
         return self._init_module
     init_module = property(_get_init_module)
 
@@ -351,6 +356,58 @@ class Package(DBPackage):
     def get_py_deps(self):
         return self.py_dependencies
 
+    # Names of the init module hooks that we need to know about without
+    # importing the init module (see set_lazy_initialization)
+    INIT_MODULE_HOOKS = ['handle_all_errors', 'handle_module_upgrade_request',
+                         'handle_missing_module', 'can_handle_identifier',
+                         'can_handle_vt_file', 'contextMenuName',
+                         'callContextMenu', 'loadVistrailFileHook',
+                         'saveVistrailFileHook', 'menu_items']
+
+    def get_init_module_hooks(self):
+        """get_init_module_hooks() -> list of str
+
+        Returns the hooks from INIT_MODULE_HOOKS that the init module
+        defines.
+
+        """
+        return [attr for attr in self.INIT_MODULE_HOOKS
+                if self._init_module_has(attr)]
+
+    def set_lazy_initialization(self, materializer, init_attrs):
+        """set_lazy_initialization(materializer: callable,
+                                   init_attrs: list of str) -> None
+
+        Marks the package as initialized without its init module having
+        been imported. materializer is called with the package the first
+        time the init module is needed, and init_attrs lists the hooks the
+        init module provides so that they can be queried before that.
+
+        """
+        self._materializer = materializer
+        self._lazy_init_attrs = set(init_attrs)
+
+    def is_lazy(self):
+        return self._materializer is not None
+
+    def materialize(self):
+        """materialize() -> None
+
+        Imports and initializes the init module of a package that was
+        lazily initialized. This is a NOP for other packages.
+
+        """
+        materializer = self._materializer
+        if materializer is not None:
+            self._materializer = None
+            self._lazy_init_attrs = None
+            materializer(self)
+
+    def _init_module_has(self, attr):
+        if self._lazy_init_attrs is not None:
+            return attr in self._lazy_init_attrs
+        return hasattr(self._init_module, attr)
+
     def load(self, prefix=None):
         """load(module=None). Loads package's module.
 
@@ -437,7 +494,9 @@ class Package(DBPackage):
                                      'configuration', 'package_dependencies',
                                      'package_requirements',
                                      'can_handle_identifier',
-                                     'can_handle_vt_file']
+                                     'can_handle_vt_file',
+                                     'registry_snapshot',
+                                     'registry_snapshot_token']
                 for attr in module_attributes:
                     if (hasattr(self._module, attr) and
                             not hasattr(self._init_module, attr)):
@@ -485,16 +544,16 @@ class Package(DBPackage):
             self.description = "(No description available)"
 
     def can_handle_all_errors(self):
-        return hasattr(self._init_module, 'handle_all_errors')
+        return self._init_module_has('handle_all_errors')
 
     def can_handle_upgrades(self):
-        return hasattr(self._init_module, 'handle_module_upgrade_request')
+        return self._init_module_has('handle_module_upgrade_request')
 
     def can_handle_identifier(self, identifier):
         """ Asks package if it can handle this package
         """
         try:
-            return (hasattr(self.init_module, 'can_handle_identifier') and
+            return (self._init_module_has('can_handle_identifier') and
                     self.init_module.can_handle_identifier(identifier))
         except Exception, e:
             debug.critical("Got exception calling %s's can_handle_identifier: "
@@ -506,7 +565,7 @@ class Package(DBPackage):
         """ Asks package if it can handle a file inside a zipped vt file
         """
         try:
-            return (hasattr(self.init_module, 'can_handle_vt_file') and
+            return (self._init_module_has('can_handle_vt_file') and
                     self.init_module.can_handle_vt_file(name))
         except Exception, e:
             debug.critical("Got exception calling %s's can_handle_vt_file: "
@@ -515,13 +574,13 @@ class Package(DBPackage):
             return False
 
     def can_handle_missing_modules(self):
-        return hasattr(self._init_module, 'handle_missing_module')
+        return self._init_module_has('handle_missing_module')
 
     def handle_all_errors(self, *args, **kwargs):
-        return self._init_module.handle_all_errors(*args, **kwargs)
+        return self.init_module.handle_all_errors(*args, **kwargs)
 
     def handle_module_upgrade_request(self, *args, **kwargs):
-        return self._init_module.handle_module_upgrade_request(*args, **kwargs)
+        return self.init_module.handle_module_upgrade_request(*args, **kwargs)
         
     def handle_missing_module(self, *args, **kwargs):
         """report_missing_module(name, namespace):
@@ -530,7 +589,7 @@ class Package(DBPackage):
         present, to allow the package to dynamically add a missing
         module.
         """
-        return self._init_module.handle_missing_module(*args, **kwargs)
+        return self.init_module.handle_missing_module(*args, **kwargs)
 
     def add_abs_upgrade(self, new_desc, name, namespace, module_version):
         key = (name, namespace)
@@ -558,30 +617,30 @@ class Package(DBPackage):
         return None
 
     def has_contextMenuName(self):
-        return hasattr(self._init_module, 'contextMenuName')
+        return self._init_module_has('contextMenuName')
 
     def contextMenuName(self, signature):
-        return self._init_module.contextMenuName(signature)
+        return self.init_module.contextMenuName(signature)
     
     def has_callContextMenu(self):
-        return hasattr(self._init_module, 'callContextMenu')
+        return self._init_module_has('callContextMenu')
 
     def callContextMenu(self, signature):
-        return self._init_module.callContextMenu(signature)
+        return self.init_module.callContextMenu(signature)
 
     def loadVistrailFileHook(self, vistrail, tmp_dir):
-        if hasattr(self._init_module, 'loadVistrailFileHook'):
+        if self._init_module_has('loadVistrailFileHook'):
             try:
-                self._init_module.loadVistrailFileHook(vistrail, tmp_dir)
+                self.init_module.loadVistrailFileHook(vistrail, tmp_dir)
             except Exception, e:
                 debug.critical("Got exception in %s's loadVistrailFileHook(): "
                                "%s: %s" % (self.name, type(e).__name__,
                                            ', '.join(e.args)))
 
     def saveVistrailFileHook(self, vistrail, tmp_dir):
-        if hasattr(self._init_module, 'saveVistrailFileHook'):
+        if self._init_module_has('saveVistrailFileHook'):
             try:
-                self._init_module.saveVistrailFileHook(vistrail, tmp_dir)
+                self.init_module.saveVistrailFileHook(vistrail, tmp_dir)
             except Exception, e:
                 debug.critical("Got exception in %s's saveVistrailFileHook(): "
                                "%s: %s" % (self.name, type(e).__name__,
@@ -596,6 +655,8 @@ class Package(DBPackage):
             callable_()
 
     def menu_items(self):
+        if self.is_lazy() and self._init_module_has('menu_items'):
+            self.materialize()
         try:
             callable_ = self._module.menu_items
         except AttributeError:
@@ -628,6 +689,8 @@ class Package(DBPackage):
         self._module = None
         self._init_module = None
         self._initialized = False
+        self._materializer = None
+        self._lazy_init_attrs = None
 
     def dependencies(self):
         deps = []
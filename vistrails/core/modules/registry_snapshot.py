@@ -0,0 +1,462 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Persisted snapshots of the module registry.
+
+Initializing a package imports its init module and registers all of its
+modules and ports, which can take a long time for packages that
+introspect large libraries (e.g. vtk). When the registrySnapshot option
+is set, the registry saves the descriptors and port specs of each
+package to a snapshot file after initializing it. In later sessions,
+the descriptors are restored from that file and the package code is
+only imported when a module class is needed (see
+ModuleRegistry.load_package_snapshot and Package.materialize).
+
+A snapshot is only used if its key matches the package: the key
+includes the snapshot format, the VisTrails version, the package
+identifier and version, its dependencies, the modification time of its
+code and an optional token computed by the package itself. Packages can
+define the following in their __init__.py:
+
+registry_snapshot = False
+    to never be restored from a snapshot (e.g. if their modules depend
+    on the environment in ways the key doesn't capture)
+
+def registry_snapshot_token():
+    to return a string that changes whenever the registered modules
+    would, e.g. the version of the wrapped library
+
+Packages can also ship a manifest, a JSON file named registry_manifest.json
+next to their __init__.py, with the same content as a snapshot. It is
+used whatever the configuration, as long as it matches the identifier
+and version of the package. Descriptors restored from a manifest only
+import the python module that defines their class when it is first
+needed, without importing the package's init module; the classes of
+such packages must therefore not depend on initialize() having been
+called. A manifest is written by write_manifest() or by running
+scripts/generate_registry_manifest.py.
+
+"""
+
+import cPickle
+import json
+import os
+import tempfile
+
+from vistrails.core import debug, system
+from vistrails.core.configuration import get_vistrails_configuration
+
+SNAPSHOT_FORMAT_VERSION = 2
+MANIFEST_FILENAME = 'registry_manifest.json'
+
+def snapshots_enabled():
+    """snapshots_enabled() -> bool
+
+    Returns whether the registry should use snapshots, according to
+    the configuration.
+
+    """
+    try:
+        return bool(get_vistrails_configuration().check('registrySnapshot'))
+    except AttributeError:
+        # no application
+        return False
+
+def get_snapshot_directory():
+    """get_snapshot_directory() -> str
+
+    Returns the directory where the snapshots are stored, creating it
+    if necessary. Returns None if it isn't configured.
+
+    """
+    directory = system.get_vistrails_directory('registrySnapshotDir')
+    if directory is not None and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            debug.warning("Could not create registry snapshot directory",
+                          e)
+            return None
+    return directory
+
+def can_snapshot(package):
+    """can_snapshot(package: Package) -> bool
+
+    Returns whether package can be restored from a snapshot. Packages
+    with subworkflows are excluded, as are packages that set
+    registry_snapshot to False.
+
+    """
+    module = package.module
+    if module is None or package.package_dir is None:
+        return False
+    if not getattr(module, 'registry_snapshot', True):
+        return False
+    return not hasattr(module, '_subworkflows')
+
+def package_code_mtime(package):
+    """package_code_mtime(package: Package) -> float
+
+    Returns the most recent modification time of the python files of
+    package.
+
+    """
+    mtime = 0.0
+    if package.package_dir is None:
+        return mtime
+    for dirpath, dirnames, filenames in os.walk(package.package_dir):
+        for filename in filenames:
+            if filename.endswith('.py'):
+                mtime = max(mtime,
+                            os.path.getmtime(os.path.join(dirpath,
+                                                          filename)))
+    return mtime
+
+def get_snapshot_key(package):
+    """get_snapshot_key(package: Package) -> tuple
+
+    Returns the key that a snapshot must match to be used for package.
+
+    """
+    token = None
+    token_f = getattr(package.module, 'registry_snapshot_token', None)
+    if token_f is not None:
+        token = token_f()
+    dependencies = sorted(str(dep) for dep in package.dependencies())
+    return (SNAPSHOT_FORMAT_VERSION,
+            system.vistrails_version(),
+            package.identifier,
+            package.version,
+            package.codepath,
+            package_code_mtime(package),
+            token,
+            dependencies)
+
+def get_snapshot_filename(package, directory):
+    name = '%s-%s.snapshot' % (package.identifier, package.version)
+    name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+    return os.path.join(directory, name)
+
+def read_snapshot(package, directory=None):
+    """read_snapshot(package: Package, directory: str) -> dict
+
+    Returns the snapshot of package if there is one that matches its
+    current key, else None.
+
+    """
+    if directory is None:
+        directory = get_snapshot_directory()
+        if directory is None:
+            return None
+    filename = get_snapshot_filename(package, directory)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            key = cPickle.load(f)
+            if key != get_snapshot_key(package):
+                debug.log("Registry snapshot of package %s is out of date" %
+                          package.codepath)
+                return None
+            return cPickle.load(f)
+    except Exception, e:
+        debug.warning("Could not read registry snapshot %s" % filename, e)
+        return None
+
+def write_snapshot(package, snapshot, directory=None):
+    """write_snapshot(package: Package, snapshot: dict,
+                      directory: str) -> None
+
+    Saves the snapshot of package (see
+    ModuleRegistry.get_package_snapshot) along with its current key.
+
+    """
+    if directory is None:
+        directory = get_snapshot_directory()
+        if directory is None:
+            return
+    filename = get_snapshot_filename(package, directory)
+    # write to a temporary file first so that concurrent sessions never
+    # see a partial snapshot
+    fd, tmp_filename = tempfile.mkstemp(prefix='snapshot_', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            cPickle.dump(get_snapshot_key(package), f,
+                         cPickle.HIGHEST_PROTOCOL)
+            cPickle.dump(snapshot, f, cPickle.HIGHEST_PROTOCOL)
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+    except Exception:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+def remove_snapshot(package, directory=None):
+    """remove_snapshot(package: Package, directory: str) -> None
+
+    Deletes the snapshot of package, if any.
+
+    """
+    if directory is None:
+        directory = get_snapshot_directory()
+        if directory is None:
+            return
+    filename = get_snapshot_filename(package, directory)
+    if os.path.exists(filename):
+        try:
+            os.remove(filename)
+        except OSError, e:
+            debug.warning("Could not remove registry snapshot %s" % filename,
+                          e)
+
+def get_manifest_filename(package):
+    if package.package_dir is None:
+        return None
+    return os.path.join(package.package_dir, MANIFEST_FILENAME)
+
+def _from_json(obj):
+    if isinstance(obj, unicode):
+        return obj.encode('utf-8')
+    elif isinstance(obj, list):
+        return [_from_json(o) for o in obj]
+    elif isinstance(obj, dict):
+        return dict((_from_json(k), _from_json(v))
+                    for k, v in obj.iteritems())
+    return obj
+
+def read_manifest(package):
+    """read_manifest(package: Package) -> dict
+
+    Returns the content of the manifest shipped with package, in the
+    format of a snapshot, or None if there is no manifest that matches
+    the package.
+
+    """
+    filename = get_manifest_filename(package)
+    if filename is None or not os.path.isfile(filename):
+        return None
+    try:
+        with open(filename, 'rb') as f:
+            manifest = _from_json(json.load(f))
+    except Exception, e:
+        debug.warning("Could not read registry manifest %s" % filename, e)
+        return None
+    if (manifest.get('format') != SNAPSHOT_FORMAT_VERSION or
+            manifest.get('identifier') != package.identifier or
+            manifest.get('version') != package.version):
+        debug.warning("Registry manifest %s does not match package %s "
+                      "(version %s), ignoring it" % (
+                      filename, package.identifier, package.version))
+        return None
+
+    # JSON has no tuples
+    manifest['constant_hashers'] = [tuple(k)
+                                    for k in manifest['constant_hashers']]
+    for d in manifest['descriptors']:
+        if d['color'] is not None:
+            d['color'] = tuple(d['color'])
+        if d['fringe'] is not None:
+            d['fringe'] = [[tuple(v) for v in fringe]
+                           for fringe in d['fringe']]
+        if isinstance(d['configure_widget'], list):
+            d['configure_widget'] = tuple(d['configure_widget'])
+        for spec_d in d['port_specs']:
+            if isinstance(spec_d['shape'], list):
+                spec_d['shape'] = [tuple(v) for v in spec_d['shape']]
+    return manifest
+
+def write_manifest(package, snapshot, filename=None):
+    """write_manifest(package: Package, snapshot: dict,
+                      filename: str) -> None
+
+    Writes snapshot (see ModuleRegistry.get_package_snapshot) as the
+    manifest of package. filename defaults to the manifest file in
+    the package directory.
+
+    """
+    if filename is None:
+        filename = get_manifest_filename(package)
+    manifest = dict(snapshot)
+    manifest['format'] = SNAPSHOT_FORMAT_VERSION
+    manifest['identifier'] = package.identifier
+    manifest['version'] = package.version
+    with open(filename, 'wb') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+##############################################################################
+
+import shutil
+import sys
+import unittest
+
+class TestRegistrySnapshot(unittest.TestCase):
+    def setUp(self):
+        conf = get_vistrails_configuration()
+        self.old_values = (conf.check('registrySnapshot'),
+                           conf.registrySnapshotDir)
+        self.directory = tempfile.mkdtemp(prefix='vt_snapshot_')
+        conf.registrySnapshot = True
+        conf.registrySnapshotDir = self.directory
+
+    def tearDown(self):
+        conf = get_vistrails_configuration()
+        conf.registrySnapshot, conf.registrySnapshotDir = self.old_values
+        shutil.rmtree(self.directory)
+
+    def test_restore_lazy(self):
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.core.packagemanager import get_package_manager
+
+        identifier = 'org.vistrails.vistrails.tests.upgrade'
+        pm = get_package_manager()
+        reg = get_module_registry()
+
+        pm.late_enable_package('upgrades',
+                               {'upgrades': 'vistrails.tests.resources.'})
+        try:
+            package = reg.get_package_by_name(identifier)
+            self.assertFalse(package.is_lazy())
+            d = reg.get_descriptor_by_name(identifier, 'TestUpgradeA')
+            specs = sorted(d.port_specs.keys())
+            self.assertIsNotNone(read_snapshot(package))
+        finally:
+            pm.late_disable_package('upgrades')
+
+        pm.late_enable_package('upgrades',
+                               {'upgrades': 'vistrails.tests.resources.'})
+        try:
+            package = reg.get_package_by_name(identifier)
+            self.assertTrue(package.is_lazy())
+            d = reg.get_descriptor_by_name(identifier, 'TestUpgradeA')
+            self.assertFalse(d.is_module_loaded())
+            self.assertEqual(sorted(d.port_specs.keys()), specs)
+
+            # accessing the module class imports the package
+            self.assertEqual(d.module.__name__, 'TestUpgradeA')
+            self.assertFalse(package.is_lazy())
+            self.assertIs(reg.get_descriptor(d.module), d)
+            self.assertEqual(sorted(d.port_specs.keys()), specs)
+        finally:
+            pm.late_disable_package('upgrades')
+
+    def test_stale_snapshot(self):
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.core.packagemanager import get_package_manager
+
+        identifier = 'org.vistrails.vistrails.tests.upgrade'
+        pm = get_package_manager()
+        reg = get_module_registry()
+
+        pm.late_enable_package('upgrades',
+                               {'upgrades': 'vistrails.tests.resources.'})
+        try:
+            package = reg.get_package_by_name(identifier)
+            filename = get_snapshot_filename(package, self.directory)
+            # change the key of the stored snapshot
+            with open(filename, 'rb') as f:
+                key = cPickle.load(f)
+                snapshot = cPickle.load(f)
+            with open(filename, 'wb') as f:
+                cPickle.dump(key[:-1] + (['missing.package'],), f)
+                cPickle.dump(snapshot, f)
+            self.assertIsNone(read_snapshot(package))
+        finally:
+            pm.late_disable_package('upgrades')
+
+        pm.late_enable_package('upgrades',
+                               {'upgrades': 'vistrails.tests.resources.'})
+        try:
+            package = reg.get_package_by_name(identifier)
+            self.assertFalse(package.is_lazy())
+            self.assertIsNotNone(read_snapshot(package))
+        finally:
+            pm.late_disable_package('upgrades')
+
+    def test_manifest(self):
+        from vistrails.core.modules.module_registry import get_module_registry
+        from vistrails.core.packagemanager import get_package_manager
+
+        identifier = 'org.vistrails.vistrails.tests.upgrade'
+        pm = get_package_manager()
+        reg = get_module_registry()
+
+        # The manifest goes in the package's directory, so this uses a copy
+        # of the package instead of writing to the source tree; it gets its
+        # own codepath since the package manager remembers the prefix
+        packages_dir = os.path.join(self.directory, 'packages')
+        shutil.copytree(os.path.join(system.vistrails_root_directory(),
+                                     'tests', 'resources', 'upgrades'),
+                        os.path.join(packages_dir, 'manifest_upgrades'),
+                        ignore=shutil.ignore_patterns('*.pyc'))
+        sys.path.insert(0, packages_dir)
+        self.addCleanup(sys.path.remove, packages_dir)
+        prefix_dictionary = {'manifest_upgrades': ''}
+
+        conf = get_vistrails_configuration()
+        conf.registrySnapshot = False
+        pm.late_enable_package('manifest_upgrades', prefix_dictionary)
+        try:
+            package = reg.get_package_by_name(identifier)
+            self.assertTrue(get_manifest_filename(package).startswith(
+                    packages_dir))
+            write_manifest(package, reg.get_package_snapshot(package))
+            d = reg.get_descriptor_by_name(identifier, 'TestUpgradeA')
+            specs = sorted(d.port_specs.keys())
+        finally:
+            pm.late_disable_package('manifest_upgrades')
+
+        pm.late_enable_package('manifest_upgrades', prefix_dictionary)
+        try:
+            package = reg.get_package_by_name(identifier)
+            self.assertTrue(package.is_lazy())
+            d = reg.get_descriptor_by_name(identifier, 'TestUpgradeA')
+            self.assertFalse(d.is_module_loaded())
+            self.assertEqual(sorted(d.port_specs.keys()), specs)
+
+            # the class is loaded without initializing the package
+            self.assertEqual(d.module.__name__, 'TestUpgradeA')
+            self.assertTrue(package.is_lazy())
+            self.assertIs(reg.get_descriptor(d.module), d)
+            d2 = reg.get_descriptor_by_name(identifier, 'TestUpgradeB')
+            self.assertFalse(d2.is_module_loaded())
+
+            package.materialize()
+            self.assertFalse(package.is_lazy())
+            self.assertIs(reg.get_descriptor(d.module), d)
+            self.assertEqual(d2.module.__name__, 'TestUpgradeB')
+            self.assertEqual(sorted(d.port_specs.keys()), specs)
+        finally:
+            pm.late_disable_package('manifest_upgrades')
@@ -197,6 +197,9 @@ class Group(Module):
         for arg in module_info_args:
             if arg in self.moduleInfo:
                 kwargs[arg] = self.moduleInfo[arg]
+        profiler = getattr(self.logging, 'profiler', None)
+        if profiler is not None:
+            kwargs['profiler'] = profiler
 
         res = self.interpreter.execute_pipeline(self.pipeline,
                                                 *res[:2],
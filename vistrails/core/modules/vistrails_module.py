@@ -34,6 +34,7 @@
 ###############################################################################
 from base64 import b16encode, b16decode
 
+import collections
 import copy
 import json
 import time
@@ -591,10 +592,13 @@ class Module(Serializable):
             return self.control_params[ModuleControlParam.LOOP_KEY]
         return default
 
-    def compute_all(self):
+    def compute_all(self, run_jobs=None):
         """This method executes the module once for each input.
            Similarly to controlflow's fold.
 
+           Modules that can run the iterations of a list of depth 1
+           concurrently pass run_jobs, see compute_all_jobs().
+
         """
         from vistrails.core.modules.sub_module import InputPort
         if isinstance(self, InputPort):
@@ -623,6 +627,9 @@ class Module(Serializable):
         elements, port_names = self.do_combine(combine_type, inputs, port_names)
         num_inputs = len(elements)
         loop = self.logging.begin_loop_execution(self, num_inputs)
+        if run_jobs is not None and self.list_depth == 1:
+            self.compute_all_jobs(run_jobs, loop, port_names, elements)
+            return
         ## Update everything for each value inside the list
         outputs = {}
         module = copy.copy(self)
@@ -673,6 +680,52 @@ class Module(Serializable):
             self.set_output(nameOutput, outputs[nameOutput])
         loop.end_loop_execution()
 
+    def compute_all_jobs(self, run_jobs, loop, port_names, elements):
+        """compute_all_jobs(run_jobs: callable, loop: LoopLogController,
+                            port_names: list, elements: list) -> None
+        Sets the outputs of compute_all() from jobs run by run_jobs.
+
+        run_jobs(modules, num_inputs) gets an iterator over copies of this
+        module, one per element, with the element's inputs set; they are
+        created as the iterator is consumed, so that the jobs don't need
+        to be prepared all at once. It must be a generator that yields, in
+        the same order, a function setting the outputs of the
+        corresponding module, which is called inside its iteration.
+
+        """
+        num_inputs = len(elements)
+        module = copy.copy(self)
+        module.list_depth = 0
+        prepared = collections.deque()
+        def modules():
+            for i in xrange(num_inputs):
+                element_module = copy.copy(module)
+                element_module.setInputValues(element_module, port_names,
+                                              elements[i], i)
+                prepared.append(element_module)
+                yield element_module
+
+        outputs = {}
+        if num_inputs:
+            module.typeChecking(module, port_names, elements)
+            jobs = run_jobs(modules(), num_inputs)
+            try:
+                for i, finish in enumerate(jobs):
+                    self.logging.update_progress(self, float(i)/num_inputs)
+                    element_module = prepared.popleft()
+                    loop.begin_iteration(element_module, i)
+                    finish()
+                    loop.end_iteration(element_module)
+                    for nameOutput in element_module.outputPorts:
+                        outputs.setdefault(nameOutput, []).append(
+                                element_module.get_output(nameOutput))
+            finally:
+                # lets the executor wait for the jobs that are still running
+                jobs.close()
+        for nameOutput in outputs:
+            self.set_output(nameOutput, outputs[nameOutput])
+        loop.end_loop_execution()
+
     def build_stream(self):
         """Determines and builds correct generator type.
 
@@ -726,7 +779,7 @@ class Module(Serializable):
                                   self.iterated_ports])
 
                 elements = [iter_dict[port][1].next() for port in ports]
-                if None in elements:
+                if any(e is None for e in elements):
                     for name_output in module.outputPorts:
                         module.set_output(name_output, None)
                     if suspended:
@@ -797,7 +850,7 @@ class Module(Serializable):
             i = 0
             while 1:
                 elements = [self.streamed_ports[port].next() for port in ports]
-                if None in elements:
+                if any(e is None for e in elements):
                     self.logging.begin_compute(module)
                     # assembled all inputs so do the actual computation
                     elements = [inputs[port] for port in ports]
@@ -861,7 +914,7 @@ class Module(Serializable):
                 module.set_output(name_output, None)
             while 1:
                 elements = [self.streamed_ports[port].next() for port in ports]
-                if None not in elements:
+                if all(e is not None for e in elements):
                     self.logging.begin_compute(module)
                     ## Type checking
                     module.typeChecking(module, ports, [elements])
@@ -1419,7 +1472,7 @@ class Module(Serializable):
             userGenerator = UserGenerator(module)
             while 1:
                 elements = [self.streamed_ports[port].next() for port in ports]
-                if None in elements:
+                if any(e is None for e in elements):
                     self.logging.update_progress(self, 1.0)
                     self.logging.end_update(module)
                     for name_output in module.outputPorts:
@@ -84,7 +84,7 @@ class ParameterExploration(object):
         result = []
         for step in xrange(stepCount):
             for pipeline in pipelineList:
-                newp = copy.copy(pipeline)
+                newp = pipeline.snapshot()
                 for interp in interpList:
                     interp.perform(newp, step)
                 result.append(newp)
@@ -160,7 +160,7 @@ class InterpolateDiscreteParam(object):
         pipeline
 
         """
-        m = pipeline.modules[self.module.id]
+        m = pipeline.get_module_for_update(self.module.id)
         f = ModuleFunction()
         f.name = self.function
         f.returnType = 'void'
@@ -224,7 +224,7 @@ class ActionBasedParameterExploration(object):
                 exploreDimension(pipeline, performedActions, dim-1)
                 return
             for actionSet in currentActions:
-                currentPipeline = copy.copy(pipeline)
+                currentPipeline = pipeline.snapshot()
                 currentPeformedActions = copy.copy(performedActions)
                 for action in actionSet:
                     currentPipeline.perform_action(action)
@@ -232,7 +232,7 @@ class ActionBasedParameterExploration(object):
                 exploreDimension(currentPipeline, currentPeformedActions, dim-1)
         
         # perform pre_actions
-        currentPipeline = copy.copy(pipeline)
+        currentPipeline = pipeline.snapshot()
         for action in pre_actions:
             currentPipeline.perform_action(action)
         
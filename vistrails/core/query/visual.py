@@ -43,6 +43,7 @@ import re
 class VisualQuery(query.Query):
 
     def __init__(self, pipeline, versions_to_check):
+        # not a snapshot: the query canvas changes its modules in place
         self.queryPipeline = copy.copy(pipeline)
         self.versions_to_check = versions_to_check
 
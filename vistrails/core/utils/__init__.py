@@ -44,6 +44,7 @@ from vistrails.core.utils.timemethod import time_method, time_call
 from vistrails.core.utils.tracemethod import trace_method, bump_trace, report_stack, \
      trace_method_options, trace_method_args
 from vistrails.core.utils.color import ColorByName
+import collections
 import copy
 from distutils.version import LooseVersion
 import errno
@@ -576,6 +577,30 @@ def long2bytes(nb, length=None):
         result += '\x00' * (length - len(result))
     return result
 
+def imap_window(pool, func, jobs, window):
+    """imap_window(pool: Pool, func: callable, jobs: iterable,
+                   window: int) -> iterator
+    Runs func(args) in the pool for each (item, args) pair of jobs and
+    yields the (item, result) pairs in the order of jobs.
+
+    Unlike pool.imap(), jobs is only consumed as the results come back,
+    so that no more than window of them are pending at once. Jobs whose
+    args are None are not sent to the pool and give None.
+
+    """
+    pending = collections.deque()
+    for item, args in jobs:
+        if args is None:
+            pending.append((item, None))
+        else:
+            pending.append((item, pool.apply_async(func, (args,))))
+        while len(pending) >= window:
+            item, result = pending.popleft()
+            yield item, result.get() if result is not None else None
+    while pending:
+        item, result = pending.popleft()
+        yield item, result.get() if result is not None else None
+
 ################################################################################
 
 class Chdir(object):
@@ -679,6 +704,26 @@ class TestCommon(unittest.TestCase):
         #and after deletion the reference is dead
         self.assertEquals(cf(), None)
         
+    def test_imap_window(self):
+        from multiprocessing.pool import ThreadPool
+        taken = []
+        def jobs():
+            for i in xrange(10):
+                taken.append(i)
+                yield i, (None if i == 3 else i)
+        pool = ThreadPool(2)
+        try:
+            results = []
+            for item, result in imap_window(pool, lambda x: x * 2, jobs(), 2):
+                # never more than 2 jobs ahead of the results
+                self.assertLessEqual(len(taken), item + 2)
+                results.append((item, result))
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, [(i, None if i == 3 else i * 2)
+                                   for i in xrange(10)])
+
     def test_chdir(self):
         def raise_exception():
             with Chdir(tempfile.gettempdir()):
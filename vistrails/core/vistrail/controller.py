@@ -52,6 +52,8 @@ from vistrails.core.layout.workflow_layout import WorkflowLayout, \
     Pipeline as LayoutPipeline, Defaults as LayoutDefaults
 from vistrails.core.log.controller import LogController, DummyLogController
 from vistrails.core.log.log import Log
+from vistrails.core.log.sink import open_log_sink
+from vistrails.core.log.store import ProvenanceStore
 from vistrails.core.modules.abstraction import identifier as abstraction_pkg, \
     version as abstraction_ver
 from vistrails.core.modules.basic_modules import identifier as basic_pkg
@@ -177,6 +179,11 @@ class VistrailController(object):
         # when writing the vistrail
         self._mashups = []
 
+        # sink the execution log is streamed to, see get_log_sink()
+        self._log_sink = None
+        # store the execution log is recorded in, see get_log_store()
+        self._log_store = None
+
         # the redo stack stores the undone action ids 
         # (undo is automatic with us, through the version tree)
         self.redo_stack = []
@@ -215,9 +222,48 @@ class VistrailController(object):
             
     def get_logger(self):
         if self.logging_on():
-            return LogController(self.log)
+            return LogController(self.log, sink=self.get_log_sink(),
+                                 store=self.get_log_store())
         else:
             return DummyLogController
+
+    def get_log_sink(self):
+        """get_log_sink() -> LogSink
+        Returns the sink the execution log is streamed to, if the
+        executionLogStream option is set, else None.
+
+        """
+        filename = get_vistrails_configuration().check('executionLogStream')
+        if not filename:
+            return None
+        if self._log_sink is None or self._log_sink.filename != filename:
+            self.close_log_sink()
+            self._log_sink = open_log_sink(filename)
+        return self._log_sink
+
+    def close_log_sink(self):
+        if self._log_sink is not None:
+            self._log_sink.close()
+            self._log_sink = None
+
+    def get_log_store(self):
+        """get_log_store() -> ProvenanceStore
+        Returns the store the execution log is recorded in, if the
+        executionLogStore option is set, else None.
+
+        """
+        filename = get_vistrails_configuration().check('executionLogStore')
+        if not filename:
+            return None
+        if self._log_store is None or self._log_store.database != filename:
+            self.close_log_store()
+            self._log_store = ProvenanceStore(filename)
+        return self._log_store
+
+    def close_log_store(self):
+        if self._log_store is not None:
+            self._log_store.close()
+            self._log_store = None
         
     def get_locator(self):
         return self.locator
@@ -229,6 +275,8 @@ class VistrailController(object):
         self.id_scope = id_scope
         self.current_session = -1
         self.log = Log()
+        # the ids of the new log would collide with the streamed ones
+        self.close_log_sink()
         if self.vistrail is not None:
             self.id_scope = self.vistrail.idScope
             self.current_session = self.vistrail.idScope.getNewId("session")
@@ -263,7 +311,8 @@ class VistrailController(object):
             locator.close()
 
     def cleanup(self):
-        pass
+        self.close_log_sink()
+        self.close_log_store()
 
     def set_id_scope(self, id_scope):
         self.id_scope = id_scope
@@ -2580,8 +2629,13 @@ class VistrailController(object):
     ##########################################################################
     # Workflow Execution
     
-    def execute_workflow_list(self, vistrails):
-        """execute_workflow_list(vistrails: list) -> (results, bool)"""
+    def execute_workflow_list(self, vistrails, profiler=None, prepared=False):
+        """execute_workflow_list(vistrails: list,
+                                 profiler: ExecutionProfiler,
+                                 prepared: bool)
+                                 -> (results, bool)
+        prepared is passed to the interpreter: the pipelines are already
+        validated and their signatures are up to date."""
 
         stop_on_error = getattr(get_vistrails_configuration(),
                                 'stopOnError')
@@ -2611,6 +2665,10 @@ class VistrailController(object):
                       'extra_info': extra_info,
                       'stop_on_error': stop_on_error,
                       }    
+            if profiler is not None:
+                kwargs['profiler'] = profiler
+            if prepared:
+                kwargs['prepared'] = True
             if self.get_vistrail_variables():
                 kwargs['vistrail_variables'] = \
                     self.get_vistrail_variable_by_uuid
@@ -2679,10 +2737,14 @@ class VistrailController(object):
     
     def execute_current_workflow(self, custom_aliases=None, custom_params=None,
                                  extra_info=None, reason='Pipeline Execution',
-                                 sinks=None):
+                                 sinks=None, profiler=None, view=None,
+                                 prepared=False):
         """ execute_current_workflow(custom_aliases: dict, 
                                      custom_params: list,
-                                     extra_info: dict) -> (list, bool)
+                                     extra_info: dict,
+                                     profiler: ExecutionProfiler,
+                                     view: DummyView,
+                                     prepared: bool) -> (list, bool)
         Execute the current workflow (if exists)
         custom_params is a list of tuples (vttype, oId, newval) with new values
         for parameters
@@ -2691,6 +2753,11 @@ class VistrailController(object):
         specific to each pipeline through extra_info
         As, an example, this will be useful for telling the spreadsheet where
         to dump the images.
+        profiler, if given, records statistics about each module execution.
+        view, if given, receives the execution updates instead of a
+        DummyView.
+        prepared means the current pipeline is already validated and its
+        signatures are up to date, see Pipeline.invalidate_signatures().
         """
         self.flush_delayed_actions()
         if self.current_pipeline:
@@ -2699,7 +2766,8 @@ class VistrailController(object):
                 locator.clean_temporaries()
                 if self._auto_save:
                     locator.save_temporary(self.vistrail)
-            view = DummyView()
+            if view is None:
+                view = DummyView()
             try:
                 return self.execute_workflow_list([(self.locator,
                                                     self.current_version,
@@ -2709,7 +2777,9 @@ class VistrailController(object):
                                                     custom_params,
                                                     reason,
                                                     sinks,
-                                                    extra_info)])
+                                                    extra_info)],
+                                                  profiler=profiler,
+                                                  prepared=prepared)
             except Exception, e:
                 debug.unexpected_exception(e)
                 raise
@@ -3810,6 +3880,7 @@ class VistrailController(object):
  
     def write_registry(self, locator):
         registry = vistrails.core.modules.module_registry.get_module_registry()
+        registry.load_all_ports()
         save_bundle = SaveBundle(registry.vtType, registry=registry)
         locator.save_as(save_bundle)
 
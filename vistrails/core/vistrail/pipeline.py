@@ -121,6 +121,29 @@ class CycleInPipeline(Exception):
 
 class Pipeline(DBWorkflow):
     """ A Pipeline is a set of modules and connections between them. """
+
+    # copy-on-write state, see snapshot(). _cow_owned is None for a
+    # pipeline that has never been snapshotted (it owns everything);
+    # otherwise it holds the (type, id) keys of the modules and
+    # connections that are private to this pipeline.
+    _cow_owned = None
+    _cow_shared = False
+    _cow_graph_shared = False
+    _cow_base_owners = None
+    _cow_local_owners = None
+
+    # containers that snapshots share until the first write
+    _cow_containers = ['_db_modules', 'db_modules_id_index',
+                       'db_deleted_modules',
+                       '_db_connections', 'db_connections_id_index',
+                       'db_deleted_connections',
+                       '_db_annotations', 'db_annotations_id_index',
+                       'db_deleted_annotations',
+                       '_db_plugin_datas', 'db_plugin_datas_id_index',
+                       'db_deleted_plugin_datas',
+                       '_db_others', 'db_others_id_index',
+                       'db_deleted_others',
+                       'objects']
     
     def __init__(self, *args, **kwargs):
         """ __init__() -> Pipelines
@@ -200,6 +223,166 @@ class Pipeline(DBWorkflow):
         cp.set_defaults(self)
         return cp
 
+    ##########################################################################
+    # Copy-on-write snapshots
+
+    def snapshot(self):
+        """snapshot() -> Pipeline
+        Returns a copy of the pipeline that shares its modules and
+        connections with self. Containers are copied on the first write
+        and a module or connection is only copied when it (or something
+        inside it) is changed through the pipeline API, so a snapshot
+        costs memory in proportion to what is changed in it.
+
+        Both self and the snapshot become copy-on-write; code that
+        changes module objects directly must get them through
+        get_module_for_update().
+
+        """
+        if self._cow_owned is None:
+            # first snapshot: record which module or connection owns
+            # each indexed object, shared by every later snapshot
+            owners = {}
+            for (obj_type, objs) in ((Module.vtType, self._db_modules),
+                                     (Connection.vtType, self._db_connections)):
+                for obj in objs:
+                    key = (obj_type, obj.db_id)
+                    for (child, _, _) in obj.db_children():
+                        owners[self._cow_key(child)] = key
+            self._cow_base_owners = owners
+            self._cow_local_owners = {}
+        self._cow_owned = set()
+        self._cow_shared = True
+        self._cow_graph_shared = True
+
+        cp = Pipeline.__new__(Pipeline)
+        cp.__dict__.update(self.__dict__)
+        cp._cow_owned = set()
+        cp._cow_local_owners = dict(self._cow_local_owners)
+        cp.tmp_id = copy.copy(self.tmp_id)
+        cp.aliases = Bidict(self.aliases)
+        cp._subpipeline_signatures = Bidict()
+        cp._module_signatures = Bidict()
+        cp._connection_signatures = Bidict()
+        return cp
+
+    def _cow_key(self, obj):
+        return (self._vtTypeMap.get(obj.vtType, obj.vtType),
+                obj.getPrimaryKey())
+
+    def _cow_detach(self):
+        """_cow_detach() -> None
+        Give this pipeline its own copy of the shared containers. Only
+        references are copied."""
+        if self._cow_shared:
+            for name in self._cow_containers:
+                value = getattr(self, name)
+                if isinstance(value, list):
+                    setattr(self, name, value[:])
+                else:
+                    setattr(self, name, dict(value))
+            self.aliases = Bidict(self.aliases)
+            self._cow_shared = False
+
+    def _cow_own_graph(self):
+        if self._cow_graph_shared:
+            self.graph = copy.copy(self.graph)
+            self._cow_graph_shared = False
+
+    def _cow_touch(self, obj_type, obj_id):
+        """_cow_touch(obj_type: str, obj_id: id) -> None
+        Makes the module or connection that holds the given object
+        private to this pipeline, copying it if it is shared."""
+        if self._cow_owned is None:
+            return
+        self._cow_detach()
+        key = (self._vtTypeMap.get(obj_type, obj_type), obj_id)
+        if key[0] in (Module.vtType, Connection.vtType):
+            owner = key
+        else:
+            owner = self._cow_local_owners.get(key,
+                                               self._cow_base_owners.get(key))
+        if owner is None or owner in self._cow_owned:
+            return
+        (owner_type, owner_id) = owner
+        if owner_type == Module.vtType:
+            (objs, index) = (self._db_modules, self.db_modules_id_index)
+        else:
+            (objs, index) = (self._db_connections,
+                             self.db_connections_id_index)
+        if owner_id not in index:
+            return
+        old_obj = index[owner_id]
+        new_obj = copy.copy(old_obj)
+        for (i, obj) in enumerate(objs):
+            if obj is old_obj:
+                objs[i] = new_obj
+                break
+        index[owner_id] = new_obj
+        for (child, _, _) in new_obj.db_children():
+            self.objects[self._cow_key(child)] = child
+        self._cow_owned.add(owner)
+
+    def _cow_prepare(self, parent_obj_type, parent_obj_id, parent_obj):
+        """_cow_prepare(...) -> tuple or None
+        Called before a db_*_object write; returns the key of the
+        parent object if the write happens inside a module or
+        connection."""
+        if self._cow_owned is None:
+            return None
+        self._cow_detach()
+        if parent_obj is not None:
+            if parent_obj is self:
+                return None
+            key = self._cow_key(parent_obj)
+        elif parent_obj_type is None or parent_obj_id is None:
+            return None
+        else:
+            key = (self._vtTypeMap.get(parent_obj_type, parent_obj_type),
+                   parent_obj_id)
+        self._cow_touch(*key)
+        return key
+
+    def get_module_for_update(self, id):
+        """get_module_for_update(id: int) -> Module
+        Returns the module with the given id, making sure it is not
+        shared with a snapshot so it can be changed in place.
+
+        """
+        self._cow_touch(Module.vtType, id)
+        return self.modules[id]
+
+    def db_add_object(self, object, parent_obj_type=None,
+                      parent_obj_id=None, parent_obj=None):
+        parent_key = self._cow_prepare(parent_obj_type, parent_obj_id,
+                                       parent_obj)
+        DBWorkflow.db_add_object(self, object, parent_obj_type,
+                                 parent_obj_id, parent_obj)
+        if self._cow_owned is not None:
+            key = self._cow_key(object)
+            if parent_key is None:
+                if key[0] in (Module.vtType, Connection.vtType):
+                    self._cow_owned.add(key)
+            else:
+                if parent_key[0] in (Module.vtType, Connection.vtType):
+                    owner = parent_key
+                else:
+                    owner = self._cow_local_owners.get(
+                        parent_key, self._cow_base_owners.get(parent_key))
+                self._cow_local_owners[key] = owner
+
+    def db_change_object(self, old_id, object, parent_obj_type=None,
+                         parent_obj_id=None, parent_obj=None):
+        self._cow_prepare(parent_obj_type, parent_obj_id, parent_obj)
+        DBWorkflow.db_change_object(self, old_id, object, parent_obj_type,
+                                    parent_obj_id, parent_obj)
+
+    def db_delete_object(self, obj_id, obj_type, parent_obj_type=None,
+                         parent_obj_id=None, parent_obj=None):
+        self._cow_prepare(parent_obj_type, parent_obj_id, parent_obj)
+        DBWorkflow.db_delete_object(self, obj_id, obj_type, parent_obj_type,
+                                    parent_obj_id, parent_obj)
+
     @staticmethod
     def convert(_workflow):
         if _workflow.__class__ == Pipeline:
@@ -260,6 +443,7 @@ class Pipeline(DBWorkflow):
 
     def clear(self):
         """clear() -> None. Erases pipeline contents."""
+        self._cow_detach()
         if hasattr(self, 'db_modules'):
             for module in self.db_modules:
                 self.db_delete_module(module)
@@ -414,12 +598,14 @@ class Pipeline(DBWorkflow):
 #         if m.vtType == Abstraction.vtType:
 #             m.abstraction = self.abstraction_map[m.abstraction_id]
         self.db_add_object(m)
+        self._cow_own_graph()
         self.graph.add_vertex(m.id)
 
     def change_module(self, old_id, m, *args):
         if not self.has_module_with_id(old_id):
             raise VistrailsInternalError("module %s doesn't exist" % old_id)
         self.db_change_object(old_id, m)
+        self._cow_own_graph()
         self.graph.delete_vertex(old_id)
         self.graph.add_vertex(m.id)
 
@@ -439,6 +625,7 @@ class Pipeline(DBWorkflow):
 
         # self.modules.pop(id)
         self.db_delete_object(id, Module.vtType)
+        self._cow_own_graph()
         self.graph.delete_vertex(id)
         if id in self._module_signatures:
             del self._module_signatures[id]
@@ -456,6 +643,9 @@ class Pipeline(DBWorkflow):
         self.db_add_object(c)
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)        
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, c.sourceId)
+            self._cow_touch(Module.vtType, c.destinationId)
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
             self.ensure_connection_specs([c.id])
 
@@ -481,6 +671,9 @@ class Pipeline(DBWorkflow):
 
         old_conn = self.connections[old_id]
         if old_conn.source is not None and old_conn.destination is not None:
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, old_conn.sourceId)
+            self._cow_touch(Module.vtType, old_conn.destinationId)
             self.graph.delete_edge(old_conn.sourceId, old_conn.destinationId,
                                    old_conn.id)
             if self.graph.out_degree(old_conn.sourceId) < 1:
@@ -496,6 +689,9 @@ class Pipeline(DBWorkflow):
         self.db_change_object(old_id, c)        
         if c.source is not None and c.destination is not None:
             assert(c.sourceId != c.destinationId)
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, c.sourceId)
+            self._cow_touch(Module.vtType, c.destinationId)
             self.graph.add_edge(c.sourceId, c.destinationId, c.id)
             self.ensure_connection_specs([c.id])
             self.modules[c.sourceId].connected_output_ports.add(c.source.name)
@@ -516,6 +712,9 @@ class Pipeline(DBWorkflow):
         if conn.source is not None and conn.destination is not None and \
                 (conn.destinationId, conn.id) in \
                 self.graph.edges_from(conn.sourceId):
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, conn.sourceId)
+            self._cow_touch(Module.vtType, conn.destinationId)
             self.graph.delete_edge(conn.sourceId, conn.destinationId, conn.id)
 
             c = conn
@@ -564,6 +763,9 @@ class Pipeline(DBWorkflow):
         connection = self.connections[parent_id]
         if connection.source is not None and \
                 connection.destination is not None:
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, connection.sourceId)
+            self._cow_touch(Module.vtType, connection.destinationId)
             self.graph.add_edge(connection.sourceId, 
                                 connection.destinationId, 
                                 connection.id)
@@ -581,8 +783,12 @@ class Pipeline(DBWorkflow):
             input_ports[dest_name] += 1
 
     def delete_port(self, port_id, port_type, parent_type, parent_id):
+        self._cow_touch(Connection.vtType, parent_id)
         conn = self.connections[parent_id]
         if len(conn.ports) >= 2:
+            self._cow_own_graph()
+            self._cow_touch(Module.vtType, conn.sourceId)
+            self._cow_touch(Module.vtType, conn.destinationId)
             self.graph.delete_edge(conn.sourceId, 
                                    conn.destinationId, 
                                    conn.id)
@@ -598,6 +804,8 @@ class Pipeline(DBWorkflow):
         self.db_delete_object(port_id, Port.vtType, parent_type, parent_id)
 
     def change_port(self, old_port_id, port, parent_type, parent_id):
+        self._cow_touch(Connection.vtType, parent_id)
+        self._cow_own_graph()
         connection = self.connections[parent_id]
         if len(connection.ports) >= 2:
             source_list = self.graph.adjacency_list[connection.sourceId]
@@ -614,6 +822,7 @@ class Pipeline(DBWorkflow):
             dest_list.append((connection.sourceId, connection.id))
 
     def add_port_to_registry(self, portSpec, moduleId):
+        self._cow_touch(Module.vtType, moduleId)
         m = self.get_module_by_id(moduleId)
         m.add_port_spec(portSpec)
 
@@ -622,6 +831,7 @@ class Pipeline(DBWorkflow):
         self.add_port_to_registry(port_spec, parent_id)
         
     def delete_port_from_registry(self, id, moduleId):
+        self._cow_touch(Module.vtType, moduleId)
         m = self.get_module_by_id(moduleId)
         portSpec = m.port_specs[id]
         m.delete_port_spec(portSpec)
@@ -643,6 +853,7 @@ class Pipeline(DBWorkflow):
         """
         if self.has_alias(name):
             raise VistrailsInternalError("duplicate alias")
+        self._cow_detach()
         if mId is not None:
             self.aliases[name] = (type, oId, parentType, parentId, mId)
         else:
@@ -662,12 +873,14 @@ class Pipeline(DBWorkflow):
         """remove_alias_by_name(name: str) -> None
         Remove alias with given name """
         if self.has_alias(name):
+            self._cow_detach()
             del self.aliases[name]
 
     def remove_alias(self, type, oId, parentType, parentId, mId):
         """remove_alias(name: str, type:str, oId: int, parentType: str, 
                         parentId: int, mId: int)-> None
         Remove alias identified by oId """
+        self._cow_detach()
         if mId is not None:
             try:
                 oldname = self.aliases.inverse[(type,oId, parentType, parentId, mId)]
@@ -725,6 +938,7 @@ class Pipeline(DBWorkflow):
         else:
             if what == 'parameter':
                 #FIXME: check if a change parameter action needs to be generated
+                self._cow_touch(what, oId)
                 parameter = self.db_get_object(what, oId)
                 parameter.strValue = str(value)
             else:
@@ -819,28 +1033,41 @@ class Pipeline(DBWorkflow):
 
     # Subpipelines
 
-    def subpipeline_signature(self, module_id, visited_ids=None):
+    def subpipeline_signature(self, module_id):
         """subpipeline_signature(module_id): string
-        Returns the signature for the subpipeline whose sink id is module_id."""
-        if visited_ids is None:
-            visited_ids = set([module_id])
-        elif module_id in visited_ids:
-            raise CycleInPipeline()
+        Returns the signature for the subpipeline whose sink id is module_id.
+
+        Upstream signatures are computed with an explicit stack so deep
+        pipelines do not hit the recursion limit."""
+        signatures = self._subpipeline_signatures
         try:
-            return self._subpipeline_signatures[module_id]
+            return signatures[module_id]
         except KeyError:
-            upstream_sigs = [(self.subpipeline_signature(
-                                      m,
-                                      visited_ids | set([module_id])) +
-                              Hasher.connection_signature(
-                                      self.connections[edge_id]))
-                             for (m, edge_id) in
-                             self.graph.edges_to(module_id)]
-            module_sig = self.module_signature(module_id)
-            sig = Hasher.subpipeline_signature(module_sig,
-                                               upstream_sigs)
-            self._subpipeline_signatures[module_id] = sig
-            return sig
+            pass
+        graph = self.graph
+        on_stack = set([module_id])
+        stack = [(module_id, iter(graph.edges_to(module_id)))]
+        while stack:
+            (m, upstream) = stack[-1]
+            for (u, edge_id) in upstream:
+                if u in signatures:
+                    continue
+                if u in on_stack:
+                    raise CycleInPipeline()
+                on_stack.add(u)
+                stack.append((u, iter(graph.edges_to(u))))
+                break
+            else:
+                stack.pop()
+                on_stack.discard(m)
+                upstream_sigs = [(signatures[u] +
+                                  Hasher.connection_signature(
+                                          self.connections[edge_id]))
+                                 for (u, edge_id) in graph.edges_to(m)]
+                module_sig = self.module_signature(m)
+                signatures[m] = Hasher.subpipeline_signature(module_sig,
+                                                             upstream_sigs)
+        return signatures[module_id]
 
     def subpipeline_id_from_signature(self, signature):
         """subpipeline_id_from_signature(sig): int
@@ -887,6 +1114,28 @@ class Pipeline(DBWorkflow):
         for c in self.connections.iterkeys():
             self.connection_signature(c)
 
+    def invalidate_signatures(self, module_ids):
+        """invalidate_signatures(module_ids: iterable) -> None
+        Forgets the signatures that depend on the given modules, e.g. after
+        their parameters were changed in place. compute_signatures() then
+        only recomputes those, instead of everything like
+        refresh_signatures().
+
+        """
+        module_ids = [i for i in module_ids if i in self.modules]
+        if not module_ids:
+            return
+        for i in module_ids:
+            if i in self._module_signatures:
+                del self._module_signatures[i]
+        graph = self.graph
+        for i in graph.compact().reachable(module_ids):
+            if i in self._subpipeline_signatures:
+                del self._subpipeline_signatures[i]
+            for _, conn_id in graph.edges_to(i):
+                if conn_id in self._connection_signatures:
+                    del self._connection_signatures[conn_id]
+
     ##########################################################################
     # Registry-related
 
@@ -1526,6 +1775,101 @@ class TestPipeline(unittest.TestCase):
         self.assertNotEquals(p1, p3)
         self.assertNotEquals(p1.id, p3.id)
 
+    def create_string_pipeline(self):
+        import vistrails.core.db.action
+        basic_pkg = get_vistrails_basic_pkg_id()
+        def module(i):
+            param = ModuleParam(id=i, type='String', val='v%d' % i)
+            func = ModuleFunction(id=i, name='value', parameters=[param])
+            return Module(id=i, package=basic_pkg, name='String',
+                          functions=[func])
+        source = Port(id=0, type='source', moduleId=0, moduleName='String',
+                      name='value', signature='(%s:String)' % basic_pkg)
+        destination = Port(id=1, type='destination', moduleId=1,
+                           moduleName='String', name='value',
+                           signature='(%s:String)' % basic_pkg)
+        c = Connection(id=0, ports=[source, destination])
+        p = Pipeline()
+        p.perform_action(vistrails.core.db.action.create_action(
+                [('add', module(0)), ('add', module(1)), ('add', module(2)),
+                 ('add', c)]))
+        return p
+
+    def change_string(self, p, i, value):
+        import vistrails.core.db.action
+        old_param = p.modules[i].functions[0].params[0]
+        new_param = ModuleParam(id=old_param.real_id + 100, type='String',
+                                val=value)
+        p.perform_action(vistrails.core.db.action.create_action(
+                [('change', old_param, new_param, ModuleFunction.vtType, i)]))
+
+    def test_snapshot(self):
+        p1 = self.create_string_pipeline()
+        p2 = p1.snapshot()
+        self.assertEquals(p1, p2)
+        for i in p1.modules:
+            self.assertIs(p1.modules[i], p2.modules[i])
+
+        # only the changed module is copied
+        self.change_string(p2, 0, 'changed')
+        self.assertEquals(p2.modules[0].functions[0].params[0].strValue,
+                          'changed')
+        self.assertEquals(p1.modules[0].functions[0].params[0].strValue,
+                          'v0')
+        self.assertIsNot(p1.modules[0], p2.modules[0])
+        self.assertIs(p1.modules[1], p2.modules[1])
+        self.assertIs(p1.modules[2], p2.modules[2])
+        self.assertIs(p1.connections[0], p2.connections[0])
+        self.assertIs(p1.graph, p2.graph)
+
+        # changes to the original do not show up in the snapshot
+        p1.delete_connection(0)
+        self.assertIsNot(p1.graph, p2.graph)
+        self.assertEquals(p1.graph.out_degree(0), 0)
+        self.assertEquals(p2.graph.out_degree(0), 1)
+        self.assertIn(0, p2.connections)
+        self.assertEquals(p2.modules[1].connected_input_ports['value'], 1)
+        self.assertEquals(p1.modules[1].connected_input_ports['value'], 0)
+
+    def test_snapshot_chain(self):
+        p1 = self.create_string_pipeline()
+        p2 = p1.snapshot()
+        self.change_string(p2, 1, 'p2')
+        p3 = p2.snapshot()
+        self.assertIs(p2.modules[1], p3.modules[1])
+        self.change_string(p3, 1, 'p3')
+        self.change_string(p3, 2, 'p3')
+        self.assertEquals([p.modules[1].functions[0].params[0].strValue
+                           for p in (p1, p2, p3)], ['v1', 'p2', 'p3'])
+        self.assertEquals([p.modules[2].functions[0].params[0].strValue
+                           for p in (p1, p2, p3)], ['v2', 'v2', 'p3'])
+        self.assertIs(p1.modules[0], p3.modules[0])
+        # a regular copy of a snapshot is independent
+        p4 = copy.copy(p3)
+        self.assertEquals(p3, p4)
+        self.assertIsNot(p3.modules[0], p4.modules[0])
+
+    def test_invalidate_signatures(self):
+        p = self.create_string_pipeline()
+        p.compute_signatures()
+        old = dict((i, p.subpipeline_signature(i)) for i in p.modules)
+        old_conn = p.connection_signature(0)
+        p.modules[0].functions[0].params[0].strValue = 'changed'
+        p.invalidate_signatures([0])
+        self.assertNotIn(0, p._subpipeline_signatures)
+        self.assertNotIn(1, p._subpipeline_signatures)
+        self.assertNotIn(0, p._connection_signatures)
+        self.assertEquals(p._subpipeline_signatures[2], old[2])
+        p.compute_signatures()
+        self.assertNotEquals(p.subpipeline_signature(0), old[0])
+        self.assertNotEquals(p.subpipeline_signature(1), old[1])
+        self.assertNotEquals(p.connection_signature(0), old_conn)
+        # same as recomputing everything
+        new = dict((i, p.subpipeline_signature(i)) for i in p.modules)
+        p.refresh_signatures()
+        self.assertEquals(new, dict((i, p.subpipeline_signature(i))
+                                    for i in p.modules))
+
     def test_serialization(self):
         import vistrails.core.db.io
         p1 = self.create_default_pipeline()
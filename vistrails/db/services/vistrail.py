@@ -38,13 +38,15 @@ from vistrails.db.services.action_chain import getActionChain, getCurrentOperati
     getCurrentOperations, simplify_ops
 from vistrails.db import VistrailsDBException
 
+from collections import OrderedDict
 import copy
 import datetime
 import getpass
+import heapq
 
 import unittest
 import vistrails.core.system
-from itertools import chain
+from itertools import chain, izip
 
 def update_id_scope(vistrail):
     if hasattr(vistrail, 'update_id_scope'):
@@ -1004,6 +1006,178 @@ def function_sig(function):
             [(param.db_type, param.db_val)
              for param in function.db_get_parameters()])
 
+class _CandidateIndex(object):
+    """Positions in a list of candidates, indexed by keys.
+
+    The heuristic matching code uses this to find candidates without
+    comparing against every element of the list. Positions are removed
+    once matched and skipped from then on.
+
+    """
+    def __init__(self, keys_list):
+        """__init__(keys_list: list) -> None
+
+        keys_list has one list of (hashable) keys per position.
+
+        """
+        self.removed = [False] * len(keys_list)
+        self._end = len(keys_list)
+        self._index = {}
+        self._start = {}
+        for pos, keys in enumerate(keys_list):
+            for key in keys:
+                self._index.setdefault(key, []).append(pos)
+
+    def _iter_key(self, key):
+        positions = self._index.get(key)
+        if not positions:
+            return iter(())
+        start = self._start.get(key, 0)
+        while start < len(positions) and self.removed[positions[start]]:
+            start += 1
+        self._start[key] = start
+        return (positions[i] for i in xrange(start, len(positions)))
+
+    def candidates(self, *keys):
+        """candidates(*keys) -> iterator
+
+        Yields the remaining positions listed under any of the keys, in
+        increasing order.
+
+        """
+        if len(keys) == 1:
+            positions = self._iter_key(keys[0])
+        else:
+            positions = heapq.merge(*[self._iter_key(key) for key in keys])
+        last = None
+        for pos in positions:
+            if pos != last and not self.removed[pos]:
+                yield pos
+            last = pos
+
+    def first(self, key):
+        for pos in self.candidates(key):
+            return pos
+        return None
+
+    def last(self, key=None):
+        """last(key=None) -> int
+
+        Returns the last remaining position listed under key, or the last
+        remaining position if key is None.
+
+        """
+        if key is None:
+            while self._end > 0 and self.removed[self._end - 1]:
+                self._end -= 1
+            if self._end > 0:
+                return self._end - 1
+            return None
+        positions = self._index.get(key)
+        while positions and self.removed[positions[-1]]:
+            positions.pop()
+        if positions:
+            return positions[-1]
+        return None
+
+    def remove(self, pos):
+        self.removed[pos] = True
+
+    def remaining(self):
+        return [pos for pos, removed in enumerate(self.removed)
+                if not removed]
+
+def _function_key(function):
+    """_function_key(function) -> tuple
+
+    Functions for which heuristicFunctionMatch() returns 1 have the same
+    key.
+
+    """
+    return (function.db_name,
+            tuple(sorted((param.db_type, param.db_val)
+                         for param in function.db_get_parameters())))
+
+def _control_parameter_key(cparam):
+    return (cparam.db_name, cparam.db_value)
+
+def _annotation_key(annotation):
+    return (annotation.db_key, annotation.db_value)
+
+def _module_bucket(module):
+    return (module.db_name, module.db_namespace, module.db_package)
+
+def _module_key(module):
+    """_module_key(module) -> tuple
+
+    Modules for which heuristicModuleMatch() returns 1 have the same key.
+
+    """
+    return (_module_bucket(module),
+            tuple(sorted(_function_key(f)
+                         for f in module.db_get_functions())),
+            tuple(sorted(_control_parameter_key(cp)
+                         for cp in module.db_get_controlParameters())),
+            tuple(sorted(_annotation_key(a)
+                         for a in module.db_get_annotations())))
+
+def _port_keys(port):
+    return [(0, port.db_moduleId),
+            (1, port.db_type, port.db_moduleName, port.sig)]
+
+def _connection_keys(connection):
+    ports = connection.db_get_ports()
+    if not ports:
+        return [(2,)]
+    keys = []
+    for port in ports:
+        keys.extend(_port_keys(port))
+    return keys
+
+def heuristic_match_children(unmatched1, unmatched2, match_func, get_name,
+                             get_key):
+    """heuristic_match_children(unmatched1: list, unmatched2: list,
+                                match_func: callable, get_name: callable,
+                                get_key: callable) -> (list, list, list)
+
+    Pairs up the children (functions, control parameters, annotations) of
+    two modules. Each element of unmatched1 is paired with the first
+    element of unmatched2 that matches exactly (match_func() returns 1).
+    If there is none but an element has the same name, it is paired with
+    the last element of unmatched2, which is the last one the original
+    linear scan compared it to. get_key() has to return the same key for
+    elements that match exactly.
+
+    Returns the pairs that are not exact matches and the unpaired
+    elements of both lists.
+
+    """
+    index = _CandidateIndex([[(0, get_name(c)), (1, get_key(c))]
+                             for c in unmatched2])
+    changed = []
+    remaining1 = []
+    for c1 in unmatched1:
+        match = None
+        for pos in index.candidates((1, get_key(c1))):
+            if match_func(c1, unmatched2[pos]) == 1:
+                match = pos
+                break
+        else:
+            if index.first((0, get_name(c1))) is not None:
+                match = index.last()
+                changed.append((c1, unmatched2[match]))
+        if match is None:
+            remaining1.append(c1)
+        else:
+            # like list.remove(), drop the first element equal to the match
+            c2 = unmatched2[match]
+            for pos in index.candidates((1, get_key(c2))):
+                if unmatched2[pos] == c2:
+                    index.remove(pos)
+                    break
+    remaining2 = [unmatched2[pos] for pos in index.remaining()]
+    return changed, remaining1, remaining2
+
 def getParamChanges(m1, m2, same_vt=True, heuristic_match=True):
     paramChanges = []
     # need to check to see if any children of m1 and m2 are affected
@@ -1034,42 +1208,14 @@ def getParamChanges(m1, m2, same_vt=True, heuristic_match=True):
         m1_unmatched.extend(m1_functions)
         m2_unmatched.extend(m2_functions)
 
-#             functionMatch = True
-#             f1_params = f1.db_get_parameters()
-#             f2_params = f2.db_get_parameters()
-#             for p1 in f1_params:
-#                 if f2.db_get_parameter(p1.db_id) is None:
-#                     functionMatch = False
-#                     m1_unmatched.append(f1)
-#                     break
-#             for p2 in f2_params:
-#                 if f1.db_get_parameter(p2.db_id) is None:
-#                     functionMatch = False
-#                     m2_unmatched.append(f2)
-#                     break
-#             if functionMatch:
-
     if len(m1_unmatched) + len(m2_unmatched) > 0:
         if heuristic_match and len(m1_unmatched) > 0 and len(m2_unmatched) > 0:
             # do heuristic matches
-            for f1 in m1_unmatched[:]:
-                matched = False
-                matchValue = 0
-                for f2 in m2_unmatched:
-                    matchValue = heuristicFunctionMatch(f1, f2)
-                    if matchValue == 1:
-                        # best match so quit
-                        matched = f1
-                        break
-                    elif matchValue == 0:
-                        # match, but not exact so continue to look
-                        matched = f1
-                if matched:
-                    if matchValue != 1:
-                        paramChanges.append((function_sig(f1), 
-                                             function_sig(f2)))
-                    m1_unmatched.remove(f1)
-                    m2_unmatched.remove(f2)
+            changed, m1_unmatched, m2_unmatched = heuristic_match_children(
+                m1_unmatched, m2_unmatched, heuristicFunctionMatch,
+                lambda f: f.db_name, _function_key)
+            for (f1, f2) in changed:
+                paramChanges.append((function_sig(f1), function_sig(f2)))
 
         for f in m1_unmatched:
             paramChanges.append((function_sig(f), (None, None)))
@@ -1109,42 +1255,15 @@ def getCParamChanges(m1, m2, same_vt=True, heuristic_match=True):
         m1_unmatched.extend(m1_cparams)
         m2_unmatched.extend(m2_cparams)
 
-#             functionMatch = True
-#             f1_params = f1.db_get_parameters()
-#             f2_params = f2.db_get_parameters()
-#             for p1 in f1_params:
-#                 if f2.db_get_parameter(p1.db_id) is None:
-#                     functionMatch = False
-#                     m1_unmatched.append(f1)
-#                     break
-#             for p2 in f2_params:
-#                 if f1.db_get_parameter(p2.db_id) is None:
-#                     functionMatch = False
-#                     m2_unmatched.append(f2)
-#                     break
-#             if functionMatch:
-
     if len(m1_unmatched) + len(m2_unmatched) > 0:
         if heuristic_match and len(m1_unmatched) > 0 and len(m2_unmatched) > 0:
             # do heuristic matches
-            for cp1 in m1_unmatched[:]:
-                matched = False
-                matchValue = 0
-                for cp2 in m2_unmatched:
-                    matchValue = heuristicControlParameterMatch(cp1, cp2)
-                    if matchValue == 1:
-                        # best match so quit
-                        matched = cp1
-                        break
-                    elif matchValue == 0:
-                        # match, but not exact so continue to look
-                        matched = cp1
-                if matched:
-                    if matchValue != 1:
-                        cparamChanges.append(((cp1.db_name,cp1.db_value), 
-                                              (cp2.db_name,cp2.db_value)))
-                    m1_unmatched.remove(cp1)
-                    m2_unmatched.remove(cp2)
+            changed, m1_unmatched, m2_unmatched = heuristic_match_children(
+                m1_unmatched, m2_unmatched, heuristicControlParameterMatch,
+                lambda cp: cp.db_name, _control_parameter_key)
+            for (cp1, cp2) in changed:
+                cparamChanges.append(((cp1.db_name,cp1.db_value), 
+                                      (cp2.db_name,cp2.db_value)))
 
         for cp in m1_unmatched:
             cparamChanges.append(((cp.db_name,cp.db_value), (None, None)))
@@ -1183,42 +1302,15 @@ def getAnnotationChanges(m1, m2, same_vt=True, heuristic_match=True):
         m1_unmatched.extend(m1_annots)
         m2_unmatched.extend(m2_annots)
 
-#             functionMatch = True
-#             f1_params = f1.db_get_parameters()
-#             f2_params = f2.db_get_parameters()
-#             for p1 in f1_params:
-#                 if f2.db_get_parameter(p1.db_id) is None:
-#                     functionMatch = False
-#                     m1_unmatched.append(f1)
-#                     break
-#             for p2 in f2_params:
-#                 if f1.db_get_parameter(p2.db_id) is None:
-#                     functionMatch = False
-#                     m2_unmatched.append(f2)
-#                     break
-#             if functionMatch:
-
     if len(m1_unmatched) + len(m2_unmatched) > 0:
         if heuristic_match and len(m1_unmatched) > 0 and len(m2_unmatched) > 0:
             # do heuristic matches
-            for a1 in m1_unmatched[:]:
-                matched = False
-                matchValue = 0
-                for a2 in m2_unmatched:
-                    matchValue = heuristicAnnotationMatch(a1, a2)
-                    if matchValue == 1:
-                        # best match so quit
-                        matched = a1
-                        break
-                    elif matchValue == 0:
-                        # match, but not exact so continue to look
-                        matched = a1
-                if matched:
-                    if matchValue != 1:
-                        annotChanges.append(((a1.db_key,a1.db_value), 
-                                             (a2.db_key,a2.db_value)))
-                    m1_unmatched.remove(a1)
-                    m2_unmatched.remove(a2)
+            changed, m1_unmatched, m2_unmatched = heuristic_match_children(
+                m1_unmatched, m2_unmatched, heuristicAnnotationMatch,
+                lambda a: a.db_key, _annotation_key)
+            for (a1, a2) in changed:
+                annotChanges.append(((a1.db_key,a1.db_value), 
+                                     (a2.db_key,a2.db_value)))
 
         for cp in m1_unmatched:
             annotChanges.append(((cp.db_key,cp.db_value), (None, None)))
@@ -1266,17 +1358,18 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
     performAdds(v2Ops, v2Workflow)
 
     # FIXME connections do not check their ports
-    sharedModuleIds = []
-    sharedConnectionIds = []
+    # ordered sets: membership tests and removals are done for every op
+    sharedModuleIds = OrderedDict()
+    sharedConnectionIds = OrderedDict()
     sharedFunctionIds = {}
     sharedCParameterIds = {}
     sharedAnnotationIds = {}
     for op in sharedOps:
         if op.what == 'module' or op.what == 'abstraction' or \
                 op.what == 'group':
-            sharedModuleIds.append(getNewObjId(op))
+            sharedModuleIds[getNewObjId(op)] = None
         elif op.what == 'connection':
-            sharedConnectionIds.append(getNewObjId(op))
+            sharedConnectionIds[getNewObjId(op)] = None
         elif op.what == 'function':
             sharedFunctionIds[getNewObjId(op)] = op.db_parentObjId
         elif op.what == 'controlParameter':
@@ -1297,7 +1390,7 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                     op.what == 'group':
                 moduleDeleteIds.append(getOldObjId(op))
                 if getOldObjId(op) in sharedModuleIds:
-                    sharedModuleIds.remove(getOldObjId(op))
+                    del sharedModuleIds[getOldObjId(op)]
                 if paramChgModules.has_key(getOldObjId(op)):
                     del paramChgModules[getOldObjId(op)]
             elif op.what == 'function' and \
@@ -1307,14 +1400,14 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                      op.db_parentObjId in sharedModuleIds:
                 # have a function change
                 paramChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif op.what == 'parameter' and op.db_parentObjType == 'function' \
                     and sharedFunctionIds.has_key(op.db_parentObjId):
                 # have a parameter change
                 moduleId = sharedFunctionIds[op.db_parentObjId]
                 if moduleId in sharedModuleIds:
                     paramChgModules[moduleId] = None
-                    sharedModuleIds.remove(moduleId)
+                    del sharedModuleIds[moduleId]
             elif op.what == 'controlParameter' and \
                     (op.db_parentObjType == 'module' or 
                      op.db_parentObjType == 'abstraction' or 
@@ -1323,7 +1416,7 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                     op.db_parentObjId in sharedModuleIds:
                 # have a control parameter change
                 cparamChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif op.what == 'annotation' and \
                     (op.db_parentObjType == 'module' or 
                      op.db_parentObjType == 'abstraction' or 
@@ -1332,11 +1425,11 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                     op.db_parentObjId in sharedModuleIds:
                 # have an annotation change
                 annotChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif op.what == 'connection':
                 connectionDeleteIds.append(getOldObjId(op))
                 if getOldObjId(op) in sharedConnectionIds:
-                    sharedConnectionIds.remove(getOldObjId(op))
+                    del sharedConnectionIds[getOldObjId(op)]
 
         moduleAddIds = []
         connectionAddIds = []
@@ -1351,14 +1444,14 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                   op.db_parentObjId in sharedModuleIds):
                 # have a function change
                 paramChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif op.what == 'parameter' and op.db_parentObjType == 'function' \
                     and sharedFunctionIds.has_key(op.db_parentObjId):
                 # have a parameter change
                 moduleId = sharedFunctionIds[op.db_parentObjId]
                 if moduleId in sharedModuleIds:
                     paramChgModules[moduleId] = None
-                    sharedModuleIds.remove(moduleId)
+                    del sharedModuleIds[moduleId]
             elif (op.what == 'controlParameter' and
                   (op.db_parentObjType == 'module' or
                    op.db_parentObjType == 'abstraction' or
@@ -1367,7 +1460,7 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                   op.db_parentObjId in sharedModuleIds):
                 # have a control parameter change
                 cparamChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif (op.what == 'annotation' and
                   (op.db_parentObjType == 'module' or
                    op.db_parentObjType == 'abstraction' or
@@ -1376,7 +1469,7 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
                   op.db_parentObjId in sharedModuleIds):
                 # have an annotation change
                 annotChgModules[op.db_parentObjId] = None
-                sharedModuleIds.remove(op.db_parentObjId)
+                del sharedModuleIds[op.db_parentObjId]
             elif op.what == 'connection':
                 connectionAddIds.append(getOldObjId(op))
 
@@ -1386,21 +1479,25 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
     sharedModulePairs = [(id, id) for id in sharedModuleIds]
     v1Only = vOnlyModules[0][0]
     v2Only = vOnlyModules[1][0]
+    v1DeleteIds = set(vOnlyModules[0][1])
+    v2DeleteIds = set(vOnlyModules[1][1])
     for id in vOnlyModules[1][1]:
-        if id not in vOnlyModules[0][1]:
+        if id not in v1DeleteIds:
             v1Only.append(id)
     for id in vOnlyModules[0][1]:
-        if id not in vOnlyModules[1][1]:
+        if id not in v2DeleteIds:
             v2Only.append(id)
 
     sharedConnectionPairs = [(id, id) for id in sharedConnectionIds]
     c1Only = vOnlyConnections[0][0]
     c2Only = vOnlyConnections[1][0]
+    c1DeleteIds = set(vOnlyConnections[0][1])
+    c2DeleteIds = set(vOnlyConnections[1][1])
     for id in vOnlyConnections[1][1]:
-        if id not in vOnlyConnections[0][1]:
+        if id not in c1DeleteIds:
             c1Only.append(id)
     for id in vOnlyConnections[0][1]:
-        if id not in vOnlyConnections[1][1]:
+        if id not in c2DeleteIds:
             c2Only.append(id)
 
     paramChgModulePairs = [(id, id) for id in paramChgModules.keys()]
@@ -1433,59 +1530,75 @@ def getWorkflowDiffCommon(vistrail, v1, v2, heuristic_match=True):
 
 def do_heuristic_diff(v1Workflow, v2Workflow, v1_modules, v2_modules, 
                       v1_connections, v2_connections):    
+    """do_heuristic_diff(v1Workflow: DBWorkflow, v2Workflow: DBWorkflow,
+                         v1_modules: list, v2_modules: list,
+                         v1_connections: list, v2_connections: list)
+                         -> tuple
+
+    Pairs up the modules and connections that are only in one of the
+    workflows. Each module of v1_modules, in order, is paired with the
+    first remaining module of v2_modules that matches exactly, or else
+    with the last remaining module of the same type. Each connection is
+    paired with the first remaining connection that matches.
+
+    Candidates are looked up by key rather than compared one by one, so
+    this is roughly linear in the size of the workflows.
+
+    """
     # add heuristic matches
     heuristicModulePairs = []
     heuristicConnectionPairs = []
-    
-    v1Only = copy.copy(v1_modules)
-    v2Only = copy.copy(v2_modules)
-    c1Only = copy.copy(v1_connections)
-    c2Only = copy.copy(v2_connections)
 
-    # we now check all heuristic pairs for parameter changes
     # match modules
-    # for (m1_id, m2_id) in paramChgModulePairs[:]:
-    #     m1 = v1Workflow.db_get_module(m1_id)
-    #     m2 = v2Workflow.db_get_module(m2_id)
-    #     if heuristicModuleMatch(m1, m2) == 1:
-    #         # paramChgModulePairs.remove((m1_id, m2_id))
-    #         # heuristicModulePairs.append((m1_id, m2_id))
-    #         pass
-
-    for m1_id in v1Only[:]:
+    modules2 = [v2Workflow.db_get_module(m2_id) for m2_id in v2_modules]
+    index = _CandidateIndex([[(0, _module_bucket(m2)), (1, _module_key(m2))]
+                             for m2 in modules2])
+    v1Only = []
+    for m1_id in v1_modules:
         m1 = v1Workflow.db_get_module(m1_id)
+        key = _module_key(m1)
         match = None
-        for m2_id in v2Only:
-            m2 = v2Workflow.db_get_module(m2_id)
-            isMatch = heuristicModuleMatch(m1, m2)
-            if isMatch == 1:
-                match = (m1_id, m2_id)
+        for pos in index.candidates((1, key)):
+            if heuristicModuleMatch(m1, modules2[pos]) == 1:
+                match = pos
                 break
-            elif isMatch == 0:
-                match = (m1_id, m2_id)
+        else:
+            # modules of the same type are a partial match
+            match = index.last((0, key[0]))
         if match is not None:
-            v1Only.remove(match[0])
-            v2Only.remove(match[1])
+            index.remove(match)
             # we now check all heuristic pairs for parameter changes
-            heuristicModulePairs.append(match)
+            heuristicModulePairs.append((m1_id, v2_modules[match]))
+        else:
+            v1Only.append(m1_id)
+    v2Only = [v2_modules[pos] for pos in index.remaining()]
 
     # match connections
-    for c1_id in c1Only[:]:
+    connections2 = [v2Workflow.db_get_connection(c2_id)
+                    for c2_id in v2_connections]
+    keys2 = [_connection_keys(c2) for c2 in connections2]
+    index = _CandidateIndex(keys2)
+    keys2 = [set(keys) for keys in keys2]
+    c1Only = []
+    for c1_id in v1_connections:
         c1 = v1Workflow.db_get_connection(c1_id)
+        # every port has to be matched by a port of the candidate
+        port_keys = [_port_keys(port) for port in c1.db_get_ports()]
+        keys = port_keys[0] if port_keys else [(2,)]
         match = None
-        for c2_id in c2Only:
-            c2 = v2Workflow.db_get_connection(c2_id)
-            isMatch = heuristicConnectionMatch(c1, c2)
-            if isMatch == 1:
-                match = (c1_id, c2_id)
+        for pos in index.candidates(*keys):
+            if (all(any(key in keys2[pos] for key in other_keys)
+                    for other_keys in port_keys[1:]) and
+                    heuristicConnectionMatch(c1, connections2[pos]) == 1):
+                match = pos
                 break
-            elif isMatch == 0:
-                match = (c1_id, c2_id)
         if match is not None:
             # don't have port changes yet
-            c1Only.remove(match[0])
-            c2Only.remove(match[1])
-            heuristicConnectionPairs.append(match)
+            index.remove(match)
+            heuristicConnectionPairs.append((c1_id, v2_connections[match]))
+        else:
+            c1Only.append(c1_id)
+    c2Only = [v2_connections[pos] for pos in index.remaining()]
 
     return (heuristicModulePairs, heuristicConnectionPairs, v1Only, v2Only,
             c1Only, c2Only)
@@ -1627,5 +1740,50 @@ class TestDBVistrailService(unittest.TestCase):
         # test parameter change inequality
         assert heuristicModuleMatch(module1, module5) == 0
 
+    def test_heuristic_diff(self):
+        from vistrails.core.vistrail.connection import Connection
+        from vistrails.core.vistrail.module import Module
+        from vistrails.core.vistrail.module_function import ModuleFunction
+        from vistrails.core.vistrail.module_param import ModuleParam
+        from vistrails.core.vistrail.port import Port
+
+        def module(id, name, value=None):
+            functions = []
+            if value is not None:
+                param = ModuleParam(id=id, pos=0, type='Integer', val=value)
+                functions.append(ModuleFunction(id=id, name='f',
+                                                parameters=[param]))
+            return Module(id=id, name=name, package='pkg',
+                          functions=functions)
+
+        def connection(id, source_id, dest_id):
+            return Connection(id=id, ports=[
+                    Port(id=id*2, type='source', moduleId=source_id,
+                         moduleName='A', name='value', signature='()'),
+                    Port(id=id*2+1, type='destination', moduleId=dest_id,
+                         moduleName='A', name='value', signature='()')])
+
+        workflow1 = DBWorkflow()
+        workflow2 = DBWorkflow()
+        for m in [module(1, 'A', '1'), module(2, 'A', '2'), module(3, 'B')]:
+            workflow1.db_add_module(m)
+        for m in [module(11, 'A', '2'), module(12, 'A', '3'),
+                  module(13, 'C')]:
+            workflow2.db_add_module(m)
+        workflow1.db_add_connection(connection(100, 1, 2))
+        workflow1.db_add_connection(connection(101, 2, 3))
+        workflow2.db_add_connection(connection(200, 7, 8))
+        workflow2.db_add_connection(connection(201, 2, 3))
+
+        (module_pairs, connection_pairs, v1_only, v2_only, c1_only,
+         c2_only) = do_heuristic_diff(workflow1, workflow2, [1, 2, 3],
+                                      [11, 12, 13], [100, 101], [200, 201])
+        # exact match first, then the last module of the same type
+        self.assertEqual(module_pairs, [(1, 12), (2, 11)])
+        self.assertEqual((v1_only, v2_only), ([3], [13]))
+        # connections match on module ids, or port types and names
+        self.assertEqual(connection_pairs, [(100, 200), (101, 201)])
+        self.assertEqual((c1_only, c2_only), ([], []))
+
 if __name__ == '__main__':
     unittest.main()
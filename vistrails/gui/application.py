@@ -487,6 +487,22 @@ class VistrailsApplicationSingleton(VistrailsApplicationInterface,
                     debug.critical("Cannot login to database")
                     return False
     
+        if self.temp_configuration.check('batchManifest'):
+            import vistrails.core.batch_mode
+            jobs = vistrails.core.batch_mode.load_manifest(
+                    self.temp_configuration.batchManifest)
+            summary = vistrails.core.batch_mode.run_batch(
+                    jobs,
+                    self.temp_configuration.check('batchProcesses'),
+                    self.temp_configuration.check('batchSummary'),
+                    self.temp_configuration.check('outputDirectory'))
+            errs = vistrails.core.batch_mode.summary_errors(summary)
+            if len(errs) > 0:
+                for err in errs:
+                    debug.critical("*** Error in %s:%s:%s -- %s" % err)
+                return [False, ["*** Error in %s:%s:%s -- %s" % err for err in errs]]
+            return True
+
         if self.input:
             w_list = []
             vt_list = []
@@ -556,12 +572,19 @@ class VistrailsApplicationSingleton(VistrailsApplicationInterface,
                     vistrails.core.console_mode.run_parameter_explorations(
                         w_list, extra_info=extra_info))
             else:
+                profiler = None
+                if self.temp_configuration.check('executionProfile'):
+                    from vistrails.core.interpreter.profiler import \
+                        ExecutionProfiler
+                    profiler = ExecutionProfiler()
                 errs.extend(vistrails.core.console_mode.run(
                         w_list,
                         self.temp_configuration.check('parameters')
                             or '',
                         output_dir, update_vistrail=True,
-                        extra_info=extra_info))
+                        extra_info=extra_info, profiler=profiler))
+                if profiler is not None:
+                    profiler.write(self.temp_configuration.executionProfile)
             if len(errs) > 0:
                 for err in errs:
                     debug.critical("*** Error in %s:%s:%s -- %s" % err)
@@ -233,6 +233,9 @@ class QMashupAppMainWindow(QtGui.QMainWindow):
             (res, errors) = self.run(useDefaultValues)
             if res:
                 cellEvents = spreadsheetController.getEchoCellEvents()
+                # executions superseded midway may have echoed some cells
+                # before the final one
+                cellEvents = cellEvents[-self.numberOfCells:]
         except Exception, e:
             import traceback
             debug.unexpected_exception(e)
@@ -542,8 +545,13 @@ class QMashupAppMainWindow(QtGui.QMainWindow):
         self.controlDocks["_stretch_"] = stretchDock
 
     def widget_changed(self, info):
-        if self.cb_auto_update.isChecked() and not self.is_executing:
-            self.updateCells(info)
+        if self.cb_auto_update.isChecked():
+            if not self.is_executing:
+                self.updateCells(info)
+            elif not self.cb_loop_sequence.isChecked():
+                # the running execution is aborted and restarted with the
+                # latest values
+                self.run()
 
 
     def run(self, useDefaultValues=False):
@@ -563,8 +571,11 @@ class QMashupAppMainWindow(QtGui.QMainWindow):
                     val =str(edit.text())
                 params.append((alias.component.vttype, alias.component.vtid,
                               val))
-        results = self.controller.execute(params)[0]
-        result = results[0]
+        results = self.controller.execute(params)
+        if results is None:
+            # superseded, the running execution will use these values
+            return (None, [])
+        result = results[0][0]
         (objs, errors, executed) = (result.objects, result.errors,
                                                    result.executed)
         if len(errors) > 0:
@@ -38,6 +38,7 @@ QParameterExplorationTab
 """
 from PyQt4 import QtCore, QtGui
 from ast import literal_eval
+import copy
 from xml.dom.minidom import parseString
 from xml.sax.saxutils import escape
 from vistrails.core import debug
@@ -276,8 +277,10 @@ class QParameterExplorationTab(QDockContainer, QToolWindowInterface):
 
         if self.controller.current_pipeline and actions:
             explorer = ActionBasedParameterExploration()
+            # the snapshots must not share the modules that the builder
+            # changes in place
             (pipelines, performedActions) = explorer.explore(
-                self.controller.current_pipeline, actions)
+                copy.copy(self.controller.current_pipeline), actions)
             
             dim = [max(1, len(a)) for a in actions]
             if (registry.has_module(spreadsheet_pkg, 'CellLocation') and
@@ -272,6 +272,8 @@ class VistrailController(QtCore.QObject, BaseController):
             return None
 
     def cleanup(self):
+        self.close_log_sink()
+        self.close_log_store()
         locator = self.get_locator()
         if locator:
             locator.clean_temporaries()
@@ -357,13 +359,13 @@ class VistrailController(QtCore.QObject, BaseController):
     ##########################################################################
     # Workflow Execution
     
-    def execute_workflow_list(self, vistrails):
+    def execute_workflow_list(self, vistrails, profiler=None, prepared=False):
         old_quiet = self.quiet
         self.quiet = True
         self.current_pipeline_scene.reset_module_colors()
         self.current_pipeline_scene.update()
-        (results, changed) = BaseController.execute_workflow_list(self, 
-                                                                  vistrails)        
+        (results, changed) = BaseController.execute_workflow_list(
+                self, vistrails, profiler=profiler, prepared=prepared)
         self.quiet = old_quiet
         if changed:
             self.invalidate_version_tree(False)
@@ -371,7 +373,8 @@ class VistrailController(QtCore.QObject, BaseController):
 
     def execute_current_workflow(self, custom_aliases=None, custom_params=None,
                                  extra_info=None, reason='Pipeline Execution',
-                                 sinks=None):
+                                 sinks=None, profiler=None, view=None,
+                                 prepared=False):
         """ execute_current_workflow() -> None
         Execute the current workflow (if exists)
         
@@ -383,15 +386,19 @@ class VistrailController(QtCore.QObject, BaseController):
                 locator.clean_temporaries()
                 locator.save_temporary(self.vistrail)
             try:
+                if view is None:
+                    view = self.current_pipeline_scene
                 return self.execute_workflow_list([(self.locator,
                                              self.current_version,
                                              self.current_pipeline,
-                                             self.current_pipeline_scene,
+                                             view,
                                              custom_aliases,
                                              custom_params,
                                              reason,
                                              sinks,
-                                             extra_info)])
+                                             extra_info)],
+                                             profiler=profiler,
+                                             prepared=prepared)
             except Exception, e:
                 debug.unexpected_exception(e)
                 raise
@@ -1362,10 +1369,13 @@ class VistrailController(QtCore.QObject, BaseController):
                                             self.vistrail.db_log_filename)
             else:
                 log = self.log
+            registry = get_module_registry()
+            # OPM reads the port specs of the descriptors directly
+            registry.load_all_ports()
             opm_graph = OpmGraph(log=log, 
                                  version=self.current_version,
                                  workflow=self.current_pipeline,
-                                 registry=get_module_registry())
+                                 registry=registry)
             locator.save_as(opm_graph)
             
     def write_prov(self, locator):
@@ -1479,8 +1489,10 @@ class VistrailController(QtCore.QObject, BaseController):
         if self.current_pipeline and actions:
             pe_log_id = uuid.uuid1()
             explorer = ActionBasedParameterExploration()
+            # the snapshots must not share the modules that the builder
+            # changes in place
             (pipelines, performedActions) = explorer.explore(
-                self.current_pipeline, actions, pre_actions)
+                copy.copy(self.current_pipeline), actions, pre_actions)
             
             dim = [max(1, len(a)) for a in actions]
             if use_spreadsheet:
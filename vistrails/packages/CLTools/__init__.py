@@ -38,4 +38,15 @@ from vistrails.core.configuration import ConfigurationObject
 
 from identifiers import *
 
-configuration = ConfigurationObject(env=(None, str))
+# result_cache keeps the results of the tools in cache_directory (by default
+# CLTools_cache in the per-user VisTrails directory), keyed by their arguments,
+# input files, and the environment variables listed in cache_env
+# max_processes bounds the processes run at once when iterating over a list,
+# it defaults to the number of CPUs
+configuration = ConfigurationObject(env=(None, str),
+                                    result_cache=False,
+                                    cache_directory=(None, str),
+                                    cache_env='PATH;LANG;LC_ALL',
+                                    max_processes=(None, int))
+# modules are generated from the user's CLTools directory
+registry_snapshot = False
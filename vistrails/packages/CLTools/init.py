@@ -34,18 +34,27 @@
 ###############################################################################
 
 import errno
+import functools
 import json
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
 
+from vistrails.core.cache.file_signature import FileSignatureCache
+from vistrails.core.cache.utils import sha_hash
+from vistrails.core.modules.basic_modules import PathObject
 from vistrails.core.modules.vistrails_module import Module, ModuleError, IncompleteImplementation, new_module
 import vistrails.core.modules.module_registry
 from vistrails.core import debug
 from vistrails.core.packagemanager import get_package_manager
 import vistrails.core.system
 from vistrails.core.system import packages_directory, vistrails_root_directory
+from vistrails.core.utils import imap_window
 
 import identifiers
 
@@ -60,6 +69,53 @@ class CLTools(Module):
 
     """
     def compute(self):
+        invocation = self.prepare_invocation()
+        invocation.run()
+        self.finish_invocation(invocation)
+
+    def compute_all(self):
+        """compute_all() -> None
+        Runs the tool once for each input, several at a time.
+
+        This is Module.compute_all() with the processes started
+        concurrently, up to the 'max_processes' setting; the outputs are
+        still set in the order of the inputs.
+
+        """
+        if get_max_processes() <= 1:
+            return Module.compute_all(self)
+        return Module.compute_all(self, run_jobs=self.run_invocations)
+
+    def run_invocations(self, modules, num_inputs):
+        """run_invocations(modules: iterator, num_inputs: int) -> iterator
+        Runs the tool for the modules of compute_all_jobs().
+
+        An invocation is only prepared once a process is available for it,
+        so that no more than 'max_processes' of them hold open files or
+        the content of their stdin at any time.
+
+        """
+        processes = min(get_max_processes(), num_inputs)
+        def invocations():
+            for module in modules:
+                invocation = module.prepare_invocation()
+                yield (module, invocation), invocation
+        pool = ThreadPool(processes)
+        try:
+            # the threads only wait on the processes
+            for (module, invocation), _ in imap_window(pool,
+                                                       ToolInvocation.run,
+                                                       invocations(),
+                                                       processes):
+                yield functools.partial(module.finish_invocation, invocation)
+        finally:
+            pool.close()
+            pool.join()
+
+    def prepare_invocation(self):
+        raise IncompleteImplementation # pragma: no cover
+
+    def finish_invocation(self, invocation):
         raise IncompleteImplementation # pragma: no cover
 
 
@@ -82,6 +138,339 @@ def _eintr_retry_call(func, *args):
             raise
 
 
+def _restore_sigpipe(): # pragma: no cover
+    """Restores the default SIGPIPE handler in a child process.
+
+    Python ignores SIGPIPE and children inherit that, so a producer whose
+    consumer exits early would fail on EPIPE instead of stopping quietly
+    like it does in a shell pipeline.
+    """
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+class StreamedFile(PathObject):
+    """The stdout of a running CLTools process, in place of a file.
+
+    A downstream CLTools module connects the pipe directly to the stdin of
+    its own process; anything else asking for the file name causes the
+    stream to be written to a temporary file first.
+    """
+    def __init__(self, module, process, file, upstream=None):
+        self.module = module
+        self.process = process
+        self.upstream = upstream
+        self.consumed = False
+        self.materialized = False
+        self._file = file
+        self._waited = False
+
+    def _get_name(self):
+        if not self.materialized:
+            self.materialize()
+        return self._file.name
+    name = property(_get_name)
+
+    def __repr__(self):
+        return "StreamedFile(%r)" % self.module.conf['command']
+    __str__ = __repr__
+
+    def is_pipe(self):
+        """is_pipe() -> bool
+        Tells whether the stream can still be read from the pipe.
+
+        """
+        return not self.consumed and not self.materialized
+
+    def release(self):
+        """release() -> None
+        Closes our end of the pipe, once a consumer process owns it.
+
+        """
+        self.consumed = True
+        self.process.stdout.close()
+
+    def materialize(self):
+        """materialize() -> None
+        Writes the rest of the stream to the temporary file.
+
+        """
+        if self.consumed:
+            raise ModuleError(self.module,
+                              "Output was streamed to another module and "
+                              "is no longer available")
+        with open(self._file.name, 'wb') as f:
+            shutil.copyfileobj(self.process.stdout, f)
+        self.release()
+        self.materialized = True
+        self.wait()
+
+    def wait(self):
+        """wait() -> None
+        Waits for the producing process and the ones feeding it.
+
+        Raises a ModuleError on the producing module if its command did not
+        return the expected code.
+
+        """
+        if self._waited:
+            return
+        self._waited = True
+        returncode = _eintr_retry_call(self.process.wait)
+        if self.upstream is not None:
+            self.upstream.wait()
+        self.module.set_output('return_code', returncode)
+        return_code = self.module.conf.get('return_code', None)
+        if return_code is not None and returncode != return_code:
+            raise ModuleError(self.module, "Command returned %d (!= %d)" % (
+                              returncode, return_code))
+
+
+def _streams_stdout(module):
+    """_streams_stdout(module: CLTools) -> bool
+    Tells whether the stdout of a module can be piped into its consumer.
+
+    This requires the 'stream_stdout' option, a File stdout, and a single
+    outgoing connection that goes to the stdin of another CLTools module.
+
+    """
+    conf = module.conf
+    if ('stdout' not in conf or
+            'stream_stdout' not in conf.get('options', {})):
+        return False
+    name, type, options = conf['stdout']
+    if "file" != type.lower():
+        return False
+    pipeline = module.moduleInfo['pipeline']
+    if pipeline is None:
+        return False
+    edges = pipeline.graph.edges_from(module.moduleInfo['moduleId'])
+    if len(edges) != 1:
+        return False
+    connection = pipeline.connections[edges[0][1]]
+    if connection.source.name != name:
+        return False
+    dest = pipeline.modules[connection.destination.moduleId]
+    klass = dest.module_descriptor.module
+    dest_conf = getattr(klass, 'conf', {})
+    return (issubclass(klass, CLTools) and 'stdin' in dest_conf and
+            dest_conf['stdin'][0] == connection.destination.name)
+
+
+# bump this if the layout of the result cache changes
+CACHE_FORMAT_VERSION = 1
+
+
+def get_cache_directory():
+    """get_cache_directory() -> str
+    Returns the directory of the result cache, or None if it is disabled.
+
+    """
+    if not configuration.check('result_cache'):
+        return None
+    if configuration.check('cache_directory'):
+        directory = configuration.cache_directory
+    else:
+        directory = os.path.join(vistrails.core.system.current_dot_vistrails(),
+                                 "CLTools_cache")
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError, e: # pragma: no cover
+            if not os.path.isdir(directory):
+                debug.warning("Could not create CLTools cache directory "
+                              "'%s'" % directory, e)
+                return None
+    return directory
+
+
+def get_max_processes():
+    """get_max_processes() -> int
+    Returns how many invocations a module can run concurrently when it
+    iterates over a list.
+
+    """
+    if configuration.check('max_processes'):
+        return configuration.max_processes
+    return cpu_count()
+
+
+class ToolInvocation(object):
+    """One run of a command line tool.
+
+    The module prepares it from its inputs and sets its outputs from it
+    afterwards; run() only uses the state kept here, so that several
+    invocations can run concurrently.
+
+    If the result cache is enabled, the results are stored under a key made
+    of the wrapper, the arguments (with file names replaced), the
+    environment variables that were set plus those in 'cache_env', and the
+    content of the input files and stdin.
+
+    """
+    def __init__(self, tool_name, conf, args, file_std, stream_out):
+        self.tool_name = tool_name
+        self.conf = conf
+        self.args = args
+        self.file_std = file_std
+        self.stream_out = stream_out
+        self.kwargs = {}
+        self.env = {}
+        self.stdin = None
+        self.outputs = []
+        self.file_outputs = []
+        self.open_files = []
+        self.upstream = None
+        self.stdout_file = None
+
+        self.cacheable = not stream_out
+        self.input_files = []
+        self.key_stdin = None
+        self._output_files = [] # files written by the tool
+        self._temporary_args = {} # argument -> placeholder in the key
+
+        self.process = None
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+
+    def add_output_file(self, arg, file, name):
+        """add_output_file(arg: str, file: PathObject, name: str) -> None
+        Records a temporary file the tool writes, passed as argument arg.
+
+        """
+        self._output_files.append(file)
+        if arg is not None:
+            self._temporary_args[arg] = '<%s>' % name
+
+    def add_input_file(self, arg, filename, name):
+        """add_input_file(arg: str, filename: str, name: str) -> None
+        Records a file the tool reads, passed as argument arg.
+
+        The key uses the content of the file instead of its name, which
+        changes on every run for the temporary files of upstream modules.
+
+        """
+        self.input_files.append(filename)
+        if arg is not None:
+            self._temporary_args[arg] = '<%s%s>' % (
+                    name, os.path.splitext(filename)[1])
+
+    def run(self):
+        """run() -> None
+        Runs the tool, unless its results are in the cache.
+
+        """
+        key = self.cache_key()
+        if key is not None and self.load(key):
+            return
+        self.process = subprocess.Popen(self.args, **self.kwargs)
+        if self.upstream is not None:
+            # the child process owns the read end now
+            self.upstream.release()
+        if self.stream_out:
+            for f in self.open_files:
+                f.close()
+            return
+        if self.file_std:
+            _eintr_retry_call(self.process.wait)
+        else:
+            self.stdout, self.stderr = _eintr_retry_call(
+                    self.process.communicate, self.stdin)
+        self.returncode = self.process.returncode
+        for f in self.open_files:
+            f.close()
+        if self.upstream is not None:
+            self.upstream.wait()
+
+        return_code = self.conf.get('return_code', None)
+        if key is not None and (return_code is None or
+                                self.returncode == return_code):
+            self.store(key)
+
+    def cache_key(self):
+        """cache_key() -> str
+        Returns the key of this invocation in the result cache, or None if
+        it can't be cached.
+
+        """
+        if not self.cacheable or get_cache_directory() is None:
+            return None
+        try:
+            digests = FileSignatureCache.getInstance().get_file_digests(
+                    self.input_files)
+        except (OSError, IOError):
+            return None
+        env = dict(self.env)
+        if configuration.check('cache_env'):
+            for var in configuration.cache_env.split(';'):
+                var = var.strip()
+                if var and var not in env and var in os.environ:
+                    env[var] = os.environ[var]
+        stdin = None
+        if self.key_stdin is not None:
+            stdin = sha_hash(self.key_stdin).hexdigest()
+        key = [CACHE_FORMAT_VERSION, self.tool_name, self.conf,
+               [self._temporary_args.get(arg, arg) for arg in self.args],
+               sorted(env.iteritems()), digests, stdin]
+        return sha_hash(json.dumps(key, sort_keys=True)).hexdigest()
+
+    def load(self, key):
+        """load(key: str) -> bool
+        Gets the results from the cache, returning False if they are not
+        there.
+
+        """
+        entry = os.path.join(get_cache_directory(), key)
+        try:
+            with open(os.path.join(entry, 'results.json'), 'rb') as fp:
+                results = json.load(fp)
+        except (OSError, IOError, ValueError):
+            return False
+        if results['files'] != len(self._output_files):
+            return False # pragma: no cover
+        for f in self.open_files:
+            f.close()
+        for i, file in enumerate(self._output_files):
+            shutil.copyfile(os.path.join(entry, str(i)), file.name)
+        for name in ('stdout', 'stderr'):
+            if results[name]:
+                with open(os.path.join(entry, name), 'rb') as fp:
+                    setattr(self, name, fp.read())
+        self.returncode = results['returncode']
+        return True
+
+    def store(self, key):
+        """store(key: str) -> None
+        Puts the results in the cache.
+
+        """
+        directory = get_cache_directory()
+        entry = os.path.join(directory, key)
+        if os.path.exists(entry):
+            return
+        # build the entry aside so that it appears complete or not at all
+        tmp = tempfile.mkdtemp(prefix='.tmp', dir=directory)
+        try:
+            for i, file in enumerate(self._output_files):
+                shutil.copyfile(file.name, os.path.join(tmp, str(i)))
+            for name in ('stdout', 'stderr'):
+                value = getattr(self, name)
+                if value is not None:
+                    with open(os.path.join(tmp, name), 'wb') as fp:
+                        fp.write(value)
+            with open(os.path.join(tmp, 'results.json'), 'wb') as fp:
+                json.dump({'returncode': self.returncode,
+                           'files': len(self._output_files),
+                           'stdout': self.stdout is not None,
+                           'stderr': self.stderr is not None}, fp)
+            os.rename(tmp, entry)
+        except (OSError, IOError), e: # pragma: no cover
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.exists(entry):
+                debug.warning("Could not store results of '%s' in the "
+                              "CLTools cache" % self.tool_name, e)
+
+
 def add_tool(path):
     # first create classes
     tool_name = os.path.basename(path)
@@ -97,18 +486,24 @@ def add_tool(path):
         debug.critical("Package CLTools could not parse '%s'" % path, exc)
         return
 
-    def compute(self):
+    def prepare_invocation(self):
         """ 1. read inputs
-            2. call with inputs
-            3. set outputs
+            2. build the command line and redirections
         """
         # add all arguments as an unordered list
         args = [self.conf['command']]
         file_std = 'options' in self.conf and 'std_using_files' in self.conf['options']
-        setOutput = [] # (name, File) - set File contents as output for name
-        open_files = []
-        stdin = None
-        kwargs = {}
+        # piping stdout into the next module means we can't communicate(),
+        # so stdin and stderr go through files
+        stream_out = _streams_stdout(self)
+        if stream_out:
+            file_std = True
+        invocation = ToolInvocation(self.tool_name, self.conf, args,
+                                    file_std, stream_out)
+        outputs = invocation.outputs # (name, value) - outputs to set
+        setOutput = invocation.file_outputs # (name, File) - set File contents as output for name
+        open_files = invocation.open_files
+        kwargs = invocation.kwargs
         for type, name, klass, options in self.conf['args']:
             type = type.lower()
             klass = klass.lower()
@@ -128,6 +523,7 @@ def add_tool(path):
                     klass = options['type'].lower() \
                       if 'type' in options else 'string'
                 for value in values:
+                    filename = None
                     if 'flag' == klass:
                         if not value:
                             continue
@@ -138,12 +534,19 @@ def add_tool(path):
                             value = name
                     elif klass in ('file', 'directory', 'path'):
                         value = value.name
+                        if 'file' == klass:
+                            filename = value
+                        else:
+                            # the tool might write there
+                            invocation.cacheable = False
                     # check for flag and append file name
                     if not 'flag' == klass and 'flag' in options:
                         args.append(options['flag'])
                     value = '%s%s' % (options.get('prefix', ''),
                                       value)
                     args.append(value)
+                    if filename is not None:
+                        invocation.add_input_file(value, filename, name)
             elif "output" == type:
                 # output must be a filename but we may convert the result to a string
                 # create new file
@@ -155,8 +558,9 @@ def add_tool(path):
                 if 'flag' in options:
                     args.append(options['flag'])
                 args.append(fname)
+                invocation.add_output_file(fname, file, name)
                 if "file" == klass:
-                    self.set_output(name, file)
+                    outputs.append((name, file))
                 elif "string" == klass:
                     setOutput.append((name, file))
                 else:
@@ -164,6 +568,7 @@ def add_tool(path):
             elif "inputoutput" == type:
                 # handle single file that is both input and output
                 value = self.get_input(name)
+                invocation.add_input_file(None, value.name, name)
 
                 # create copy of infile to operate on
                 outfile = self.interpreter.filePool.create_file(
@@ -179,20 +584,26 @@ def add_tool(path):
                 if 'flag' in options:
                     args.append(options['flag'])
                 args.append(value)
-                self.set_output(name, outfile)
+                invocation.add_output_file(value, outfile, name)
+                outputs.append((name, outfile))
         if "stdin" in self.conf:
             name, type, options = self.conf["stdin"]
             type = type.lower()
             if self.has_input(name):
                 value = self.get_input(name)
-                if "file" == type:
+                if isinstance(value, StreamedFile) and value.is_pipe():
+                    invocation.upstream = value
+                    invocation.cacheable = False
+                elif "file" == type:
+                    invocation.add_input_file(None, value.name, name)
                     if file_std:
                         f = open(value.name, 'rb')
                     else:
                         f = open(value.name, 'rb')
-                        stdin = f.read()
+                        invocation.stdin = f.read()
                         f.close()
                 elif "string" == type:
+                    invocation.key_stdin = value
                     if file_std:
                         file = self.interpreter.filePool.create_file()
                         f = open(file.name, 'wb')
@@ -200,26 +611,34 @@ def add_tool(path):
                         f.close()
                         f = open(file.name, 'rb')
                     else:
-                        stdin = value
+                        invocation.stdin = value
                 else: # pragma: no cover
                     raise ValueError
-                if file_std:
+                if invocation.upstream is not None:
+                    kwargs['stdin'] = invocation.upstream.process.stdout
+                elif file_std:
                     open_files.append(f)
                     kwargs['stdin'] = f.fileno()
                 else:
                     kwargs['stdin'] = subprocess.PIPE
         if "stdout" in self.conf:
-            if file_std:
+            if stream_out:
+                kwargs['stdout'] = subprocess.PIPE
+                invocation.stdout_file = \
+                        self.interpreter.filePool.create_file(
+                                suffix=DEFAULTFILESUFFIX)
+            elif file_std:
                 name, type, options = self.conf["stdout"]
                 type = type.lower()
                 file = self.interpreter.filePool.create_file(
                         suffix=DEFAULTFILESUFFIX)
                 if "file" == type:
-                    self.set_output(name, file)
+                    outputs.append((name, file))
                 elif "string" == type:
                     setOutput.append((name, file))
                 else: # pragma: no cover
                     raise ValueError
+                invocation.add_output_file(None, file, 'stdout')
                 f = open(file.name, 'wb')
                 open_files.append(f)
                 kwargs['stdout'] = f.fileno()
@@ -232,19 +651,18 @@ def add_tool(path):
                 file = self.interpreter.filePool.create_file(
                         suffix=DEFAULTFILESUFFIX)
                 if "file" == type:
-                    self.set_output(name, file)
+                    outputs.append((name, file))
                 elif "string" == type:
                     setOutput.append((name, file))
                 else: # pragma: no cover
                     raise ValueError
+                invocation.add_output_file(None, file, 'stderr')
                 f = open(file.name, 'wb')
                 open_files.append(f)
                 kwargs['stderr'] = f.fileno()
             else:
                 kwargs['stderr'] = subprocess.PIPE
 
-        return_code = self.conf.get('return_code', None)
-
         env = {}
         # 0. add defaults
         # 1. add from configuration
@@ -292,6 +710,7 @@ def add_tool(path):
                                       "Error parsing env port: %s" % (
                                       debug.format_exception(e)))
 
+        invocation.env = env
         if env:
             kwargs['env'] = dict(os.environ)
             kwargs['env'].update(env)
@@ -302,34 +721,41 @@ def add_tool(path):
         if 'dir' in self.conf:
             kwargs['cwd'] = self.conf['dir']
 
-        process = subprocess.Popen(args, **kwargs)
-        if file_std:
-            process.wait()
-        else:
-            #if stdin:
-            #    print "stdin:", len(stdin), stdin[:30]
-            stdout, stderr = _eintr_retry_call(process.communicate, stdin)
-            #stdout, stderr = process.communicate(stdin)
-            #if stdout:
-            #    print "stdout:", len(stdout), stdout[:30]
-            #if stderr:
-            #    print "stderr:", len(stderr), stderr[:30]
+        if stream_out and os.name != 'nt':
+            kwargs['preexec_fn'] = _restore_sigpipe
+
+        return invocation
+
+    def finish_invocation(self, invocation):
+        """ 3. set outputs
+        """
+        for name, value in invocation.outputs:
+            self.set_output(name, value)
 
+        if invocation.stream_out:
+            # the consumer waits for this process once it is done reading
+            self.is_cacheable = lambda *args: False
+            self.set_output(self.conf['stdout'][0],
+                            StreamedFile(self, invocation.process,
+                                         invocation.stdout_file,
+                                         invocation.upstream))
+            return
+
+        return_code = self.conf.get('return_code', None)
         if return_code is not None:
-            if process.returncode != return_code:
+            if invocation.returncode != return_code:
                 raise ModuleError(self, "Command returned %d (!= %d)" % (
-                                  process.returncode, return_code))
-        self.set_output('return_code', process.returncode)
-
-        for f in open_files:
-            f.close()
+                                  invocation.returncode, return_code))
+        self.set_output('return_code', invocation.returncode)
 
-        for name, file in setOutput:
+        for name, file in invocation.file_outputs:
             f = open(file.name, 'rb')
             self.set_output(name, f.read())
             f.close()
 
-        if not file_std:
+        if not invocation.file_std:
+            stdout = invocation.stdout
+            stderr = invocation.stderr
             if stdout and "stdout" in self.conf:
                 name, type, options = self.conf["stdout"]
                 type = type.lower()
@@ -364,7 +790,8 @@ def add_tool(path):
     d = """This module is a wrapper for the command line tool '%s'""" % \
         conf['command']
     # create module
-    M = new_module(CLTools, tool_name,{"compute": compute,
+    M = new_module(CLTools, tool_name,{"prepare_invocation": prepare_invocation,
+                                           "finish_invocation": finish_invocation,
                                            "conf": conf,
                                            "tool_name": tool_name,
                                            "__doc__": d})
@@ -492,7 +919,7 @@ def finalize():
 ###############################################################################
 
 import unittest
-from vistrails.tests.utils import execute, intercept_results
+from vistrails.tests.utils import execute, intercept_result, intercept_results
 
 
 class TestCLTools(unittest.TestCase):
@@ -519,13 +946,15 @@ class TestCLTools(unittest.TestCase):
         os.chdir(cls._old_dir)
         reload_scripts()
 
-    def do_the_test(self, toolname):
+    def do_the_test(self, toolname, f_in=None):
+        if f_in is None:
+            f_in = self.testdir + '/test_1.cltest'
         with intercept_results(self._tools['intern_cltools_1'],
                 'return_code', 'f_out', 'stdout') as (
                 return_code, f_out, stdout):
             self.assertFalse(execute([
                     ('intern_cltools_1', 'org.vistrails.vistrails.cltools', [
-                        ('f_in', [('File', self.testdir + '/test_1.cltest')]),
+                        ('f_in', [('File', f_in)]),
                         ('chars', [('List', '["a", "b", "c"]')]),
                         ('false', [('Boolean', 'False')]),
                         ('true', [('Boolean', 'True')]),
@@ -546,3 +975,133 @@ class TestCLTools(unittest.TestCase):
         """With std_using_files: use files instead of pipes.
         """
         self.do_the_test('intern_cltools_2')
+
+    def test_streaming(self):
+        """With stream_stdout: chain processes through pipes.
+        """
+        with intercept_results(self._tools['intern_cltools_4'],
+                               'stdout', 'return_code') as (
+                stdout, return_code):
+            self.assertFalse(execute([
+                    ('intern_cltools_3', 'org.vistrails.vistrails.cltools', [
+                        ('nb', [('Integer', '100000')]),
+                    ]),
+                    ('intern_cltools_4', 'org.vistrails.vistrails.cltools', []),
+                    ('intern_cltools_4', 'org.vistrails.vistrails.cltools', []),
+                ],
+                [
+                    (0, 'stdout', 1, 'stdin'),
+                    (1, 'stdout', 2, 'stdin'),
+                ]))
+        self.assertEqual(len(stdout), 2)
+        # the middle module was streamed, the last one was not
+        self.assertIsInstance(stdout[0], StreamedFile)
+        self.assertFalse(stdout[0].materialized)
+        self.assertNotIsInstance(stdout[1], StreamedFile)
+        self.assertEqual(return_code, [0, 0])
+        with open(stdout[1].name, 'rb') as fp:
+            lines = fp.read().splitlines()
+        self.assertEqual(len(lines), 100000)
+        self.assertEqual(lines[42], 'LINE 42')
+
+    def run_list(self, values):
+        with intercept_result(self._tools['intern_cltools_5'],
+                              'stdout') as stdout:
+            self.assertFalse(execute([
+                    ('List', 'org.vistrails.vistrails.basic', [
+                        ('value', [('List', json.dumps(values))]),
+                    ]),
+                    ('intern_cltools_5', 'org.vistrails.vistrails.cltools', []),
+                ],
+                [
+                    (0, 'value', 1, 'text'),
+                ]))
+        # the last result is the list set on the looping module
+        return stdout[-1]
+
+    def test_result_cache(self):
+        """Iterate over a list concurrently, and cache the results.
+        """
+        cache_dir = tempfile.mkdtemp()
+        old_popen = subprocess.Popen
+        calls = []
+        def popen(args, **kwargs):
+            calls.append(args[-1])
+            return old_popen(args, **kwargs)
+        configuration.result_cache = True
+        configuration.cache_directory = cache_dir
+        configuration.max_processes = 4
+        subprocess.Popen = popen
+        try:
+            values = ['item %d' % i for i in xrange(10)]
+            self.assertEqual(self.run_list(values),
+                             [v.upper() for v in values])
+            self.assertEqual(sorted(calls), sorted(values))
+            del calls[:]
+            values.insert(5, 'new item')
+            self.assertEqual(self.run_list(values),
+                             [v.upper() for v in values])
+            self.assertEqual(calls, ['new item'])
+        finally:
+            subprocess.Popen = old_popen
+            configuration.result_cache = False
+            configuration.cache_directory = None
+            configuration.max_processes = None
+            shutil.rmtree(cache_dir)
+
+    def test_cache_input_content(self):
+        """Gets a cache hit for the same input file under another name.
+        """
+        cache_dir = tempfile.mkdtemp()
+        old_popen = subprocess.Popen
+        calls = []
+        def popen(args, **kwargs):
+            calls.append(args)
+            return old_popen(args, **kwargs)
+        configuration.result_cache = True
+        configuration.cache_directory = cache_dir
+        subprocess.Popen = popen
+        try:
+            for i in xrange(2):
+                # like the temporary file of an upstream module
+                fd, f_in = tempfile.mkstemp(suffix='.cltest')
+                os.close(fd)
+                try:
+                    shutil.copyfile(self.testdir + '/test_1.cltest', f_in)
+                    self.do_the_test('intern_cltools_1', f_in)
+                finally:
+                    os.remove(f_in)
+            self.assertEqual(len(calls), 1)
+        finally:
+            subprocess.Popen = old_popen
+            configuration.result_cache = False
+            configuration.cache_directory = None
+            shutil.rmtree(cache_dir)
+
+    def test_prepare_in_window(self):
+        """Doesn't prepare the invocations of a list all at once.
+        """
+        klass = self._tools['intern_cltools_5']
+        prepare = klass.prepare_invocation
+        finish = klass.finish_invocation
+        pending = [0, 0] # prepared but not finished, highest count
+        def counting_prepare(module):
+            pending[0] += 1
+            pending[1] = max(pending)
+            return prepare(module)
+        def counting_finish(module, invocation):
+            pending[0] -= 1
+            return finish(module, invocation)
+        configuration.max_processes = 2
+        klass.prepare_invocation = counting_prepare
+        klass.finish_invocation = counting_finish
+        try:
+            values = ['item %d' % i for i in xrange(10)]
+            self.assertEqual(self.run_list(values),
+                             [v.upper() for v in values])
+        finally:
+            klass.prepare_invocation = prepare
+            klass.finish_invocation = finish
+            configuration.max_processes = None
+        self.assertEqual(pending[0], 0)
+        self.assertLessEqual(pending[1], 2)
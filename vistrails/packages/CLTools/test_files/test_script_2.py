@@ -0,0 +1,21 @@
+# pragma: no testimport
+
+import sys
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+
+    if args[0] == 'produce':
+        for i in xrange(int(args[1])):
+            sys.stdout.write("line %d\n" % i)
+    elif args[0] == 'echo':
+        sys.stdout.write(args[1].upper())
+    elif args[0] == 'upper':
+        for line in sys.stdin:
+            sys.stdout.write(line.upper())
+    else:
+        sys.stderr.write("Unknown mode '%s'\n" % args[0])
+        sys.exit(1)
+
+    sys.exit(0)
@@ -215,6 +215,10 @@ class QCLToolsWizard(QtGui.QWidget):
         self.stdAsFiles.setToolTip('Check to make pipes communicate using files instead of strings\nOnly useful when processing large files')
         self.stdAsFiles.setCheckable(True)
         self.toolBar.addAction(self.stdAsFiles)
+        self.streamStdout = QtGui.QAction('stream stdout', self)
+        self.streamStdout.setToolTip('Check to pipe standard output directly into a connected CLTools module\nThe tools then run concurrently without intermediate files')
+        self.streamStdout.setCheckable(True)
+        self.toolBar.addAction(self.streamStdout)
 
         self.toolBar.addSeparator()
 
@@ -360,6 +364,7 @@ class QCLToolsWizard(QtGui.QWidget):
         self.argList = QtGui.QListWidget()
         self.layout().addWidget(self.argList)
         self.stdAsFiles.setChecked(False)
+        self.streamStdout.setChecked(False)
         self.setTitle()
         self.generate_preview()
     
@@ -403,6 +408,8 @@ class QCLToolsWizard(QtGui.QWidget):
                                 'env_port' in conf['options'])
         self.stdAsFiles.setChecked('options' in conf and
                                    'std_using_files' in conf['options'])
+        self.streamStdout.setChecked('options' in conf and
+                                     'stream_stdout' in conf['options'])
         self.envOption = conf['options']['env'] \
                  if ('options' in conf and 'env' in conf['options']) else None
         self.conf = conf
@@ -430,6 +437,8 @@ class QCLToolsWizard(QtGui.QWidget):
         options = {}
         if self.stdAsFiles.isChecked():
             options['std_using_files'] = ''
+        if self.streamStdout.isChecked():
+            options['stream_stdout'] = ''
         if self.envPort.isChecked():
             options['env_port'] = ''
         if self.envOption:
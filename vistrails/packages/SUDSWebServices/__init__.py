@@ -34,7 +34,9 @@
 ###############################################################################
 """ This package defines a set of methods to deal with web services.
 It requires suds library to be installed. Click on configure to add wsdl
-urls to the package (use a ; to separate the urls).
+urls to the package (use a ; to separate the urls). max_concurrent_calls
+sets how many calls are made at the same time when a method module iterates
+over a list (default 4).
 """
 from vistrails.core.configuration import ConfigurationObject
 import vistrails.core
@@ -45,7 +47,10 @@ version = '0.1.2'
 old_identifiers = ['edu.utah.sci.vistrails.sudswebservices']
 configuration = ConfigurationObject(wsdlList=(None, str),
                                     proxy_http=(None, str),
-                                    cache_days=(None, int))
+                                    cache_days=(None, int),
+                                    max_concurrent_calls=(None, int))
+# modules are generated from the configured WSDL documents
+registry_snapshot = False
 
 
 def can_handle_identifier(identifier):
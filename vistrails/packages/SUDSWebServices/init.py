@@ -33,9 +33,18 @@
 ##
 ###############################################################################
 import sys
+import cPickle as pickle
+import httplib
 import os.path
 import shutil
+import socket
 import hashlib
+import functools
+import tempfile
+import threading
+import urlparse
+from multiprocessing.pool import ThreadPool
+from StringIO import StringIO
 import vistrails.core.system
 import vistrails.core.modules.module_registry
 import vistrails.core.modules.basic_modules
@@ -44,13 +53,20 @@ from vistrails.core.packagemanager import get_package_manager
 from vistrails.core.modules.package import Package
 from vistrails.core.modules.vistrails_module import Module, ModuleError, new_module
 from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
+from vistrails.core.utils import imap_window
 from vistrails.core import debug
 
 import suds
+import suds.client
+from suds.transport import Reply, TransportError
+from suds.transport.http import HttpTransport
 
 
 package_cache = None
 
+# version of the type and method model stored in the model cache
+MODEL_CACHE_VERSION = 1
+
 webServicesDict = {}
 
 def toSignature(s):
@@ -165,7 +181,7 @@ def initialize(*args, **keywords):
             debug.warning('Duplicate WSDL entry: '+wsdl)
             continue
         s = Service(wsdl)
-        if s.service:
+        if s.isLoaded():
             webServicesDict[wsdl] = s
         
 def finalize():
@@ -175,6 +191,72 @@ def finalize():
         if s.package:
             reg.remove_package(s.package)
 
+def get_max_concurrent_calls():
+    """ Returns the number of SOAP calls made at the same time when a method
+    module is iterated over a list
+    """
+    if configuration.check('max_concurrent_calls'):
+        return configuration.max_concurrent_calls
+    return 4
+
+class KeepAliveTransport(HttpTransport):
+    """ A SUDS transport that keeps a connection open to each endpoint
+    and sends the following calls over it, instead of connecting for
+    each call. A transport should only be used by one thread at a time.
+    """
+    def __init__(self, **kwargs):
+        HttpTransport.__init__(self, **kwargs)
+        self.connections = {}
+
+    def connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if key not in self.connections:
+            if scheme == 'https':
+                cls = httplib.HTTPSConnection
+            else:
+                cls = httplib.HTTPConnection
+            self.connections[key] = cls(netloc, timeout=self.options.timeout)
+        return self.connections[key]
+
+    def close(self):
+        for conn in self.connections.itervalues():
+            conn.close()
+        self.connections = {}
+
+    def send(self, request):
+        if self.options.proxy:
+            return HttpTransport.send(self, request)
+        url = urlparse.urlsplit(request.url)
+        path = url.path or '/'
+        if url.query:
+            path += '?' + url.query
+        key = (url.scheme, url.netloc)
+        while True:
+            reused = key in self.connections
+            conn = self.connection(*key)
+            try:
+                conn.request('POST', path, request.message,
+                             dict(request.headers))
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                del self.connections[key]
+                # the server may have closed the idle connection; only a
+                # new connection failing is an error
+                if not reused:
+                    raise
+        if response.will_close:
+            conn.close()
+            del self.connections[key]
+        if response.status in (202, 204):
+            return None
+        if response.status >= 300:
+            raise TransportError(response.reason, response.status,
+                                 StringIO(data))
+        return Reply(response.status, dict(response.getheaders()), data)
+
 class WSMethod(object):
     """ A WSDL method
     """
@@ -204,7 +286,39 @@ class WSType(object):
         self.enum = enum
         "name: WSElement"
         self.parts = {}
- 
+
+def modelToDict(wstypes, wsmethods):
+    """ Converts the types and methods of a service to builtin types, to be
+    stored in the model cache
+    """
+    types = {}
+    for qname, wstype in wstypes.iteritems():
+        parts = dict((name, (p.type, p.optional, p.min, p.max, p.enum))
+                     for name, p in wstype.parts.iteritems())
+        types[qname] = (wstype.enum, parts)
+    methods = dict((qname, (m.inputs, m.outputs))
+                   for qname, m in wsmethods.iteritems())
+    return {'version': MODEL_CACHE_VERSION,
+            'types': types,
+            'methods': methods}
+
+def dictToModel(d):
+    """ Rebuilds the types and methods from modelToDict() output """
+    wstypes = {}
+    for qname, (enum, parts) in d['types'].iteritems():
+        wstype = WSType(qname, enum)
+        for name, (type, optional, min, max, penum) in parts.iteritems():
+            wstype.parts[name] = WSElement(name, type, optional, min, max,
+                                           penum)
+        wstypes[qname] = wstype
+    wsmethods = {}
+    for qname, (inputs, outputs) in d['methods'].iteritems():
+        wsmethod = WSMethod(qname)
+        wsmethod.inputs = inputs
+        wsmethod.outputs = outputs
+        wsmethods[qname] = wsmethod
+    return wstypes, wsmethods
+
 class Service(object):
     def __init__(self, address):
         """ Process WSDL and add all Types and Methods
@@ -214,9 +328,14 @@ class Service(object):
         self.wsdlHash = '-1'
         self.modules = []
         self.package = None
+        self._service = None
+        self._deferred = False
+        self._serviceLock = threading.Lock()
+        self._local = threading.local()
         debug.log("Installing Web Service from WSDL: %s"% address)
 
-        options = dict(cachingpolicy=1, cache=package_cache)
+        options = dict(cachingpolicy=1, cache=package_cache,
+                       transport=KeepAliveTransport())
         
         proxy_types = ['http']
         for t in proxy_types:
@@ -226,6 +345,27 @@ class Service(object):
                 debug.log("Using proxy: %s" % proxy)
                 if len(proxy):
                     options['proxy'] = {t:proxy}
+        self.options = options
+
+        # A WSDL already processed has its types and methods in the model
+        # cache; the client is then only created when first used
+        wsdlHash = self.getWsdlHash()
+        model = self.loadModel(wsdlHash) if wsdlHash else None
+        if model is not None:
+            self.wstypes, self.wsmethods = model
+            self._deferred = True
+            try:
+                self.createPackage(wsdlHash)
+                self.createTypeClasses()
+                self.createMethodClasses()
+            except Exception:
+                debug.critical("Could not create Web Service: %s" % address,
+                               traceback.format_exc())
+                self.service = None
+            if self.wsdlHash == '-1':
+                self.createFailedPackage()
+            return
+
         try:
             self.service = suds.client.Client(address, **options)
             self.backUpCache()
@@ -248,6 +388,8 @@ class Service(object):
                 self.createPackage()
                 self.setTypes()
                 self.setMethods()
+                if self.wsdlHash != '0':
+                    self.saveModel(self.wsdlHash)
                 self.createTypeClasses()
                 self.createMethodClasses()
             except Exception:
@@ -257,6 +399,83 @@ class Service(object):
         if self.wsdlHash == '-1':
             # create empty package so that it can be reloaded/deleted
             self.createFailedPackage()
+
+    def _get_service(self):
+        if self._deferred:
+            with self._serviceLock:
+                if self._deferred:
+                    self._service = suds.client.Client(self.address,
+                                                       **self.options)
+                    self._deferred = False
+        return self._service
+    def _set_service(self, service):
+        self._deferred = False
+        self._service = service
+    service = property(_get_service, _set_service,
+                       doc="The SUDS client, created on first use if the "
+                           "model came from the cache")
+
+    def isLoaded(self):
+        """ Whether the service was loaded, without creating its client """
+        return self._deferred or bool(self._service)
+
+    def threadService(self):
+        """ Returns a SUDS client for the current thread, sharing the WSDL
+            of the main client but with its own options and transport
+        """
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.service.clone()
+        return client
+
+    def getWsdlHash(self):
+        """ Returns a hash of the WSDL document in the SUDS cache, or None
+            if it is not there
+        """
+        # "name" is what suds use as the cache key
+        name = '%s-%s' % (abs(hash(self.address)), "wsdl")
+        wsdl = package_cache.get(name)
+        if not wsdl:
+            return None
+        return str(int(hashlib.md5(str(wsdl.root)).hexdigest(), 16))
+
+    def modelCacheFile(self, wsdlHash):
+        return os.path.join(package_cache.location,
+                            "suds-%s-model.pickle" % wsdlHash)
+
+    def loadModel(self, wsdlHash):
+        """ Returns the (types, methods) stored for this WSDL document, or
+            None
+        """
+        filename = self.modelCacheFile(wsdlHash)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                d = pickle.load(f)
+            if d['version'] != MODEL_CACHE_VERSION:
+                return None
+            return dictToModel(d)
+        except Exception, e:
+            debug.warning("Could not read the model cache of %s" %
+                          self.address, e)
+            return None
+
+    def saveModel(self, wsdlHash):
+        """ Stores the types and methods for this WSDL document """
+        filename = self.modelCacheFile(wsdlHash)
+        try:
+            fd, tmp = tempfile.mkstemp(dir=package_cache.location)
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(modelToDict(self.wstypes, self.wsmethods), f,
+                            pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(filename):
+                # windows cannot rename over a file
+                os.remove(filename)
+            os.rename(tmp, filename)
+        except Exception, e:
+            debug.warning("Could not write the model cache of %s" %
+                          self.address, e)
         
     def makeDictType(self, obj):
         """ Create recursive dict from SUDS object
@@ -300,20 +519,20 @@ class Service(object):
             return True
         return False
 
-    def createPackage(self):
+    def createPackage(self, wsdlHash=None):
         reg = vistrails.core.modules.module_registry.get_module_registry()
         if self.signature in reg.packages:
             reg.remove_package(reg.packages[self.signature])
 
         # create a document hash integer from the cached sax tree
-        # "name" is what suds use as the cache key
-        name = '%s-%s' % (abs(hash(self.address)), "wsdl")
-        wsdl = package_cache.get(name)
-        if not wsdl:
-            debug.critical("File not found in SUDS cache: '%s'" % name)
+        if wsdlHash is None:
+            wsdlHash = self.getWsdlHash()
+        if wsdlHash is None:
+            debug.critical("File not found in SUDS cache: '%s-wsdl'" %
+                           abs(hash(self.address)))
             self.wsdlHash = '0'
             return
-        self.wsdlHash = str(int(hashlib.md5(str(wsdl.root)).hexdigest(), 16))
+        self.wsdlHash = wsdlHash
 
         package_id = reg.idScope.getNewId(Package.vtType)
         package = Package(id=package_id,
@@ -580,20 +799,8 @@ It is a WSDL type with signature:
         self.methodClasses = {}
         for m in self.wsmethods.itervalues():
             def compute(self):
-                # create dict of inputs
-                cacheable = False
-                if self.has_input('cacheable'):
-                    cacheable = self.get_input('cacheable')
-                self.is_cacheable = lambda *args, **kwargs: cacheable            
-                params = {}
-                mname = self.wsmethod.qname[0]
-                for name in self.wsmethod.inputs:
-                    name = str(name)
-                    if self.has_input(name):
-                        params[name] = self.get_input(name)
-                        if params[name].__class__.__name__ == 'UberClass':
-                            params[name] = params[name].value
-                        params[name] = self.service.makeDictType(params[name])
+                self.setCacheable()
+                params = self.getParams()
                 try:
                     #import logging
                     #logging.basicConfig(level=logging.INFO)
@@ -603,11 +810,77 @@ It is a WSDL type with signature:
                     #result = getattr(self.service.service.service, mname)(**params)
                     #print "result:", str(result)[:400]
                     #self.service.service.set_options(retxml = False)
-                    result = getattr(self.service.service.service, mname)(**params)
+                    result = getattr(self.service.service.service,
+                                     self.wsmethod.qname[0])(**params)
                 except Exception, e:
                     debug.unexpected_exception(e)
                     raise ModuleError(self, "Error invoking method %s: %s" % (
-                            name, debug.format_exception(e)))
+                            self.wsmethod.qname[0], debug.format_exception(e)))
+                self.setResult(result)
+
+            def compute_all(self):
+                """ Calls the method for each input, several at a time.
+
+                This is Module.compute_all() with the calls made
+                concurrently, up to the 'max_concurrent_calls' setting,
+                each thread reusing its connection to the endpoint; the
+                outputs are still set in the order of the inputs.
+                """
+                if get_max_concurrent_calls() <= 1:
+                    return Module.compute_all(self)
+                self.setCacheable()
+                return Module.compute_all(self, run_jobs=self.callAll)
+
+            def callAll(self, modules, num_inputs):
+                """ Makes the calls of the modules of compute_all_jobs() """
+                workers = min(get_max_concurrent_calls(), num_inputs)
+                service = self.service
+                mname = self.wsmethod.qname[0]
+                def call(params):
+                    try:
+                        client = service.threadService()
+                        return True, getattr(client.service, mname)(**params)
+                    except Exception, e:
+                        return False, e
+                def finish(module, success, result):
+                    if not success:
+                        debug.unexpected_exception(result)
+                        raise ModuleError(module,
+                                          "Error invoking method %s: %s" % (
+                                          mname,
+                                          debug.format_exception(result)))
+                    module.setResult(result)
+                calls = ((module, module.getParams()) for module in modules)
+                pool = ThreadPool(workers)
+                try:
+                    for module, (success, result) in imap_window(
+                            pool, call, calls, workers):
+                        yield functools.partial(finish, module, success,
+                                                result)
+                finally:
+                    pool.close()
+                    pool.join()
+
+            def setCacheable(self):
+                cacheable = False
+                if self.has_input('cacheable'):
+                    cacheable = self.get_input('cacheable')
+                self.is_cacheable = lambda *args, **kwargs: cacheable
+
+            def getParams(self):
+                """ Returns the dict of inputs of the call """
+                params = {}
+                for name in self.wsmethod.inputs:
+                    name = str(name)
+                    if self.has_input(name):
+                        params[name] = self.get_input(name)
+                        if params[name].__class__.__name__ == 'UberClass':
+                            params[name] = params[name].value
+                        params[name] = self.service.makeDictType(params[name])
+                return params
+
+            def setResult(self, result):
+                """ Sets the outputs from the result of the call """
                 for name, qtype in self.wsmethod.outputs.iteritems():
                     if isinstance(result, list):
                         # if result is a list just set the output
@@ -646,6 +919,11 @@ Outputs:
 """%(self.address, m.qname[0], inputs, outputs)
 
             M = new_module(self.module, str(m.qname[0]), {"compute":compute,
+                                                          "compute_all":compute_all,
+                                                          "callAll":callAll,
+                                                          "setCacheable":setCacheable,
+                                                          "getParams":getParams,
+                                                          "setResult":setResult,
                                                           "wsmethod":m,
                                                           "service":self,
                                                            "__doc__":d})
@@ -688,7 +966,7 @@ def load_from_signature(signature):
         except Exception, e:
             debug.unexpected_exception(e)
             return False
-        if not service.service:
+        if not service.isLoaded():
             return False
         webServicesDict[wsdl] = service
         wsdlList.append(wsdl)
@@ -712,7 +990,7 @@ def handle_module_upgrade_request(controller, module_id, pipeline):
         wsdlList = configuration.wsdlList.split(";")
     if not wsdl in wsdlList:
         service = Service(wsdl)
-        if not service.service:
+        if not service.isLoaded():
             return []
         webServicesDict[wsdl] = service
         wsdlList.append(wsdl)
@@ -765,7 +1043,7 @@ def handle_missing_module(controller, module_id, pipeline):
         return True
 
     service = Service(wsdl)
-    if not service.service:
+    if not service.isLoaded():
         return False
 
     webServicesDict[wsdl] = service
@@ -788,7 +1066,7 @@ def load_from_identifier(service_identifier):
         return True
 
     service = Service(wsdl)
-    if not service.service:
+    if not service.isLoaded():
         return False
 
     webServicesDict[wsdl] = service
@@ -853,7 +1131,7 @@ def callContextMenu(signature):
             debug.critical('WSDL already loaded: '+wsdl)
             return
         s = Service(wsdl)
-        if s.service:
+        if s.isLoaded():
             webServicesDict[wsdl] = s
             if configuration.wsdlList:
                 configuration.wsdlList += ';' + wsdl
@@ -877,3 +1155,173 @@ def callContextMenu(signature):
             wsdlList = configuration.wsdlList.split(";")
             wsdlList.remove(address)
             configuration.wsdlList = ';'.join(wsdlList)
+
+###############################################################################
+
+import unittest
+import BaseHTTPServer
+import re
+import SocketServer
+
+
+TEST_WSDL = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions name="Hello" targetNamespace="urn:hello"
+             xmlns="http://schemas.xmlsoap.org/wsdl/"
+             xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+             xmlns:tns="urn:hello"
+             xmlns:xsd="http://www.w3.org/2001/XMLSchema">
+  <types>
+    <xsd:schema targetNamespace="urn:hello" elementFormDefault="qualified">
+      <xsd:element name="hello">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="name" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="helloResponse">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="greeting" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </types>
+  <message name="helloRequest">
+    <part name="parameters" element="tns:hello"/>
+  </message>
+  <message name="helloResponse">
+    <part name="parameters" element="tns:helloResponse"/>
+  </message>
+  <portType name="HelloPortType">
+    <operation name="hello">
+      <input message="tns:helloRequest"/>
+      <output message="tns:helloResponse"/>
+    </operation>
+  </portType>
+  <binding name="HelloBinding" type="tns:HelloPortType">
+    <soap:binding style="document"
+                  transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="hello">
+      <soap:operation soapAction="urn:hello#hello"/>
+      <input><soap:body use="literal"/></input>
+      <output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="HelloService">
+    <port name="HelloPort" binding="tns:HelloBinding">
+      <soap:address location="%(url)s/soap"/>
+    </port>
+  </service>
+</definitions>
+"""
+
+TEST_RESPONSE = """<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <helloResponse xmlns="urn:hello"><greeting>Hello %s</greeting></helloResponse>
+  </soap:Body>
+</soap:Envelope>
+"""
+
+
+class SOAPRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves TEST_WSDL and answers its hello() method, with keep-alive.
+    """
+    protocol_version = 'HTTP/1.1'
+    name_format = re.compile(r'<(?:\w+:)?name>(.*?)</')
+
+    def send_content(self, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.send_content(TEST_WSDL % {'url': self.server.url})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length')))
+        with self.server.lock:
+            self.server.connections.add(self.client_address)
+        self.send_content(TEST_RESPONSE %
+                          self.name_format.search(body).group(1))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SOAPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Kept-alive connections of the clients are dropped at exit
+        pass
+
+
+class TestSUDSWebServices(unittest.TestCase):
+    def setUp(self):
+        self.server = SOAPServer(('127.0.0.1', 0), SOAPRequestHandler)
+        self.server.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.server.connections = set()
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.client = suds.client.Client(self.server.url + '/wsdl',
+                                         cache=None,
+                                         transport=KeepAliveTransport())
+
+    def tearDown(self):
+        self.client.options.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_service(self):
+        service = Service.__new__(Service)
+        service.address = self.server.url + '/wsdl'
+        service._local = threading.local()
+        service.service = self.client
+        return service
+
+    def test_keep_alive(self):
+        """Calls reuse the connection to the endpoint"""
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(self.client.service.hello(name=name),
+                             'Hello %s' % name)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_concurrent_calls(self):
+        """Each thread has its own client and connection"""
+        service = self.create_service()
+        def call(name):
+            return service.threadService().service.hello(name=name)
+        names = [str(i) for i in xrange(12)]
+        pool = ThreadPool(3)
+        try:
+            results = pool.map(call, names)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(results, ['Hello %s' % name for name in names])
+        self.assertLessEqual(len(self.server.connections), 3)
+
+    def test_model_cache(self):
+        """The model read back from the cache is the one built from the WSDL
+        """
+        service = self.create_service()
+        service.setTypes()
+        service.setMethods()
+        d = pickle.loads(pickle.dumps(modelToDict(service.wstypes,
+                                                  service.wsmethods),
+                                      pickle.HIGHEST_PROTOCOL))
+        wstypes, wsmethods = dictToModel(d)
+        self.assertEqual(sorted(wsmethods), sorted(service.wsmethods))
+        self.assertIn(('hello', service.address), wsmethods)
+        for qname, m in service.wsmethods.iteritems():
+            self.assertEqual(wsmethods[qname].inputs, m.inputs)
+            self.assertEqual(wsmethods[qname].outputs, m.outputs)
+        self.assertEqual(sorted(wstypes), sorted(service.wstypes))
+        for qname, t in service.wstypes.iteritems():
+            self.assertEqual(wstypes[qname].enum, t.enum)
+            self.assertEqual(
+                    dict((n, p.__dict__) for n, p in wstypes[qname].parts.iteritems()),
+                    dict((n, p.__dict__) for n, p in t.parts.iteritems()))
@@ -40,7 +40,14 @@ without its associated data.
 
 This package uses a local cache, inside the per-user VisTrails directory. This
 way, files that haven't been changed do not need to be downloaded again. The
-check is performed efficiently using HTTP headers.
+check is performed efficiently using HTTP headers. The least recently used
+files are removed from the cache when it grows over the cache_quota setting.
 """
 
+from vistrails.core.configuration import ConfigurationObject
+
 from identifiers import *
+
+# cache_quota is in megabytes, 0 means no limit
+configuration = ConfigurationObject(max_connections=4,
+                                    cache_quota=2048)
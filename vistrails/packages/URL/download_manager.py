@@ -0,0 +1,880 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Download manager used by the URL package.
+
+DownloadManager keeps HTTP connections alive between requests to the same
+host, and downloads large files in several byte ranges, concurrently. An
+interrupted download keeps its partial file next to the destination and
+is resumed the next time the same URL is fetched, if the server still
+serves the same content (checked with If-Range).
+
+CacheIndex keeps track of the files in the package's cache directory and
+removes the least recently used ones when a quota is exceeded.
+"""
+
+import email.utils
+import httplib
+import json
+import os
+import shutil
+import socket
+import ssl
+import threading
+import time
+import urllib
+import urllib2
+import urlparse
+import weakref
+from multiprocessing.pool import ThreadPool
+
+from vistrails.core import debug
+
+from .https_if_available import build_opener, make_https_connection
+
+
+BUFFER_SIZE = 1 << 16
+SEGMENT_SIZE = 1 << 22
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+def _replace(src, dst):
+    if os.name == 'nt' and os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+class Response(object):
+    """A response to a GET request.
+
+    Wraps either an httplib response on a pooled connection, which is
+    given back to the pool once the body has been read, or a response
+    from a urllib2 opener.
+    """
+    def __init__(self, url, fp, status, reason, headers, release=None):
+        self.url = url
+        self.fp = fp
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._release = release
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def getheader(self, name, default=None):
+        return self.headers.getheader(name, default)
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self.fp.read()
+        else:
+            data = self.fp.read(amt)
+        if not data:
+            self.close()
+        return data
+
+    def close(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+        else:
+            self.fp.close()
+
+
+class ConnectionPool(object):
+    """Keeps idle HTTP(S) connections, per host.
+    """
+    def __init__(self, max_idle=4, timeout=None):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, key):
+        scheme, netloc, insecure = key
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if scheme == 'http':
+            return httplib.HTTPConnection(netloc, **kwargs)
+        elif not insecure:
+            return make_https_connection(netloc, **kwargs)
+        if hasattr(ssl, '_create_unverified_context'):
+            kwargs['context'] = ssl._create_unverified_context()
+        return httplib.HTTPSConnection(netloc, **kwargs)
+
+    def get(self, key):
+        """get(key: tuple) -> (connection, bool)
+
+        Returns an idle connection for (scheme, netloc, insecure) if there
+        is one, or a new connection. The boolean indicates whether the
+        connection was reused.
+        """
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def put(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+
+class ResourceChanged(Exception):
+    """The remote file changed while it was being downloaded in parts.
+    """
+
+
+class DownloadManager(object):
+    """Downloads files over HTTP(S), reusing connections.
+
+    Other URL schemes, and requests that go through a proxy, use a urllib2
+    opener instead.
+    """
+    def __init__(self, max_connections=4, segment_size=SEGMENT_SIZE,
+                 timeout=None):
+        self.max_connections = max(1, max_connections)
+        self.segment_size = segment_size
+        self.pool = ConnectionPool(self.max_connections, timeout)
+
+    def close(self):
+        self.pool.close()
+
+    ##########################################################################
+    # Requests
+
+    def _use_opener(self, scheme, netloc):
+        if scheme not in ('http', 'https'):
+            return True
+        proxies = urllib.getproxies()
+        return (scheme in proxies and
+                not urllib.proxy_bypass(netloc.split(':', 1)[0]))
+
+    def _open_with_opener(self, url, headers, insecure):
+        request = urllib2.Request(url, headers=headers)
+        try:
+            fp = build_opener(insecure=insecure).open(request)
+        except urllib2.HTTPError, e:
+            if e.code != 304:
+                raise
+            fp = e
+        return Response(fp.geturl(), fp, fp.getcode() or 200,
+                        getattr(fp, 'msg', ''), fp.info())
+
+    def _send(self, url, headers, insecure):
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        scheme = scheme.lower()
+        if self._use_opener(scheme, netloc):
+            return self._open_with_opener(url, headers, insecure)
+        selector = path or '/'
+        if query:
+            selector += '?' + query
+        headers = dict(headers)
+        headers.setdefault('User-Agent',
+                           'Python-urllib/%s' % urllib2.__version__)
+        key = (scheme, netloc.lower(), bool(insecure))
+        while True:
+            conn, reused = self.pool.get(key)
+            try:
+                conn.request('GET', selector, headers=headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error), e:
+                conn.close()
+                if reused:
+                    # The server closed this keep-alive connection
+                    continue
+                raise urllib2.URLError(e)
+            break
+
+        def release():
+            if not response.isclosed() and response.length == 0:
+                # No body (e.g. 304), mark the response as complete
+                response.read()
+            if response.isclosed() and not response.will_close:
+                self.pool.put(key, conn)
+            else:
+                conn.close()
+        return Response(url, response, response.status, response.reason,
+                        response.msg, release)
+
+    def open(self, url, headers={}, insecure=False):
+        """open(url: str, headers: dict, insecure: bool) -> Response
+
+        Sends a GET request, following redirections. Raises HTTPError if
+        the server returns an error, and URLError if it can't be reached.
+        """
+        for i in xrange(MAX_REDIRECTS + 1):
+            response = self._send(url, headers, insecure)
+            location = response.getheader('location')
+            if response.status not in REDIRECT_CODES or location is None:
+                break
+            response.read()
+            response.close()
+            url = urlparse.urljoin(url, location)
+        else:
+            response.close()
+            raise urllib2.HTTPError(url, response.status,
+                                    "Too many redirections",
+                                    response.headers, None)
+        if response.status >= 400:
+            response.read()
+            response.close()
+            raise urllib2.HTTPError(url, response.status, response.reason,
+                                    response.headers, None)
+        return response
+
+    ##########################################################################
+    # Downloads
+
+    @staticmethod
+    def _copy(response, fp, size=None):
+        """Copies a response body to a file, returns the number of bytes.
+        """
+        copied = 0
+        while size is None or copied < size:
+            if size is None:
+                chunk = response.read(BUFFER_SIZE)
+            else:
+                chunk = response.read(min(BUFFER_SIZE, size - copied))
+            if not chunk:
+                break
+            fp.write(chunk)
+            copied += len(chunk)
+        if size is not None and copied != size:
+            response.close()
+            raise IOError("Incomplete read: got %d bytes out of %d" % (
+                          copied, size))
+        response.close()
+        return copied
+
+    @staticmethod
+    def _read_state(filename):
+        try:
+            with open(filename + '.part.json', 'rb') as fp:
+                state = json.load(fp)
+        except (IOError, ValueError):
+            return None
+        if not os.path.isfile(filename + '.part'):
+            return None
+        return state
+
+    @staticmethod
+    def _write_state(filename, state):
+        with open(filename + '.part.json.tmp', 'wb') as fp:
+            json.dump(state, fp)
+        _replace(filename + '.part.json.tmp', filename + '.part.json')
+
+    @staticmethod
+    def _parse_content_range(value):
+        """Parses 'bytes start-end/total', returns (start, end, total).
+        """
+        try:
+            unit, value = value.split(None, 1)
+            byte_range, total = value.split('/', 1)
+            start, end = byte_range.split('-', 1)
+            return int(start), int(end), int(total)
+        except (AttributeError, ValueError):
+            return None
+
+    @staticmethod
+    def _get_validator(response):
+        etag = response.getheader('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return response.getheader('last-modified')
+
+    @staticmethod
+    def _is_newer(response, filename):
+        """Whether the response is newer than the local file.
+
+        Used when the server ignored our conditional request.
+        """
+        last_modified = response.getheader('last-modified')
+        if not last_modified:
+            return True
+        remote_time = email.utils.parsedate_tz(last_modified)
+        if remote_time is None:
+            debug.warning("Unable to parse Last-Modified header, "
+                          "downloading file")
+            return True
+        return (email.utils.mktime_tz(remote_time) >
+                os.path.getmtime(filename))
+
+    def _segment_range(self, state, index):
+        start = index * state['segment_size']
+        end = min(start + state['segment_size'], state['size']) - 1
+        return start, end
+
+    def _fetch_segment(self, url, filename, state, index, insecure):
+        start, end = self._segment_range(state, index)
+        headers = {'Range': 'bytes=%d-%d' % (start, end)}
+        if state['validator']:
+            headers['If-Range'] = state['validator']
+        response = self.open(url, headers, insecure)
+        if response.status != 206:
+            response.close()
+            raise ResourceChanged
+        with open(filename + '.part', 'r+b') as fp:
+            fp.seek(start)
+            self._copy(response, fp, end - start + 1)
+        return index
+
+    def fetch(self, url, filename, insecure=False, progress=None):
+        """fetch(url: str, filename: str, insecure: bool,
+                 progress: callable) -> bool
+
+        Downloads url to filename, unless filename is a current copy. The
+        ETag of the download is kept in filename + '.etag'. progress is
+        called with the number of bytes downloaded and the total size, if
+        known.
+
+        Returns True if the file was downloaded, False if the local copy
+        was still current.
+        """
+        try:
+            return self._fetch(url, filename, insecure, progress)
+        except ResourceChanged:
+            _remove(filename + '.part.json')
+            return self._fetch(url, filename, insecure, progress)
+
+    def _fetch(self, url, filename, insecure, progress):
+        headers = {}
+        state = self._read_state(filename)
+        cached = os.path.isfile(filename)
+        if state is not None:
+            if False in state['done']:
+                first = state['done'].index(False)
+            else:
+                first = 0
+            headers['If-Range'] = state['validator']
+            headers['Range'] = 'bytes=%d-%d' % self._segment_range(state,
+                                                                   first)
+        else:
+            headers['Range'] = 'bytes=0-%d' % (self.segment_size - 1)
+            if cached:
+                try:
+                    with open(filename + '.etag', 'rb') as fp:
+                        headers['If-None-Match'] = fp.read()
+                except IOError:
+                    pass
+                headers['If-Modified-Since'] = email.utils.formatdate(
+                        os.path.getmtime(filename), usegmt=True)
+
+        try:
+            response = self.open(url, headers, insecure)
+        except urllib2.HTTPError, e:
+            if e.code != 416:
+                raise
+            # The file is empty
+            del headers['Range']
+            response = self.open(url, headers, insecure)
+        if response.status == 304:
+            response.close()
+            return False
+
+        content_range = None
+        if response.status == 206:
+            content_range = self._parse_content_range(
+                    response.getheader('content-range'))
+        if content_range is None:
+            # Whole file
+            if state is None and cached and not self._is_newer(response,
+                                                               filename):
+                response.close()
+                return False
+            _remove(filename + '.part.json')
+            size = response.getheader('content-length')
+            size = int(size) if size and size.isdigit() else None
+            if progress is not None:
+                progress(0, size)
+            with open(filename + '.part', 'wb') as fp:
+                self._copy(response, fp, size)
+        else:
+            start, end, total = content_range
+            validator = self._get_validator(response)
+            if (state is None or state['size'] != total or
+                    state['validator'] != validator):
+                nb_segments = ((total + self.segment_size - 1) //
+                               self.segment_size)
+                state = {'url': url,
+                         'size': total,
+                         'segment_size': self.segment_size,
+                         'validator': validator,
+                         'done': [False] * nb_segments}
+                with open(filename + '.part', 'wb') as fp:
+                    fp.truncate(total)
+            first = start // state['segment_size']
+            if self._segment_range(state, first) != (start, end):
+                response.close()
+                raise ResourceChanged
+            with open(filename + '.part', 'r+b') as fp:
+                fp.seek(start)
+                self._copy(response, fp, end - start + 1)
+            self._download_segments(url, filename, state, first, insecure,
+                                    progress)
+
+        _replace(filename + '.part', filename)
+        _remove(filename + '.part.json')
+        etag = response.getheader('etag')
+        if etag:
+            with open(filename + '.etag', 'wb') as fp:
+                fp.write(etag)
+        else:
+            _remove(filename + '.etag')
+        return True
+
+    def _download_segments(self, url, filename, state, first, insecure,
+                           progress):
+        done = state['done']
+        def segment_done(index):
+            done[index] = True
+            if state['validator']:
+                # Only resume downloads that can be checked with If-Range
+                self._write_state(filename, state)
+            if progress is not None:
+                nb_bytes = sum(self._segment_range(state, i)[1] -
+                               self._segment_range(state, i)[0] + 1
+                               for i, d in enumerate(done) if d)
+                progress(nb_bytes, state['size'])
+        segment_done(first)
+
+        remaining = [i for i, d in enumerate(done) if not d]
+        if not remaining:
+            return
+        threads = min(self.max_connections, len(remaining))
+        if threads == 1:
+            for index in remaining:
+                segment_done(self._fetch_segment(url, filename, state, index,
+                                                 insecure))
+            return
+        pool = ThreadPool(threads)
+        try:
+            for index in pool.imap_unordered(
+                    lambda i: self._fetch_segment(url, filename, state, i,
+                                                  insecure),
+                    remaining):
+                segment_done(index)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+_download_manager = None
+
+def get_download_manager():
+    global _download_manager
+    if _download_manager is None:
+        _download_manager = DownloadManager()
+    return _download_manager
+
+def set_download_manager(manager):
+    global _download_manager
+    if _download_manager is not None and _download_manager is not manager:
+        _download_manager.close()
+    _download_manager = manager
+
+
+###############################################################################
+
+class CacheIndex(object):
+    """Index of the files in a cache directory, with LRU eviction.
+
+    Each cached file can have sidecar files (ETag, partial download) that
+    are accounted and evicted with it; directories are accounted and
+    evicted as a whole. The index is stored as JSON in the directory; files
+    that are not in it are added when it is loaded.
+
+    A file touched with an owner is not evicted while the owner is alive,
+    so that the modules still using a file (e.g. from the interpreter's
+    cache) don't lose it.
+    """
+    INDEX_FILENAME = '.cache_index.json'
+    SIDECAR_SUFFIXES = ('.etag', '.part', '.part.json', '.part.json.tmp')
+
+    def __init__(self, directory, quota=0):
+        self.directory = directory
+        self.quota = quota
+        self._entries = {}
+        self._owners = weakref.WeakKeyDictionary() # owner -> name
+        self._lock = threading.Lock()
+        self.load()
+
+    def _size(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            size = 0
+            for dirpath, dirnames, filenames in os.walk(path):
+                for filename in filenames:
+                    try:
+                        size += os.path.getsize(os.path.join(dirpath,
+                                                             filename))
+                    except OSError:
+                        pass
+            return size
+        size = 0
+        for suffix in ('',) + self.SIDECAR_SUFFIXES:
+            try:
+                size += os.path.getsize(os.path.join(self.directory,
+                                                     name + suffix))
+            except OSError:
+                pass
+        return size
+
+    def load(self):
+        index_filename = os.path.join(self.directory, self.INDEX_FILENAME)
+        try:
+            with open(index_filename, 'rb') as fp:
+                entries = json.load(fp)
+        except (IOError, ValueError):
+            entries = {}
+        self._entries = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if (name == self.INDEX_FILENAME or
+                    name.endswith(self.SIDECAR_SUFFIXES) or
+                    not os.path.exists(os.path.join(self.directory, name))):
+                continue
+            if name in entries:
+                url, atime, size = entries[name]
+            else:
+                url = urllib.unquote_plus(name)
+                atime = os.path.getmtime(os.path.join(self.directory, name))
+                size = self._size(name)
+            self._entries[name] = [url, atime, size]
+
+    def save(self):
+        index_filename = os.path.join(self.directory, self.INDEX_FILENAME)
+        with open(index_filename + '.tmp', 'wb') as fp:
+            json.dump(self._entries, fp)
+        _replace(index_filename + '.tmp', index_filename)
+
+    def total_size(self):
+        return sum(entry[2] for entry in self._entries.itervalues())
+
+    def touch(self, filename, url=None, owner=None):
+        """touch(filename: str, url: str, owner: object) -> None
+
+        Records an access to a file or directory of the cache, and evicts
+        other files if the cache is over quota. If an owner is given, the
+        file is kept for as long as it is alive.
+        """
+        name = os.path.basename(filename)
+        with self._lock:
+            if owner is not None:
+                self._owners[owner] = name
+            if url is None:
+                url = self._entries.get(name, [urllib.unquote_plus(name)])[0]
+            self._entries[name] = [url, time.time(), self._size(name)]
+            self._evict(keep=name)
+            self.save()
+
+    def remove(self, name):
+        path = os.path.join(self.directory, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        for suffix in ('',) + self.SIDECAR_SUFFIXES:
+            _remove(path + suffix)
+        self._entries.pop(name, None)
+
+    def _evict(self, keep=None):
+        if not self.quota:
+            return
+        total = self.total_size()
+        if total <= self.quota:
+            return
+        pinned = set(self._owners.values())
+        lru = sorted(self._entries.iteritems(), key=lambda e: e[1][1])
+        for name, (url, atime, size) in lru:
+            if total <= self.quota:
+                break
+            if name == keep or name in pinned:
+                continue
+            debug.log("Removing %s from the download cache" % url)
+            self.remove(name)
+            total -= size
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+            self.save()
+
+
+###############################################################################
+
+import unittest
+import BaseHTTPServer
+import hashlib
+import re
+import shutil
+import SocketServer
+import tempfile
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves server.files, with keep-alive and byte ranges.
+    """
+    protocol_version = 'HTTP/1.1'
+    range_format = re.compile(r'^bytes=([0-9]+)-([0-9]*)$')
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        content = self.server.files.get(self.path)
+        byte_range = self.headers.getheader('range')
+        with self.server.lock:
+            self.server.requests.append((self.path, byte_range))
+        if content is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        if self.headers.getheader('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        if_range = self.headers.getheader('if-range')
+        m = None
+        if byte_range is not None and if_range in (None, etag):
+            m = self.range_format.match(byte_range)
+        if m is not None:
+            start = int(m.group(1))
+            end = min(int(m.group(2) or len(content) - 1), len(content) - 1)
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, end, len(content)))
+            content = content[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestDownloadManager(unittest.TestCase):
+    def setUp(self):
+        self.server = RangeHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        self.directory = tempfile.mkdtemp(prefix='vt_test_download_')
+        self.manager = DownloadManager(max_connections=3, segment_size=1000)
+
+    def tearDown(self):
+        self.manager.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def read(self, filename):
+        with open(filename, 'rb') as fp:
+            return fp.read()
+
+    def test_keepalive(self):
+        self.server.files['/a'] = 'aaa'
+        self.server.files['/b'] = ''
+        filename = os.path.join(self.directory, 'a')
+        self.assertTrue(self.manager.fetch(self.url + '/a', filename))
+        self.assertEqual(self.read(filename), 'aaa')
+        self.assertEqual(self.read(filename + '.etag'),
+                         '"%s"' % hashlib.sha1('aaa').hexdigest())
+        # Not modified
+        self.assertFalse(self.manager.fetch(self.url + '/a', filename))
+        # Empty file
+        filename = os.path.join(self.directory, 'b')
+        self.assertTrue(self.manager.fetch(self.url + '/b', filename))
+        self.assertEqual(self.read(filename), '')
+        self.assertEqual(self.server.connections, 1)
+
+        self.assertRaises(urllib2.HTTPError,
+                          self.manager.open, self.url + '/missing')
+
+    def test_segments(self):
+        content = ''.join(chr(i % 251) for i in xrange(10500))
+        self.server.files['/big'] = content
+        filename = os.path.join(self.directory, 'big')
+        progress = []
+        self.assertTrue(self.manager.fetch(
+                self.url + '/big', filename,
+                progress=lambda done, total: progress.append((done, total))))
+        self.assertEqual(self.read(filename), content)
+        self.assertEqual(len(self.server.requests), 11)
+        self.assertEqual(progress[-1], (10500, 10500))
+        self.assertFalse(os.path.exists(filename + '.part'))
+        self.assertFalse(os.path.exists(filename + '.part.json'))
+
+    def test_resume(self):
+        content = ''.join(chr(i % 251) for i in xrange(5500))
+        self.server.files['/big'] = content
+        filename = os.path.join(self.directory, 'big')
+        manager = DownloadManager(max_connections=1, segment_size=1000)
+        def interrupt(done, total):
+            if done >= 3000:
+                raise KeyboardInterrupt
+        try:
+            self.assertRaises(KeyboardInterrupt, manager.fetch,
+                              self.url + '/big', filename,
+                              progress=interrupt)
+        finally:
+            manager.close()
+        self.assertTrue(os.path.exists(filename + '.part.json'))
+
+        del self.server.requests[:]
+        self.assertTrue(self.manager.fetch(self.url + '/big', filename))
+        self.assertEqual(self.read(filename), content)
+        self.assertEqual(sorted(r for p, r in self.server.requests),
+                         ['bytes=3000-3999', 'bytes=4000-4999',
+                          'bytes=5000-5499'])
+
+        # Content changed while resuming: starts over
+        manager = DownloadManager(max_connections=1, segment_size=1000)
+        try:
+            self.assertRaises(KeyboardInterrupt, manager.fetch,
+                              self.url + '/big', filename + '2',
+                              progress=interrupt)
+        finally:
+            manager.close()
+        content = content[::-1]
+        self.server.files['/big'] = content
+        self.assertTrue(self.manager.fetch(self.url + '/big', filename + '2'))
+        self.assertEqual(self.read(filename + '2'), content)
+
+
+class TestCacheIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_test_cache_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, size):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as fp:
+            fp.write('x' * size)
+        return filename
+
+    def test_lru(self):
+        self.write('old', 40)
+        self.write('old.etag', 5)
+        index = CacheIndex(self.directory, quota=100)
+        self.assertEqual(index.total_size(), 45)
+        index.touch(self.write('a', 40))
+        index.touch(self.write('b', 10))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'a', 'b', 'old', 'old.etag'])
+        index.touch(os.path.join(self.directory, 'old'))
+        index.touch(self.write('c', 30))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'b', 'c', 'old', 'old.etag'])
+        self.assertEqual(index.total_size(), 85)
+
+        index = CacheIndex(self.directory, quota=50)
+        index.evict()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'c'])
+
+    def test_owners_and_directories(self):
+        class Owner(object):
+            pass
+        os.mkdir(os.path.join(self.directory, 'dir'))
+        self.write(os.path.join('dir', 'data'), 40)
+        os.utime(os.path.join(self.directory, 'dir'), (0, 0))
+        index = CacheIndex(self.directory, quota=100)
+        self.assertEqual(index.total_size(), 40)
+        owner = Owner()
+        index.touch(self.write('a', 40), owner=owner)
+        index.touch(self.write('b', 40))
+        # 'dir' is the oldest, 'a' is in use
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'a', 'b'])
+        index.touch(self.write('c', 40))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'a', 'c'])
+        del owner
+        index.touch(self.write('d', 40))
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.cache_index.json', 'c', 'd'])
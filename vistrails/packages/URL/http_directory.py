@@ -4,7 +4,7 @@ from HTMLParser import HTMLParser
 import os
 import re
 
-from .https_if_available import build_opener
+from .download_manager import BUFFER_SIZE, get_download_manager
 
 
 re_url = re.compile(r'^(([a-zA-Z_-]+)://([^/]+))(/.*)?$')
@@ -54,7 +54,7 @@ class ListingParser(HTMLParser):
                     break
 
 
-def download_directory(url, target, insecure=False):
+def download_directory(url, target, insecure=False, manager=None):
     def mkdir():
         if not mkdir.done:
             try:
@@ -64,11 +64,13 @@ def download_directory(url, target, insecure=False):
             mkdir.done = True
     mkdir.done = False
 
-    opener = build_opener(insecure=insecure)
-    response = opener.open(url)
+    if manager is None:
+        manager = get_download_manager()
+    response = manager.open(url, insecure=insecure)
 
     if response.info().type == 'text/html':
         contents = response.read()
+        response.close()
 
         parser = ListingParser(url)
         parser.feed(contents)
@@ -82,7 +84,8 @@ def download_directory(url, target, insecure=False):
             if '?' in name:
                 continue
             mkdir()
-            download_directory(link, os.path.join(target, name), insecure)
+            download_directory(link, os.path.join(target, name), insecure,
+                               manager)
         if not mkdir.done:
             # We didn't find anything to write inside this directory
             # Maybe it's a HTML file?
@@ -93,12 +96,12 @@ def download_directory(url, target, insecure=False):
                 with open(target, 'wb') as fp:
                     fp.write(contents)
     else:
-        buffer_size = 4096
         with open(target, 'wb') as fp:
-            chunk = response.read(buffer_size)
+            chunk = response.read(BUFFER_SIZE)
             while chunk:
                 fp.write(chunk)
-                chunk = response.read(buffer_size)
+                chunk = response.read(BUFFER_SIZE)
+        response.close()
 
 
 ###############################################################################
@@ -12,7 +12,8 @@ import certifi
 from backports.ssl_match_hostname import match_hostname
 
 
-__all__ = ['VerifiedHTTPSHandler', 'https_handler', 'build_opener']
+__all__ = ['VerifiedHTTPSHandler', 'https_handler', 'build_opener',
+           'make_https_connection']
 
 
 class CertValidatingHTTPSConnection(httplib.HTTPConnection):
@@ -69,3 +70,8 @@ def build_opener(*handlers, **kwargs):
         handlers = handlers + (https_handler,)
     handlers = handlers + (urllib2.ProxyHandler(),)
     return urllib2.build_opener(*handlers)
+
+
+def make_https_connection(host, port=None, **kwargs):
+    return CertValidatingHTTPSConnection(host, port, ca_certs=certifi.where(),
+                                         **kwargs)
@@ -1,3 +1,4 @@
+import httplib
 import urllib2
 
 from vistrails.core.bundles.pyimport import py_import
@@ -17,5 +18,10 @@ except ImportError:
             debug.warning("Unable to use secure SSL requests -- please "
                           "install certifi and ssl_match_hostname")
         return urllib2.build_opener(*args, **kwargs)
+
+    def make_https_connection(host, port=None, **kwargs):
+        debug.warning("Unable to use secure SSL requests -- please "
+                      "install certifi and ssl_match_hostname")
+        return httplib.HTTPSConnection(host, port, **kwargs)
 else:
     from .https import *
@@ -40,11 +40,10 @@ without its associated data.
 
 This package uses a local cache, inside the per-user VisTrails directory. This
 way, files that haven't been changed do not need to be downloaded again. The
-check is performed efficiently using HTTP headers.
+check is performed efficiently using HTTP headers. The least recently used
+files are removed from the cache when it grows over the cache_quota setting.
 """
 
-from datetime import datetime
-import email.utils
 import hashlib
 import os
 import re
@@ -58,7 +57,7 @@ import vistrails.core.modules.basic_modules
 from vistrails.core.modules.basic_modules import PathObject
 import vistrails.core.modules.module_registry
 from vistrails.core.modules.vistrails_module import Module, ModuleError
-from vistrails.core.system import current_dot_vistrails, strptime
+from vistrails.core.system import current_dot_vistrails
 from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
 import vistrails.gui.repository
 from vistrails.gui.utils import show_warning
@@ -67,11 +66,14 @@ from vistrails.core.repository.poster.encode import multipart_encode
 from vistrails.core.repository.poster.streaminghttp import register_openers
 
 from .identifiers import identifier
+from .download_manager import BUFFER_SIZE, CacheIndex, DownloadManager, \
+    get_download_manager, set_download_manager
 from .http_directory import download_directory
 from .https_if_available import build_opener
 
 
 package_directory = None
+cache_index = None
 
 
 ###############################################################################
@@ -80,6 +82,7 @@ class Downloader(object):
     def __init__(self, url, module, insecure):
         self.url = url
         self.module = module
+        self.insecure = insecure
         self.opener = build_opener(insecure=insecure)
 
     def execute(self):
@@ -133,14 +136,13 @@ class Downloader(object):
     def download(self, response):
         try:
             dl_size = 0
-            CHUNKSIZE = 4096
             f2 = open(self.local_filename, 'wb')
             while True:
                 if self.size_header is not None:
                     self.module.logging.update_progress(
                             self.module,
                             dl_size*1.0/self.size_header)
-                chunk = response.read(CHUNKSIZE)
+                chunk = response.read(BUFFER_SIZE)
                 if not chunk:
                     break
                 dl_size += len(chunk)
@@ -166,81 +168,38 @@ class Downloader(object):
 
 
 class HTTPDownloader(Downloader):
-    def pre_download(self):
-        # Get ETag from disk
-        try:
-            with open(self.local_filename + '.etag') as etag_file:
-                self.etag = etag_file.read()
-        except IOError:
-            self.etag = None
+    """Downloads over HTTP(S) using the package's DownloadManager.
 
-    def send_request(self):
-        try:
-            request = urllib2.Request(self.url)
-            if self.etag is not None:
-                request.add_header(
-                    'If-None-Match',
-                    self.etag)
-            try:
-                mtime = email.utils.formatdate(
-                        os.path.getmtime(self.local_filename),
-                        usegmt=True)
-                request.add_header(
-                    'If-Modified-Since',
-                    mtime)
-            except OSError:
-                pass
-            return self.opener.open(request)
-        except urllib2.HTTPError, e:
-            if e.code == 304:
-                # Not modified
-                return None
-            raise
-
-    def read_headers(self, response):
-        try:
-            self.mod_header = response.headers['last-modified']
-        except KeyError:
-            self.mod_header = None
-        try:
-            size_header = response.headers['content-length']
-            if not size_header:
-                raise ValueError
-            self.size_header = int(size_header)
-        except (KeyError, ValueError):
-            self.size_header = None
-        return True
-
-    def _is_outdated(self):
-        local_time = datetime.utcfromtimestamp(
-                os.path.getmtime(self.local_filename))
-        try:
-            remote_time = strptime(self.mod_header,
-                                   "%a, %d %b %Y %H:%M:%S %Z")
-        except ValueError:
-            try:
-                remote_time = strptime(self.mod_header,
-                                       "%a, %d %B %Y %H:%M:%S %Z")
-            except ValueError:
-                # unable to parse last-modified header, download file again
-                debug.warning("Unable to parse Last-Modified header, "
-                              "downloading file")
-                return True
-        return remote_time > local_time
+    The manager reuses connections, downloads large files in concurrent
+    parts and resumes interrupted downloads. Requests are conditional
+    (ETag, modification time) so unchanged files are not downloaded again.
+    """
+    def execute(self):
+        self.local_filename = os.path.join(package_directory,
+                                           urllib.quote_plus(self.url))
 
-    def download(self, response):
-        if (not self.is_in_local_cache or
-                not self.mod_header or self._is_outdated()):
-            Downloader.download(self, response)
+        def progress(dl_size, size):
+            if size:
+                self.module.logging.update_progress(self.module,
+                                                    dl_size*1.0/size)
 
-    def post_download(self, response):
         try:
-            etag = response.headers['ETag']
-        except KeyError:
-            pass
-        else:
-            with open(self.local_filename + '.etag', 'w') as etag_file:
-                etag = etag_file.write(etag)
+            get_download_manager().fetch(self.url, self.local_filename,
+                                         self.insecure, progress)
+        except urllib2.URLError, e:
+            if not self.is_in_local_cache:
+                raise ModuleError(
+                        self.module,
+                        "Network error: %s" % debug.format_exception(e))
+            debug.warning("A network error occurred. DownloadFile will "
+                          "use a cached version of the file")
+        except Exception, e:
+            raise ModuleError(
+                    self.module,
+                    "Error retrieving URL: %s" % debug.format_exception(e))
+        if cache_index is not None:
+            cache_index.touch(self.local_filename, self.url, self.module)
+        return self.local_filename
 
 
 class SSHDownloader(object):
@@ -334,6 +293,8 @@ class SSHDownloader(object):
         client = scp.SCPClient(ssh.get_transport())
 
         client.get(path, local_filename)
+        if cache_index is not None:
+            cache_index.touch(local_filename, self.url, self.module)
         return local_filename
 
 
@@ -378,6 +339,17 @@ class DownloadFile(Module):
         result = PathObject(local_filename)
         self.set_output('file', result)
 
+    def is_cacheable(self):
+        # The download cache doesn't evict the files of live modules, but
+        # the copies made to iterate on a list don't stay alive; if a file
+        # is gone, the interpreter has to drop this module and run it again
+        filenames = self.outputPorts.get('local_filename')
+        if filenames is None:
+            return True
+        if not isinstance(filenames, list):
+            filenames = [filenames]
+        return all(os.path.exists(f) for f in filenames)
+
     def download(self, url, insecure):
         """ Tries to download a file from url.
 
@@ -458,9 +430,10 @@ class RepoSync(Module):
                                                    self.checksum)
         self.on_server = False
         try:
-            check_dataset_on_repo = urllib2.urlopen(url=checksum_url)
+            check_dataset_on_repo = get_download_manager().open(checksum_url)
             self.up_to_date = True if \
                     check_dataset_on_repo.read() == 'uptodate' else False
+            check_dataset_on_repo.close()
             self.on_server = True
         except urllib2.HTTPError:
             self.up_to_date = True
@@ -524,9 +497,12 @@ class RepoSync(Module):
                 if not self._file_is_in_local_cache(local_filename):
                     # file not in cache, download.
                     try:
-                        urllib.urlretrieve(self.url, local_filename)
-                    except IOError, e:
+                        get_download_manager().fetch(self.url,
+                                                     local_filename)
+                    except (urllib2.URLError, IOError), e:
                         raise ModuleError(self, ("Invalid URL: %s" % e))
+                if cache_index is not None:
+                    cache_index.touch(local_filename, self.url, self)
                 out_file = PathObject(local_filename)
                 debug.warning('RepoSync is using repository data')
                 self.set_output("file", out_file)
@@ -540,8 +516,9 @@ class RepoSync(Module):
             # get file path
             path_url = "%s/datasets/path/%s/"%(self.base_url, self.checksum)
             try:
-                dataset_path_request = urllib2.urlopen(url=path_url)
+                dataset_path_request = get_download_manager().open(path_url)
                 dataset_path = dataset_path_request.read()
+                dataset_path_request.close()
             except urllib2.HTTPError:
                 pass
 
@@ -639,7 +616,7 @@ def initialize(*args, **keywords):
     reg.add_input_port(URLDecode, "encoded", basic.String)
     reg.add_output_port(URLDecode, "string", basic.String)
 
-    global package_directory
+    global package_directory, cache_index
     dotVistrails = current_dot_vistrails()
     package_directory = os.path.join(dotVistrails, "HTTP")
 
@@ -651,6 +628,22 @@ def initialize(*args, **keywords):
             raise RuntimeError("Failed to create cache directory: %s" %
                                package_directory, e)
 
+    max_connections = 4
+    if configuration.check('max_connections'):
+        max_connections = configuration.max_connections
+    set_download_manager(DownloadManager(max_connections))
+    quota = 0
+    if configuration.check('cache_quota'):
+        quota = configuration.cache_quota * 1024 * 1024
+    cache_index = CacheIndex(package_directory, quota)
+    cache_index.evict()
+
+
+def finalize():
+    global cache_index
+    get_download_manager().close()
+    cache_index = None
+
 
 def handle_module_upgrade_request(controller, module_id, pipeline):
     module_remap = {
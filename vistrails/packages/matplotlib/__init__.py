@@ -34,12 +34,27 @@
 """Matplotlib package for VisTrails.
 
 This package wrap Matplotlib to provide a plotting tool for
-VisTrails. We are going to use the 'Qt4Agg' backend of the library.
+VisTrails. We are going to use the 'Qt4Agg' backend of the library, or the
+'Agg' one when there is no display.
 
 """
 
+from vistrails.core.configuration import ConfigurationObject
+
 from identifiers import *
 
+# backend overrides the automatic choice of the matplotlib backend
+# figure_cache keeps the image files written by MplFigureOutput in
+# cache_directory (by default matplotlib_cache in the per-user VisTrails
+# directory), keyed by the signature of the figure; only enable it if the
+# plots do not depend on anything outside the workflow, such as random numbers
+# max_processes bounds the processes writing image files at once when
+# iterating over a list of figures, it defaults to the number of CPUs
+configuration = ConfigurationObject(backend=(None, str),
+                                    figure_cache=False,
+                                    cache_directory=(None, str),
+                                    max_processes=(None, int))
+
 def package_dependencies():
     import vistrails.core.packagemanager
     manager = vistrails.core.packagemanager.get_package_manager()
@@ -48,6 +63,16 @@ def package_dependencies():
     else:
         return []
 
+def registry_snapshot_token():
+    """registry_snapshot_token() -> str
+
+    The plot modules are generated from the installed matplotlib, so a
+    registry snapshot is only valid for the same matplotlib version.
+
+    """
+    import matplotlib
+    return matplotlib.__version__
+
 def package_requirements():
     from vistrails.core.requirements import require_python_module
     require_python_module('numpy', {
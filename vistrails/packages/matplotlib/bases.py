@@ -32,19 +32,35 @@
 ##
 ###############################################################################
 
+import copy
+import cPickle as pickle
+import functools
+import glob
 import itertools
+import json
 import matplotlib
+from matplotlib import _png
 from matplotlib.backend_bases import FigureCanvasBase
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import multiprocessing
+import numpy
+import os
 import pylab
+import shutil
+import sys
+import tempfile
 import urllib
 
-from matplotlib.backend_bases import FigureCanvasBase
-
+from vistrails.core import debug
+from vistrails.core.cache.utils import sha_hash
 from vistrails.core.modules.basic_modules import CodeRunnerMixin
 from vistrails.core.modules.config import ModuleSettings, IPort
 from vistrails.core.modules.output_modules import ImageFileMode, \
     ImageFileModeConfig, OutputModule
-from vistrails.core.modules.vistrails_module import Module, NotCacheable
+from vistrails.core.modules.vistrails_module import Module, ModuleError, \
+    NotCacheable
+import vistrails.core.system
+from vistrails.core.utils import imap_window
 
 ################################################################################
 
@@ -80,9 +96,11 @@ class MplSource(CodeRunnerMixin, MplPlot):
                                                                  source))
 
     def plot_figure(self, figure, source):
+        # the figure is selected here rather than in the code so that the
+        # compiled code can be reused for every figure
+        pylab.figure(figure.number)
         s = ('from pylab import *\n'
              'from numpy import *\n' +
-             'figure(%d)\n' % figure.number +
              urllib.unquote(source))
         self.run_code(s, use_input=True, use_output=True)
 
@@ -94,27 +112,65 @@ class MplFigure(Module):
 
     _output_ports = [("self", "(MplFigure)")]
 
+    _figure = None
+
     def compute(self):
+        # The output is a copy of the module so that iterating gives
+        # different figures
+        value = copy.copy(self)
+        value.plots = self.get_input("addPlot")
+        value.figure_props = self.force_get_input("figureProperties")
+        value.axes_props = self.force_get_input("axesProperties")
+        value.has_legend = self.has_input("setLegend")
+        # If this figure is in the cache, it is only drawn if something
+        # needs it that the cache doesn't have; else it is drawn here, so
+        # that errors in the plots are raised by this module
+        if not is_figure_cached(getattr(self, 'signature', None)):
+            value._figure = value.draw()
+        self.set_output("self", value)
+
+    def _get_figInstance(self):
+        if self._figure is None:
+            self._figure = self.draw()
+        return self._figure
+    figInstance = property(_get_figInstance)
+
+    def is_drawn(self):
+        """is_drawn() -> bool
+        Whether the figure was drawn already.
+
+        """
+        return self._figure is not None
+
+    def close(self):
+        """close() -> None
+        Closes the figure; it is drawn again if it is needed.
+
+        """
+        if self._figure is not None:
+            pylab.close(self._figure)
+            self._figure = None
+
+    def draw(self):
+        """draw() -> Figure
+        Creates the figure and runs the plots on it.
+
+        """
         # Create a figure
-        self.figInstance = pylab.figure()
+        figure = pylab.figure()
         pylab.hold(True)
 
         # Run the plots
-        plots = self.get_input("addPlot")
-        for plot in plots:
-            plot(self.figInstance)
-
-        if self.has_input("figureProperties"):
-            figure_props = self.get_input("figureProperties")
-            figure_props.update_props(self.figInstance)
-        if self.has_input("axesProperties"):
-            axes_props = self.get_input("axesProperties")
-            axes_props.update_props(self.figInstance.gca())
-        if self.has_input("setLegend"):
-            legend = self.get_input("setLegend")
-            self.figInstance.gca().legend()
-
-        self.set_output("self", self)
+        for plot in self.plots:
+            plot(figure)
+
+        if self.figure_props is not None:
+            self.figure_props.update_props(figure)
+        if self.axes_props is not None:
+            self.axes_props.update_props(figure.gca())
+        if self.has_legend:
+            figure.gca().legend()
+        return figure
 
 class MplContourSet(Module):
     pass
@@ -122,33 +178,305 @@ class MplContourSet(Module):
 class MplQuadContourSet(MplContourSet):
     pass
 
+def _get_configuration():
+    # init copies it from the package only once it is loaded
+    return sys.modules[__name__.rsplit('.', 1)[0]].configuration
+
+def get_cache_directory():
+    """get_cache_directory() -> str
+    Returns the directory of the figure cache, or None if it is disabled.
+
+    """
+    configuration = _get_configuration()
+    if not configuration.check('figure_cache'):
+        return None
+    if configuration.check('cache_directory'):
+        directory = configuration.cache_directory
+    else:
+        directory = os.path.join(vistrails.core.system.current_dot_vistrails(),
+                                 "matplotlib_cache")
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError, e: # pragma: no cover
+            if not os.path.isdir(directory):
+                debug.warning("Could not create matplotlib cache directory "
+                              "'%s'" % directory, e)
+                return None
+    return directory
+
+def get_cache_prefix(signature):
+    """get_cache_prefix(signature: str) -> str
+    Returns the path prefix of the files of a figure in the figure cache,
+    or None if the cache is disabled or the figure has no signature.
+
+    """
+    directory = get_cache_directory()
+    if directory is None or signature is None:
+        return None
+    key = sha_hash(json.dumps([signature, matplotlib.__version__]))
+    return os.path.join(directory, key.hexdigest())
+
+def is_figure_cached(signature):
+    """is_figure_cached(signature: str) -> bool
+    Whether the figure cache has an image of this figure, of any size or
+    format.
+
+    """
+    prefix = get_cache_prefix(signature)
+    return prefix is not None and bool(glob.glob(prefix + '_*'))
+
+def get_max_processes():
+    """get_max_processes() -> int
+    Returns how many processes can write image files at once when a list
+    of figures is output.
+
+    """
+    configuration = _get_configuration()
+    if configuration.check('max_processes'):
+        return configuration.max_processes
+    return multiprocessing.cpu_count()
+
+def write_figure(figure, filename, img_format, width, height):
+    """write_figure(figure: Figure, filename: str, img_format: str,
+                    width: int, height: int) -> None
+    Writes the figure to an image file of the given size in pixels.
+    The figure is given back to the canvas it was displayed on, if any.
+
+    """
+    w_inches = width / 72.0
+    h_inches = height / 72.0
+
+    previous_canvas = figure.canvas
+    previous_size = tuple(figure.get_size_inches())
+    figure.set_size_inches(w_inches, h_inches)
+    try:
+        canvas = FigureCanvasBase(figure)
+        canvas.print_figure(filename, dpi=72, format=img_format)
+    finally:
+        figure.set_size_inches(previous_size[0],previous_size[1])
+        if previous_canvas is not None:
+            figure.set_canvas(previous_canvas)
+
+def render_figure(figure, width, height):
+    """render_figure(figure: Figure, width: int, height: int)
+        -> numpy.ndarray
+    Draws the figure on an Agg canvas of the given size in pixels and
+    returns a copy of the image, as a height x width x 4 RGBA array.
+    The figure is given back to the canvas it was displayed on, if any.
+
+    """
+    previous_canvas = figure.canvas
+    previous_size = tuple(figure.get_size_inches())
+    previous_dpi = figure.get_dpi()
+    figure.set_size_inches(width / 72.0, height / 72.0)
+    figure.set_dpi(72)
+    try:
+        canvas = FigureCanvasAgg(figure)
+        canvas.draw()
+        w, h = canvas.get_width_height()
+        return numpy.frombuffer(canvas.buffer_rgba(),
+                                numpy.uint8).reshape(h, w, 4).copy()
+    finally:
+        figure.set_dpi(previous_dpi)
+        figure.set_size_inches(previous_size[0], previous_size[1])
+        if previous_canvas is not None:
+            figure.set_canvas(previous_canvas)
+
+def write_png(image, filename):
+    """write_png(image: numpy.ndarray, filename: str) -> None
+    Encodes an image returned by render_figure() to a PNG file. This does
+    not touch any figure, so it may run on a worker thread.
+
+    """
+    _png.write_png(image, filename, 72)
+
+def _init_export_process():
+    # unpickled figures are added to pylab, which must not use the GUI here
+    pylab.switch_backend('agg')
+
+def write_pickled_figure(args):
+    """write_pickled_figure(args: tuple) -> None
+    Writes an image file from the arguments returned by
+    FigureExport.pickle(), in a process of the export pool.
+
+    """
+    data, filename, img_format, width, height = args
+    figure = pickle.loads(data)
+    try:
+        write_figure(figure, filename, img_format, width, height)
+    finally:
+        pylab.close(figure)
+
+class FigureExport(object):
+    """An image file to write from a figure.
+
+    MplFigureToFile prepares it, then it is either written in this process,
+    or from a pickled copy of the figure in another one. If the figure cache
+    is enabled, the file is stored under a key made of the signature of the
+    figure, the size and the format, and copied from there the next time
+    instead of drawing and writing the figure again. A figure that had to be
+    drawn only to be written is closed afterwards.
+
+    """
+    def __init__(self, value, filename, img_format, width, height):
+        self.value = value
+        self.filename = filename
+        self.img_format = img_format
+        self.width = width
+        self.height = height
+
+        self.cache_file = None
+        prefix = get_cache_prefix(getattr(value, 'signature', None))
+        if prefix is not None:
+            self.cache_file = '%s_%sx%s.%s' % (prefix, width, height,
+                                               img_format)
+
+    def from_cache(self):
+        """from_cache() -> bool
+        Copies the image from the figure cache, if it is there.
+
+        """
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return False
+        shutil.copyfile(self.cache_file, self.filename)
+        return True
+
+    def store(self):
+        """store() -> None
+        Adds the written image to the figure cache.
+
+        """
+        if self.cache_file is None:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.cache_file))
+            os.close(fd)
+            shutil.copyfile(self.filename, tmp)
+            if os.path.exists(self.cache_file):
+                # windows cannot rename over a file
+                os.remove(self.cache_file)
+            os.rename(tmp, self.cache_file)
+        except (IOError, OSError), e: # pragma: no cover
+            debug.warning("Could not add figure to the cache", e)
+
+    def write(self):
+        """write() -> None
+        Writes the image in this process.
+
+        """
+        drawn = self.value.is_drawn()
+        try:
+            write_figure(self.value.figInstance, self.filename,
+                         self.img_format, self.width, self.height)
+        finally:
+            if not drawn:
+                self.value.close()
+
+    def pickle(self):
+        """pickle() -> tuple
+        Returns the arguments of write_pickled_figure() for this image, or
+        None if the figure cannot be pickled.
+
+        """
+        drawn = self.value.is_drawn()
+        try:
+            data = pickle.dumps(self.value.figInstance,
+                                pickle.HIGHEST_PROTOCOL)
+        except Exception, e:
+            debug.log("Figure can't be pickled, writing it here: %s" % (
+                      debug.format_exception(e)))
+            return None
+        finally:
+            if not drawn:
+                self.value.close()
+        return (data, self.filename, self.img_format, self.width, self.height)
+
 class MplFigureToFile(ImageFileMode):
     config_cls = ImageFileModeConfig
     formats = ['pdf', 'png', 'jpg']
 
     def compute_output(self, output_module, configuration=None):
+        export = self.prepare_export(output_module, configuration)
+        if not export.from_cache():
+            export.write()
+            export.store()
+
+    def prepare_export(self, output_module, configuration):
+        """prepare_export(output_module: MplFigureOutput,
+                          configuration: ImageFileModeConfig) -> FigureExport
+        Picks the file to write the figure to.
+
+        """
         value = output_module.get_input('value')
-        w = configuration["width"]
-        h = configuration["height"]
         img_format = self.get_format(configuration)
         filename = self.get_filename(configuration, suffix='.%s' % img_format)
-
-        w_inches = w / 72.0
-        h_inches = h / 72.0
-        figure = value.figInstance
-        
-        previous_size = tuple(figure.get_size_inches())
-        figure.set_size_inches(w_inches, h_inches)
-        canvas = FigureCanvasBase(figure)
-        canvas.print_figure(filename, dpi=72, format=img_format)
-        figure.set_size_inches(previous_size[0],previous_size[1])
-        canvas.draw()
+        return FigureExport(value, filename, img_format,
+                            configuration["width"], configuration["height"])
 
 class MplFigureOutput(OutputModule):
     _settings = ModuleSettings(configure_widget="vistrails.gui.modules.output_configuration:OutputModuleConfigurationWidget")
     _input_ports = [('value', 'MplFigure')]
     _output_modes = [MplFigureToFile]
 
+    def compute_all(self):
+        """compute_all() -> None
+        Writes the image files of a list of figures, several at a time.
+
+        This is Module.compute_all() with the figures pickled here but
+        written by a pool of processes, up to the 'max_processes' setting;
+        the other output modes still show the figures one by one.
+
+        """
+        if get_max_processes() <= 1 or self.list_depth != 1:
+            return OutputModule.compute_all(self)
+        # the ports are read as lists at the list depth
+        module = copy.copy(self)
+        module.list_depth = 0
+        mode_cls = module.get_output_mode_class()
+        if not issubclass(mode_cls, MplFigureToFile):
+            return OutputModule.compute_all(self)
+        run_jobs = functools.partial(self.write_figures, mode_cls(),
+                                     module.get_mode_config(mode_cls))
+        return OutputModule.compute_all(self, run_jobs=run_jobs)
+
+    def write_figures(self, mode, mode_config, modules, num_inputs):
+        """write_figures(mode: MplFigureToFile, mode_config: dict,
+                         modules: iterator, num_inputs: int) -> iterator
+        Writes the figures of the modules of compute_all_jobs().
+
+        """
+        def exports():
+            for module in modules:
+                export = mode.prepare_export(module, mode_config)
+                args = None
+                if not export.from_cache():
+                    args = export.pickle()
+                    if args is None:
+                        export.write()
+                        export.store()
+                yield (module, export, args is not None), args
+        def finish(module, export, written):
+            if written:
+                export.store()
+            module.annotate({"output_mode": mode.mode_type})
+
+        processes = min(get_max_processes(), num_inputs)
+        pool = multiprocessing.Pool(processes, _init_export_process)
+        try:
+            try:
+                for (module, export, written), _ in imap_window(
+                        pool, write_pickled_figure, exports(), processes):
+                    yield functools.partial(finish, module, export, written)
+            except ModuleError:
+                raise
+            except Exception, e:
+                raise ModuleError(self, "Error writing figure: %s" %
+                                  debug.format_exception(e))
+        finally:
+            pool.close()
+            pool.join()
+
 _modules = [(MplProperties, {'abstract': True}),
             (MplPlot, {'abstract': True}), 
             (MplSource, {'configureWidgetType': \
@@ -159,3 +487,166 @@ _modules = [(MplProperties, {'abstract': True}),
             MplQuadContourSet,
             MplFigureOutput]
 
+
+###############################################################################
+
+import unittest
+from vistrails.tests.utils import execute
+from identifiers import identifier
+
+
+class TestWriteFigure(unittest.TestCase):
+    def test_keeps_canvas(self):
+        """Writes a figure displayed on a canvas without taking it"""
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        import struct
+
+        figure = Figure()
+        canvas = FigureCanvasAgg(figure)
+        figure.add_subplot(111).plot([1, 3, 2])
+        fd, filename = tempfile.mkstemp(suffix='.png', prefix='vt_mpl_')
+        os.close(fd)
+        try:
+            write_figure(figure, filename, 'png', 120, 90)
+            self.assertIs(figure.canvas, canvas)
+            with open(filename, 'rb') as f:
+                header = f.read(24)
+            self.assertEqual(header[:8], '\x89PNG\r\n\x1a\n')
+            self.assertEqual(struct.unpack('>II', header[16:24]), (120, 90))
+        finally:
+            os.remove(filename)
+
+
+    def test_render_png(self):
+        """Draws a figure to an image, then encodes it"""
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+        import struct
+
+        figure = Figure()
+        canvas = FigureCanvasAgg(figure)
+        figure.add_subplot(111).plot([1, 3, 2])
+        dpi = figure.get_dpi()
+        image = render_figure(figure, 120, 90)
+        self.assertEqual(image.shape, (90, 120, 4))
+        self.assertIs(figure.canvas, canvas)
+        self.assertEqual(figure.get_dpi(), dpi)
+        fd, filename = tempfile.mkstemp(suffix='.png', prefix='vt_mpl_')
+        os.close(fd)
+        try:
+            write_png(image, filename)
+            with open(filename, 'rb') as f:
+                header = f.read(24)
+            self.assertEqual(header[:8], '\x89PNG\r\n\x1a\n')
+            self.assertEqual(struct.unpack('>II', header[16:24]), (120, 90))
+        finally:
+            os.remove(filename)
+
+
+class TestMplFigureOutput(unittest.TestCase):
+    def setUp(self):
+        self.configuration = _get_configuration()
+        self.directory = tempfile.mkdtemp(prefix='vt_mpl_')
+        self.configuration.figure_cache = True
+        self.configuration.cache_directory = os.path.join(self.directory,
+                                                          'cache')
+        self.configuration.max_processes = 2
+
+    def tearDown(self):
+        self.configuration.figure_cache = False
+        self.configuration.cache_directory = None
+        self.configuration.max_processes = None
+        shutil.rmtree(self.directory)
+
+    def write_figures(self, basename, width=120):
+        """Writes one figure for each of 3 widths"""
+        configuration = {'file': {'dir': self.directory,
+                                  'basename': basename,
+                                  'series': True},
+                         'imageFile': {'format': 'png',
+                                       'width': width,
+                                       'height': 90}}
+        self.assertFalse(execute([
+                ('List', 'org.vistrails.vistrails.basic', [
+                    ('value', [('List', '[4.0, 5.0, 6.0]')]),
+                ]),
+                ('MplFigureProperties', identifier, []),
+                ('MplSource', identifier, [
+                    ('source', [('String', 'plot([1, 3, 2])')]),
+                ]),
+                ('MplFigure', identifier, []),
+                ('MplFigureOutput', identifier, [
+                    ('mode_type', [('String', 'imageFile')]),
+                    ('configuration', [('Dictionary',
+                                        repr(configuration))]),
+                ]),
+            ], [
+                (0, 'value', 1, 'figwidth'),
+                (1, 'value', 3, 'figureProperties'),
+                (2, 'value', 3, 'addPlot'),
+                (3, 'self', 4, 'value'),
+            ]))
+        return sorted(f for f in os.listdir(self.directory)
+                      if f.startswith(basename))
+
+    def test_pool_and_cache(self):
+        """Writes a list of figures in processes, then from the cache"""
+        hits = []
+        draws = []
+        from_cache = FigureExport.from_cache
+        draw = MplFigure.draw
+        def count_hits(export):
+            hit = from_cache(export)
+            hits.append(hit)
+            return hit
+        def count_draws(figure):
+            draws.append(figure)
+            return draw(figure)
+        FigureExport.from_cache = count_hits
+        MplFigure.draw = count_draws
+        try:
+            files = self.write_figures('first')
+            self.assertEqual(hits, [False] * 3)
+            self.assertEqual(len(draws), 3)
+            self.assertEqual(len(os.listdir(
+                    self.configuration.cache_directory)), 3)
+            del hits[:]
+            del draws[:]
+            self.assertEqual(len(self.write_figures('second')), 3)
+            self.assertEqual(hits, [True] * 3)
+            # the figures are not drawn again
+            self.assertEqual(draws, [])
+        finally:
+            FigureExport.from_cache = from_cache
+            MplFigure.draw = draw
+        self.assertEqual(len(files), 3)
+        for filename in files:
+            with open(os.path.join(self.directory, filename), 'rb') as fp:
+                self.assertEqual(fp.read(8), '\x89PNG\r\n\x1a\n')
+
+    def test_close_exported(self):
+        """Figures drawn only to be written are closed"""
+        self.write_figures('first')
+        figures = pylab.get_fignums()
+        # the figures are in the cache, but not at this size
+        self.assertEqual(len(self.write_figures('second', 100)), 3)
+        self.assertEqual(pylab.get_fignums(), figures)
+        self.assertEqual(len(os.listdir(
+                self.configuration.cache_directory)), 6)
+
+    def test_plot_error(self):
+        """Errors in the plots are raised by the figure that runs them"""
+        errors = execute([
+                ('MplSource', identifier, [
+                    ('source', [('String', 'raise ValueError("bad plot")')]),
+                ]),
+                ('MplFigure', identifier, []),
+                ('MplFigureOutput', identifier, [
+                    ('mode_type', [('String', 'imageFile')]),
+                ]),
+            ], [
+                (0, 'value', 1, 'addPlot'),
+                (1, 'self', 2, 'value'),
+            ])
+        self.assertEqual(errors.keys(), [1])
@@ -46,6 +46,8 @@ from matplotlib.backend_bases import NavigationToolbar2, FigureManagerBase
 from vistrails.packages.spreadsheet.basic_widgets import SpreadsheetCell, SpreadsheetMode
 from vistrails.packages.spreadsheet.spreadsheet_cell import QCellWidget, QCellToolBar
 
+from bases import render_figure, write_png
+
 FigureCanvasQTAgg.DEBUG = True
 
 ################################################################################
@@ -167,6 +169,26 @@ class MplFigureCellWidget(QCellWidget):
         self.figure.set_size_inches(previous_size[0],previous_size[1])
         self.canvas.draw()
 
+def renderOffscreen(inputPorts, width, height):
+    """ renderOffscreen(inputPorts: tuple, width: int, height: int)
+          -> function
+    Offscreen renderer of MplFigureCellWidget: draws the figure on an
+    Agg canvas here, since matplotlib is not thread-safe, and returns a
+    function only encoding the image to a PNG file
+    
+    """
+    (fig, ) = inputPorts
+    drawn = fig.is_drawn()
+    try:
+        image = render_figure(fig.figInstance, width, height)
+    finally:
+        # it was drawn only for this file
+        if not drawn:
+            fig.close()
+    def write(filename):
+        write_png(image, filename)
+    return write
+
 class MplNavigationToolbar(NavigationToolbar2QT):
     # override a bunch of stuff here...
     def __init__(self, canvas, parent):
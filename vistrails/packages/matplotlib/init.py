@@ -32,8 +32,35 @@
 ##
 ###############################################################################
 
+import sys
+
 import matplotlib
-matplotlib.use('Qt4Agg', warn=False)
+
+import vistrails.core.application
+
+# the package configuration is only copied into this module once it is
+# loaded, but the backend has to be selected before pylab gets imported
+configuration = sys.modules[__name__.rsplit('.', 1)[0]].configuration
+
+def get_backend():
+    """get_backend() -> str
+    Returns the matplotlib backend to use: the 'backend' setting if it is
+    set, else 'Qt4Agg' if the GUI is running, or 'Agg' to draw figures
+    without a display.
+
+    """
+    if configuration.check('backend'):
+        return configuration.backend
+    app = vistrails.core.application.get_vistrails_application()
+    if app is not None and app.is_running_gui():
+        return 'Qt4Agg'
+    return 'Agg'
+
+if 'matplotlib.pyplot' in sys.modules:
+    # package_requirements() imported pylab already
+    matplotlib.pyplot.switch_backend(get_backend())
+else:
+    matplotlib.use(get_backend(), warn=False)
 
 import vistrails.core.modules.module_registry
 import vistrails.core.db.action
@@ -54,9 +81,14 @@ def initialize(*args, **kwargs):
     reg = vistrails.core.modules.module_registry.get_module_registry()
     if reg.has_module('org.vistrails.vistrails.spreadsheet',
                       'SpreadsheetCell'):
-        from figure_cell import MplFigureCell, MplFigureToSpreadsheet
+        from figure_cell import MplFigureCell, MplFigureCellWidget, \
+            MplFigureToSpreadsheet, renderOffscreen
+        from vistrails.packages.spreadsheet.spreadsheet_registry import \
+            spreadsheetRegistry
         _modules.append(MplFigureCell)
         MplFigureOutput.register_output_mode(MplFigureToSpreadsheet)
+        spreadsheetRegistry.registerOffscreenRenderer(MplFigureCellWidget,
+                                                      renderOffscreen)
 
 def handle_module_upgrade_request(controller, module_id, pipeline):
     from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
@@ -41,4 +41,6 @@ configuration = ConfigurationObject(global_db=(None, str),
                                     git_bin=(None, str),
                                     search_dbs=(None, str),
                                     compress_by_default=False,
+                                    store='git',
+                                    chunk_size=(None, int),
                                     debug=False)
@@ -0,0 +1,414 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Content-addressed store for persistent files and directories.
+
+ChunkRepo is an alternative to GitRepo (see repo.py), selected with the
+package's store option. Files are split in fixed-size chunks that are
+stored once under their SHA1, so a new version of a large directory in
+which few files changed only writes the changed chunks. Each version is
+described by a manifest listing the chunks of every file.
+
+Chunks are read-only files. A stored file made of a single chunk is
+retrieved to a temporary file by hard-linking that chunk rather than
+copying it, so those files must not be modified in place; files written
+to a path given with out_name are always copies.
+
+Layout of the store directory:
+  id              unique id of the store
+  chunks/ab/cd... chunk data, named after its SHA1
+  manifests/v     manifest (JSON) of version v
+  refs/name       versions of name, one per line, the latest last
+  tmp/            temporary files, in the same filesystem as chunks
+
+"""
+
+import json
+import os
+import shutil
+import stat
+import tempfile
+import uuid
+
+from vistrails.core.cache.file_signature import FileSignatureCache, \
+    list_files
+from vistrails.core.cache.utils import sha_hash
+
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+class ChunkRepo(object):
+    def __init__(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        for dirname in ['chunks', 'manifests', 'refs', 'tmp']:
+            dirname = os.path.join(path, dirname)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        id_fname = os.path.join(path, 'id')
+        if not os.path.exists(id_fname):
+            with open(id_fname, 'w') as f:
+                f.write(uuid.uuid4().hex)
+        with open(id_fname) as f:
+            self.store_id = f.read().strip()
+        # chunk lists are cached with the stats of files; the kind ties
+        # them to this store, since the chunks might not exist elsewhere
+        self.signature_kind = 'chunks:%s:%d' % (self.store_id, chunk_size)
+        self.temp_persist_files = []
+        # manifests computed by compute_hash(), reused by store()
+        self._computed = {}
+
+    ##########################################################################
+    # Chunks
+
+    def _chunk_path(self, chunk_id):
+        return os.path.join(self.path, 'chunks', chunk_id[:2], chunk_id[2:])
+
+    def _write_atomic(self, fname, data, readonly=False):
+        dirname = os.path.dirname(fname)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created concurrently
+                if not os.path.isdir(dirname):
+                    raise
+        fd, tmp_fname = tempfile.mkstemp(dir=os.path.join(self.path, 'tmp'))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if readonly:
+                os.chmod(tmp_fname, stat.S_IRUSR | stat.S_IRGRP |
+                                    stat.S_IROTH)
+            if os.path.exists(fname):
+                os.remove(fname)
+            os.rename(tmp_fname, fname)
+        except Exception:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+            raise
+
+    def store_chunks(self, fname):
+        """store_chunks(fname: str) -> str
+
+        Splits a file in chunks, adds the chunks that are not in the
+        store yet and returns their ids, separated by spaces.
+
+        """
+        chunk_ids = []
+        with open(fname, 'rb') as f:
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                chunk_id = sha_hash(data).hexdigest()
+                chunk_path = self._chunk_path(chunk_id)
+                if not os.path.exists(chunk_path):
+                    self._write_atomic(chunk_path, data, True)
+                chunk_ids.append(chunk_id)
+        return ' '.join(chunk_ids)
+
+    ##########################################################################
+    # Manifests
+
+    def compute_manifest(self, path):
+        """compute_manifest(path: str) -> dict
+
+        Stores the chunks of a file or directory and returns its
+        manifest. Files that are not in the file signature cache are
+        read concurrently.
+
+        """
+        if os.path.isdir(path):
+            path_type = 'tree'
+            names = list_files(path)
+            fnames = [os.path.join(path, name) for name in names]
+            names = [name.replace(os.sep, '/') for name in names]
+        elif os.path.isfile(path):
+            path_type = 'blob'
+            names = ['']
+            fnames = [path]
+        else:
+            raise TypeError("Do not support this type of path")
+        chunk_lists = FileSignatureCache.getInstance().get_file_digests(
+                fnames, self.store_chunks, self.signature_kind)
+        files = []
+        stats = []
+        hasher = sha_hash()
+        hasher.update(path_type)
+        for name, fname, chunks in zip(names, fnames, chunk_lists):
+            st = os.stat(fname)
+            mode = stat.S_IMODE(st.st_mode)
+            files.append((name, mode, st.st_size, chunks.split()))
+            stats.append((st.st_ino, st.st_size, st.st_mtime))
+            hasher.update('\0%s\0%o\0%s' % (name, mode, chunks))
+        return {'type': path_type,
+                'hash': hasher.hexdigest(),
+                'files': files,
+                'stats': stats}
+
+    def _get_manifest(self, name, version="HEAD"):
+        if version is None or version == "HEAD":
+            version = self.get_latest_version(name)
+        fname = os.path.join(self.path, 'manifests', version)
+        if not os.path.isfile(fname):
+            raise KeyError('Cannot find object "%s" version %s' % (name,
+                                                                 version))
+        with open(fname, 'rb') as f:
+            return json.load(f)
+
+    ##########################################################################
+    # Repository interface (see GitRepo)
+
+    def compute_hash(self, path):
+        manifest = self.compute_manifest(path)
+        self._computed[os.path.abspath(path)] = manifest
+        return manifest['hash']
+
+    def store(self, name, path):
+        """store(name: str, path: str) -> str
+
+        Adds a new version of name with the content of path, and
+        returns the version id.
+
+        """
+        manifest = self._computed.pop(os.path.abspath(path), None)
+        if manifest is not None:
+            # reuse the manifest from compute_hash() if nothing changed
+            if manifest['type'] == 'tree':
+                fnames = [os.path.join(path, f[0]) for f in manifest['files']]
+            else:
+                fnames = [path]
+            try:
+                for fname, stats in zip(fnames, manifest['stats']):
+                    st = os.stat(fname)
+                    if (st.st_ino, st.st_size, st.st_mtime) != stats:
+                        manifest = None
+                        break
+            except OSError:
+                manifest = None
+            if (manifest is not None and manifest['type'] == 'tree' and
+                    len(list_files(path)) != len(fnames)):
+                manifest = None
+        if manifest is None:
+            manifest = self.compute_manifest(path)
+
+        version = sha_hash('%s\0%s\0%s' % (name, manifest['hash'],
+                                           uuid.uuid1())).hexdigest()
+        content = {'name': name,
+                   'type': manifest['type'],
+                   'hash': manifest['hash'],
+                   'files': manifest['files']}
+        self._write_atomic(os.path.join(self.path, 'manifests', version),
+                           json.dumps(content))
+        with open(os.path.join(self.path, 'refs', name), 'a') as f:
+            f.write(version + '\n')
+        return version
+
+    def has_path(self, name):
+        return os.path.isfile(os.path.join(self.path, 'refs', name))
+
+    def get_current_type(self, name):
+        return self.get_type(name)
+
+    def get_versions(self, name):
+        ref_fname = os.path.join(self.path, 'refs', name)
+        if not os.path.isfile(ref_fname):
+            raise KeyError('Cannot find object "%s"' % name)
+        with open(ref_fname) as f:
+            return [line.strip() for line in f if line.strip()]
+
+    def get_latest_version(self, name):
+        return self.get_versions(name)[-1]
+
+    def get_type(self, name, version="HEAD"):
+        return self._get_manifest(name, version)['type']
+
+    def get_hash(self, name, version="HEAD", path_type=None):
+        return self._get_manifest(name, version)['hash']
+
+    def get_path(self, name, version="HEAD", path_type=None, out_name=None,
+                 out_suffix=''):
+        manifest = self._get_manifest(name, version)
+        if path_type is not None and path_type != manifest['type']:
+            raise TypeError('"%s" is a %s, not a %s' % (name,
+                                                        manifest['type'],
+                                                        path_type))
+        if manifest['type'] == 'tree':
+            return self._get_dir(manifest, out_name, out_suffix)
+        return self._get_file(manifest, out_name, out_suffix)
+
+    def get_file(self, name, version="HEAD", out_fname=None, out_suffix=''):
+        return self.get_path(name, version, 'blob', out_fname, out_suffix)
+
+    def get_dir(self, name, version="HEAD", out_dirname=None,
+                out_suffix=''):
+        return self.get_path(name, version, 'tree', out_dirname, out_suffix)
+
+    ##########################################################################
+    # Retrieval
+
+    def _write_file(self, entry, out_fname, link=False):
+        name, mode, size, chunk_ids = entry
+        if os.path.lexists(out_fname):
+            os.remove(out_fname)
+        if link and len(chunk_ids) == 1 and hasattr(os, 'link'):
+            try:
+                os.link(self._chunk_path(chunk_ids[0]), out_fname)
+                return
+            except OSError:
+                # e.g. not in the same filesystem
+                pass
+        with open(out_fname, 'wb') as out:
+            for chunk_id in chunk_ids:
+                with open(self._chunk_path(chunk_id), 'rb') as f:
+                    shutil.copyfileobj(f, out, self.chunk_size)
+        os.chmod(out_fname, mode)
+
+    def _get_file(self, manifest, out_fname, out_suffix):
+        # only link to the chunks from our own temporary files, the user
+        # could modify an exported file
+        link = out_fname is None
+        if out_fname is None:
+            fd, out_fname = tempfile.mkstemp(
+                    suffix=out_suffix, prefix='vt_persist',
+                    dir=os.path.join(self.path, 'tmp'))
+            os.close(fd)
+            self.temp_persist_files.append(out_fname)
+        else:
+            out_dirname = os.path.dirname(out_fname)
+            if out_dirname and not os.path.exists(out_dirname):
+                os.makedirs(out_dirname)
+        self._write_file(manifest['files'][0], out_fname, link)
+        return out_fname
+
+    def _get_dir(self, manifest, out_dirname, out_suffix):
+        link = out_dirname is None
+        if out_dirname is None:
+            out_dirname = tempfile.mkdtemp(suffix=out_suffix,
+                                           prefix='vt_persist',
+                                           dir=os.path.join(self.path,
+                                                            'tmp'))
+            self.temp_persist_files.append(out_dirname)
+        elif not os.path.exists(out_dirname):
+            os.makedirs(out_dirname)
+        for entry in manifest['files']:
+            out_fname = os.path.join(out_dirname, *entry[0].split('/'))
+            dirname = os.path.dirname(out_fname)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            self._write_file(entry, out_fname, link)
+        return out_dirname
+
+##############################################################################
+
+import unittest
+
+class TestChunkRepo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='vt_chunks_')
+        self.repo = ChunkRepo(os.path.join(self.directory, 'store'), 16)
+
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                os.chmod(os.path.join(root, name), stat.S_IRUSR |
+                                                    stat.S_IWUSR)
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        fname = os.path.join(self.directory, name)
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        with open(fname, 'wb') as f:
+            f.write(content)
+        return fname
+
+    def read(self, fname):
+        with open(fname, 'rb') as f:
+            return f.read()
+
+    def count_chunks(self):
+        return sum(len(files) for root, dirs, files in
+                   os.walk(os.path.join(self.repo.path, 'chunks')))
+
+    def test_file(self):
+        content = ''.join(chr(i % 256) for i in xrange(100))
+        fname = self.write('file.dat', content)
+        h = self.repo.compute_hash(fname)
+        v1 = self.repo.store('ref', fname)
+        self.assertEqual(self.repo.get_hash('ref', v1), h)
+        self.assertEqual(self.repo.get_type('ref'), 'blob')
+        self.assertEqual(self.count_chunks(), 7)
+
+        out = self.repo.get_path('ref', v1, out_suffix='.dat')
+        self.assertTrue(out.endswith('.dat'))
+        self.assertEqual(self.read(out), content)
+
+        # only the modified chunk is added
+        self.write('file.dat', content[:50] + 'X' + content[51:])
+        v2 = self.repo.store('ref', fname)
+        self.assertEqual(self.count_chunks(), 8)
+        self.assertEqual(self.repo.get_latest_version('ref'), v2)
+        self.assertNotEqual(self.repo.get_hash('ref', v2), h)
+        self.assertEqual(self.read(self.repo.get_file('ref', v1)), content)
+
+    def test_dir(self):
+        self.write('src/a', 'a' * 16)
+        self.write('src/sub/b', 'a' * 16)
+        self.write('src/sub/c', '')
+        src = os.path.join(self.directory, 'src')
+        v = self.repo.store('ref', src)
+        self.assertEqual(self.count_chunks(), 1)
+        self.assertEqual(self.repo.get_hash('ref'),
+                         self.repo.compute_hash(src))
+
+        out = self.repo.get_dir('ref', v)
+        self.assertEqual(sorted(list_files(out)),
+                         ['a', os.path.join('sub', 'b'),
+                          os.path.join('sub', 'c')])
+        self.assertEqual(self.read(os.path.join(out, 'sub', 'b')), 'a' * 16)
+        self.assertEqual(self.read(os.path.join(out, 'sub', 'c')), '')
+        self.assertRaises(TypeError, self.repo.get_file, 'ref', v)
+
+    def test_export_is_copy(self):
+        content = 'a' * 16
+        fname = self.write('file.dat', content)
+        v = self.repo.store('ref', fname)
+        out = os.path.join(self.directory, 'out', 'export.dat')
+        self.assertEqual(self.repo.get_file('ref', v, out), out)
+        self.assertEqual(os.stat(out).st_nlink, 1)
+        os.chmod(out, stat.S_IRUSR | stat.S_IWUSR)
+        with open(out, 'wb') as f:
+            f.write('b' * 16)
+        self.assertEqual(self.read(self.repo.get_file('ref', v)), content)
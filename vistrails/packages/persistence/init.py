@@ -344,14 +344,11 @@ class PersistentPath(Module):
             except ModuleError, e:
                 e.module = self
                 raise e
-            rep_path = os.path.join(local_db, ref.id)
+            current_repo = repo.get_current_repo()
             do_update = True
-            if os.path.exists(rep_path):
-                if os.path.isdir(rep_path):
-                    actual_type = 'tree'
-                elif os.path.isfile(rep_path):
-                    actual_type = 'blob'
-                else:
+            if current_repo.has_path(ref.id):
+                actual_type = current_repo.get_current_type(ref.id)
+                if actual_type is None:
                     raise ModuleError(self, "Path is something not a file or "
                                       "a directory")
                 if path_type is None:
@@ -381,12 +378,10 @@ class PersistentPath(Module):
                             not os.listdir(path)):
                         raise ModuleError(self, "This directory is empty")
 
-                self.copypath(path, os.path.join(local_db, ref.id))
-
-                # commit (and add to) repository
+                # store (and add to) repository
                 # get commit id as version id
                 # persist object-hash, commit-version to repository
-                version = repo.get_current_repo().add_commit(ref.id)
+                version = current_repo.store(ref.id, path)
                 ref.version = version
 
                 # write object-hash, commit-version to provenance
@@ -584,7 +579,15 @@ def initialize():
             except OSError:
                 raise RuntimeError('local_db "%s" does not exist' % local_db)
 
-    local_repo = repo.get_repo(local_db)
+    if configuration.check('store') and configuration.store == 'chunks':
+        from chunk_store import ChunkRepo, DEFAULT_CHUNK_SIZE
+        chunk_size = DEFAULT_CHUNK_SIZE
+        if configuration.check('chunk_size'):
+            chunk_size = configuration.chunk_size
+        local_repo = ChunkRepo(os.path.join(local_db, '.chunkstore'),
+                               chunk_size)
+    else:
+        local_repo = repo.get_repo(local_db)
     repo.set_current_repo(local_repo)
 
     debug_print('creating DatabaseAccess')
@@ -40,6 +40,8 @@ py_import('dulwich', {
         'linux-ubuntu': 'python-dulwich',
         'linux-fedora': 'python-dulwich'})
 from vistrails.core import debug
+from vistrails.core.cache.file_signature import FileSignatureCache, \
+    list_files
 
 from dulwich.errors import NotCommitError, NotGitRepository
 from dulwich.repo import Repo
@@ -152,6 +154,12 @@ class GitRepo(object):
 
     @staticmethod
     def compute_blob_hash(fname, chunk_size=1<<16):
+        # blob hashes are cached along with the stats of the file
+        return FileSignatureCache.getInstance().get_file_digest(
+                fname, GitRepo.hash_blob_file, 'git-blob')
+
+    @staticmethod
+    def hash_blob_file(fname, chunk_size=1<<16):
         obj_len = os.path.getsize(fname)
         head = object_header(Blob.type_num, obj_len)
         with open(fname, "rb") as f:
@@ -162,16 +170,20 @@ class GitRepo(object):
         return None
 
     @staticmethod
-    def compute_tree_hash(dirname):
+    def compute_tree_hash(dirname, blob_hashes=None):
+        if blob_hashes is None:
+            blob_hashes = {}
         tree = Tree()
         for entry in sorted(os.listdir(dirname)):
             fname = os.path.join(dirname, entry)
             if os.path.isdir(fname):
-                thash = GitRepo.compute_tree_hash(fname)
+                thash = GitRepo.compute_tree_hash(fname, blob_hashes)
                 mode = stat.S_IFDIR # os.stat(fname)[stat.ST_MODE]
                 tree.add(entry, mode, thash)
             elif os.path.isfile(fname):
-                bhash = GitRepo.compute_blob_hash(fname)
+                bhash = blob_hashes.get(fname)
+                if bhash is None:
+                    bhash = GitRepo.compute_blob_hash(fname)
                 mode = os.stat(fname)[stat.ST_MODE]
                 tree.add(entry, mode, bhash)
         return tree.id
@@ -179,7 +191,12 @@ class GitRepo(object):
     @staticmethod
     def compute_hash(path):
         if os.path.isdir(path):
-            return GitRepo.compute_tree_hash(path)
+            # hash the files that changed concurrently first
+            fnames = [os.path.join(path, f) for f in list_files(path)]
+            blob_hashes = FileSignatureCache.getInstance().get_file_digests(
+                    fnames, GitRepo.hash_blob_file, 'git-blob')
+            return GitRepo.compute_tree_hash(path,
+                                             dict(zip(fnames, blob_hashes)))
         elif os.path.isfile(path):
             return GitRepo.compute_blob_hash(path)
         raise TypeError("Do not support this type of path")
@@ -208,6 +225,35 @@ class GitRepo(object):
         commit_id = self.repo.do_commit('Updated %s' % filename)
         return commit_id
 
+    def store(self, name, path):
+        """store(name: str, path: str) -> str
+
+        Copies path into the working tree as name and commits it,
+        returning the commit id as the version.
+
+        """
+        dst = os.path.join(self.repo.path, name)
+        if os.path.isdir(path):
+            if os.path.exists(dst):
+                shutil.rmtree(dst)
+            shutil.copytree(path, dst)
+        elif os.path.isfile(path):
+            shutil.copyfile(path, dst)
+        else:
+            raise TypeError("Do not support this type of path")
+        return self.add_commit(name)
+
+    def has_path(self, name):
+        return os.path.exists(os.path.join(self.repo.path, name))
+
+    def get_current_type(self, name):
+        path = os.path.join(self.repo.path, name)
+        if os.path.isdir(path):
+            return 'tree'
+        elif os.path.isfile(path):
+            return 'blob'
+        return None
+
     def setup_git(self):
         config_stack = self.repo.get_config_stack()
 
@@ -37,16 +37,24 @@ import os
 import sys
 import tempfile
 import urllib
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+import rpy2.rinterface as rinterface
 import rpy2.robjects as robjects
 
 from vistrails.core.modules.basic_modules import PathObject, Constant, \
-    new_constant
+    ListType, new_constant
 
 from vistrails.core.modules.vistrails_module import Module, ModuleError, \
     ModuleConnector, NotCacheable
 from vistrails.core.modules.basic_modules import new_constant
 import vistrails.core.modules.module_registry
 from widgets import RSourceConfigurationWidget, RFigureConfigurationWidget
+from vector_buffers import TypeException, R_VECTOR_TYPES, \
+    array_vector_type, flatten_array, fill_buffer, decode_integers, \
+    decode_logicals, decode_factor, shape_array
 
 # FIXME when rpy2 is installed on the path, we won't need this
 old_sys_path = sys.path
@@ -55,10 +63,101 @@ sys.path = old_sys_path
 
 r_temp_files = []
 
-class TypeException(Exception):
-    pass
+def _set_dim(rvector, shape):
+    """_set_dim(rvector: RVector, shape: tuple) -> RVector
+    Sets the dimensions of a vector in place, making it an array.
+
+    """
+    rvector.do_slot_assign('dim', rinterface.SexpVector(list(shape),
+                                                        rinterface.INTSXP))
+    return robjects.RArray(rvector)
+
+def array_to_rvector(array, desired_type=None):
+    """array_to_rvector(array: numpy.ndarray, desired_type: type) -> RVector
+    Creates an R vector from a numpy array.
+
+    Numeric data is copied straight into the memory of a new R vector, in
+    R's column-major order, without creating a Python object per element.
+    Masked values become NA, and arrays with more than one dimension get it
+    as their 'dim' attribute.
+
+    """
+    vector_type = array_vector_type(array, desired_type)
+    data, mask = flatten_array(array)
+
+    if vector_type == str:
+        values = data.tolist()
+        if data.dtype.kind not in 'SU':
+            values = [elt if isinstance(elt, basestring) else str(elt)
+                      for elt in values]
+        rvector = robjects.StrVector(values)
+        if mask is not numpy.ma.nomask:
+            rvector = robjects.r('function(x, i) { x[i] <- NA; x }')(
+                    rvector, robjects.IntVector(
+                            (numpy.flatnonzero(mask) + 1).tolist()))
+    else:
+        constructor, dtype = R_VECTOR_TYPES[vector_type]
+        rvector = robjects.r[constructor](len(data))
+        # this is a view on the memory of the R vector
+        fill_buffer(numpy.asarray(rvector), data, mask, vector_type)
+
+    if array.ndim > 1:
+        return _set_dim(rvector, array.shape)
+    return rvector
+
+def _get_slot(rvector, name):
+    try:
+        return rvector.do_slot(name)
+    except LookupError:
+        return None
+
+def rvector_to_array(rvector):
+    """rvector_to_array(rvector: RVector) -> numpy.ndarray
+    Returns the content of an R vector as a numpy array, or None if it is
+    not an atomic vector.
+
+    Numeric and logical vectors are returned as a view on their memory,
+    without copying them. NA integers and logicals are masked, and NA
+    doubles are NaN. Strings and factors are returned as an array of
+    objects, where NA is None. Arrays keep their dimensions.
+
+    """
+    typeof = rvector.typeof
+    rclass = _get_slot(rvector, 'class')
+    if typeof == rinterface.INTSXP and rclass is not None and \
+            'factor' in list(rclass):
+        array = decode_factor(numpy.asarray(rvector),
+                              rvector_to_array(_get_slot(rvector, 'levels')))
+    elif typeof == rinterface.INTSXP:
+        array = decode_integers(numpy.asarray(rvector))
+    elif typeof in (rinterface.REALSXP, rinterface.CPLXSXP):
+        array = numpy.asarray(rvector)
+    elif typeof == rinterface.LGLSXP:
+        array = decode_logicals(numpy.asarray(rvector))
+    elif typeof == rinterface.STRSXP:
+        na = getattr(rinterface, 'NA_Character', None)
+        array = numpy.array([None if elt is na else elt
+                             for elt in rvector], dtype=object)
+    else:
+        return None
+    return shape_array(array, _get_slot(rvector, 'dim'))
+
+def rvector_to_list(rvector, as_array=False):
+    """rvector_to_list(rvector: RVector, as_array: bool) -> list
+    Returns the elements of an R vector as a list, as rpy2 gives them (e.g.
+    factors are their integer codes), or as the numpy array from
+    rvector_to_array() if as_array is True.
+
+    """
+    if as_array and numpy is not None:
+        array = rvector_to_array(rvector)
+        if array is not None:
+            return array
+    return list(rvector)
 
 def create_vector(v_list, desired_type=None):
+    if numpy is not None and isinstance(v_list, numpy.ndarray):
+        return array_to_rvector(v_list, desired_type)
     is_bool = True
     is_int = True
     is_float = True
@@ -145,6 +244,10 @@ RArray = new_constant('RArray', staticmethod(array_conv),
                       base_class=RVector)
 
 def create_matrix(v_list):
+    if numpy is not None and isinstance(v_list, numpy.ndarray):
+        if v_list.ndim != 2:
+            raise TypeException("Matrix must have two dimensions")
+        return array_to_rvector(v_list)
     vec_list = []
     nrow = 0
     ncol = -1
@@ -182,7 +285,7 @@ RMatrix._input_ports.extend([('rvector', '(Types|RVector)'),
 def create_list(v_dict):
     data_dict = {}
     for k,v in v_dict.iteritems():
-        if isinstance(v, list):
+        if isinstance(v, ListType):
             data_dict[k] = create_vector(v)
         elif isinstance(v, dict):
             data_dict[k] = create_list(v)
@@ -201,9 +304,11 @@ RList = new_constant('RList', staticmethod(list_conv),
 # compute=list_compute)
 
 def create_data_frame(v_dict):
+    if hasattr(v_dict, 'get_column'):
+        return create_data_frame_from_table(v_dict)
     data_dict = {}
     for k,v in v_dict.iteritems():
-        if isinstance(v, list):
+        if isinstance(v, ListType):
             data_dict[k] = create_vector(v)
         elif isinstance(v, dict):
             data_dict[k] = create_data_frame(v)
@@ -211,6 +316,29 @@ def create_data_frame(v_dict):
             data_dict[k] = v
     return robjects.r['data.frame'](**data_dict)
 
+def create_data_frame_from_table(table):
+    """create_data_frame_from_table(table) -> RDataFrame
+    Creates a data frame from a column-oriented table, such as the
+    TableObject of the tabledata package, keeping the order of its columns.
+
+    """
+    names = table.names
+    if names is None:
+        names = ['V%d' % (i + 1) for i in xrange(table.columns)]
+    data_dict = {}
+    for i, name in enumerate(names):
+        try:
+            # numeric columns are numpy arrays, that are copied at once
+            column = table.get_column(i, numeric=True)
+        except (TypeError, ValueError):
+            column = table.get_column(i)
+        if numpy is not None and not isinstance(column, numpy.ndarray):
+            column = numpy.asarray(column)
+        data_dict[name] = create_vector(column)
+    rdataframe = robjects.r['data.frame'](**data_dict)
+    return robjects.r('function(df, names) df[names]')(
+            rdataframe, robjects.StrVector(names))
+
 def data_frame_conv(v):
     v_dict = literal_eval(v)
     return create_data_frame(v_dict)
@@ -230,12 +358,14 @@ class RVectorFromList(Module):
         self.set_output('rvector', rvector)
 
 class ListFromRVector(Module):
-    _input_ports = [('rvector', '(Types|RVector)')]
+    _input_ports = [('rvector', '(Types|RVector)'),
+                    ('asArray', '(basic:Boolean)', True)]
     _output_ports = [('list', '(basic:List)')]
 
     def compute(self):
         rvector = self.get_input('rvector')
-        olist = list(rvector)
+        olist = rvector_to_list(rvector,
+                                self.force_get_input('asArray', False))
         self.set_output('list', olist)
 
 class RMatrixFromNestedList(Module):
@@ -248,17 +378,26 @@ class RMatrixFromNestedList(Module):
         self.set_output('rmatrix', rmatrix)
 
 class NestedListFromRMatrix(Module):
-    _input_ports = [('rmatrix', '(Types|RMatrix)')]
+    _input_ports = [('rmatrix', '(Types|RMatrix)'),
+                    ('asArray', '(basic:Boolean)', True)]
     _output_ports = [('list', '(basic:List)')]
     
     def compute(self):
         rmatrix = self.get_input('rmatrix')
-        mlist = list(rmatrix)
-        nrows = rmatrix.nrow
-        ncols = len(mlist) / nrows
-        olist = [] 
-        for row in xrange(nrows):
-            olist.append(mlist[row*ncols:(row+1)*ncols])
+        array = None
+        if numpy is not None and self.force_get_input('asArray', False):
+            array = rvector_to_array(rmatrix)
+        if array is not None:
+            olist = array
+        else:
+            # the values are split in rows in the order R stores them,
+            # which is the order RMatrixFromNestedList filled them in
+            mlist = list(rmatrix)
+            nrows = rmatrix.nrow
+            ncols = len(mlist) / nrows
+            olist = []
+            for row in xrange(nrows):
+                olist.append(mlist[row*ncols:(row+1)*ncols])
         self.set_output('list', olist)
 
 class RDataFrameFromDict(Module):
@@ -271,16 +410,18 @@ class RDataFrameFromDict(Module):
         self.set_output('rdataframe', rdataframe)
 
 class DictFromRDataFrame(Module):
-    _input_ports = [('rdataframe','(Types|RDataFrame)')]
+    _input_ports = [('rdataframe','(Types|RDataFrame)'),
+                    ('asArray', '(basic:Boolean)', True)]
     _output_ports = [('dict', '(basic:Dictionary)')]
 
     def compute(self):
         rdataframe = self.get_input('rdataframe')
+        as_array = self.force_get_input('asArray', False)
         colnames = list(rdataframe.colnames())
         odict = {}
         for i in xrange(len(rdataframe)):
             # FIXME !!! just assume that each row can be converted to a list!!!
-            odict[colnames[i]] = list(rdataframe[i])
+            odict[colnames[i]] = rvector_to_list(rdataframe[i], as_array)
         self.set_output('dict', odict)
 
 class RListFromDict(Module):
@@ -294,18 +435,20 @@ class RListFromDict(Module):
         self.set_output('rlist', rlist)
 
 class DictFromRList(Module):
-    _input_ports = [('rlist', '(Types|RList)')]
+    _input_ports = [('rlist', '(Types|RList)'),
+                    ('asArray', '(basic:Boolean)', True)]
     # _output_ports = [('dict', '(basic:Dictionary)')]
     _output_ports = [('dict', '(basic:Module)')]
 
     def compute(self):
         rlist = self.get_input('rlist')
+        as_array = self.force_get_input('asArray', False)
         colnames = list(rlist.names)
         odict = {}
         for i in xrange(len(rlist)):
             # FIXME !!! just assume that each row can be converted to a list!!!
             # FIXME this may need to be a list of lists
-            odict[colnames[i]] = list(rlist[i])
+            odict[colnames[i]] = rvector_to_list(rlist[i], as_array)
         self.set_output('dict', odict)
 
 class RRead(Module):
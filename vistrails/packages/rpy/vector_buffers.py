@@ -0,0 +1,310 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""The numpy side of exchanging arrays with R.
+
+rpy2 gives numpy views on the memory of numeric and logical R vectors; the
+functions here lay out numpy arrays the way R stores them in that memory,
+and decode what R stored there, without depending on rpy2 themselves.
+
+"""
+
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+
+
+class TypeException(Exception):
+    pass
+
+# R stores a missing integer or logical as the smallest 32-bit integer, and a
+# missing double as a NaN with 1954 in its low word
+R_NA_INTEGER = -2**31
+R_NA_REAL_BITS = 0x7FF00000000007A2
+
+# R vector constructor for each kind of vector, with the numpy dtype of its
+# data
+R_VECTOR_TYPES = {bool: ('logical', 'int32'),
+                  int: ('integer', 'int32'),
+                  float: ('numeric', 'float64'),
+                  complex: ('complex', 'complex128')}
+
+def array_vector_type(array, desired_type=None):
+    """array_vector_type(array: numpy.ndarray, desired_type: type) -> type
+    Returns the type of R vector to store the array in, following the same
+    rules as create_vector() does for lists.
+
+    """
+    kind = array.dtype.kind
+    if kind in 'SUO':
+        vector_type = str
+    elif kind == 'b':
+        vector_type = bool
+    elif kind in 'iu':
+        vector_type = int
+        if array.dtype.itemsize >= 4 and array.size:
+            # R integers are 32-bit, and the smallest one means NA
+            if array.min() <= R_NA_INTEGER or array.max() >= 2**31:
+                vector_type = float
+    elif kind == 'f':
+        vector_type = float
+    elif kind == 'c':
+        vector_type = complex
+    else:
+        raise TypeException("Cannot convert array of type '%s'" %
+                            array.dtype)
+    if desired_type is None or desired_type == vector_type:
+        return vector_type
+    order = [bool, int, float, str]
+    if (vector_type in order and desired_type in order and
+            order.index(desired_type) > order.index(vector_type)):
+        return desired_type
+    raise TypeException("Cannot coerce vector to type '%s'" % desired_type)
+
+def flatten_array(array):
+    """flatten_array(array: numpy.ndarray) -> (numpy.ndarray, mask)
+    Returns the data of the array in R's column-major order, with the mask
+    of its missing values, or numpy.ma.nomask if there are none.
+
+    Masked values are missing, and so are None values in object arrays.
+
+    """
+    mask = numpy.ma.getmask(array)
+    if mask is not numpy.ma.nomask:
+        mask = mask.ravel(order='F')
+        if not mask.any():
+            mask = numpy.ma.nomask
+    data = numpy.ma.getdata(array).ravel(order='F')
+    if data.dtype.kind == 'O':
+        none = numpy.equal(data, None)
+        if none.any():
+            mask = none if mask is numpy.ma.nomask else mask | none
+    return data, mask
+
+def fill_buffer(buf, data, mask, vector_type):
+    """fill_buffer(buf: numpy.ndarray, data: numpy.ndarray, mask,
+                   vector_type: type) -> None
+    Copies data from flatten_array() into buf, the memory of an R vector
+    of the given type, writing NA where mask is set.
+
+    """
+    buf[:] = data.astype(R_VECTOR_TYPES[vector_type][1])
+    if mask is numpy.ma.nomask:
+        return
+    if vector_type == float:
+        buf.view(numpy.int64)[mask] = R_NA_REAL_BITS
+    elif vector_type == complex:
+        buf.view(numpy.int64)[numpy.repeat(mask, 2)] = R_NA_REAL_BITS
+    else:
+        buf[mask] = R_NA_INTEGER
+
+def decode_integers(data):
+    """decode_integers(data: numpy.ndarray) -> numpy.ndarray
+    Returns the memory of an R integer vector, with NA masked.
+
+    """
+    missing = data == R_NA_INTEGER
+    if missing.any():
+        return numpy.ma.masked_array(data, missing)
+    return data
+
+def decode_logicals(data):
+    """decode_logicals(data: numpy.ndarray) -> numpy.ndarray
+    Returns the memory of an R logical vector as booleans, with NA masked.
+
+    """
+    array = data != 0
+    missing = data == R_NA_INTEGER
+    if missing.any():
+        return numpy.ma.masked_array(array, missing)
+    return array
+
+def decode_factor(codes, levels):
+    """decode_factor(codes: numpy.ndarray, levels: numpy.ndarray)
+        -> numpy.ndarray
+    Returns the levels of the codes of an R factor as an array of objects,
+    where NA is None.
+
+    """
+    array = numpy.empty(len(codes), dtype=object)
+    missing = codes == R_NA_INTEGER
+    array[~missing] = levels[codes[~missing] - 1]
+    array[missing] = None
+    return array
+
+def shape_array(array, dim):
+    """shape_array(array: numpy.ndarray, dim: sequence) -> numpy.ndarray
+    Gives an array read from R the dimensions in its 'dim' attribute, if it
+    has more than one.
+
+    """
+    if dim is not None and len(dim) > 1:
+        return array.reshape(tuple(dim), order='F')
+    return array
+
+###############################################################################
+
+import unittest
+
+
+class TestVectorBuffers(unittest.TestCase):
+    def setUp(self):
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+
+    def test_vector_type(self):
+        self.assertIs(array_vector_type(numpy.array([True, False])), bool)
+        self.assertIs(array_vector_type(numpy.array([1, 2], 'int16')), int)
+        self.assertIs(array_vector_type(numpy.array([1, 2**31])), float)
+        self.assertIs(array_vector_type(numpy.array([1, -2**31])), float)
+        self.assertIs(array_vector_type(numpy.array([1.5])), float)
+        self.assertIs(array_vector_type(numpy.array([1j])), complex)
+        self.assertIs(array_vector_type(numpy.array(['a'])), str)
+        self.assertIs(array_vector_type(numpy.array([1, 2]), float), float)
+        self.assertRaises(TypeException, array_vector_type,
+                          numpy.array([1.5]), int)
+
+    def test_flatten(self):
+        array = numpy.ma.masked_array([[1, 2, 3], [4, 5, 6]],
+                                      [[False, True, False],
+                                       [False, False, False]])
+        data, mask = flatten_array(array)
+        self.assertEqual(data.tolist(), [1, 4, 2, 5, 3, 6])
+        self.assertEqual(mask.tolist(),
+                         [False, False, True, False, False, False])
+        data, mask = flatten_array(numpy.ma.masked_array([1, 2]))
+        self.assertIs(mask, numpy.ma.nomask)
+        data, mask = flatten_array(numpy.array(['a', None], dtype=object))
+        self.assertEqual(mask.tolist(), [False, True])
+
+    def test_fill_buffer(self):
+        data, mask = flatten_array(numpy.ma.masked_array([1.5, 2.5],
+                                                         [True, False]))
+        buf = numpy.empty(2, 'float64')
+        fill_buffer(buf, data, mask, float)
+        self.assertEqual(buf.view(numpy.int64)[0], R_NA_REAL_BITS)
+        self.assertTrue(numpy.isnan(buf[0]))
+        self.assertEqual(buf[1], 2.5)
+
+        data, mask = flatten_array(numpy.ma.masked_array([True, False, True],
+                                                         [False, True,
+                                                          False]))
+        buf = numpy.empty(3, 'int32')
+        fill_buffer(buf, data, mask, bool)
+        self.assertEqual(buf.tolist(), [1, R_NA_INTEGER, 1])
+
+        data, mask = flatten_array(numpy.array([1, 2], 'int8'))
+        buf = numpy.empty(2, 'float64')
+        fill_buffer(buf, data, mask, float)
+        self.assertEqual(buf.tolist(), [1.0, 2.0])
+
+    def test_decode(self):
+        ints = decode_integers(numpy.array([3, R_NA_INTEGER], 'int32'))
+        self.assertEqual(ints.tolist(), [3, None])
+        self.assertIs(type(decode_integers(numpy.array([3], 'int32'))),
+                      numpy.ndarray)
+        bools = decode_logicals(numpy.array([1, 0, R_NA_INTEGER], 'int32'))
+        self.assertEqual(bools.tolist(), [True, False, None])
+        factor = decode_factor(numpy.array([2, R_NA_INTEGER, 1], 'int32'),
+                               numpy.array(['a', 'b'], dtype=object))
+        self.assertEqual(factor.tolist(), ['b', None, 'a'])
+
+    def test_shape_round_trip(self):
+        array = numpy.arange(6).reshape(2, 3)
+        data, mask = flatten_array(array)
+        self.assertEqual(shape_array(data, (2, 3)).tolist(), array.tolist())
+        self.assertIs(shape_array(data, (6,)), data)
+
+
+class TestRExchange(unittest.TestCase):
+    def setUp(self):
+        if numpy is None: # pragma: no cover
+            self.skipTest("numpy is not available")
+        try:
+            import rpy2.robjects
+        except ImportError:
+            self.skipTest("rpy2 is not available")
+
+    def test_array_round_trip(self):
+        from vistrails.packages.rpy.init import array_to_rvector, \
+            rvector_to_array
+        array = numpy.ma.masked_array([[1.5, 2.5, 3.5], [4.5, 5.5, 6.5]],
+                                      [[False, True, False],
+                                       [False, False, False]])
+        rvector = array_to_rvector(array)
+        self.assertEqual(list(rvector.do_slot('dim')), [2, 3])
+        result = rvector_to_array(rvector)
+        self.assertEqual(result.shape, (2, 3))
+        self.assertTrue(numpy.isnan(result[0, 1]))
+        self.assertEqual(result[1, 2], 6.5)
+        self.assertEqual(result[0, 2], 3.5)
+
+    def test_integers_and_strings(self):
+        from vistrails.packages.rpy.init import create_vector, \
+            rvector_to_list
+        ints = numpy.ma.masked_array([1, 2, 3], [False, True, False])
+        self.assertEqual(rvector_to_list(create_vector(ints), True).tolist(),
+                         [1, None, 3])
+        strings = numpy.array(['a', None, 'c'], dtype=object)
+        self.assertEqual(
+                rvector_to_list(create_vector(strings), True).tolist(),
+                ['a', None, 'c'])
+
+    def test_factors(self):
+        """Factors are only decoded into their levels with asArray.
+        """
+        import rpy2.robjects as robjects
+        from vistrails.packages.rpy.init import rvector_to_list
+        factor = robjects.r('factor(c("b", "a", "b"))')
+        self.assertEqual(rvector_to_list(factor), [2, 1, 2])
+        self.assertEqual(rvector_to_list(factor, True).tolist(),
+                         ['b', 'a', 'b'])
+
+    def test_data_frame_from_table(self):
+        import rpy2.rinterface as rinterface
+        from vistrails.packages.rpy.init import create_data_frame
+        class Table(object):
+            names = ['z', 'a']
+            columns = 2
+            def get_column(self, i, numeric=False):
+                column = [['3', '4'], ['x', 'y']][i]
+                if numeric:
+                    return numpy.array(column, dtype=numpy.float32)
+                return column
+        rdataframe = create_data_frame(Table())
+        self.assertEqual(list(rdataframe.colnames), ['z', 'a'])
+        self.assertEqual(rdataframe[0].typeof, rinterface.REALSXP)
+        self.assertEqual(list(rdataframe[0]), [3.0, 4.0])
+        self.assertEqual(rdataframe[1].typeof, rinterface.STRSXP)
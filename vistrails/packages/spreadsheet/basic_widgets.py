@@ -47,6 +47,7 @@ from spreadsheet_base import (StandardSheetReference,
                               StandardSingleCellSheetReference)
 from spreadsheet_controller import spreadsheetController
 from spreadsheet_event import DisplayCellEvent
+from spreadsheet_offscreen import offscreenExporter, canDumpOffscreen
 from PyQt4 import QtCore
 
 ################################################################################
@@ -217,6 +218,17 @@ class SpreadsheetCell(NotCacheable, Module):
         
         """
         e = self.createDisplayEvent(cellType, inputPorts)
+        if canDumpOffscreen(e):
+            # Only written to its file: the spreadsheet is not needed
+            offscreenExporter.dumpCell(e)
+            self.cellWidget = None
+            self.set_output('Widget', self.cellWidget)
+            return self.cellWidget
+        import vistrails.core.application
+        if not vistrails.core.application.is_running_gui():
+            raise ModuleError(self, "The spreadsheet requires the GUI, only "
+                              "cells with an offscreen renderer can be "
+                              "dumped to PNG files without it")
         QtCore.QCoreApplication.processEvents()
         spreadsheetWindow = spreadsheetController.findSpreadsheetWindow()
         if spreadsheetWindow.echoMode == False:
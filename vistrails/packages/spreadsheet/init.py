@@ -41,12 +41,14 @@ import sys
 from PyQt4 import QtCore, QtGui
 
 from vistrails.core import debug
+from vistrails.core.configuration import get_vistrails_configuration
 from vistrails.core.modules import basic_modules
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.core.system import vistrails_root_directory
 from vistrails.core.upgradeworkflow import UpgradeWorkflowHandler
 
 from spreadsheet_controller import spreadsheetController
+from spreadsheet_offscreen import offscreenExporter
 from spreadsheet_registry import spreadsheetRegistry
 
 # This must be here because of VisTrails protocol
@@ -111,7 +113,10 @@ def initialize(*args, **keywords):
     """
     import vistrails.core.application
     if not vistrails.core.application.is_running_gui():
-        raise RuntimeError, "GUI is not running. The Spreadsheet package requires the GUI"
+        # In batch mode, the cells with an offscreen renderer can still be
+        # dumped to files, see canDumpOffscreen()
+        if not get_vistrails_configuration().check('batch'):
+            raise RuntimeError, "GUI is not running. The Spreadsheet package requires the GUI"
     
     # initialize widgets
     debug.log('Loading Spreadsheet widgets...')
@@ -124,6 +129,8 @@ def initialize(*args, **keywords):
     global app
     app = QtCore.QCoreApplication.instance()
     if app==None:
+        if not vistrails.core.application.is_running_gui():
+            return
         app = QtGui.QApplication(sys.argv)
     if hasattr(app, 'builderWindow'):
         global spreadsheetWindow
@@ -144,6 +151,10 @@ def menu_items():
     return tuple(lst)
 
 def finalize():
+    offscreenExporter.wait()
+    if QtCore.QCoreApplication.instance() is None:
+        # batch mode without the GUI, no window was created
+        return
     spreadsheetWindow = spreadsheetController.findSpreadsheetWindow()
     ### DO NOT ADD BACK spreadsheetWindow.destroy()
     ### That will crash VisTrails on Mac. 
@@ -36,5 +36,12 @@ from vistrails.core.configuration import ConfigurationObject
 configuration = ConfigurationObject(rowCount=2,
                                     columnCount=3,
                                     dumpfileType='PNG',
-                                    fixedCellSize=False)
+                                    fixedCellSize=False,
+                                    offscreenWidth=640,
+                                    offscreenHeight=480,
+                                    offscreenThreads=(None, int))
 # other possible value for dumpfileType is PDF
+# offscreenWidth and offscreenHeight are the size of the images dumped
+# in batch mode, where cells have no widget
+# offscreenThreads limits how many cells are written to files at the
+# same time (default: the number of processors)
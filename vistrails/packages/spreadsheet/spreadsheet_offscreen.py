@@ -0,0 +1,328 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+################################################################################
+# This file contains the offscreen export of spreadsheet cells:
+#   OffscreenExporter
+#   getDumpFileName
+#   canDumpOffscreen
+################################################################################
+from multiprocessing import cpu_count
+import os.path
+import threading
+import time
+
+from vistrails.core import debug
+from vistrails.core.configuration import get_vistrails_configuration
+from spreadsheet_config import configuration
+from spreadsheet_registry import spreadsheetRegistry
+
+def get_max_threads():
+    """get_max_threads() -> int
+    Returns how many cells can be written to files at the same time.
+
+    """
+    if configuration.check('offscreenThreads'):
+        return configuration.offscreenThreads
+    return cpu_count()
+
+class OffscreenExporter(object):
+    """
+    OffscreenExporter writes cells to image files through the offscreen
+    renderers registered with the spreadsheet registry, without
+    grabbing their widgets. The renderer is called on the calling
+    thread, and returns a function that renders and writes the file on
+    a thread of its own, so that the following cells do not wait for
+    it. These threads are not daemonic: the application does not exit
+    before the files are complete.
+    
+    """
+    def __init__(self):
+        """ OffscreenExporter() -> OffscreenExporter
+        Initialize an exporter with no pending file
+        
+        """
+        self._threads = []
+        self._errors = []
+        self._slots = None
+
+    def canExport(self, cellType):
+        """ canExport(cellType: type) -> bool
+        Check if cells of this type can be exported offscreen
+        
+        """
+        return spreadsheetRegistry.getOffscreenRenderer(cellType) is not None
+
+    def export(self, cellType, inputPorts, filename, width, height):
+        """ export(cellType: type, inputPorts: tuple, filename: str,
+                   width: int, height: int) -> bool
+        Start writing a cell with these inputs to filename. Returns
+        False if the cell type has no offscreen renderer
+        
+        """
+        renderer = spreadsheetRegistry.getOffscreenRenderer(cellType)
+        if renderer is None:
+            return False
+        write = renderer(inputPorts, width, height)
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(max(1, get_max_threads()))
+        self._slots.acquire()
+        thread = threading.Thread(target=self._write, args=(write, filename))
+        self._threads = [t for t in self._threads if t.isAlive()]
+        self._threads.append(thread)
+        thread.start()
+        return True
+
+    def dumpCell(self, e, row=None, col=None):
+        """ dumpCell(e: DisplayCellEvent, row: int, col: int) -> bool
+        Start writing the cell of a display event to its dump file,
+        without any widget or window, see canDumpOffscreen(). Cells
+        that are not placed on a sheet are named after their location
+        or (0, 0), with a counter
+        
+        """
+        if row is None or col is None:
+            (row, col) = (max(e.row, 0), max(e.col, 0))
+        (filename, _) = getDumpFileName(e, row, col)
+        # Reserve the name, the file is written in the background
+        open(filename, 'wb').close()
+        return self.export(e.cellType, e.inputPorts, filename,
+                           configuration.offscreenWidth,
+                           configuration.offscreenHeight)
+
+    def _write(self, write, filename):
+        try:
+            write(filename)
+        except Exception, e:
+            # Reported from the calling thread by wait()
+            self._errors.append((filename, e))
+        finally:
+            self._slots.release()
+
+    def wait(self):
+        """ wait() -> list
+        Wait until all pending files are written. The ones that failed
+        are reported and returned as (filename, exception) pairs
+        
+        """
+        threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join()
+        errors, self._errors = self._errors, []
+        for (filename, e) in errors:
+            debug.critical("Could not export cell to '%s'" % filename, e)
+        return errors
+
+offscreenExporter = OffscreenExporter()
+
+def getDumpFileName(e, row, col):
+    """ getDumpFileName(e: DisplayCellEvent, row: int, col: int)
+          -> (str, bool)
+    Return a new file name the cell at (row, col) has to be dumped
+    to and whether it is a PDF, or None if the cell is not dumped
+    
+    """
+    if not e.vistrail.has_key('extra_info'):
+        return None
+    extra_info = e.vistrail['extra_info']
+    if not extra_info.has_key('pathDumpCells'):
+        return None
+    dump_as_pdf = False
+    dumppath = extra_info['pathDumpCells']
+    if extra_info.has_key('nameDumpCells'):
+        name = extra_info['nameDumpCells']
+        base_fname = os.path.join(dumppath,
+                                  name)
+    else:
+        locator = e.vistrail['locator']
+        if locator is not None:
+            name = e.vistrail['locator'].short_name
+        else:
+            name = 'untitled'
+        version = e.vistrail['version']
+        if version is None:
+            version = 0L
+        base_fname = os.path.join(dumppath,"%s_%s" % \
+                                  (name, e.vistrail['version']))
+
+    if configuration.dumpfileType == 'PNG':
+        dump_as_pdf = False
+    elif configuration.dumpfileType == 'PDF':
+        dump_as_pdf = True
+        
+    #extra_info configuration overwrites global configuration    
+    if extra_info.has_key('pdf'):
+        dump_as_pdf = extra_info['pdf']
+    
+    file_extension = '.png'
+    if dump_as_pdf == True:
+        file_extension = '.pdf'
+            
+    # add cell location by default
+    if not extra_info.has_key('nameDumpCells'):
+        base_fname = base_fname + "_%d_%d" % (row, col)
+    # make a unique filename
+    filename = base_fname + file_extension
+    counter = 2
+    while os.path.exists(filename):
+        filename = base_fname + "_%d%s" % (counter,
+                                           file_extension)
+        counter += 1
+    return (filename, dump_as_pdf)
+
+def canDumpOffscreen(e):
+    """ canDumpOffscreen(e: DisplayCellEvent) -> bool
+    Check if the cell of this event only has to be dumped to a
+    file, and can be without creating its widget. This is the case
+    in batch mode, for PNG dumps of cells with an offscreen renderer
+    
+    """
+    if (not get_vistrails_configuration().check('batch') or
+            e.inputPorts is None or
+            not offscreenExporter.canExport(e.cellType) or
+            not e.vistrail.has_key('extra_info')):
+        return False
+    extra_info = e.vistrail['extra_info']
+    if not extra_info.has_key('pathDumpCells'):
+        return False
+    if extra_info.has_key('pdf'):
+        return not extra_info['pdf']
+    return configuration.dumpfileType != 'PDF'
+
+
+################################################################################
+
+import unittest
+
+class TestOffscreenExporter(unittest.TestCase):
+    class Cell(object):
+        pass
+
+    class DerivedCell(Cell):
+        pass
+
+    def setUp(self):
+        self.exporter = OffscreenExporter()
+        self.written = []
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+        self.event = threading.Event()
+
+    def tearDown(self):
+        spreadsheetRegistry.unregisterOffscreenRenderer(self.Cell)
+        configuration.offscreenThreads = None
+
+    def render(self, inputPorts, width, height):
+        (value,) = inputPorts
+        def write(filename):
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            self.event.wait(5)
+            if value is None:
+                raise ValueError("no value")
+            with self.lock:
+                self.running -= 1
+                self.written.append((filename, value, width, height))
+        return write
+
+    def test_unregistered(self):
+        self.assertFalse(self.exporter.canExport(self.Cell))
+        self.assertFalse(self.exporter.export(self.Cell, (1,), 'a.png',
+                                              10, 10))
+        self.assertEqual(self.exporter.wait(), [])
+
+    def test_concurrent(self):
+        configuration.offscreenThreads = 3
+        spreadsheetRegistry.registerOffscreenRenderer(self.Cell, self.render)
+        self.assertTrue(self.exporter.canExport(self.DerivedCell))
+        for i in xrange(3):
+            self.assertTrue(self.exporter.export(self.DerivedCell, (i,),
+                                                 '%d.png' % i, 20, 10))
+        # all three are written at the same time
+        for i in xrange(500):
+            if self.running == 3:
+                break
+            time.sleep(0.01)
+        self.event.set()
+        self.assertEqual(self.exporter.wait(), [])
+        self.assertEqual(sorted(self.written),
+                         [('%d.png' % i, i, 20, 10) for i in xrange(3)])
+        self.assertEqual(self.max_running, 3)
+
+    def test_errors(self):
+        configuration.offscreenThreads = 1
+        spreadsheetRegistry.registerOffscreenRenderer(self.Cell, self.render)
+        self.event.set()
+        self.exporter.export(self.Cell, (None,), 'bad.png', 10, 10)
+        self.exporter.export(self.Cell, (1,), 'good.png', 10, 10)
+        errors = self.exporter.wait()
+        self.assertEqual([f for f, e in errors], ['bad.png'])
+        self.assertIsInstance(errors[0][1], ValueError)
+        self.assertEqual(self.written, [('good.png', 1, 10, 10)])
+
+    def test_dump_cell(self):
+        import shutil
+        import tempfile
+
+        class Event(object):
+            row = -1
+            col = -1
+            cellType = self.Cell
+            inputPorts = (1,)
+        e = Event()
+        dumppath = tempfile.mkdtemp(prefix='vt_offscreen_')
+        e.vistrail = {'locator': None, 'version': 3,
+                      'extra_info': {'pathDumpCells': dumppath}}
+        spreadsheetRegistry.registerOffscreenRenderer(self.Cell, self.render)
+        batch = get_vistrails_configuration().check('batch')
+        get_vistrails_configuration().batch = True
+        self.event.set()
+        try:
+            self.assertTrue(canDumpOffscreen(e))
+            self.assertTrue(self.exporter.dumpCell(e))
+            self.assertTrue(self.exporter.dumpCell(e))
+            self.assertEqual(self.exporter.wait(), [])
+            self.assertEqual(sorted(f for f, v, w, h in self.written),
+                             [os.path.join(dumppath, 'untitled_3_0_0.png'),
+                              os.path.join(dumppath, 'untitled_3_0_0_2.png')])
+            e.vistrail['extra_info']['pdf'] = True
+            self.assertFalse(canDumpOffscreen(e))
+            get_vistrails_configuration().batch = False
+            del e.vistrail['extra_info']['pdf']
+            self.assertFalse(canDumpOffscreen(e))
+        finally:
+            get_vistrails_configuration().batch = batch
+            shutil.rmtree(dumppath)
@@ -50,6 +50,7 @@ class SpreadsheetRegistry(object):
         """
         self.packages = {}
         self.sheets = {}
+        self.offscreenRenderers = {}
 
     def registerPackage(self, package, name):
         """ registerPackage(package: python package, name: str) -> None
@@ -100,5 +101,36 @@ class SpreadsheetRegistry(object):
             if t==type:
                 return n
         return None
+
+    def registerOffscreenRenderer(self, cellType, renderer):
+        """ registerOffscreenRenderer(cellType: type,
+                                       renderer: function) -> None
+        Register a function rendering the contents of cellType without
+        its widget. renderer(inputPorts, width, height) is called with
+        the inputs the cell would be updated with and returns a
+        function writing the image to the filename it is given, which
+        must be safe to call from another thread
+        
+        """
+        self.offscreenRenderers[cellType] = renderer
+
+    def unregisterOffscreenRenderer(self, cellType):
+        """ unregisterOffscreenRenderer(cellType: type) -> None
+        Unregister the offscreen renderer of a cell type
+        
+        """
+        if self.offscreenRenderers.has_key(cellType):
+            del self.offscreenRenderers[cellType]
+
+    def getOffscreenRenderer(self, cellType):
+        """ getOffscreenRenderer(cellType: type) -> function
+        Return the offscreen renderer of cellType or of its closest base
+        class, or None if the cell can only be exported from its widget
+        
+        """
+        for t in getattr(cellType, '__mro__', ()):
+            if self.offscreenRenderers.has_key(t):
+                return self.offscreenRenderers[t]
+        return None
         
 spreadsheetRegistry = SpreadsheetRegistry()
@@ -50,6 +50,7 @@ from spreadsheet_cell import QCellPresenter, QCellContainer, QCellToolBar
 from spreadsheet_execute import assignPipelineCellLocations, \
      executePipelineWithProgress
 from spreadsheet_config import configuration
+from spreadsheet_offscreen import offscreenExporter
 from vistrails.core.inspector import PipelineInspector
 import spreadsheet_rc
 
@@ -305,6 +306,10 @@ class StandardWidgetSheetTabInterface(object):
                 oldCell.deleteLater()
         else:
             oldCell.updateContents(inputPorts)
+        cell = self.getCell(row, col)
+        if cell is not None:
+            # Kept to render the cell again offscreen
+            cell.offscreenInputPorts = inputPorts
         self.lastCellLocation = (row, col)
 
     def showHelpers(self, show, globalPos):
@@ -539,7 +544,9 @@ class StandardWidgetSheetTabInterface(object):
 
     def exportSheetToImages(self, dirPath, format='png'):
         """ exportSheetToImage() -> None
-        Montage all the cell images and export to a file
+        Export each cell to an image file named after its location.
+        Cells that can be rendered offscreen are written concurrently,
+        the others are grabbed from their widgets
         
         """
         (rCount, cCount) = self.getDimension()
@@ -547,10 +554,17 @@ class StandardWidgetSheetTabInterface(object):
             for c in xrange(cCount):
                 widget = self.getCell(r, c)
                 if widget:
-                    widget.grabWindowPixmap().save(dirPath+'/'+
-                                                   chr(c+ord('a'))+
-                                                   str(r+1)+
-                                                   '.'+format)
+                    fileName = (dirPath+'/'+chr(c+ord('a'))+str(r+1)+
+                                '.'+format)
+                    inputPorts = getattr(widget, 'offscreenInputPorts', None)
+                    if (inputPorts is None or
+                            not offscreenExporter.export(type(widget),
+                                                         inputPorts,
+                                                         fileName,
+                                                         widget.width(),
+                                                         widget.height())):
+                        widget.grabWindowPixmap().save(fileName)
+        offscreenExporter.wait()
 
     def setSpan(self, row, col, rowSpan, colSpan):
         """ setSpan(row, col, rowSpan, colSpan: int) -> None
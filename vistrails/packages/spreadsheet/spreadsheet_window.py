@@ -44,6 +44,8 @@ from spreadsheet_tabcontroller import StandardWidgetTabController
 from spreadsheet_sheet import StandardWidgetSheet
 from spreadsheet_cell import QCellContainer
 from spreadsheet_config import configuration
+from spreadsheet_offscreen import offscreenExporter, canDumpOffscreen, \
+    getDumpFileName
 from vistrails.core.modules import module_utils
 from vistrails.core.utils import trace_method
 import ctypes
@@ -468,6 +470,10 @@ class SpreadsheetWindow(QtGui.QMainWindow):
             col = e.col
             if row<0 or col<0:
                 (row, col) = sheet.getFreeCell()
+            if canDumpOffscreen(e):
+                # Write the cell straight to its file, no widget needed
+                offscreenExporter.dumpCell(e, row, col)
+                return None
             sheet.tabWidget.setCurrentWidget(sheet)
             sheet.setCellPipelineInfo(row, col,
                                       (e.vistrail, pid, cid))
@@ -483,50 +489,10 @@ class SpreadsheetWindow(QtGui.QMainWindow):
                 sheet.setCellEditingMode(row, col, True)
             #If a cell has to dump its contents to a file, it will be in the
             #extra_info dictionary
-            if cell and e.vistrail.has_key('extra_info'):
-                dump_as_pdf = False
-                extra_info = e.vistrail['extra_info']
-                if extra_info.has_key('pathDumpCells'):
-                    dumppath = extra_info['pathDumpCells']
-                    if extra_info.has_key('nameDumpCells'):
-                        name = extra_info['nameDumpCells']
-                        base_fname = os.path.join(dumppath,
-                                                  name)
-                    else:
-                        locator = e.vistrail['locator']
-                        if locator is not None:
-                            name = e.vistrail['locator'].short_name
-                        else:
-                            name = 'untitled'
-                        version = e.vistrail['version']
-                        if version is None:
-                            version = 0L
-                        base_fname = os.path.join(dumppath,"%s_%s" % \
-                                                  (name, e.vistrail['version']))
-
-                    if configuration.dumpfileType == 'PNG':
-                        dump_as_pdf = False
-                    elif configuration.dumpfileType == 'PDF':
-                        dump_as_pdf = True
-                        
-                    #extra_info configuration overwrites global configuration    
-                    if extra_info.has_key('pdf'):
-                        dump_as_pdf = extra_info['pdf']
-                    
-                    file_extension = '.png'
-                    if dump_as_pdf == True:
-                        file_extension = '.pdf'
-                            
-                    # add cell location by default
-                    if not extra_info.has_key('nameDumpCells'):
-                        base_fname = base_fname + "_%d_%d" % (row, col)
-                    # make a unique filename
-                    filename = base_fname + file_extension
-                    counter = 2
-                    while os.path.exists(filename):
-                        filename = base_fname + "_%d%s" % (counter,
-                                                           file_extension)
-                        counter += 1
+            if cell:
+                dump = getDumpFileName(e, row, col)
+                if dump is not None:
+                    (filename, dump_as_pdf) = dump
                     if not dump_as_pdf:
                         cell.dumpToFile(filename)
                     else:
@@ -547,6 +513,7 @@ class SpreadsheetWindow(QtGui.QMainWindow):
         for e in batchEvent.displayEvents:
             e.vistrail = batchEvent.vistrail
             self.displayCellEvent(e)
+        offscreenExporter.wait()
 
     def repaintCurrentSheetEvent(self, e):
         """ repaintCurrentSheetEvent(e: RepaintCurrentSheetEvent) -> None
@@ -33,11 +33,20 @@
 ##
 ###############################################################################
 
+from collections import OrderedDict
+from itertools import chain
 from sqlalchemy.engine import create_engine
 from sqlalchemy.engine.url import URL
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import SingletonThreadPool
+import threading
 import urllib
 
+try:
+    import numpy
+except ImportError: # pragma: no cover
+    numpy = None
+
 from vistrails.core.db.action import create_action
 from vistrails.core.bundles.installbundle import install
 from vistrails.core import debug
@@ -50,11 +59,106 @@ from vistrails.core.utils import versions_increasing
 from vistrails.packages.tabledata.common import TableObject
 
 
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _url_key(url):
+    return (url.drivername, url.username, url.password, url.host, url.port,
+            url.database, tuple(sorted((url.query or {}).iteritems())))
+
+def get_engine(url, **options):
+    """get_engine(url: URL, **options) -> Engine
+
+    Returns the engine for this URL and create_engine() options, creating
+    it the first time, so that the dialect and driver are only set up once.
+    """
+    key = (_url_key(url), tuple(sorted(options.iteritems())))
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = create_engine(url, **options)
+        return engine
+
+def pool_options(url):
+    """pool_options(url: URL) -> dict
+
+    Returns the create_engine() options for the connection pool of this URL.
+    SQLAlchemy doesn't pool connections to SQLite files by default, and
+    they can't be shared between threads, so they are kept per thread.
+    """
+    if url.drivername.split('+', 1)[0] == 'sqlite':
+        return {'poolclass': SingletonThreadPool}
+    return {}
+
+def dispose_engines():
+    with _engines_lock:
+        engines = _engines.values()
+        _engines.clear()
+    for engine in engines:
+        engine.dispose()
+
+
+RESULT_CACHE_SIZE = 16
+
+_result_cache = OrderedDict()
+_result_cache_lock = threading.Lock()
+
+def get_cached_result(key):
+    with _result_cache_lock:
+        try:
+            result = _result_cache.pop(key)
+        except KeyError:
+            return None
+        _result_cache[key] = result
+        return result
+
+def set_cached_result(key, result):
+    with _result_cache_lock:
+        _result_cache.pop(key, None)
+        _result_cache[key] = result
+        while len(_result_cache) > RESULT_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+
+def clear_result_cache():
+    with _result_cache_lock:
+        _result_cache.clear()
+
+
+class BatchedTable(TableObject):
+    """A table read from a result set in batches of rows.
+
+    Each batch is stored as one list per column, so the rows themselves
+    are never kept; the lists are only joined when a column is requested.
+    """
+    def __init__(self, names):
+        TableObject.__init__(self, [], 0, list(names))
+        self.columns = len(self.names)
+        self._batches = [[] for name in self.names]
+
+    def add_batch(self, rows):
+        for i, column in enumerate(zip(*rows)):
+            self._batches[i].append(list(column))
+        self.rows += len(rows)
+
+    def get_column(self, i, numeric=False):
+        if numeric and numpy is not None:
+            return numpy.concatenate(
+                    [numpy.array(batch, dtype=numpy.float32)
+                     for batch in self._batches[i]] or
+                    [numpy.array([], dtype=numpy.float32)])
+        return list(chain.from_iterable(self._batches[i]))
+
+
 class DBConnection(Module):
     """Connects to a database.
 
     If the URI you enter uses a driver which is not currently installed,
     VisTrails will try to set it up.
+
+    The output is the engine, shared between executions and modules with
+    the same URL. Its connections are pooled: the modules using it check a
+    connection out when they run and give it back when they are done, so
+    cached modules don't hold any.
     """
     _input_ports = [('protocol', '(basic:String)'),
                     ('user', '(basic:String)',
@@ -77,7 +181,7 @@ class DBConnection(Module):
                   database=self.get_input('db_name'))
 
         try:
-            engine = create_engine(url)
+            engine = get_engine(url, **pool_options(url))
         except ImportError, e:
             driver = url.drivername
             installed = False
@@ -119,7 +223,7 @@ class DBConnection(Module):
                 raise ModuleError(self,
                                   "Failed to install required driver")
             try:
-                engine = create_engine(url)
+                engine = get_engine(url, **pool_options(url))
             except Exception, e:
                 raise ModuleError(self,
                                   "Couldn't connect to the database: %s" %
@@ -132,14 +236,31 @@ class DBConnection(Module):
                     "SQLAlchemy has no support for protocol %r -- are you "
                     "sure you spelled that correctly?" % url.drivername)
 
-        self.set_output('connection', engine.connect())
+        self.set_output('connection', engine)
 
 
 class SQLSource(Module):
+    """Runs a query on a database.
+
+    If batchSize is set, the rows are fetched from a server-side cursor,
+    that many at a time, and the table is built one batch at a time;
+    resultSet is not set in that mode.
+
+    If freshnessToken is set, the result is kept in memory and reused by
+    later executions with the same query, parameters and token; change the
+    token when the data should be read again.
+
+    A connection is checked out of the engine's pool for the query and
+    returned when it is done.
+    """
     _settings = ModuleSettings(configure_widget=
             'vistrails.packages.sql.widgets:SQLSourceConfigurationWidget')
     _input_ports = [('connection', '(DBConnection)'),
                     ('cacheResults', '(basic:Boolean)'),
+                    ('batchSize', '(basic:Integer)',
+                     {'optional': True}),
+                    ('freshnessToken', '(basic:String)',
+                     {'optional': True}),
                     ('source', '(basic:String)')]
     _output_ports = [('result', '(org.vistrails.vistrails.tabledata:Table)'),
                      ('resultSet', '(basic:List)')]
@@ -152,34 +273,76 @@ class SQLSource(Module):
         if self.has_input('cacheResults'):
             cached = self.get_input('cacheResults')
             self.is_cacheable = lambda: cached
-        connection = self.get_input('connection')
+        connectable = self.get_input('connection')
         inputs = dict((k, self.get_input(k)) for k in self.inputPorts.iterkeys()
-                  if k not in ('source', 'connection', 'cacheResults'))
+                  if k not in ('source', 'connection', 'cacheResults',
+                               'batchSize', 'freshnessToken'))
         s = urllib.unquote(str(self.get_input('source')))
+        batch_size = self.force_get_input('batchSize', None)
+
+        cache_key = None
+        if self.has_input('freshnessToken'):
+            cache_key = (_url_key(connectable.engine.url), s,
+                         repr(sorted(inputs.iteritems())), batch_size,
+                         self.get_input('freshnessToken'))
+            result = get_cached_result(cache_key)
+            if result is not None:
+                table, rows = result
+                self.set_output('result', table)
+                self.set_output('resultSet', rows)
+                return
 
+        try:
+            # Also works on a Connection, giving a branch of it
+            connection = connectable.connect()
+        except SQLAlchemyError, e:
+            raise ModuleError(self, debug.format_exception(e))
         try:
             transaction = connection.begin()
-            results = connection.execute(s, inputs)
+            if batch_size:
+                results = connection.execution_options(
+                        stream_results=True).execute(s, inputs)
+            else:
+                results = connection.execute(s, inputs)
             try:
-                rows = results.fetchall()
+                if batch_size:
+                    rows = results.fetchmany(batch_size)
+                else:
+                    rows = results.fetchall()
             except Exception:
-                self.set_output('result', None)
-                self.set_output('resultSet', None)
+                table = rows = None
             else:
                 # results.returns_rows is True
                 # We don't use 'if return_rows' because this attribute didn't
                 # use to exist
-                table = TableObject.from_dicts(rows, results.keys())
-                self.set_output('result', table)
-                self.set_output('resultSet', rows)
+                if batch_size:
+                    table = BatchedTable(results.keys())
+                    while rows:
+                        table.add_batch(rows)
+                        rows = results.fetchmany(batch_size)
+                    rows = None
+                else:
+                    table = TableObject.from_dicts(rows, results.keys())
+            self.set_output('result', table)
+            self.set_output('resultSet', rows)
             transaction.commit()
         except SQLAlchemyError, e:
             raise ModuleError(self, debug.format_exception(e))
+        finally:
+            connection.close()
+
+        if cache_key is not None and table is not None:
+            set_cached_result(cache_key, (table, rows))
 
 
 _modules = [DBConnection, SQLSource]
 
 
+def finalize():
+    clear_result_cache()
+    dispose_engines()
+
+
 def handle_module_upgrade_request(controller, module_id, pipeline):
     # Before 0.0.3, SQLSource's resultSet output was type ListOfElements (which
     #   doesn't exist anymore)
@@ -292,7 +455,6 @@ class TestSQL(unittest.TestCase):
                     ]))
 
             self.assertEqual(len(connection), 1)
-            connection[0].close()
             self.assertEqual(len(table), 1)
             self.assertIsNone(table[0])
 
@@ -318,7 +480,6 @@ class TestSQL(unittest.TestCase):
                     ]))
 
             self.assertEqual(len(connection), 1)
-            connection[0].close()
             self.assertEqual(len(table), 1)
             table, = table
             self.assertEqual(table.names, ['name', 'lastname', 'age'])
@@ -330,3 +491,95 @@ class TestSQL(unittest.TestCase):
                 os.remove(test_db)
             except OSError:
                 pass # Oops, we are leaking the file here...
+
+    def test_batches_and_cache(self):
+        """Reads a large SQLite3 table in batches, with the result cache.
+        """
+        import os
+        import sqlite3
+        import tempfile
+        import urllib2
+        from sqlalchemy import event
+        from vistrails.tests.utils import execute, intercept_results
+        identifier = 'org.vistrails.vistrails.sql'
+
+        test_db_fd, test_db = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(test_db_fd)
+        nb_rows = 200000
+        try:
+            conn = sqlite3.connect(test_db)
+            cur = conn.cursor()
+            cur.execute('CREATE TABLE test(id INTEGER PRIMARY KEY, '
+                        'value INTEGER NOT NULL)')
+            cur.executemany('INSERT INTO test(id, value) VALUES(?, ?)',
+                            ((i, i % 10) for i in xrange(nb_rows)))
+            conn.commit()
+
+            source = "SELECT id, value FROM test WHERE value < :limit"
+
+            def run(token):
+                with intercept_results(DBConnection, 'connection',
+                                       SQLSource, 'result') as (
+                        connection, table):
+                    self.assertFalse(execute([
+                            ('DBConnection', identifier, [
+                                ('protocol', [('String', 'sqlite')]),
+                                ('db_name', [('String', test_db)]),
+                            ]),
+                            ('SQLSource', identifier, [
+                                ('source', [('String',
+                                             urllib2.quote(source))]),
+                                ('limit', [('Integer', '5')]),
+                                ('batchSize', [('Integer', '4096')]),
+                                ('freshnessToken', [('String', token)]),
+                            ]),
+                        ],
+                        [
+                            (0, 'connection', 1, 'connection'),
+                        ],
+                        add_port_specs=[
+                            (1, 'input', 'limit',
+                             'org.vistrails.vistrails.basic:Integer'),
+                        ]))
+                self.assertEqual(len(connection), 1)
+                self.assertEqual(len(table), 1)
+                return connection[0], table[0]
+
+            engine1, table1 = run('1')
+            self.assertIsInstance(table1, BatchedTable)
+            self.assertEqual(table1.names, ['id', 'value'])
+            self.assertEqual((table1.rows, table1.columns),
+                             (nb_rows // 2, 2))
+            self.assertEqual(sum(table1.get_column(1)), nb_rows // 10 * 10)
+            if numpy is not None:
+                self.assertEqual(table1.get_column(1, True).sum(),
+                                 nb_rows // 10 * 10)
+
+            cur.execute('DELETE FROM test WHERE id % 2 = 0')
+            conn.commit()
+            conn.close()
+
+            events = []
+            def recorder(name):
+                return lambda *args: events.append(name)
+            for name in ('connect', 'checkout', 'checkin'):
+                event.listen(engine1, name, recorder(name))
+
+            # Same token: result is cached, engine is shared
+            engine2, table2 = run('1')
+            self.assertIs(table2, table1)
+            self.assertIs(engine2, engine1)
+            self.assertEqual(events, [])
+
+            # New token: query runs again, on the pooled connection
+            engine3, table3 = run('2')
+            self.assertEqual(table3.rows, nb_rows // 5)
+            self.assertIs(engine3, engine1)
+            self.assertEqual(events, ['checkout', 'checkin'])
+        finally:
+            clear_result_cache()
+            dispose_engines()
+            try:
+                os.remove(test_db)
+            except OSError:
+                pass # Oops, we are leaking the file here...
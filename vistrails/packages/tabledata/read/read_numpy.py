@@ -1,6 +1,43 @@
 import numpy
+import os
 
-from vistrails.core.modules.vistrails_module import Module
+from vistrails.core.modules.vistrails_module import Module, ModuleError
+
+
+def parse_slice(text):
+    """parse_slice(text: str) -> tuple
+
+    Parses NumPy index notation such as '10:20, ::2, 3' into a tuple that
+    can be used to index an array.
+    """
+    index = []
+    for part in text.split(','):
+        part = part.strip()
+        if part == '...':
+            index.append(Ellipsis)
+        elif ':' in part:
+            bounds = [b.strip() for b in part.split(':')]
+            if len(bounds) > 3:
+                raise ValueError("invalid slice %r" % part)
+            index.append(slice(*[int(b) if b else None for b in bounds]))
+        elif part:
+            index.append(int(part))
+        else:
+            raise ValueError("empty index in %r" % text)
+    return tuple(index)
+
+
+def iter_chunks(array, chunk_size):
+    """iter_chunks(array: ndarray, chunk_size: int) -> iterator
+
+    Yields copies of consecutive blocks of chunk_size rows. When array is
+    memory-mapped, only one block is in memory at a time.
+    """
+    if array.ndim == 0:
+        yield numpy.array(array)
+        return
+    for start in xrange(0, array.shape[0], chunk_size):
+        yield numpy.array(array[start:start + chunk_size])
 
 
 class NumPyArray(Module):
@@ -15,6 +52,12 @@ class NumPyArray(Module):
 
     If the array you are reading is not a simple one-dimensional array, you can
     use the shape port to indicate its expected structure.
+
+    To work with arrays that do not fit in memory, set mmap to map the file
+    instead of reading it, and use offset and count (in elements of the flat
+    data) and slice (NumPy index notation, applied after shape) to select a
+    part of it. Setting chunk_size streams the array on the chunks port, in
+    blocks of that many rows; this implies mmap.
     """
     NPY_FMT = object()
 
@@ -41,9 +84,21 @@ class NumPyArray(Module):
             ('file', '(org.vistrails.vistrails.basic:File)'),
             ('datatype', '(org.vistrails.vistrails.basic:String)',
              {'entry_types': "['enum']", 'values': "[%r]" % FORMAT_MAP.keys()}),
-            ('shape', '(org.vistrails.vistrails.basic:List)')]
+            ('shape', '(org.vistrails.vistrails.basic:List)'),
+            ('mmap', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"}),
+            ('offset', '(org.vistrails.vistrails.basic:Integer)',
+             {'optional': True}),
+            ('count', '(org.vistrails.vistrails.basic:Integer)',
+             {'optional': True}),
+            ('slice', '(org.vistrails.vistrails.basic:String)',
+             {'optional': True}),
+            ('chunk_size', '(org.vistrails.vistrails.basic:Integer)',
+             {'optional': True})]
     _output_ports = [
-            ('value', '(org.vistrails.vistrails.basic:List)')]
+            ('value', '(org.vistrails.vistrails.basic:List)'),
+            ('chunks', '(org.vistrails.vistrails.basic:List)',
+             {'optional': True, 'depth': 1})]
 
     def compute(self):
         filename = self.get_input('file').name
@@ -54,18 +109,59 @@ class NumPyArray(Module):
                 dtype = self.NPY_FMT
             else:
                 dtype = numpy.float32
+        offset = self.force_get_input('offset', 0)
+        count = self.force_get_input('count', -1)
+        chunk_size = self.force_get_input('chunk_size', None)
+        if offset < 0:
+            raise ModuleError(self, "offset cannot be negative")
+        if chunk_size is not None and chunk_size < 1:
+            raise ModuleError(self, "chunk_size must be positive")
+        mmap = self.get_input('mmap') or chunk_size is not None
+
         if dtype is self.NPY_FMT:
             # Numpy's ".NPY" format
             # Written with: numpy.save('xxx.npy', array)
-            array = numpy.load(filename)
+            array = numpy.load(filename, mmap_mode='r' if mmap else None)
+            if offset or count >= 0:
+                stop = offset + count if count >= 0 else None
+                array = array.reshape(-1)[offset:stop]
+        elif mmap:
+            # Map the plain binary file instead of reading it
+            itemsize = numpy.dtype(dtype).itemsize
+            size = os.path.getsize(filename) // itemsize - offset
+            if count >= 0:
+                size = min(size, count)
+            if size > 0:
+                array = numpy.memmap(filename, dtype, mode='r',
+                                     offset=offset * itemsize,
+                                     shape=(size,))
+            else:
+                array = numpy.empty((0,), dtype)
         else:
             # Numpy's plain binary format
             # Written with: array.tofile('xxx.dat')
-            array = numpy.fromfile(filename, dtype)
+            with open(filename, 'rb') as fp:
+                fp.seek(offset * numpy.dtype(dtype).itemsize)
+                array = numpy.fromfile(fp, dtype, count)
         if self.has_input('shape'):
             array.shape = tuple(self.get_input('shape'))
+        if self.has_input('slice'):
+            try:
+                index = parse_slice(self.get_input('slice'))
+            except ValueError, e:
+                raise ModuleError(self, "Invalid slice: %s" % e)
+            array = array[index]
         self.set_output('value', array)
 
+        if chunk_size is not None:
+            if array.ndim == 0:
+                nb_chunks = 1
+            else:
+                nb_chunks = (array.shape[0] + chunk_size - 1) // chunk_size
+            self.set_streaming_output('chunks',
+                                      iter_chunks(array, chunk_size),
+                                      nb_chunks)
+
 
 _modules = [NumPyArray]
 
@@ -142,3 +238,61 @@ class NumpyTestCase(unittest.TestCase):
                 ]))
         self.assertEqual(len(results), 1)
         self.assertEqual(list(results[0]), [1.0, 7.0, 5.0, 3.0, 6.0, 1.0])
+
+    def test_mmap_slice(self):
+        """Reads part of a raw array with mmap, offset, count and slice.
+        """
+        from ..identifiers import identifier
+        from vistrails.tests.utils import execute, intercept_result
+
+        with intercept_result(NumPyArray, 'value') as results:
+            self.assertFalse(execute([
+                    ('read|NumPyArray', identifier, [
+                        ('datatype', [('String', 'float32')]),
+                        ('mmap', [('Boolean', 'True')]),
+                        ('offset', [('Integer', '1')]),
+                        ('count', [('Integer', '4')]),
+                        ('shape', [('List', '[2, 2]')]),
+                        ('slice', [('String', '1:, ::-1')]),
+                        ('file', [('File', self._test_dir + '/random.dat')]),
+                    ]),
+                ]))
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], numpy.memmap)
+        self.assertEqual(results[0].tolist(), [[6.0, 3.0]])
+
+    def test_parse_slice(self):
+        self.assertEqual(parse_slice('1:5, ::2, 3, ...'),
+                         (slice(1, 5), slice(None, None, 2), 3, Ellipsis))
+        self.assertRaises(ValueError, parse_slice, '1,,2')
+        self.assertRaises(ValueError, parse_slice, 'a:b')
+
+    def test_chunks(self):
+        """Streams a .NPY array in chunks into an appending WriteNumPy.
+        """
+        import os
+        import shutil
+        import tempfile
+        from ..identifiers import identifier
+        from vistrails.tests.utils import execute
+
+        tmp_dir = tempfile.mkdtemp(prefix='vt_numpy_')
+        try:
+            out = os.path.join(tmp_dir, 'out.npy')
+            self.assertFalse(execute([
+                    ('read|NumPyArray', identifier, [
+                        ('file', [('File', self._test_dir + '/random.npy')]),
+                        ('chunk_size', [('Integer', '4')]),
+                    ]),
+                    ('write|WriteNumPy', identifier, [
+                        ('datatype', [('String', 'npy')]),
+                        ('file', [('File', out)]),
+                        ('append', [('Boolean', 'True')]),
+                    ]),
+                ], [
+                    (0, 'chunks', 1, 'array'),
+                ]))
+            self.assertEqual(numpy.load(out).tolist(),
+                             [1.0, 7.0, 5.0, 3.0, 6.0, 1.0])
+        finally:
+            shutil.rmtree(tmp_dir)
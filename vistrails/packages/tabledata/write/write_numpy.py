@@ -1,10 +1,65 @@
 import numpy
+from numpy.lib import format as npy_format
+import os
+import shutil
+from StringIO import StringIO
 
-from vistrails.core.modules.vistrails_module import Module
+from vistrails.core.modules.vistrails_module import Module, ModuleError
 
 from ..read.read_numpy import NumPyArray
 
 
+def append_npy(filename, array):
+    """append_npy(filename: str, array: ndarray) -> None
+
+    Appends array to the .NPY file filename along the first axis, without
+    loading the existing data. The header is updated in place when its size
+    does not change; otherwise the file is rewritten by streaming the
+    existing data to a new file.
+    """
+    with open(filename, 'rb') as fp:
+        version = npy_format.read_magic(fp)
+        if version == (1, 0):
+            shape, fortran_order, dtype = npy_format.read_array_header_1_0(fp)
+        else:
+            shape, fortran_order, dtype = npy_format.read_array_header_2_0(fp)
+        data_start = fp.tell()
+    if fortran_order or not shape:
+        raise ValueError("can only append to C-ordered arrays of at least "
+                         "one dimension")
+    if array.ndim == 0:
+        array = array.reshape(1)
+    if array.shape[1:] != shape[1:]:
+        raise ValueError("cannot append array of shape %r to array of shape "
+                         "%r" % (array.shape, shape))
+    array = array.astype(dtype, copy=False)
+
+    header = StringIO()
+    write_header = (npy_format.write_array_header_1_0 if version == (1, 0)
+                    else npy_format.write_array_header_2_0)
+    write_header(header, {'descr': npy_format.dtype_to_descr(dtype),
+                          'fortran_order': False,
+                          'shape': (shape[0] + array.shape[0],) + shape[1:]})
+    header = header.getvalue()
+
+    if len(header) == data_start:
+        with open(filename, 'r+b') as fp:
+            fp.write(header)
+            fp.seek(0, os.SEEK_END)
+            array.tofile(fp)
+    else:
+        tmp_filename = filename + '.tmp'
+        with open(filename, 'rb') as src:
+            with open(tmp_filename, 'wb') as dst:
+                dst.write(header)
+                src.seek(data_start)
+                shutil.copyfileobj(src, dst)
+                array.tofile(dst)
+        if os.name == 'nt':
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+
+
 class WriteNumPy(Module):
     """Writes a list as a Numpy file.
 
@@ -12,32 +67,65 @@ class WriteNumPy(Module):
     the binary representation of the data format (in this case you must specify
     the exact format to get the original data back), or the NPY format, i.e.
     .npy files that know what the actual structure of the array is.
+
+    By default a new temporary file is created. Set file to write to a given
+    file instead, and append to add the array at the end of it (along the
+    first axis for .NPY files). Connected to a chunks stream, this writes
+    each block as it arrives.
+
+    Only what this module wrote during the current execution is appended to:
+    the first write overwrites the file, so that running the pipeline again
+    doesn't add to the previous output.
     """
     _input_ports = [
             ('array', '(org.vistrails.vistrails.basic:List)'),
             ('datatype', '(org.vistrails.vistrails.basic:String)',
              {'entry_types': "['enum']",
-              'values': "[%r]" % NumPyArray.FORMAT_MAP.keys()})]
+              'values': "[%r]" % NumPyArray.FORMAT_MAP.keys()}),
+            ('file', '(org.vistrails.vistrails.basic:File)',
+             {'optional': True}),
+            ('append', '(org.vistrails.vistrails.basic:Boolean)',
+             {'optional': True, 'defaults': "['False']"})]
     _output_ports = [('file', '(org.vistrails.vistrails.basic:File)')]
 
+    def __init__(self):
+        Module.__init__(self)
+        # Shared with the copies made to iterate on lists and streams
+        self._written_files = set()
+
     def compute(self):
         array = self.get_input('array')
         if not isinstance(array, numpy.ndarray):
             array = numpy.array(array)
         dtype = NumPyArray.FORMAT_MAP[self.get_input('datatype')]
+        append = self.get_input('append')
 
-        if dtype is NumPyArray.NPY_FMT:
+        if self.has_input('file'):
+            fileobj = self.get_input('file')
+        elif append:
+            raise ModuleError(self, "append requires a file to write to")
+        elif dtype is NumPyArray.NPY_FMT:
             fileobj = self.interpreter.filePool.create_file(suffix='.npy')
-            fname = fileobj.name
-
-            # Numpy's ".NPY" format
-            numpy.save(fname, array)
         else:
             fileobj = self.interpreter.filePool.create_file(suffix='.dat')
-            fname = fileobj.name
+        fname = fileobj.name
+        append = append and fname in self._written_files
 
+        if dtype is NumPyArray.NPY_FMT:
+            # Numpy's ".NPY" format
+            if append:
+                try:
+                    append_npy(fname, array)
+                except ValueError, e:
+                    raise ModuleError(self, "Can't append: %s" % e)
+            else:
+                with open(fname, 'wb') as fp:
+                    numpy.save(fp, array)
+        else:
             # Numpy's plain binary format
-            array.astype(dtype).tofile(fname)
+            with open(fname, 'ab' if append else 'wb') as fp:
+                array.astype(dtype).tofile(fp)
+        self._written_files.add(fname)
 
         self.set_output('file', fileobj)
 
@@ -108,3 +196,78 @@ class WriteNumpyTestCase(unittest.TestCase):
                     ]))
             self.assertEqual(len(results), 1)
             self.assertEqual(list(results[0]), [0, 1, 258, 6758])
+
+    def test_append_rerun(self):
+        """Runs a chunked copy into an appending WriteNumPy twice.
+        """
+        import shutil
+        import tempfile
+        from vistrails.tests.utils import execute
+        from ..identifiers import identifier
+        tmp_dir = tempfile.mkdtemp(prefix='vt_numpy_')
+        try:
+            source = os.path.join(tmp_dir, 'in.npy')
+            numpy.save(source, numpy.array([1, 2, 3], dtype=numpy.uint32))
+            for dtype in ('npy', 'uint32'):
+                fname = os.path.join(tmp_dir, 'out.%s' % dtype)
+                with open(fname, 'wb') as fp:
+                    fp.write('old content')
+                for i in xrange(2):
+                    self.assertFalse(execute([
+                            ('read|NumPyArray', identifier, [
+                                ('file', [('File', source)]),
+                                ('chunk_size', [('Integer', '2')]),
+                            ]),
+                            ('write|WriteNumPy', identifier, [
+                                ('datatype', [('String', dtype)]),
+                                ('file', [('File', fname)]),
+                                ('append', [('Boolean', 'True')]),
+                            ]),
+                        ], [
+                            (0, 'chunks', 1, 'array'),
+                        ]))
+                    if dtype == 'npy':
+                        result = numpy.load(fname)
+                    else:
+                        result = numpy.fromfile(fname, dtype=numpy.uint32)
+                    self.assertEqual(result.tolist(), [1, 2, 3])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_append_npy(self):
+        """Appends to .NPY files, both in place and by rewriting the header.
+        """
+        import shutil
+        import tempfile
+        tmp_dir = tempfile.mkdtemp(prefix='vt_numpy_')
+        try:
+            fname = os.path.join(tmp_dir, 'a.npy')
+            expected = numpy.arange(6, dtype=numpy.int16).reshape(3, 2)
+            numpy.save(fname, expected)
+            for i in xrange(1, 40):
+                block = numpy.arange(i * 2).reshape(i, 2)
+                append_npy(fname, block)
+                expected = numpy.concatenate([expected,
+                                              block.astype(numpy.int16)])
+            result = numpy.load(fname)
+            self.assertEqual(result.dtype, numpy.int16)
+            self.assertTrue((result == expected).all())
+            self.assertRaises(ValueError, append_npy, fname,
+                              numpy.zeros((1, 3)))
+
+            # older writers pad the header tightly: it has to grow
+            import struct
+            fname = os.path.join(tmp_dir, 'b.npy')
+            header = ("{'descr': '<i2', 'fortran_order': False, "
+                      "'shape': (3,), }")
+            header += ' ' * (15 - (10 + len(header)) % 16) + '\n'
+            with open(fname, 'wb') as fp:
+                fp.write(npy_format.magic(1, 0))
+                fp.write(struct.pack('<H', len(header)))
+                fp.write(header)
+                numpy.arange(3, dtype=numpy.int16).tofile(fp)
+            self.assertEqual(numpy.load(fname).tolist(), [0, 1, 2])
+            append_npy(fname, numpy.array([3, 4]))
+            self.assertEqual(numpy.load(fname).tolist(), [0, 1, 2, 3, 4])
+        finally:
+            shutil.rmtree(tmp_dir)
@@ -48,6 +48,16 @@ def package_dependencies():
     else:
         return []
 
+def registry_snapshot_token():
+    """registry_snapshot_token() -> str
+
+    The wrapped classes depend on the installed VTK, so a registry
+    snapshot is only valid for the same VTK version.
+
+    """
+    import vtk
+    return vtk.vtkVersion().GetVTKVersion()
+
 def package_requirements():
     from vistrails.core.requirements import require_python_module, \
         python_module_exists
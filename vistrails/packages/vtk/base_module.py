@@ -46,8 +46,8 @@ from vistrails.core.modules.module_registry import registry
 from vistrails.core.modules.output_modules import OutputModule, ImageFileMode, \
     ImageFileModeConfig
 from vistrails.core.modules.vistrails_module import Module, ModuleError
-import vistrails.core.system
 from .identifiers import identifier as vtk_pkg_identifier
+from .offscreen import image_writers, render_to_image, write_image
 from .wrapper import VTKInstanceWrapper
 
 ################################################################################
@@ -273,45 +273,15 @@ class vtkRendererToFile(ImageFileMode):
         return True
 
     def compute_output(self, output_module, configuration):
-        format_map = {'png': vtk.vtkPNGWriter,
-                      'jpg': vtk.vtkJPEGWriter,
-                      'tif': vtk.vtkTIFFWriter,
-                      'pnm': vtk.vtkPNMWriter}
         r = output_module.get_input("value").vtkInstance
         w = configuration["width"]
         h = configuration["height"]
         img_format = self.get_format(configuration)
-        if img_format not in format_map:
+        if img_format not in image_writers:
             raise ModuleError(output_module, 
                               'Cannot output in format "%s"' % img_format)
         fname = self.get_filename(configuration, suffix='.%s' % img_format)
-
-        window = vtk.vtkRenderWindow()
-        window.OffScreenRenderingOn()
-        window.SetSize(w, h)
-
-        # FIXME think this may be fixed in VTK6 so we don't have this
-        # dependency...
-        widget = None
-        if vistrails.core.system.systemType=='Darwin':
-            from PyQt4 import QtCore, QtGui
-            widget = QtGui.QWidget(None, QtCore.Qt.FramelessWindowHint)
-            widget.resize(w, h)
-            widget.show()
-            window.SetWindowInfo(str(int(widget.winId())))
-
-        window.AddRenderer(r)
-        window.Render()
-        win2image = vtk.vtkWindowToImageFilter()
-        win2image.SetInput(window)
-        win2image.Update()
-        writer = format_map[img_format]()
-        writer.SetInput(win2image.GetOutput())
-        writer.SetFileName(fname)
-        writer.Write()
-        window.Finalize()
-        if widget!=None:
-            widget.close()
+        write_image(render_to_image([r], w, h), fname, img_format)
 
 class vtkRendererOutput(OutputModule):
     # DAK: no render view here, use a separate module for this...
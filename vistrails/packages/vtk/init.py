@@ -60,6 +60,7 @@ from base_module import vtkBaseModule, vtkRendererOutput
 from class_tree import ClassTree
 import fix_classes
 import inspectors
+import numpy_bridge
 import offscreen
 import tf_widget
 from vtk_parser import VTKMethodParser
@@ -806,14 +807,27 @@ def addPorts(module, delayed):
     elif klass==vtk.vtkCell:
         registry.add_input_port(module, 'SetPointIds', typeMap('vtkIdList'))
 
-def setAllPorts(descriptor, delayed):
-    """ setAllPorts(descriptor: ModuleDescriptor) -> None
-    Traverse descriptor and all of its children/grand-children to add all ports
+def loadPorts(descriptor):
+    """ loadPorts(descriptor: ModuleDescriptor) -> None
+    Port loader of the VTK modules: introspects the VTK class of
+    descriptor and adds its ports, the first time they are needed
 
     """
+    delayed = InstanceObject(add_input_port=[])
     addPorts(descriptor.module, delayed)
+    registry = get_module_registry()
+    for args in delayed.add_input_port:
+        registry.add_input_port(*args)
+
+def setAllPortLoaders(descriptor):
+    """ setAllPortLoaders(descriptor: ModuleDescriptor) -> None
+    Traverse descriptor and all of its children/grand-children to add
+    their ports on demand
+
+    """
+    descriptor.set_port_loader(loadPorts)
     for child in descriptor.children:
-        setAllPorts(child, delayed)
+        setAllPortLoaders(child)
 
 def class_dict(base_module, node):
     """class_dict(base_module, node) -> dict
@@ -1160,15 +1174,15 @@ def initialize():
     # Transfer Function constant
     tf_widget.initialize()
 
-    delayed = InstanceObject(add_input_port=[])
     # Add VTK modules
     registry = get_module_registry()
     registry.add_module(vtkBaseModule)
     registry.add_module(vtkRendererOutput)
     createAllModules(inheritanceGraph)
-    setAllPorts(registry.get_descriptor_by_name(identifier,
-                                                'vtkObjectBase'),
-                delayed)
+    # Parsing the methods of every VTK class is slow: the ports of a
+    # module are only added when they are first needed
+    setAllPortLoaders(registry.get_descriptor_by_name(identifier,
+                                                      'vtkObjectBase'))
 
     # Register the VTKCell and VTKHandler type if the spreadsheet is up
     if registry.has_module('%s.spreadsheet' % \
@@ -1184,10 +1198,9 @@ def initialize():
     # register offscreen rendering module
     offscreen.register_self()
 
-    # Now add all "delayed" ports - see comment on addSetGetPorts
-    for args in delayed.add_input_port:
-        
-        registry.add_input_port(*args)
+    # register the NumPy array converters
+    if numpy_bridge.numpy_support is not None:
+        numpy_bridge.register_self()
 
     # register Transfer Function adjustment
     # This can't be reordered -- TransferFunction needs to go before
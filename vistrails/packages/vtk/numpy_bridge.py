@@ -0,0 +1,160 @@
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+"""Converters between NumPy arrays and vtkDataArrays.
+
+Both directions share the memory of the array instead of copying it:
+NumPyToVTKArray makes a vtkDataArray that points to the data of the
+NumPy array, and VTKArrayToNumPy returns a NumPy view of the buffer of
+a vtkDataArray. A copy is only made if the NumPy array is not
+contiguous or has a type VTK doesn't support (e.g. bool).
+
+"""
+try:
+    import numpy
+    from vtk.util import numpy_support
+except ImportError: # pragma: no cover
+    numpy = None
+    numpy_support = None
+
+from identifiers import identifier as vtk_pkg_identifier
+
+from vistrails.core.modules.basic_modules import List, String
+from vistrails.core.modules.module_registry import get_module_registry
+from vistrails.core.modules.vistrails_module import Converter, ModuleError
+from wrapper import VTKInstanceWrapper
+
+def numpy_to_vtk_array(array, name=None):
+    """numpy_to_vtk_array(array: numpy.ndarray, name: str) -> vtkDataArray
+    Returns a vtkDataArray using the memory of array. 1-dimensional
+    arrays give one component per tuple, 2-dimensional arrays one tuple
+    per row; higher dimensions are flattened to the last one, which
+    becomes the number of components.
+
+    """
+    array = numpy.asarray(array)
+    if array.dtype == numpy.bool_:
+        array = array.astype(numpy.uint8)
+    if array.ndim == 0:
+        array = array.reshape(1)
+    elif array.ndim > 2:
+        array = array.reshape(-1, array.shape[-1])
+    array = numpy.ascontiguousarray(array)
+    vtk_array = numpy_support.numpy_to_vtk(array, deep=0)
+    # VTK doesn't own the memory: the array has to live as long as the
+    # vtkDataArray
+    vtk_array._numpy_reference = array
+    if name is not None:
+        vtk_array.SetName(name)
+    return vtk_array
+
+def vtk_array_to_numpy(vtk_array):
+    """vtk_array_to_numpy(vtk_array: vtkDataArray) -> numpy.ndarray
+    Returns a view of the memory of vtk_array, with one row per tuple
+    if it has several components. The view keeps vtk_array alive
+    through its buffer.
+
+    """
+    return numpy_support.vtk_to_numpy(vtk_array)
+
+class NumPyToVTKArray(Converter):
+    """Wraps a NumPy array as a vtkDataArray without copying it.
+    """
+    def compute(self):
+        array = self.get_input('in_value')
+        try:
+            vtk_array = numpy_to_vtk_array(array,
+                                           self.force_get_input('name'))
+        except (AssertionError, KeyError, TypeError), e:
+            raise ModuleError(self, "Cannot wrap array as a vtkDataArray: %s" %
+                              e)
+        self.set_output('out_value',
+                        VTKInstanceWrapper(vtk_array,
+                                           self.moduleInfo['moduleId']))
+
+class VTKArrayToNumPy(Converter):
+    """Gives a NumPy view of a vtkDataArray without copying it.
+    """
+    def compute(self):
+        vtk_array = self.get_input('in_value').vtkInstance
+        try:
+            array = vtk_array_to_numpy(vtk_array)
+        except (AssertionError, KeyError, TypeError), e:
+            raise ModuleError(self, "Cannot view %s as a NumPy array: %s" %
+                              (vtk_array.GetClassName(), e))
+        self.set_output('out_value', array)
+
+def register_self():
+    registry = get_module_registry()
+    vtkDataArray = registry.get_descriptor_by_name(vtk_pkg_identifier,
+                                                   'vtkDataArray').module
+    registry.add_module(NumPyToVTKArray)
+    registry.add_input_port(NumPyToVTKArray, 'in_value', List)
+    registry.add_input_port(NumPyToVTKArray, 'name', String, True)
+    registry.add_output_port(NumPyToVTKArray, 'out_value', vtkDataArray)
+    registry.add_module(VTKArrayToNumPy)
+    registry.add_input_port(VTKArrayToNumPy, 'in_value', vtkDataArray)
+    registry.add_output_port(VTKArrayToNumPy, 'out_value', List)
+
+################################################################################
+
+import unittest
+
+class TestNumPyBridge(unittest.TestCase):
+    def setUp(self):
+        if numpy_support is None:
+            self.skipTest("numpy is not available")
+
+    def test_shared_memory(self):
+        array = numpy.arange(6, dtype=numpy.float64).reshape(3, 2)
+        vtk_array = numpy_to_vtk_array(array, 'coords')
+        self.assertEqual(vtk_array.GetName(), 'coords')
+        self.assertEqual(vtk_array.GetNumberOfTuples(), 3)
+        self.assertEqual(vtk_array.GetNumberOfComponents(), 2)
+        array[2, 1] = 42.0
+        self.assertEqual(vtk_array.GetComponent(2, 1), 42.0)
+
+        view = vtk_array_to_numpy(vtk_array)
+        self.assertEqual(view.shape, (3, 2))
+        vtk_array.SetComponent(0, 0, -1.0)
+        self.assertEqual(view[0, 0], -1.0)
+        self.assertEqual(array[0, 0], -1.0)
+
+    def test_copies(self):
+        # a non-contiguous array is copied, a bool array converted
+        array = numpy.arange(8, dtype=numpy.int32)[::2]
+        vtk_array = numpy_to_vtk_array(array)
+        self.assertEqual(list(vtk_array_to_numpy(vtk_array)), [0, 2, 4, 6])
+        vtk_array = numpy_to_vtk_array(numpy.array([True, False]))
+        self.assertEqual(list(vtk_array_to_numpy(vtk_array)), [1, 0])
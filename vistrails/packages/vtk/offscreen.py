@@ -32,6 +32,7 @@
 ## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
 ##
 ###############################################################################
+import threading
 import vtk
 from identifiers import identifier as vtk_pkg_identifier
 
@@ -40,39 +41,111 @@ from vistrails.core.modules.vistrails_module import Module
 from vistrails.core.modules.basic_modules import File, Integer
 from vistrails.core import system
 
+image_writers = {'png': vtk.vtkPNGWriter,
+                 'jpg': vtk.vtkJPEGWriter,
+                 'tif': vtk.vtkTIFFWriter,
+                 'pnm': vtk.vtkPNMWriter}
+
+def render_to_image(renderers, width, height, render_view=None):
+    """render_to_image(renderers: list, width: int, height: int,
+                       render_view: vtkRenderView) -> vtkImageData
+    Renders the vtkRenderers, or the vtkRenderView if one is given,
+    into an offscreen window of the given size and returns a copy of
+    the image. They are given back to the windows they were displayed
+    in, if any.
+
+    """
+    window = vtk.vtkRenderWindow()
+    window.OffScreenRenderingOn()
+    window.SetSize(width, height)
+
+    # FIXME think this may be fixed in VTK6 so we don't have this
+    # dependency...
+    widget = None
+    if system.systemType=='Darwin':
+        from PyQt4 import QtCore, QtGui
+        widget = QtGui.QWidget(None, QtCore.Qt.FramelessWindowHint)
+        widget.resize(width, height)
+        widget.show()
+        window.SetWindowInfo(str(int(widget.winId())))
+
+    if render_view is not None:
+        previous_view_window = render_view.GetRenderWindow()
+        render_view.SetupRenderWindow(window)
+        previous = []
+    else:
+        previous = [(r, r.GetRenderWindow()) for r in renderers]
+        for r in renderers:
+            window.AddRenderer(r)
+    window.Render()
+    win2image = vtk.vtkWindowToImageFilter()
+    win2image.SetInput(window)
+    win2image.Update()
+    image = vtk.vtkImageData()
+    image.DeepCopy(win2image.GetOutput())
+
+    for r, previous_window in previous:
+        window.RemoveRenderer(r)
+        if previous_window is not None:
+            r.SetRenderWindow(previous_window)
+    if render_view is not None and previous_view_window is not None:
+        render_view.SetupRenderWindow(previous_view_window)
+    window.Finalize()
+    if widget!=None:
+        widget.close()
+    return image
+
+_object_locks = {}
+_object_locks_lock = threading.Lock()
+
+def get_object_locks(objects):
+    """get_object_locks(objects: list) -> list
+    Returns a lock for each of the VTK objects, always in the same order,
+    so that renders running at the same time on different threads never
+    use the same renderer or view at once.
+
+    """
+    with _object_locks_lock:
+        return [_object_locks.setdefault(key, threading.Lock())
+                for key in sorted(set(o.GetAddressAsString('vtkObject')
+                                      for o in objects))]
+
+def update_props(renderers):
+    """update_props(renderers: list) -> None
+    Brings the data of the props of the vtkRenderers up to date, so that
+    rendering them does not run the pipelines they share with other cells.
+
+    """
+    for renderer in renderers:
+        props = renderer.GetViewProps()
+        props.InitTraversal()
+        for i in xrange(props.GetNumberOfItems()):
+            prop = props.GetNextProp()
+            if hasattr(prop, 'GetMapper') and prop.GetMapper() is not None:
+                prop.GetMapper().Update()
+
+def write_image(image, filename, img_format='png'):
+    """write_image(image: vtkImageData, filename: str,
+                   img_format: str) -> None
+    Encodes the image returned by render_to_image() to a file. This
+    does not touch any render window, so it may run on a worker thread.
+
+    """
+    writer = image_writers[img_format]()
+    writer.SetInput(image)
+    writer.SetFileName(filename)
+    writer.Write()
+
 class VTKRenderOffscreen(Module):
 
     def compute(self):
         r = self.get_input("renderer").vtkInstance
-        window = vtk.vtkRenderWindow()
         w = self.force_get_input("width", 512)
         h = self.force_get_input("height", 512)
-        window.OffScreenRenderingOn()
-        window.SetSize(w, h)
         # r.ResetCamera()
-
-        widget = None
-        if system.systemType=='Darwin':
-            from PyQt4 import QtCore, QtGui
-            widget = QtGui.QWidget(None, QtCore.Qt.FramelessWindowHint)
-            widget.resize(w, h)
-            widget.show()
-            window.SetWindowInfo(str(int(widget.winId())))    
-       
-        window.AddRenderer(r)
-#        window.Start()
-        window.Render()
-        win2image = vtk.vtkWindowToImageFilter()
-        win2image.SetInput(window)
-        win2image.Update()
-        writer = vtk.vtkPNGWriter()
-        writer.SetInput(win2image.GetOutput())
+        image = render_to_image([r], w, h)
         output = self.interpreter.filePool.create_file(suffix='.png')
-        writer.SetFileName(output.name)
-        writer.Write()
-        window.Finalize()
-        if widget!=None:
-            widget.close()
+        write_image(image, output.name)
         self.set_output("image", output)
 
 def register_self():
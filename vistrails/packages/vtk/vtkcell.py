@@ -45,6 +45,7 @@ from vistrails.core import system
 from vistrails.core.modules.module_registry import get_module_registry
 from vistrails.packages.spreadsheet.basic_widgets import SpreadsheetCell, CellLocation, SpreadsheetMode
 from vistrails.packages.spreadsheet.spreadsheet_cell import QCellWidget, QCellToolBar
+from vistrails.packages.spreadsheet.spreadsheet_registry import spreadsheetRegistry
 from vtk.qt4.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import gc
 from vistrails.gui.qt import qt_super
@@ -60,6 +61,8 @@ from vistrails.core.modules.vistrails_module import ModuleError
 import copy
 
 from identifiers import identifier as vtk_pkg_identifier
+from offscreen import get_object_locks, render_to_image, update_props, \
+    write_image
 
 ################################################################################
 
@@ -1101,12 +1104,54 @@ class QVTKWidgetToolBar(QCellToolBar):
         self.addAnimationButtons()
         self.appendAction(QVTKWidgetSaveCamera(self))
 
+def renderOffscreen(inputPorts, width, height):
+    """ renderOffscreen(inputPorts: tuple, width: int, height: int)
+          -> function
+    Offscreen renderer of QVTKWidget: returns a function rendering the
+    cell contents without its widget and writing them to a file. The
+    cells are rendered on the exporter threads, each in a render window
+    of its own; their data is updated here first
+    
+    """
+    (renderers, renderView, iHandlers, iStyle, picker) = inputPorts
+    if renderView:
+        renderView.vtkInstance.Update()
+        objects = [renderView.vtkInstance]
+    else:
+        objects = [r.vtkInstance for r in renderers]
+        update_props(objects)
+    def render():
+        locks = get_object_locks(objects)
+        for lock in locks:
+            lock.acquire()
+        try:
+            if renderView:
+                return render_to_image([], width, height,
+                                       render_view=renderView.vtkInstance)
+            else:
+                return render_to_image(objects, width, height)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+    if system.systemType == 'Darwin':
+        # The render window is attached to a widget there, which can only
+        # be created on this thread
+        image = render()
+        render = lambda: image
+    def write(filename):
+        img_format = os.path.splitext(filename)[1][1:].lower() or 'png'
+        img_format = {'jpeg': 'jpg', 'tiff': 'tif'}.get(img_format,
+                                                        img_format)
+        write_image(render(), filename, img_format)
+    return write
+
 def registerSelf():
     """ registerSelf() -> None
     Registry module with the registry
     """
     from base_module import vtkRendererOutput
     vtkRendererOutput.register_output_mode(vtkRendererToSpreadsheet)
+    spreadsheetRegistry.registerOffscreenRenderer(QVTKWidget, renderOffscreen)
 
     registry = get_module_registry()
     registry.add_module(VTKCell)
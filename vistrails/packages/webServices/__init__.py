@@ -66,6 +66,8 @@ version = '0.9.4'
 old_identifiers = ['edu.utah.sci.vistrails.webservices']
 configuration = ConfigurationObject(wsdlList=(None, str),
                                     showWarning=True)
+# modules are generated from the configured WSDL documents
+registry_snapshot = False
 
 def package_dependencies():
     return ['org.vistrails.vistrails.http']
@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+# pragma: no testimport
+###############################################################################
+##
+## Copyright (C) 2011-2014, NYU-Poly.
+## Copyright (C) 2006-2011, University of Utah. 
+## All rights reserved.
+## Contact: contact@vistrails.org
+##
+## This file is part of VisTrails.
+##
+## "Redistribution and use in source and binary forms, with or without 
+## modification, are permitted provided that the following conditions are met:
+##
+##  - Redistributions of source code must retain the above copyright notice, 
+##    this list of conditions and the following disclaimer.
+##  - Redistributions in binary form must reproduce the above copyright 
+##    notice, this list of conditions and the following disclaimer in the 
+##    documentation and/or other materials provided with the distribution.
+##  - Neither the name of the University of Utah nor the names of its 
+##    contributors may be used to endorse or promote products derived from 
+##    this software without specific prior written permission.
+##
+## THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+## AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, 
+## THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR 
+## PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR 
+## CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, 
+## EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, 
+## PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; 
+## OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, 
+## WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR 
+## OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF 
+## ADVISED OF THE POSSIBILITY OF SUCH DAMAGE."
+##
+###############################################################################
+
+"""Runs performance benchmarks on synthetic workloads.
+
+Each benchmark builds its workload once, then times it several times. The
+best and median times are written as JSON and can be compared with a
+baseline from a previous run; the script exits with an error if a benchmark
+got slower than the baseline by more than the tolerance.
+
+    python -m vistrails.tests.benchmarks -o results.json
+    python -m vistrails.tests.benchmarks -b baseline.json -t 0.2
+    python -m vistrails.tests.benchmarks -b baseline.json --save-baseline
+
+Everything runs offline, without the GUI.
+
+"""
+
+import atexit
+from collections import OrderedDict
+import csv
+import json
+import optparse
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+# Makes sure we can import modules as if we were running VisTrails
+# from the root directory
+_this_dir = os.path.dirname(os.path.realpath(__file__))
+root_directory = os.path.realpath(os.path.join(_this_dir,  '..'))
+sys.path.insert(0, os.path.realpath(os.path.join(root_directory, '..')))
+
+basic_pkg = 'org.vistrails.vistrails.basic'
+
+###############################################################################
+# Benchmarks
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(name):
+    """Registers a benchmark.
+
+    The decorated function gets the scale factor and the temporary directory,
+    builds the workload and returns the callable to time.
+    """
+    def wrapper(func):
+        BENCHMARKS[name] = func
+        return func
+    return wrapper
+
+
+def _execute(pipeline, **kwargs):
+    from vistrails.core.db.locator import XMLFileLocator
+    from vistrails.core.interpreter.cached import CachedInterpreter
+    from vistrails.core.utils import DummyView
+
+    # Empty the cache so that everything is computed
+    CachedInterpreter.flush()
+    result = CachedInterpreter.get().execute(
+            pipeline,
+            locator=XMLFileLocator('benchmark.xml'),
+            current_version=1,
+            view=DummyView(),
+            **kwargs)
+    if result.errors:
+        raise RuntimeError("Benchmark pipeline failed: %r" % result.errors)
+    return result
+
+
+def _wide_pipeline(width):
+    from vistrails.tests.utils import build_pipeline
+
+    modules = []
+    connections = []
+    for i in xrange(width):
+        modules.append(('Integer', basic_pkg, [
+                ('value', [('Integer', str(i))])]))
+        modules.append(('Integer', basic_pkg, []))
+        connections.append((2 * i, 'value', 2 * i + 1, 'value'))
+    return build_pipeline(modules, connections)
+
+
+def _deep_pipeline(depth):
+    from vistrails.tests.utils import build_pipeline
+
+    modules = [('Integer', basic_pkg, [('value', [('Integer', '1')])])]
+    modules.extend([('Integer', basic_pkg, [])] * (depth - 1))
+    connections = [(i, 'value', i + 1, 'value') for i in xrange(depth - 1)]
+    return build_pipeline(modules, connections)
+
+
+def _tree_pipeline(levels):
+    from vistrails.tests.utils import build_pipeline
+
+    # Binary tree of ConcatenateString with String leaves
+    modules = []
+    connections = []
+    def add(level):
+        idx = len(modules)
+        if level == 0:
+            modules.append(('String', basic_pkg, [
+                    ('value', [('String', 'leaf%d' % idx)])]))
+        else:
+            modules.append(('ConcatenateString', basic_pkg, []))
+            connections.append((add(level - 1), 'value', idx, 'str1'))
+            connections.append((add(level - 1), 'value', idx, 'str2'))
+        return idx
+    add(levels)
+    return build_pipeline(modules, connections)
+
+
+def _action_chain(length):
+    from vistrails.core.vistrail.controller import VistrailController
+    from vistrails.core.vistrail.vistrail import Vistrail
+
+    controller = VistrailController(Vistrail(), auto_save=False)
+    controller.change_selected_version(0)
+    module_ids = [controller.add_module(basic_pkg, 'Integer').id
+                  for i in xrange(20)]
+    for i in xrange(length):
+        module = controller.current_pipeline.modules[
+                module_ids[i % len(module_ids)]]
+        controller.update_function(module, 'value', [str(i)])
+    return controller
+
+
+@benchmark('interpreter_wide')
+def bench_interpreter_wide(scale, tmpdir):
+    pipeline = _wide_pipeline(int(250 * scale))
+    return lambda: _execute(pipeline)
+
+
+@benchmark('interpreter_deep')
+def bench_interpreter_deep(scale, tmpdir):
+    # Module updates are recursive, don't go near the recursion limit
+    pipeline = _deep_pipeline(min(int(150 * scale), 300))
+    return lambda: _execute(pipeline)
+
+
+@benchmark('compute_all')
+def bench_compute_all(scale, tmpdir):
+    from vistrails.tests.utils import build_pipeline
+
+    values = [float(i) for i in xrange(int(1000 * scale))]
+    pipeline = build_pipeline([
+            ('List', basic_pkg, [('value', [('List', repr(values))])]),
+            ('Round', basic_pkg, [])],
+            [(0, 'value', 1, 'in_value')])
+    return lambda: _execute(pipeline)
+
+
+@benchmark('subpipeline_signatures')
+def bench_subpipeline_signatures(scale, tmpdir):
+    levels = 9 + max(0, int(scale).bit_length() - 1)
+    pipeline = _tree_pipeline(levels)
+    return pipeline.refresh_signatures
+
+
+@benchmark('materialize_version')
+def bench_materialize_version(scale, tmpdir):
+    controller = _action_chain(int(1000 * scale))
+    vistrail = controller.vistrail
+    version = controller.current_version
+    return lambda: vistrail.getPipeline(version)
+
+
+@benchmark('xml_save_load')
+def bench_xml_save_load(scale, tmpdir):
+    from vistrails.core.db.io import load_vistrail, save_vistrail_to_xml
+    from vistrails.core.db.locator import XMLFileLocator
+
+    vistrail = _action_chain(int(1000 * scale)).vistrail
+    filename = os.path.join(tmpdir, 'benchmark.xml')
+    def run():
+        save_vistrail_to_xml(vistrail, filename)
+        load_vistrail(XMLFileLocator(filename))
+    return run
+
+
+@benchmark('vt_save_load')
+def bench_vt_save_load(scale, tmpdir):
+    from vistrails.core.db.io import load_vistrail
+    from vistrails.core.db.locator import ZIPFileLocator
+    from vistrails.core.vistrail.vistrail import Vistrail
+    from vistrails.db.services.io import SaveBundle
+
+    vistrail = _action_chain(int(1000 * scale)).vistrail
+    filename = os.path.join(tmpdir, 'benchmark.vt')
+    def run():
+        locator = ZIPFileLocator(filename)
+        locator.save(SaveBundle(Vistrail.vtType, vistrail=vistrail))
+        locator.close()
+        locator = ZIPFileLocator(filename)
+        load_vistrail(locator)
+        locator.close()
+    return run
+
+
+@benchmark('log_serialization')
+def bench_log_serialization(scale, tmpdir):
+    from vistrails.core.db.io import open_log
+    from vistrails.core.log.controller import LogController
+    from vistrails.core.log.log import Log
+    from vistrails.db.services.io import save_log_to_xml
+
+    log = Log()
+    pipeline = _wide_pipeline(int(100 * scale))
+    for i in xrange(10):
+        _execute(pipeline, logger=LogController(log))
+    filename = os.path.join(tmpdir, 'benchmark_log.xml')
+    def run():
+        save_log_to_xml(log, filename)
+        open_log(filename)
+    return run
+
+
+@benchmark('tabledata_csv_join')
+def bench_tabledata_csv_join(scale, tmpdir):
+    from vistrails.packages.tabledata.operations import JoinedTables
+    from vistrails.packages.tabledata.read.read_csv import CSVTable
+
+    rows = int(20000 * scale)
+    left = os.path.join(tmpdir, 'left.csv')
+    right = os.path.join(tmpdir, 'right.csv')
+    with open(left, 'wb') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['key', 'x', 'label'])
+        for i in xrange(rows):
+            writer.writerow(['k%d' % i, i * 0.5, 'left %d' % i])
+    with open(right, 'wb') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(['key', 'y'])
+        for i in xrange(0, rows, 2):
+            writer.writerow(['k%d' % (rows - i - 1), i * 2.0])
+    def run():
+        left_t = CSVTable(left, True, ',')
+        right_t = CSVTable(right, True, ',')
+        left_t.get_column(1, True)
+        joined = JoinedTables(left_t, right_t, 0, 0)
+        for i in xrange(joined.columns):
+            joined.get_column(i)
+    return run
+
+###############################################################################
+# Running and comparing
+
+def run_benchmarks(names, repeat=5, scale=1.0, verbose=True):
+    """Runs the benchmarks and returns the results dictionary.
+    """
+    import vistrails.core.system
+
+    tmpdir = tempfile.mkdtemp(prefix='vt_benchmark_')
+    results = OrderedDict()
+    try:
+        for name in names:
+            if verbose:
+                sys.stdout.write("%-26s " % name)
+                sys.stdout.flush()
+            func = BENCHMARKS[name](scale, tmpdir)
+            # Warm-up run, not timed
+            func()
+            times = []
+            for i in xrange(repeat):
+                start = timeit.default_timer()
+                func()
+                times.append(timeit.default_timer() - start)
+            times.sort()
+            results[name] = {'best': times[0],
+                             'median': times[len(times) // 2],
+                             'runs': times}
+            if verbose:
+                sys.stdout.write("best %.4fs  median %.4fs\n" % (
+                                 times[0], times[len(times) // 2]))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return {'vistrails': vistrails.core.system.vistrails_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'scale': scale,
+            'results': results}
+
+
+def compare(results, baseline, tolerance):
+    """Compares results with a baseline.
+
+    Returns a list of (name, baseline_time, time, ratio, status), where status
+    is 'regression', 'improvement', 'ok', 'new' or 'missing'. The best times
+    are compared; a ratio above 1 + tolerance is a regression.
+    """
+    comparison = []
+    new = results['results']
+    old = baseline['results']
+    for name in new:
+        if name not in old:
+            comparison.append((name, None, new[name]['best'], None, 'new'))
+            continue
+        old_time, new_time = old[name]['best'], new[name]['best']
+        ratio = new_time / old_time if old_time > 0 else 1.0
+        if ratio > 1.0 + tolerance:
+            status = 'regression'
+        elif ratio < 1.0 / (1.0 + tolerance):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        comparison.append((name, old_time, new_time, ratio, status))
+    for name in old:
+        if name not in new:
+            comparison.append((name, old[name]['best'], None, None,
+                               'missing'))
+    return comparison
+
+
+def print_comparison(comparison):
+    def fmt(t, pattern):
+        return '-' if t is None else pattern % t
+    print "%-26s %10s %10s %8s  %s" % ('benchmark', 'baseline', 'current',
+                                       'ratio', 'status')
+    for name, old_time, new_time, ratio, status in comparison:
+        print "%-26s %10s %10s %8s  %s" % (name,
+                                           fmt(old_time, '%.4fs'),
+                                           fmt(new_time, '%.4fs'),
+                                           fmt(ratio, '%.2fx'),
+                                           status)
+
+
+def main(args=None):
+    usage = "Usage: %prog [options] [benchmark names]"
+    parser = optparse.OptionParser(usage=usage)
+    parser.add_option('-o', '--output', action='store', type='str',
+                      default=None,
+                      help="write the results to this JSON file")
+    parser.add_option('-b', '--baseline', action='store', type='str',
+                      default=None,
+                      help="compare the results with this JSON file")
+    parser.add_option('--save-baseline', action='store_true', default=False,
+                      help="write the results to the baseline file instead "
+                      "of comparing")
+    parser.add_option('-t', '--tolerance', action='store', type='float',
+                      default=0.25,
+                      help="allowed slowdown before reporting a regression, "
+                      "as a fraction of the baseline (default: 0.25)")
+    parser.add_option('-r', '--repeat', action='store', type='int',
+                      default=5,
+                      help="number of timed runs per benchmark (default: 5)")
+    parser.add_option('-s', '--scale', action='store', type='float',
+                      default=1.0,
+                      help="multiplies the size of the workloads")
+    parser.add_option('-l', '--list', action='store_true', default=False,
+                      help="list the benchmarks and exit")
+    (options, args) = parser.parse_args(args)
+
+    if options.list:
+        for name in BENCHMARKS:
+            print name
+        return 0
+    names = [n for n in BENCHMARKS
+             if not args or any(a in n for a in args)]
+    if not names:
+        parser.error("no benchmark matches %s" % ', '.join(args))
+    if options.save_baseline and not options.baseline:
+        parser.error("--save-baseline requires --baseline")
+
+    # Start the application without the GUI, in a separate temporary
+    # directory
+    tempfile.tempdir = tempfile.mkdtemp(prefix='vt_benchmarks_')
+    atexit.register(shutil.rmtree, tempfile.tempdir, True)
+    import vistrails.core.application
+    app = vistrails.core.application.init({'batch': True,
+                                           'executionLog': False,
+                                           'singleInstance': False,
+                                           'enablePackagesSilently': True,
+                                           'handlerDontAsk': True,
+                                           'spawned': True},
+                                          [])
+    from vistrails.core.packagemanager import get_package_manager
+    pm = get_package_manager()
+    if not pm.has_package('org.vistrails.vistrails.tabledata'):
+        pm.late_enable_package('tabledata')
+
+    try:
+        results = run_benchmarks(names, options.repeat, options.scale)
+    finally:
+        app.destroy()
+    if options.output:
+        with open(options.output, 'wb') as fp:
+            json.dump(results, fp, indent=2)
+    if options.baseline:
+        if options.save_baseline:
+            with open(options.baseline, 'wb') as fp:
+                json.dump(results, fp, indent=2)
+        else:
+            with open(options.baseline, 'rb') as fp:
+                baseline = json.load(fp, object_pairs_hook=OrderedDict)
+            comparison = compare(results, baseline, options.tolerance)
+            print
+            print_comparison(comparison)
+            if any(c[4] == 'regression' for c in comparison):
+                return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
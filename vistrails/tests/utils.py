@@ -68,9 +68,33 @@ def execute(modules, connections=[], add_port_specs=[],
         ]))
     """
     from vistrails.core.db.locator import XMLFileLocator
+    from vistrails.core.utils import DummyView
+    from vistrails.core.interpreter.noncached import Interpreter
+
+    pipeline = build_pipeline(modules, connections, add_port_specs,
+                              enable_pkg)
+
+    interpreter = Interpreter.get()
+    result = interpreter.execute(
+            pipeline,
+            locator=XMLFileLocator('foo.xml'),
+            current_version=1,
+            view=DummyView())
+    if full_results:
+        return result
+    else:
+        # Allows to do self.assertFalse(execute(...))
+        return result.errors
+
+
+def build_pipeline(modules, connections=[], add_port_specs=[],
+                   enable_pkg=True):
+    """Build a pipeline from a description.
+
+    The arguments are the same as for execute(), which uses this.
+    """
     from vistrails.core.modules.module_registry import MissingPackage
     from vistrails.core.packagemanager import get_package_manager
-    from vistrails.core.utils import DummyView
     from vistrails.core.vistrail.connection import Connection
     from vistrails.core.vistrail.module import Module
     from vistrails.core.vistrail.module_function import ModuleFunction
@@ -78,7 +102,6 @@ def execute(modules, connections=[], add_port_specs=[],
     from vistrails.core.vistrail.pipeline import Pipeline
     from vistrails.core.vistrail.port import Port
     from vistrails.core.vistrail.port_spec import PortSpec
-    from vistrails.core.interpreter.noncached import Interpreter
 
     pm = get_package_manager()
 
@@ -155,18 +178,7 @@ def execute(modules, connections=[], add_port_specs=[],
                          name=dport,
                          signature=d_sig),
                 ]))
-
-    interpreter = Interpreter.get()
-    result = interpreter.execute(
-            pipeline,
-            locator=XMLFileLocator('foo.xml'),
-            current_version=1,
-            view=DummyView())
-    if full_results:
-        return result
-    else:
-        # Allows to do self.assertFalse(execute(...))
-        return result.errors
+    return pipeline
 
 
 @contextlib.contextmanager